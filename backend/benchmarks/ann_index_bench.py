@@ -0,0 +1,110 @@
+"""
+Benchmark of the FAISS index types on synthetic embedding-like vectors.
+
+Run from the backend directory:
+
+    python -m benchmarks.ann_index_bench --vectors 200000 --dim 384
+
+Vectors are drawn around random cluster centres, like embeddings of text
+about a limited number of topics, and the queries are perturbed database
+vectors. For every index type and every query-time setting (nprobe for IVF,
+efSearch for HNSW) the script reports the build time, the serialized index
+size, single-query throughput and recall@k against the exact flat index.
+"""
+import argparse
+import json
+import time
+
+import faiss
+import numpy as np
+
+from src.ann_index import INDEX_FACTORIES, build_index, configure_search
+
+
+def synthetic_vectors(count: int, dim: int, clusters: int, seed: int) -> np.ndarray:
+    """Returns `count` unit vectors grouped around `clusters` centres."""
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((clusters, dim)).astype(np.float32)
+    vectors = centres[rng.integers(0, clusters, count)] + 0.6 * rng.standard_normal((count, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def recall_at_k(found: np.ndarray, truth: np.ndarray) -> float:
+    """Returns the share of the true top-k neighbours that were found."""
+    hits = sum(len(set(row) & set(expected)) for row, expected in zip(found, truth))
+    return hits / truth.size
+
+
+def measure(index, queries: np.ndarray, k: int, truth: np.ndarray):
+    """Searches one query at a time, like the API does, and returns QPS and recall."""
+    found = np.empty((len(queries), k), dtype=np.int64)
+    started = time.perf_counter()
+    for i, query in enumerate(queries):
+        _, found[i] = index.search(query[None, :], k)
+    elapsed = time.perf_counter() - started
+    return len(queries) / elapsed, recall_at_k(found, truth)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", type=int, default=100_000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--clusters", type=int, default=1_000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--modes", nargs="+", default=list(INDEX_FACTORIES), choices=list(INDEX_FACTORIES))
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[16, 64, 256])
+    parser.add_argument("--train-sample", type=int, default=100_000)
+    parser.add_argument("--json", help="Also write the results to this file.")
+    args = parser.parse_args()
+
+    vectors = synthetic_vectors(args.vectors, args.dim, args.clusters, seed=1)
+    rng = np.random.default_rng(2)
+    queries = vectors[rng.choice(args.vectors, args.queries, replace=False)]
+    queries = queries + 0.05 * rng.standard_normal(queries.shape).astype(np.float32)
+
+    exact = faiss.IndexFlatL2(args.dim)
+    exact.add(vectors)
+    _, truth = exact.search(queries, args.k)
+
+    results = []
+    print(f"{'mode':>9} {'param':>12} {'build s':>8} {'size MB':>8} {'QPS':>9} {'recall@' + str(args.k):>9}")
+    for mode in args.modes:
+        started = time.perf_counter()
+        index = build_index(vectors, mode, train_sample_size=args.train_sample)
+        build_seconds = time.perf_counter() - started
+        size_mb = faiss.serialize_index(index).nbytes / 1e6
+
+        if mode.startswith("ivf"):
+            settings = [("nprobe", value) for value in args.nprobe]
+        elif mode.startswith("hnsw"):
+            settings = [("efSearch", value) for value in args.ef_search]
+        else:
+            settings = [("-", None)]
+
+        for name, value in settings:
+            if name == "nprobe":
+                configure_search(index, nprobe=value)
+            elif name == "efSearch":
+                configure_search(index, ef_search=value)
+            qps, recall = measure(index, queries, args.k, truth)
+            param = f"{name}={value}" if value is not None else "-"
+            print(f"{mode:>9} {param:>12} {build_seconds:>8.2f} {size_mb:>8.1f} {qps:>9.0f} {recall:>9.3f}")
+            results.append({
+                "mode": mode,
+                "param": name if value is not None else None,
+                "value": value,
+                "build_seconds": build_seconds,
+                "size_mb": size_mb,
+                "qps": qps,
+                "recall_at_k": recall,
+            })
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Benchmark of answering an evaluation set through /ask/ against /ask/batch.
+
+Run from the backend directory:
+
+    python -m benchmarks.ask_batch_bench --questions 200 --concurrency 8
+
+The backend is pointed at the local OpenAI stub and answers the same
+distinct questions twice: once as individual /ask/ requests sent by
+`--concurrency` clients, and once as a single /ask/batch request whose
+NDJSON lines are read as they arrive. For both runs the script reports the
+wall time, the time to the first answer, the number of embeddings and chat
+requests that reached the stub, and the number of failed questions. With
+`--error-rate` the stub fails that share of its requests, which shows that
+failed batch items are reported without failing the rest of the batch.
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.ask_load import synthetic_chunks
+from benchmarks.stub_openai import BackgroundServer, StubSettings, create_stub_app
+
+
+async def run_single(url: str, queries, concurrency: int):
+    """Sends every question as its own /ask/ request."""
+    failed, first = 0, None
+    started = time.perf_counter()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(timeout=300) as client:
+        async def ask(query):
+            nonlocal failed, first
+            async with semaphore:
+                response = await client.post(f"{url}/ask/", json={"query": query})
+            failed += response.status_code != 200
+            first = first or time.perf_counter() - started
+
+        await asyncio.gather(*(ask(query) for query in queries))
+    return time.perf_counter() - started, first, failed
+
+
+async def run_batch(url: str, queries):
+    """Sends all questions as one /ask/batch request and reads the NDJSON stream."""
+    failed, first, indexes = 0, None, set()
+    started = time.perf_counter()
+    async with httpx.AsyncClient(timeout=300) as client:
+        async with client.stream("POST", f"{url}/ask/batch", json={"queries": queries}) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                result = json.loads(line)
+                indexes.add(result["index"])
+                failed += "error" in result
+                first = first or time.perf_counter() - started
+    assert indexes == set(range(len(queries))), "every question must get exactly one result"
+    return time.perf_counter() - started, first, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--llm-latency", type=float, default=0.2)
+    parser.add_argument("--embedding-latency", type=float, default=0.02)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    settings = StubSettings(embedding_latency=args.embedding_latency, llm_latency=args.llm_latency)
+    with BackgroundServer(create_stub_app(settings)) as stub:
+        os.environ["OPENAI_API_KEY"] = "stub"
+        os.environ["OPENAI_BASE_URL"] = f"{stub.url}/v1"
+
+        from config import Config
+
+        # Configured before the backend modules are imported, as they bind defaults at import time
+        work_dir = tempfile.mkdtemp(prefix="ask_batch_bench_")
+        Config.VECTOR_STORE_PATH = os.path.join(work_dir, "faiss_index")
+        Config.UPLOAD_DIR = os.path.join(work_dir, "uploads")
+        Config.JOB_DB_PATH = os.path.join(work_dir, "jobs.sqlite3")
+        Config.EMBEDDING_CACHE_PATH = os.path.join(work_dir, "embedding_cache.sqlite3")
+        Config.JOB_WORKERS = 0
+        # Both runs ask the same questions; cached answers would hide the difference
+        Config.ANSWER_CACHE_ENABLED = False
+        Config.ASK_BATCH_LLM_CONCURRENCY = args.concurrency
+
+        # Imported here so the clients pick up the stub URL
+        from langchain_openai import OpenAIEmbeddings
+        from src.vector_store import VectorStore
+
+        # Send raw text instead of tiktoken ids, which need a network download
+        VectorStore._get_embeddings_model = lambda self: OpenAIEmbeddings(
+            model=self.embedding_model_name, check_embedding_ctx_length=False
+        )
+        VectorStore().create_index(synthetic_chunks(args.chunks), Config.VECTOR_STORE_PATH)
+
+        import main as backend
+
+        with BackgroundServer(backend.app) as server:
+            # Warm up the pipeline so index loading is not part of the measurement
+            httpx.post(f"{server.url}/ask/", json={"query": "warm up"}, timeout=120)
+            settings.error_rate = args.error_rate
+
+            print(f"{'endpoint':>10} {'wall s':>8} {'first s':>8} {'embed reqs':>11} {'chat reqs':>10} {'failed':>7}")
+            for name, run in (
+                ("/ask/", lambda q: run_single(server.url, q, args.concurrency)),
+                ("/ask/batch", lambda q: run_batch(server.url, q)),
+            ):
+                # Distinct questions per run, so the embedding cache doesn't serve the second one
+                queries = [f"What is the maintenance schedule of topic {i} ({name})?" for i in range(args.questions)]
+                embedding_requests, chat_requests = settings.embedding_requests, settings.chat_requests
+                wall, first, failed = asyncio.run(run(queries))
+                print(
+                    f"{name:>10} {wall:>8.2f} {first:>8.2f} {settings.embedding_requests - embedding_requests:>11} "
+                    f"{settings.chat_requests - chat_requests:>10} {failed:>7}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Load test for the /ask/ endpoint against stub embedding and LLM servers.
+
+Run from the backend directory:
+
+    python -m benchmarks.ask_load --concurrency 1 4 16 32
+
+For every concurrency level the script keeps that many clients busy and
+reports throughput, latency percentiles and the status codes returned. With a
+fully async query path, throughput should grow roughly linearly with the
+concurrency level until the query limiter starts shedding load.
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+import httpx
+import numpy as np
+from langchain.docstore.document import Document
+
+from benchmarks.stub_openai import BackgroundServer, StubSettings, create_stub_app
+
+
+def synthetic_chunks(count: int):
+    """Returns `count` small synthetic chunks about numbered topics."""
+    return [
+        Document(
+            page_content=f"Topic {i} describes part number PN-{i:05d} and its maintenance schedule.",
+            metadata={"source": f"synthetic_{i % 10}.pdf", "page": i % 50},
+        )
+        for i in range(count)
+    ]
+
+
+async def run_level(url: str, concurrency: int, requests_per_client: int):
+    """
+    Keeps `concurrency` clients busy and returns the observed statistics.
+    """
+    latencies = []
+    statuses = {}
+
+    async def client_loop(client: httpx.AsyncClient, client_id: int):
+        for i in range(requests_per_client):
+            started = time.perf_counter()
+            response = await client.post(
+                f"{url}/ask/",
+                json={"query": f"What is the maintenance schedule of topic {client_id * 31 + i}?"},
+            )
+            latencies.append(time.perf_counter() - started)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=120, limits=limits) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(client_loop(client, c) for c in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "throughput_rps": len(latencies) / elapsed,
+        "p50_ms": float(np.percentile(latencies, 50) * 1000),
+        "p95_ms": float(np.percentile(latencies, 95) * 1000),
+        "statuses": statuses,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--requests-per-client", type=int, default=8)
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--llm-latency", type=float, default=0.2)
+    parser.add_argument("--embedding-latency", type=float, default=0.02)
+    args = parser.parse_args()
+
+    settings = StubSettings(embedding_latency=args.embedding_latency, llm_latency=args.llm_latency)
+    with BackgroundServer(create_stub_app(settings)) as stub:
+        os.environ["OPENAI_API_KEY"] = "stub"
+        os.environ["OPENAI_BASE_URL"] = f"{stub.url}/v1"
+
+        # Imported here so the clients pick up the stub URL
+        from langchain_openai import OpenAIEmbeddings
+        from config import Config
+        from src.vector_store import VectorStore
+
+        # Send raw text instead of tiktoken ids, which need a network download
+        VectorStore._get_embeddings_model = lambda self: OpenAIEmbeddings(
+            model=self.embedding_model_name, check_embedding_ctx_length=False
+        )
+
+        work_dir = tempfile.mkdtemp(prefix="ask_load_")
+        Config.VECTOR_STORE_PATH = os.path.join(work_dir, "faiss_index")
+        Config.UPLOAD_DIR = os.path.join(work_dir, "uploads")
+        VectorStore().create_index(synthetic_chunks(args.chunks), Config.VECTOR_STORE_PATH)
+
+        import main as backend
+
+        with BackgroundServer(backend.app) as server:
+            # Warm up the pipeline so index loading is not part of the measurement
+            httpx.post(f"{server.url}/ask/", json={"query": "warm up"}, timeout=120)
+
+            print(f"{'conc':>5} {'reqs':>6} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8}  statuses")
+            for level in args.concurrency:
+                result = asyncio.run(run_level(server.url, level, args.requests_per_client))
+                print(
+                    f"{result['concurrency']:>5} {result['requests']:>6} {result['throughput_rps']:>8.1f} "
+                    f"{result['p50_ms']:>8.1f} {result['p95_ms']:>8.1f}  {result['statuses']}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Benchmark of the chunkers: throughput and chunk sizes in tokens.
+
+Run from the backend directory:
+
+    python -m benchmarks.chunking_bench --files 20 --pages 20 --processes 4
+
+The corpus is a structured synthetic one, with headings in larger fonts,
+paragraphs of uneven length and ruled tables. It is split three ways:
+
+- "recursive": PyMuPDFLoader pages split by RecursiveCharacterTextSplitter
+  in this process, as ingestion did before the layout chunker;
+- "layout": the LayoutChunker in this process;
+- "layout-parallel": the LayoutChunker in `--processes` worker processes,
+  through `DocumentProcessor.iter_chunks` as ingestion runs it.
+
+For each it reports the chunks per second, including PDF parsing, and the
+distribution of chunk sizes in tokens: percentiles, standard deviation and
+the share of chunks over `Config.CHUNK_MAX_TOKENS` or under a quarter of it.
+It also reports how many chunks span a heading, i.e. have a heading line
+after a line of text.
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.synthetic_pdfs import generate_corpus
+from config import Config
+from src.chunker import LayoutChunker, RecursiveChunker
+from src.tokenizer import count_tokens
+
+
+def headings_of(paths):
+    """Returns the heading lines of the corpus, as generated."""
+    import fitz
+
+    headings = set()
+    for path in paths:
+        with fitz.open(path) as pdf:
+            for page in pdf:
+                for block in page.get_text("dict")["blocks"]:
+                    for line in block.get("lines", ()):
+                        if line["spans"] and line["spans"][0]["size"] > 10:
+                            headings.add("".join(span["text"] for span in line["spans"]).strip())
+    return headings
+
+
+def spans_heading(text: str, headings) -> bool:
+    """Returns True if a heading line follows a line that isn't a heading."""
+    seen_text = False
+    for line in text.split("\n"):
+        line = line.strip()
+        if not line:
+            continue
+        if line in headings and seen_text:
+            return True
+        seen_text = seen_text or line not in headings
+    return False
+
+
+def run(mode: str, corpus_dir: str, paths, processes: int):
+    """Splits the corpus one way and returns its chunks and the elapsed time."""
+    started = time.perf_counter()
+    if mode == "recursive":
+        chunks = [chunk for path in paths for chunk in RecursiveChunker().split_pdf(path)[1]]
+    elif mode == "layout":
+        chunks = [chunk for path in paths for chunk in LayoutChunker().split_pdf(path)[1]]
+    else:
+        from src.document_processor import DocumentProcessor
+
+        Config.INGESTION_PROCESSES = processes
+        chunks = list(DocumentProcessor(corpus_dir, chunker=LayoutChunker()).iter_chunks())
+    return chunks, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=20)
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    corpus_dir = tempfile.mkdtemp(prefix="chunking_bench_")
+    paths = generate_corpus(corpus_dir, files=args.files, pages_per_file=args.pages, structured=True)
+    headings = headings_of(paths)
+    print(f"{args.files} structured PDFs x {args.pages} pages, {args.processes} process(es), "
+          f"CHUNK_MAX_TOKENS={Config.CHUNK_MAX_TOKENS}, CHUNK_SIZE={Config.CHUNK_SIZE} chars")
+    print(
+        f"{'mode':>16} {'chunks':>7} {'chunks/s':>9} {'p5':>5} {'p50':>5} {'p95':>5} {'max':>5} "
+        f"{'std':>6} {'>max':>6} {'<max/4':>7} {'span hd':>8}"
+    )
+    for mode in ("recursive", "layout", "layout-parallel"):
+        chunks, elapsed = run(mode, corpus_dir, paths, args.processes)
+        tokens = np.asarray([count_tokens(chunk.page_content) for chunk in chunks])
+        spanning = sum(spans_heading(chunk.page_content, headings) for chunk in chunks)
+        print(
+            f"{mode:>16} {len(chunks):>7} {len(chunks) / elapsed:>9.1f} "
+            f"{np.percentile(tokens, 5):>5.0f} {np.percentile(tokens, 50):>5.0f} {np.percentile(tokens, 95):>5.0f} "
+            f"{tokens.max():>5} {statistics.pstdev(tokens.tolist()):>6.1f} "
+            f"{np.mean(tokens > Config.CHUNK_MAX_TOKENS):>6.1%} {np.mean(tokens < Config.CHUNK_MAX_TOKENS / 4):>7.1%} "
+            f"{spanning:>8}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""
+Stress test of concurrent uploads against stub embedding and LLM servers.
+
+Run from the backend directory:
+
+    python -m benchmarks.concurrent_upload_stress --uploads 16 --workers 4
+
+The script fires N uploads at /upload/ at the same time, processes the
+queued jobs with several ingestion workers writing to the same index, and
+then checks that every uploaded document is registered and that every one
+of its chunks landed in the published index. It exits with status 1 if any
+chunk is missing.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+from benchmarks.stub_openai import BackgroundServer, StubSettings, create_stub_app
+from benchmarks.synthetic_pdfs import generate_corpus
+
+
+def make_uploads(work_dir: str, uploads: int, files_per_upload: int, pages_per_file: int):
+    """
+    Writes a distinct set of PDF files for every upload.
+
+    Returns:
+        list: The file paths of every upload.
+    """
+    batches = []
+    for upload in range(uploads):
+        upload_dir = os.path.join(work_dir, "corpus", f"upload_{upload:03d}")
+        paths = []
+        for path in generate_corpus(upload_dir, files=files_per_upload, pages_per_file=pages_per_file, seed=upload):
+            renamed = os.path.join(upload_dir, f"u{upload:03d}_{os.path.basename(path)}")
+            os.rename(path, renamed)
+            paths.append(renamed)
+        batches.append(paths)
+    return batches
+
+
+def expected_chunks(batches):
+    """
+    Returns the number of chunks every file should produce, keyed by file name.
+    """
+    from src.document_processor import DocumentProcessor
+
+    counts = {}
+    for paths in batches:
+        processor = DocumentProcessor(os.path.dirname(paths[0]))
+        for chunk in processor.iter_chunks():
+            source = os.path.basename(chunk.metadata["source"])
+            counts[source] = counts.get(source, 0) + 1
+    return counts
+
+
+def upload(url: str, paths):
+    """Posts one upload and returns its job ID."""
+    files = [("files", (os.path.basename(path), open(path, "rb"), "application/pdf")) for path in paths]
+    try:
+        response = httpx.post(f"{url}/upload/", files=files, timeout=120)
+    finally:
+        for _, (_, handle, _) in files:
+            handle.close()
+    response.raise_for_status()
+    return response.json()["job_id"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uploads", type=int, default=16)
+    parser.add_argument("--files-per-upload", type=int, default=2)
+    parser.add_argument("--pages-per-file", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--timeout", type=float, default=600)
+    args = parser.parse_args()
+
+    with BackgroundServer(create_stub_app(StubSettings())) as stub:
+        os.environ["OPENAI_API_KEY"] = "stub"
+        os.environ["OPENAI_BASE_URL"] = f"{stub.url}/v1"
+
+        # Imported here so the clients pick up the stub URL
+        from langchain_openai import OpenAIEmbeddings
+        from config import Config
+        from src.vector_store import VectorStore
+
+        # Send raw text instead of tiktoken ids, which need a network download
+        VectorStore._get_embeddings_model = lambda self: OpenAIEmbeddings(
+            model=self.embedding_model_name, check_embedding_ctx_length=False
+        )
+
+        work_dir = tempfile.mkdtemp(prefix="upload_stress_")
+        Config.VECTOR_STORE_PATH = os.path.join(work_dir, "faiss_index")
+        Config.UPLOAD_DIR = os.path.join(work_dir, "uploads")
+        Config.JOB_DB_PATH = os.path.join(work_dir, "jobs.sqlite3")
+        Config.EMBEDDING_CACHE_PATH = os.path.join(work_dir, "embedding_cache.sqlite3")
+        Config.INGESTION_PROCESSES = 1
+        # Workers run as threads of this process so they share the patched embeddings;
+        # they still write through separate SegmentStores, i.e. separate file locks
+        Config.JOB_WORKERS = 0
+
+        batches = make_uploads(work_dir, args.uploads, args.files_per_upload, args.pages_per_file)
+        expected = expected_chunks(batches)
+
+        import main as backend
+        from src.document_registry import DocumentRegistry
+        from src.job_store import JobStore
+        from src.segmented_index import SegmentStore
+        from worker import run_worker
+
+        stop_event = threading.Event()
+        workers = [
+            threading.Thread(target=run_worker, args=(f"stress-{i}", stop_event, Config.JOB_DB_PATH))
+            for i in range(args.workers)
+        ]
+        with BackgroundServer(backend.app) as server:
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.uploads) as executor:
+                job_ids = list(executor.map(lambda paths: upload(server.url, paths), batches))
+            print(f"Accepted {len(job_ids)} concurrent uploads in {time.perf_counter() - started:.2f}s.")
+
+            for worker in workers:
+                worker.start()
+            store = JobStore(Config.JOB_DB_PATH)
+            deadline = time.monotonic() + args.timeout
+            while time.monotonic() < deadline:
+                jobs = [store.get(job_id) for job_id in job_ids]
+                if all(job["status"] in ("succeeded", "failed") for job in jobs):
+                    break
+                time.sleep(0.5)
+            stop_event.set()
+            for worker in workers:
+                worker.join()
+            elapsed = time.perf_counter() - started
+
+        failed = [job for job in jobs if job["status"] != "succeeded"]
+        documents = {entry["source"]: entry for entry in DocumentRegistry(Config.VECTOR_STORE_PATH).list_documents()}
+        index = SegmentStore(Config.VECTOR_STORE_PATH).load(VectorStore().embeddings)
+        indexed_per_source = {}
+        for _, db in index.segments:
+            for docstore_id in db.index_to_docstore_id.values():
+                source = os.path.basename(db.docstore.search(docstore_id).metadata["source"])
+                indexed_per_source[source] = indexed_per_source.get(source, 0) + 1
+
+        missing = {
+            source: (count, indexed_per_source.get(source, 0))
+            for source, count in expected.items()
+            if indexed_per_source.get(source, 0) != count or source not in documents
+        }
+        print(
+            f"{len(job_ids)} jobs in {elapsed:.2f}s: {len(job_ids) - len(failed)} succeeded, {len(failed)} failed."
+        )
+        print(
+            f"Documents registered: {len(documents)}/{len(expected)}, "
+            f"chunks indexed: {sum(indexed_per_source.values())}/{sum(expected.values())}, "
+            f"segments: {len(index.segments)}."
+        )
+        for job in failed:
+            print(f"  job {job['id']} failed: {job['error']}")
+        for source, (want, got) in sorted(missing.items()):
+            print(f"  {source}: expected {want} chunks, found {got}")
+        shutil.rmtree(work_dir, ignore_errors=True)
+        if failed or missing:
+            sys.exit(1)
+        print("OK: every chunk of every upload is in the index.")
+
+
+if __name__ == "__main__":
+    main()
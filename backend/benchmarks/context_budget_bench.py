@@ -0,0 +1,100 @@
+"""
+Benchmark of the prompt context assembled from retrieved chunks.
+
+Run from the backend directory:
+
+    python -m benchmarks.context_budget_bench --pages 500 --queries 200
+
+Synthetic pages, each starting with the same disclaimer sentence and without
+paragraph breaks, are split by characters with overlap, as the recursive
+chunker does, and indexed with BM25. Questions about a
+part number retrieve the top `k` chunks, which are mostly neighbouring
+chunks of the same page. For every `k`, the script reports the average
+tokens of the chunks joined as they are (as the prompt was built before),
+of the assembled context, the share saved, the share of questions cut to the
+token budget, and the time to assemble one context.
+"""
+import argparse
+import random
+import statistics
+import tempfile
+import time
+
+from langchain.docstore.document import Document
+
+from benchmarks.synthetic_pdfs import page_text
+from config import Config
+from src.context_builder import ContextBuilder
+from src.chunker import RecursiveChunker
+from src.lexical_index import LexicalIndex, LexicalIndexWriter, bm25_idf, tokenize
+
+DISCLAIMER = "This manual is provided for maintenance personnel and does not replace the safety instructions."
+
+
+def build_corpus(pages: int, seed: int):
+    """Returns the chunks of the synthetic pages, split by characters with overlap."""
+    rng = random.Random(seed)
+    documents = [
+        Document(
+            # Text extracted from PDFs often has no paragraph breaks
+            page_content=f"{DISCLAIMER} " + page_text(rng, topic).replace("\n\n", " "),
+            metadata={"source": f"manual-{topic // 20}.pdf", "page": topic % 20},
+        )
+        for topic in range(pages)
+    ]
+    return RecursiveChunker().split_documents(documents)
+
+
+def search(index: LexicalIndex, chunks, query: str, k: int):
+    """Returns the `k` best chunks for `query` by BM25."""
+    terms = set(tokenize(query))
+    idf = {
+        term: bm25_idf(index.document_frequency(term), index.document_count)
+        for term in terms if index.document_frequency(term)
+    }
+    average_length = index.total_length / index.document_count
+    return [chunks[position] for position, _ in index.top(idf, average_length, k)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=500)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, nargs="+", default=[3, 5, 10, 20])
+    parser.add_argument("--max-tokens", type=int, default=Config.CONTEXT_MAX_TOKENS)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    chunks = build_corpus(args.pages, args.seed)
+    print(f"{len(chunks)} chunks from {args.pages} pages, budget {args.max_tokens} tokens")
+    rng = random.Random(args.seed)
+    queries = [f"What is the pressure of part number PN-{rng.randrange(args.pages):05d}?" for _ in range(args.queries)]
+    builder = ContextBuilder(max_tokens=args.max_tokens)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        writer = LexicalIndexWriter()
+        for chunk in chunks:
+            writer.add(chunk.page_content)
+        writer.write(tmp)
+        index = LexicalIndex.open(tmp)
+
+        print(f"{'k':>3} {'retrieved':>10} {'context':>8} {'saved':>6} {'cut':>5} {'build':>9}")
+        for k in args.k:
+            retrieved, context, truncated, timings = [], [], 0, []
+            for query in queries:
+                documents = search(index, chunks, query, k)
+                started = time.perf_counter()
+                _, stats = builder.build(documents)
+                timings.append(time.perf_counter() - started)
+                retrieved.append(stats.retrieved_tokens)
+                context.append(stats.context_tokens)
+                truncated += stats.truncated
+            saved = 1 - sum(context) / sum(retrieved)
+            print(
+                f"{k:>3} {statistics.mean(retrieved):>10.0f} {statistics.mean(context):>8.0f} "
+                f"{saved:>6.0%} {truncated / len(queries):>5.0%} {statistics.median(timings) * 1000:>7.2f}ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
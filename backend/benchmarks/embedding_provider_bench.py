@@ -0,0 +1,164 @@
+"""
+Benchmark of query embedding latency and throughput: a remote embeddings API
+against a model run in this process, with and without micro-batching.
+
+Run from the backend directory:
+
+    python -m benchmarks.embedding_provider_bench --queries 2000 --concurrency 1 4 16 64
+
+Backends:
+
+- "remote": OpenAIEmbeddings against the local stub server, which adds
+  `--remote-latency` seconds to every request to stand for the WAN round
+  trip to the API;
+- "local": `MicroBatchingEmbeddings`, as the "local" provider runs, with
+  concurrent queries merged into one forward pass;
+- "local-unbatched": the same model with one forward pass per query.
+
+The local model is the sentence-transformers model `--model` if the package
+is installed. Otherwise a stand-in encoder of a small model's shape is used:
+hashed token features through two dense layers. Its forward pass, like a
+real one on the CPU, costs mostly reading the weights, so it shows the
+effect of batching but not a real model's absolute latency.
+
+For every backend and concurrency level the script reports the per-query
+latency percentiles, the queries per second and the mean number of queries
+per forward pass, and checks that batched and unbatched vectors match.
+"""
+import argparse
+import asyncio
+import os
+import time
+
+import numpy as np
+
+from benchmarks.stub_openai import BackgroundServer, StubSettings, create_stub_app, hash_embedding
+from src.local_embeddings import MicroBatchingEmbeddings
+
+
+class StandInEncoder:
+    """
+    Hashed token features through two dense layers, about the size of the
+    last layers of a MiniLM model.
+    """
+
+    def __init__(self, features: int = 4_096, hidden: int = 1_536, dim: int = 384, seed: int = 0):
+        rng = np.random.default_rng(seed)
+        self.features = features
+        self.first = rng.standard_normal((features, hidden), dtype=np.float32) / np.sqrt(features)
+        self.second = rng.standard_normal((hidden, dim), dtype=np.float32) / np.sqrt(hidden)
+
+    def __call__(self, texts):
+        inputs = np.stack([hash_embedding(text, dim=self.features) for text in texts])
+        vectors = np.tanh(inputs @ self.first) @ self.second
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors.tolist()
+
+
+def load_encoder(model_name: str):
+    """Returns the encode function of the local model and its description."""
+    try:
+        from sentence_transformers import SentenceTransformer
+    except ImportError:
+        return StandInEncoder(), "stand-in encoder (sentence-transformers not installed)"
+    model = SentenceTransformer(model_name, device="cpu")
+
+    def encode(texts):
+        return model.encode(
+            texts, batch_size=len(texts), normalize_embeddings=True, convert_to_numpy=True, show_progress_bar=False
+        ).tolist()
+
+    return encode, model_name
+
+
+class CountingEncoder:
+    """Counts the forward passes and texts of an encode function."""
+
+    def __init__(self, encode):
+        self.encode = encode
+        self.calls = 0
+        self.texts = 0
+
+    def __call__(self, texts):
+        self.calls += 1
+        self.texts += len(texts)
+        return self.encode(texts)
+
+
+def make_queries(count: int):
+    """Returns `count` distinct short questions."""
+    return [f"what is the calibration interval of valve PN-{i:05d}?" for i in range(count)]
+
+
+async def run_queries(embeddings, queries, concurrency: int):
+    """Embeds the queries with `concurrency` concurrent clients; returns the latencies and wall time."""
+    latencies = []
+    position = iter(range(len(queries)))
+
+    async def client():
+        for i in position:
+            started = time.perf_counter()
+            await embeddings.aembed_query(queries[i])
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return np.asarray(latencies), time.perf_counter() - started
+
+
+def check_vectors(batched, unbatched, queries) -> bool:
+    """Returns True if batched and unbatched forward passes give the same vectors."""
+    sample = queries[:32]
+
+    async def embed_all(embeddings):
+        return await asyncio.gather(*(embeddings.aembed_query(query) for query in sample))
+
+    first = np.asarray(asyncio.run(embed_all(batched)))
+    second = np.asarray(asyncio.run(embed_all(unbatched)))
+    return bool(np.allclose(first, second, atol=1e-4))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", type=int, default=2_000)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--remote-latency", type=float, default=0.03)
+    parser.add_argument("--model", default="sentence-transformers/all-MiniLM-L6-v2")
+    parser.add_argument("--window", type=float, default=0.002)
+    parser.add_argument("--max-batch-size", type=int, default=64)
+    args = parser.parse_args()
+
+    queries = make_queries(args.queries)
+    encode, description = load_encoder(args.model)
+    batched_encoder, unbatched_encoder = CountingEncoder(encode), CountingEncoder(encode)
+    local = MicroBatchingEmbeddings(batched_encoder, window=args.window, max_batch_size=args.max_batch_size)
+    unbatched = MicroBatchingEmbeddings(unbatched_encoder, window=0.0, max_batch_size=1)
+    print(f"local model: {description}, {os.cpu_count()} CPU(s)")
+    print(f"vectors match between batched and unbatched passes: {check_vectors(local, unbatched, queries)}")
+
+    with BackgroundServer(create_stub_app(StubSettings(embedding_latency=args.remote_latency))) as stub:
+        os.environ.setdefault("OPENAI_API_KEY", "stub")
+        os.environ["OPENAI_BASE_URL"] = f"{stub.url}/v1"
+        from langchain_openai import OpenAIEmbeddings
+
+        remote = OpenAIEmbeddings(model="text-embedding-3-small", check_embedding_ctx_length=False)
+        backends = {"remote": (remote, None), "local": (local, batched_encoder), "local-unbatched": (unbatched, unbatched_encoder)}
+
+        print(f"{args.queries} queries per run, remote latency {args.remote_latency * 1000:.0f} ms, "
+              f"micro-batch window {args.window * 1000:.1f} ms, at most {args.max_batch_size} queries per pass")
+        print(f"{'backend':>16} {'conc':>5} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'queries/s':>10} {'per pass':>9}")
+        for concurrency in args.concurrency:
+            for name, (embeddings, counter) in backends.items():
+                if counter is not None:
+                    counter.calls = counter.texts = 0
+                latencies, elapsed = asyncio.run(run_queries(embeddings, queries, concurrency))
+                per_pass = f"{counter.texts / counter.calls:>9.1f}" if counter is not None else f"{'-':>9}"
+                print(
+                    f"{name:>16} {concurrency:>5} {np.percentile(latencies, 50) * 1000:>8.2f} "
+                    f"{np.percentile(latencies, 95) * 1000:>8.2f} {np.percentile(latencies, 99) * 1000:>8.2f} "
+                    f"{len(latencies) / elapsed:>10.1f} {per_pass}"
+                )
+
+
+if __name__ == "__main__":
+    main()
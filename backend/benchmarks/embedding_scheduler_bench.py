@@ -0,0 +1,110 @@
+"""
+Benchmark and fault-injection check of the embedding scheduler against a
+local stub embedding server.
+
+Run from the backend directory:
+
+    python -m benchmarks.embedding_scheduler_bench --texts 5000
+
+The stub adds latency to every request and answers a fraction of them with
+429 or 500. For every concurrency level the script reports the wall time and
+request counts, and checks that every returned vector matches the stub's
+deterministic embedding. A final scenario disables retries so that some
+batches fail, then repeats the call through the embedding cache, which kept
+the batches that succeeded, and reports how many inputs had to be
+re-embedded.
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.stub_openai import BackgroundServer, StubSettings, create_stub_app, hash_embedding
+
+
+def make_texts(count: int):
+    """Returns `count` distinct synthetic chunk texts."""
+    return [f"chunk {i} covers the calibration procedure of valve PN-{i:05d}" for i in range(count)]
+
+
+def check_vectors(texts, vectors) -> bool:
+    """Checks the vectors against the stub's deterministic embeddings."""
+    expected = np.stack([hash_embedding(text) for text in texts])
+    return bool(np.allclose(expected, np.asarray(vectors, dtype=np.float32), atol=1e-5))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--texts", type=int, default=5000)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--latency", type=float, default=0.1)
+    parser.add_argument("--throttle-rate", type=float, default=0.1)
+    parser.add_argument("--error-rate", type=float, default=0.05)
+    args = parser.parse_args()
+
+    settings = StubSettings(
+        embedding_latency=args.latency, throttle_rate=args.throttle_rate, error_rate=args.error_rate
+    )
+    with BackgroundServer(create_stub_app(settings)) as stub:
+        os.environ["OPENAI_API_KEY"] = "stub"
+        os.environ["OPENAI_BASE_URL"] = f"{stub.url}/v1"
+        from langchain_openai import OpenAIEmbeddings
+        from config import Config
+        from src.embedding_cache import CachedEmbeddings
+        from src.embedding_scheduler import EmbeddingSchedulerError, RateLimiter, ScheduledEmbeddings
+
+        def rate_limiter():
+            # Limits of this process only, the benchmark runs alone
+            return RateLimiter(Config.EMBEDDING_REQUESTS_PER_MINUTE, Config.EMBEDDING_TOKENS_PER_MINUTE)
+
+        # Client-side retries are disabled so that the scheduler handles every failure
+        client = OpenAIEmbeddings(check_embedding_ctx_length=False, max_retries=0)
+        texts = make_texts(args.texts)
+
+        print(f"{'conc':>5} {'sec':>7} {'texts/s':>8} {'requests':>9} {'throttled':>10}  correct")
+        for concurrency in args.concurrency:
+            scheduler = ScheduledEmbeddings(
+                client,
+                max_batch_size=args.batch_size,
+                max_concurrency=concurrency,
+                retry_base_delay=0.05,
+                rate_limiter=rate_limiter(),
+            )
+            settings.embedding_requests = settings.throttled = 0
+            started = time.perf_counter()
+            vectors = scheduler.embed_documents(texts)
+            elapsed = time.perf_counter() - started
+            print(
+                f"{concurrency:>5} {elapsed:>7.2f} {len(texts) / elapsed:>8.0f} "
+                f"{settings.embedding_requests:>9} {settings.throttled:>10}  {check_vectors(texts, vectors)}"
+            )
+
+        # Partial failure and resume
+        scheduler = ScheduledEmbeddings(
+            client, max_batch_size=args.batch_size, max_concurrency=4, max_retries=0, rate_limiter=rate_limiter()
+        )
+        cache_path = os.path.join(tempfile.mkdtemp(prefix="embedding_scheduler_bench_"), "cache.sqlite3")
+        cached = CachedEmbeddings(scheduler, "stub", cache_path=cache_path)
+        settings.throttle_rate, settings.error_rate = 0.3, 0.0
+        settings.embedded_inputs = 0
+        try:
+            cached.embed_documents(texts)
+            print("First attempt succeeded without failures; nothing to resume.")
+        except EmbeddingSchedulerError as e:
+            first_inputs = settings.embedded_inputs
+            print(f"First attempt: {e.failed_batches}/{e.total_batches} batches failed, {first_inputs} inputs embedded.")
+            settings.throttle_rate = 0.0
+            scheduler.max_retries = 3
+            vectors = cached.embed_documents(texts)
+            resumed_inputs = settings.embedded_inputs - first_inputs
+            print(
+                f"Resume: {resumed_inputs} inputs re-embedded (failed batches only), "
+                f"correct={check_vectors(texts, vectors)}"
+            )
+
+
+if __name__ == "__main__":
+    main()
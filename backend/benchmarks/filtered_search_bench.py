@@ -0,0 +1,136 @@
+"""
+Benchmark of metadata-filtered vector search, across filter selectivity.
+
+Run from the backend directory:
+
+    python -m benchmarks.filtered_search_bench --chunks 50000 --index-type flat
+
+The corpus and the hashed embeddings are the ones of `hybrid_retrieval_bench`:
+chunks are spread over 100 sources of 500 pages each. Every filter is run
+two ways:
+
+- "pre-filter" restricts the FAISS search of every segment to the chunks
+  selected by the segment's metadata index, as `SegmentedIndex` does;
+- "post-filter" searches the whole segment, drops the hits that don't match
+  in Python and fetches twice as many hits until `k` of them match, which
+  is how a LangChain FAISS `filter` has to be used to return `k` results.
+
+For every filter the script reports the share of chunks it selects, the
+p50/p95 latency per query of both ways, and their recall@k against an exact
+search of the selected chunks. `--index-type` converts the segments to an
+ANN index type of `src.ann_index` first.
+"""
+import argparse
+import random
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.hybrid_retrieval_bench import HashEmbeddings, build_index, synthetic_corpus
+from src.ann_index import build_index as build_ann_index, to_flat
+from src.metadata_index import MetadataFilter
+
+FILTERS = {
+    "none": MetadataFilter(),
+    "1 source": MetadataFilter(sources=("manual_7.pdf",)),
+    "10 sources": MetadataFilter(sources=tuple(f"manual_{i}.pdf" for i in range(10))),
+    "pages 0-49": MetadataFilter(page_min=0, page_max=49),
+    "pages 0-249": MetadataFilter(page_min=0, page_max=249),
+    "1 source, 5 pages": MetadataFilter(sources=("manual_7.pdf",), page_min=105, page_max=109),
+}
+
+
+def matches(metadata: dict, search_filter: MetadataFilter) -> bool:
+    """Returns True if chunk metadata matches the filter, as a Python predicate."""
+    if search_filter.sources is not None and metadata["source"] not in search_filter.sources:
+        return False
+    if search_filter.page_min is not None and metadata["page"] < search_filter.page_min:
+        return False
+    if search_filter.page_max is not None and metadata["page"] > search_filter.page_max:
+        return False
+    return True
+
+
+def post_filter_search(index, vector: np.ndarray, k: int, search_filter: MetadataFilter):
+    """Searches every segment unfiltered and filters the hits in Python."""
+    hits = []
+    for _, db in index.segments:
+        fetch_k = 4 * k
+        while True:
+            distances, positions = db.index.search(vector, min(fetch_k, db.index.ntotal))
+            found = []
+            for distance, position in zip(distances[0], positions[0]):
+                if position < 0:
+                    break
+                document = db.docstore.search(db.index_to_docstore_id[int(position)])
+                if matches(document.metadata, search_filter):
+                    found.append((float(distance), document.page_content))
+                    if len(found) == k:
+                        break
+            if len(found) == k or fetch_k >= db.index.ntotal:
+                break
+            fetch_k *= 2
+        hits.extend(found)
+    return sorted(hits)[:k]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=50_000)
+    parser.add_argument("--segments", type=int, default=4)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--index-type", default="flat")
+    args = parser.parse_args()
+
+    embeddings = HashEmbeddings()
+    documents, components = synthetic_corpus(args.chunks, seed=0)
+    index = build_index(tempfile.mkdtemp(prefix="filtered_bench_"), documents, args.segments, embeddings)
+    vectors = np.stack([to_flat(db.index).reconstruct_n(0, db.index.ntotal) for _, db in index.segments])
+    vectors = vectors.reshape(-1, vectors.shape[-1])
+    if args.index_type != "flat":
+        for _, db in index.segments:
+            db.index = build_ann_index(to_flat(db.index).reconstruct_n(0, db.index.ntotal), args.index_type)
+    rng = random.Random(1)
+    queries = [
+        np.asarray([embeddings.embed_query(f"How do I service the {' and '.join(components[i])}?")], dtype=np.float32)
+        for i in rng.sample(range(args.chunks), args.queries)
+    ]
+
+    print(f"{args.chunks} chunks in {args.segments} {args.index_type} segments, {args.queries} queries, k={args.k}")
+    print(
+        f"{'filter':>18} {'selected':>9} {'pre p50':>9} {'pre p95':>9} {'recall':>7} "
+        f"{'post p50':>9} {'post p95':>9} {'recall':>7}"
+    )
+    for name, search_filter in FILTERS.items():
+        selected = np.asarray([matches(document.metadata, search_filter) for document in documents])
+        timings = {"pre": [], "post": []}
+        found = {"pre": 0, "post": 0}
+        for query in queries:
+            # Recall is measured by distance, as hashed embeddings have many ties
+            distances = ((vectors[selected] - query) ** 2).sum(axis=1)
+            threshold = np.sort(distances)[:args.k][-1] + 1e-4 if len(distances) else 0.0
+
+            started = time.perf_counter()
+            hits = index.similarity_search_with_score_by_vector(query[0], k=args.k, filter=search_filter)
+            timings["pre"].append(time.perf_counter() - started)
+            found["pre"] += sum(distance <= threshold for _, distance in hits)
+
+            started = time.perf_counter()
+            hits = post_filter_search(index, query, args.k, search_filter)
+            timings["post"].append(time.perf_counter() - started)
+            found["post"] += sum(distance <= threshold for distance, _ in hits)
+
+        expected = min(args.k, int(selected.sum())) * len(queries) or 1
+        print(
+            f"{name:>18} {selected.mean():>9.2%} "
+            f"{np.percentile(timings['pre'], 50) * 1000:>7.2f}ms {np.percentile(timings['pre'], 95) * 1000:>7.2f}ms "
+            f"{found['pre'] / expected:>7.3f} "
+            f"{np.percentile(timings['post'], 50) * 1000:>7.2f}ms {np.percentile(timings['post'], 95) * 1000:>7.2f}ms "
+            f"{found['post'] / expected:>7.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
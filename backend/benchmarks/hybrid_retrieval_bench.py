@@ -0,0 +1,141 @@
+"""
+Benchmark of vector, BM25 and hybrid retrieval on a synthetic corpus.
+
+Run from the backend directory:
+
+    python -m benchmarks.hybrid_retrieval_bench --chunks 50000 --segments 5
+
+Every chunk describes one part with a part number and four random
+component words, followed by a sentence shared by all chunks. Two query
+sets are run against the same segmented index:
+
+- "part number" queries only name the part number, like a user pasting an
+  identifier from a report;
+- "description" queries name the component words without the number.
+
+For every retriever mode the script reports recall@k (the share of queries
+whose target chunk is returned) and the p50/p95 latency per query. Queries
+are embedded in-process with the hashed bag-of-words embeddings of the stub
+server, so the latencies exclude any embedding API round trip, which the
+lexical mode doesn't make at all. Hashed embeddings carry no semantics, so
+the vector recall is a lower bound of what real embeddings reach; the
+interesting numbers are the lexical gain on identifiers and the latency
+cost of fusion.
+"""
+import argparse
+import asyncio
+import json
+import random
+import tempfile
+import time
+from typing import List
+
+import numpy as np
+from langchain.docstore.document import Document
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import Embeddings
+
+from benchmarks.stub_openai import hash_embedding
+from src.hybrid_retriever import HYBRID, LEXICAL, HybridRetriever
+from src.segmented_index import SegmentStore
+
+WORDS = (
+    "hydraulic pneumatic valve pump seal gasket bearing shaft rotor stator coupling flange bracket sensor "
+    "actuator spring piston cylinder manifold filter nozzle impeller housing gear clutch brake cable relay "
+    "fuse switch thermostat compressor condenser radiator hose clamp bolt washer bushing damper"
+).split()
+BOILERPLATE = "See the maintenance manual for the inspection interval."
+
+
+class HashEmbeddings(Embeddings):
+    """In-process hashed bag-of-words embeddings, identical to the stub server's."""
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [hash_embedding(text).tolist() for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return hash_embedding(text).tolist()
+
+
+def synthetic_corpus(count: int, seed: int):
+    """Returns the chunks and the component words of each one."""
+    rng = random.Random(seed)
+    documents, components = [], []
+    for i in range(count):
+        words = rng.sample(WORDS, 4)
+        components.append(words)
+        documents.append(Document(
+            page_content=f"Part number PN-{i:06d} is the {' '.join(words)} assembly. {BOILERPLATE}",
+            metadata={"source": f"manual_{i % 100}.pdf", "page": i % 500, "doc_id": f"doc-{i % 100}"},
+        ))
+    return documents, components
+
+
+def build_index(directory: str, documents: List[Document], segments: int, embeddings: Embeddings):
+    """Writes the documents as `segments` published segments and loads them."""
+    store = SegmentStore(directory)
+    for batch in np.array_split(np.arange(len(documents)), segments):
+        db = FAISS.from_documents([documents[i] for i in batch], embeddings)
+        store.publish(add=[store.write_segment(db)])
+    return store.load(embeddings)
+
+
+def run(retriever: HybridRetriever, queries, k: int):
+    """Runs the queries one at a time and returns recall@k and latencies."""
+    latencies, found = [], 0
+    for query, target in queries:
+        started = time.perf_counter()
+        documents = asyncio.run(retriever.ainvoke(query))
+        latencies.append(time.perf_counter() - started)
+        found += any(target in document.page_content for document in documents[:k])
+    return {
+        "recall_at_k": found / len(queries),
+        "p50_ms": float(np.percentile(latencies, 50) * 1000),
+        "p95_ms": float(np.percentile(latencies, 95) * 1000),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=20_000)
+    parser.add_argument("--segments", type=int, default=4)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--fetch-k", type=int, default=20)
+    parser.add_argument("--json", help="Also write the results to this file.")
+    args = parser.parse_args()
+
+    embeddings = HashEmbeddings()
+    documents, components = synthetic_corpus(args.chunks, seed=0)
+    started = time.perf_counter()
+    index = build_index(tempfile.mkdtemp(prefix="hybrid_bench_"), documents, args.segments, embeddings)
+    print(f"Indexed {args.chunks} chunks in {args.segments} segments in {time.perf_counter() - started:.1f}s")
+
+    targets = random.Random(1).sample(range(args.chunks), args.queries)
+    query_sets = {
+        "part number": [(f"Which assembly is PN-{i:06d}?", f"PN-{i:06d}") for i in targets],
+        "description": [
+            (f"How do I service the {' and '.join(components[i])}?", f"PN-{i:06d}") for i in targets
+        ],
+    }
+    retrievers = {
+        "vector": index.as_retriever(search_kwargs={"k": args.k}),
+        "lexical": HybridRetriever(index=index, mode=LEXICAL, k=args.k),
+        "hybrid": HybridRetriever(index=index, mode=HYBRID, k=args.k, fetch_k=args.fetch_k),
+    }
+
+    results = []
+    print(f"{'queries':>12} {'mode':>8} {'recall@' + str(args.k):>9} {'p50 ms':>8} {'p95 ms':>8}")
+    for query_set, queries in query_sets.items():
+        for mode, retriever in retrievers.items():
+            r = run(retriever, queries, args.k)
+            print(f"{query_set:>12} {mode:>8} {r['recall_at_k']:>9.3f} {r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f}")
+            results.append({"queries": query_set, "mode": mode, **r})
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
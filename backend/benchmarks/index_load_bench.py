@@ -0,0 +1,129 @@
+"""
+Benchmark of opening an index segment: the pickled FAISS store against the
+chunk store layout, read fully or memory-mapped.
+
+Run from the backend directory:
+
+    python -m benchmarks.index_load_bench --chunks 200000 --dim 384
+
+A synthetic segment is written in both layouts. Every mode is then opened
+in a fresh subprocess, which reports the time to open the segment, its
+resident memory afterwards, and the latency of the first and of the
+following top-k searches, which include reading the returned chunks.
+Memory-mapped pages touched by searches count towards RSS, but they live in
+the page cache and are shared by every worker process that maps the segment.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+MODES = ("pickle", "read", "mmap")
+
+
+def rss_mb() -> float:
+    """Returns the current resident set size of this process in MB."""
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+
+
+def build(work_dir: str, chunks: int, dim: int) -> str:
+    """Writes the synthetic segment in both layouts and returns the new segment's ID."""
+    import faiss
+    from langchain.docstore.document import Document
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+    from langchain_community.vectorstores import FAISS
+    from langchain_core.embeddings import FakeEmbeddings
+    from src.segmented_index import SegmentStore
+
+    rng = np.random.default_rng(0)
+    index = faiss.IndexFlatL2(dim)
+    index.add(rng.standard_normal((chunks, dim)).astype(np.float32))
+    text = "The maintenance schedule of this part is described in section {i}. " * 10
+    documents = {
+        str(i): Document(page_content=text.format(i=i), metadata={"source": f"synthetic_{i % 100}.pdf", "page": i})
+        for i in range(chunks)
+    }
+    db = FAISS(FakeEmbeddings(size=dim), index, InMemoryDocstore(documents), {i: str(i) for i in range(chunks)})
+    db.save_local(os.path.join(work_dir, "pickle"))
+    return SegmentStore(os.path.join(work_dir, "segmented")).write_segment(db)["id"]
+
+
+def measure(mode: str, work_dir: str, segment_id: str, dim: int, queries: int, k: int) -> dict:
+    """Opens the segment in this process and reports its statistics."""
+    from langchain_community.vectorstores import FAISS
+    from langchain_core.embeddings import FakeEmbeddings
+    from src.segmented_index import SegmentStore
+
+    embeddings = FakeEmbeddings(size=dim)
+    baseline = rss_mb()
+    started = time.perf_counter()
+    if mode == "pickle":
+        db = FAISS.load_local(os.path.join(work_dir, "pickle"), embeddings, allow_dangerous_deserialization=True)
+    else:
+        db = SegmentStore(os.path.join(work_dir, "segmented")).load_segment(
+            segment_id, embeddings, use_mmap=mode == "mmap"
+        )
+    load_seconds = time.perf_counter() - started
+    loaded_rss = rss_mb() - baseline
+
+    vectors = np.random.default_rng(1).standard_normal((queries, dim)).astype(np.float32)
+    latencies = []
+    for vector in vectors:
+        started = time.perf_counter()
+        docs = db.similarity_search_with_score_by_vector(vector.tolist(), k=k)
+        latencies.append(time.perf_counter() - started)
+        assert len(docs) == k
+    return {
+        "mode": mode,
+        "load_seconds": load_seconds,
+        "rss_after_load_mb": loaded_rss,
+        "first_query_ms": latencies[0] * 1000,
+        "p50_query_ms": float(np.percentile(latencies[1:], 50) * 1000),
+        "rss_after_queries_mb": rss_mb() - baseline,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=200_000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--measure", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--work-dir", help=argparse.SUPPRESS)
+    parser.add_argument("--segment", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        result = measure(args.measure, args.work_dir, args.segment, args.dim, args.queries, args.k)
+        print(json.dumps(result))
+        return
+
+    work_dir = tempfile.mkdtemp(prefix="index_load_bench_")
+    segment_id = build(work_dir, args.chunks, args.dim)
+    print(f"Wrote {args.chunks} chunks x {args.dim} dims in {work_dir}")
+    print(f"{'mode':>7} {'load s':>8} {'RSS MB':>8} {'1st query ms':>13} {'p50 ms':>8} {'RSS after MB':>13}")
+    for mode in MODES:
+        output = subprocess.run(
+            [
+                sys.executable, "-m", "benchmarks.index_load_bench", "--measure", mode,
+                "--work-dir", work_dir, "--segment", segment_id,
+                "--dim", str(args.dim), "--queries", str(args.queries), "--k", str(args.k),
+            ],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        r = json.loads(output.strip().splitlines()[-1])
+        print(
+            f"{r['mode']:>7} {r['load_seconds']:>8.3f} {r['rss_after_load_mb']:>8.1f} "
+            f"{r['first_query_ms']:>13.1f} {r['p50_query_ms']:>8.1f} {r['rss_after_queries_mb']:>13.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
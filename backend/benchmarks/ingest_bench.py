@@ -0,0 +1,98 @@
+"""
+Benchmark of PDF ingestion: the sequential load-then-split path against the
+streaming, process-parallel DocumentProcessor pipeline.
+
+Run from the backend directory:
+
+    python -m benchmarks.ingest_bench --files 100 --pages 30
+
+Each path runs in a fresh subprocess so that peak RSS is measured
+independently. Embedding is not part of the measurement; the batches are
+consumed and dropped as the vector store would after indexing them.
+"""
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.synthetic_pdfs import generate_corpus
+
+
+def run_sequential(corpus_dir: str) -> dict:
+    """The original path: load every page of every file, then split them all."""
+    import os
+    from langchain_community.document_loaders import PyMuPDFLoader
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    from config import Config
+
+    documents = []
+    for file in sorted(os.listdir(corpus_dir)):
+        if file.endswith(".pdf"):
+            documents.extend(PyMuPDFLoader(os.path.join(corpus_dir, file)).load())
+    splitter = RecursiveCharacterTextSplitter(chunk_size=Config.CHUNK_SIZE, chunk_overlap=Config.CHUNK_OVERLAP)
+    chunks = splitter.split_documents(documents)
+    return {"pages": len(documents), "chunks": len(chunks)}
+
+
+def run_streaming(corpus_dir: str) -> dict:
+    """The streaming path: parallel parsing, incremental splitting, batches."""
+    from config import Config
+    from src.document_processor import DocumentProcessor
+
+    processor = DocumentProcessor(corpus_dir)
+    for _batch in processor.iter_chunk_batches(Config.INGESTION_BATCH_SIZE):
+        pass
+    return {"pages": processor.pages_loaded, "chunks": processor.chunks_created}
+
+
+def measure(mode: str, corpus_dir: str) -> dict:
+    """Runs one ingestion path in this process and reports its statistics."""
+    started = time.perf_counter()
+    result = run_streaming(corpus_dir) if mode == "streaming" else run_sequential(corpus_dir)
+    elapsed = time.perf_counter() - started
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    result.update({
+        "mode": mode,
+        "seconds": elapsed,
+        "pages_per_sec": result["pages"] / elapsed,
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_mb": own / 1024,
+        "peak_worker_rss_mb": children / 1024,
+    })
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=60)
+    parser.add_argument("--pages", type=int, default=30)
+    parser.add_argument("--measure", choices=["sequential", "streaming"], help=argparse.SUPPRESS)
+    parser.add_argument("--corpus", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        print(json.dumps(measure(args.measure, args.corpus)))
+        return
+
+    corpus_dir = tempfile.mkdtemp(prefix="ingest_bench_")
+    generate_corpus(corpus_dir, files=args.files, pages_per_file=args.pages)
+    print(f"Generated {args.files} PDFs x {args.pages} pages in {corpus_dir}")
+    print(f"{'mode':>10} {'pages':>7} {'chunks':>7} {'sec':>7} {'pages/s':>8} {'rss MB':>8} {'worker MB':>10}")
+    for mode in ("sequential", "streaming"):
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.ingest_bench", "--measure", mode, "--corpus", corpus_dir],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        r = json.loads(output.strip().splitlines()[-1])
+        print(
+            f"{r['mode']:>10} {r['pages']:>7} {r['chunks']:>7} {r['seconds']:>7.2f} "
+            f"{r['pages_per_sec']:>8.1f} {r['peak_rss_mb']:>8.1f} {r['peak_worker_rss_mb']:>10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
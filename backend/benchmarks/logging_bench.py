@@ -0,0 +1,175 @@
+"""
+Benchmark of request throughput under heavy logging, with the old blocking
+file handler against the queue-based logger.
+
+Run from the backend directory:
+
+    python -m benchmarks.logging_bench --requests 2000 --concurrency 32
+
+A tiny FastAPI app logs `--lines` INFO records and as many DEBUG records per
+request, each carrying a payload the size of a retrieved chunk. It is served
+in-process through httpx's ASGI transport, so the numbers measure the app
+and its logging rather than the network.
+
+- "blocking": a `logging.FileHandler` on the logger, with f-string messages,
+  i.e. the setup before the queue-based logger. Every call formats the line
+  and writes it to the file on the event loop, and the DEBUG messages are
+  built even though they are filtered out.
+- "queued": the application logger with lazy %-style arguments. Filtered
+  DEBUG calls return right away, and INFO calls only put the record on a
+  queue; the listener thread formats it as JSON and writes the file.
+
+Both setups run once against the page cache and once against a simulated
+slow disk, whose every flush takes `--disk-latency` seconds. The script
+reports requests per second and the p50/p99 request latency of both setups,
+as well as the time the listener needed to drain its queue after the last
+request. On the page cache the two are close, as the listener competes for
+the GIL with the requests; with a slow disk, the blocking handler stalls the
+event loop on every record.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import tempfile
+import time
+
+import httpx
+from fastapi import FastAPI
+
+from config import Config
+
+PAYLOAD = {"source": "report.pdf", "page": 12, "text": "lorem ipsum dolor sit amet " * 40}
+
+
+def create_app(logger: logging.Logger, lazy: bool, lines: int) -> FastAPI:
+    """Creates an app whose only route logs `lines` INFO and DEBUG records."""
+    app = FastAPI()
+
+    @app.get("/work")
+    async def work():
+        for i in range(lines):
+            if lazy:
+                logger.debug("Candidate %s: %s", i, PAYLOAD)
+                logger.info("Retrieved chunk %s from %s (page %s).", i, PAYLOAD["source"], PAYLOAD["page"])
+            else:
+                logger.debug(f"Candidate {i}: {PAYLOAD}")
+                logger.info(f"Retrieved chunk {i} from {PAYLOAD['source']} (page {PAYLOAD['page']}).")
+        return {"ok": True}
+
+    return app
+
+
+async def run(app: FastAPI, requests: int, concurrency: int):
+    """Sends `requests` requests from `concurrency` clients, returns the wall time and latencies."""
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def request():
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.get("/work")
+                latencies.append(time.perf_counter() - started)
+            response.raise_for_status()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(request() for _ in range(requests)))
+    return time.perf_counter() - started, latencies
+
+
+def report(name: str, elapsed: float, latencies):
+    latencies = sorted(latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(
+        f"{name:<9} {len(latencies) / elapsed:9.0f} req/s   "
+        f"p50 {statistics.median(latencies) * 1000:7.2f} ms   p99 {p99 * 1000:7.2f} ms"
+    )
+
+
+class SlowStream:
+    """A file whose flushes take `latency` seconds, like a busy or network-backed disk."""
+
+    def __init__(self, path: str, latency: float):
+        self._file = open(path, "a", encoding="utf-8")
+        self.latency = latency
+
+    def write(self, text: str):
+        return self._file.write(text)
+
+    def flush(self):
+        self._file.flush()
+        if self.latency:
+            time.sleep(self.latency)
+
+    def close(self):
+        self._file.close()
+
+
+def wait_for_listeners(timeout: float = 300.0) -> float:
+    """Waits until the log listeners have written every queued record, returns the time it took."""
+    from logger import logger_config
+
+    started = time.perf_counter()
+    while any(listener.queue.qsize() for listener in logger_config._listeners):
+        if time.perf_counter() - started > timeout:
+            break
+        time.sleep(0.01)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--lines", type=int, default=20, help="INFO and DEBUG records per request")
+    parser.add_argument(
+        "--disk-latency", type=float, default=0.0002, help="Seconds per flush of the simulated slow disk"
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # The application logger reads its settings on import
+        Config.LOG_FILE = os.path.join(tmp, "queued.log")
+        Config.LOG_LEVEL = "INFO"
+        Config.LOG_ROTATION = None
+        from logger import logger_config
+
+        blocking = logging.getLogger("logging_bench.blocking")
+        blocking.setLevel(logging.INFO)
+        blocking.propagate = False
+        file_handler = logging.FileHandler(os.path.join(tmp, "blocking.log"), encoding="utf-8", delay=True)
+        file_handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
+        blocking.addHandler(file_handler)
+        queued = logger_config.get_logger("logging_bench")
+        queued_handler = logger_config._get_file_handler()
+
+        print(
+            f"{args.requests} requests, {args.concurrency} clients, "
+            f"{args.lines} INFO + {args.lines} DEBUG records each"
+        )
+        for latency in (0.0, args.disk_latency):
+            print(f"\ndisk flush latency {latency * 1000:.2f} ms")
+            file_handler.setStream(SlowStream(os.path.join(tmp, "blocking.log"), latency))
+            queued_handler.setStream(SlowStream(Config.LOG_FILE, latency))
+
+            elapsed, latencies = asyncio.run(
+                run(create_app(blocking, False, args.lines), args.requests, args.concurrency)
+            )
+            report("blocking", elapsed, latencies)
+            elapsed, latencies = asyncio.run(
+                run(create_app(queued, True, args.lines), args.requests, args.concurrency)
+            )
+            report("queued", elapsed, latencies)
+            print(f"queue drained {wait_for_listeners():.2f} s after the last request")
+        logger_config._stop_listeners()
+        file_handler.close()
+
+        for name in ("blocking.log", "queued.log"):
+            with open(os.path.join(tmp, name), "rb") as f:
+                print(f"{name}: {sum(1 for _ in f)} lines")
+
+
+if __name__ == "__main__":
+    main()
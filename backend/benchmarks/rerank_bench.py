@@ -0,0 +1,91 @@
+"""
+Benchmark of re-ranking over-fetched candidates, across the number of
+candidates.
+
+Run from the backend directory:
+
+    python -m benchmarks.rerank_bench --chunks 20000 --fetch-k 3 10 20 50
+
+The corpus and the hashed bag-of-words embeddings are the ones of
+`hybrid_retrieval_bench`. Every query names three of the four component
+words of its target chunk and its part number, e.g. "Which part number is
+the pump seal and rotor assembly, PN-001234?". With hashed embeddings the
+target is often ranked just below `k`, which is where re-ranking helps.
+
+For every number of candidates N, the vector search fetches N chunks and
+the reranker keeps the best `k`. The script reports recall@k, the mean
+reciprocal rank of the target within the top `k`, the p50/p95 latency of
+the search and of re-ranking, and how many queries fell back to the
+retrieved order because re-ranking exceeded `--timeout`. N equal to `k` is
+the baseline without re-ranking. `--scorer cross-encoder` needs
+sentence-transformers and the model of `Config.RERANK_CROSS_ENCODER_MODEL`.
+"""
+import argparse
+import random
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.hybrid_retrieval_bench import HashEmbeddings, build_index, synthetic_corpus
+from src.reranker import LEXICAL_SCORER, Reranker, create_scorer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=20_000)
+    parser.add_argument("--segments", type=int, default=4)
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--fetch-k", type=int, nargs="+", default=[3, 10, 20, 50, 100])
+    parser.add_argument("--scorer", default=LEXICAL_SCORER)
+    parser.add_argument("--timeout", type=float, default=0.2, help="Re-ranking budget per query in seconds")
+    args = parser.parse_args()
+
+    embeddings = HashEmbeddings()
+    documents, components = synthetic_corpus(args.chunks, seed=0)
+    index = build_index(tempfile.mkdtemp(prefix="rerank_bench_"), documents, args.segments, embeddings)
+    rng = random.Random(1)
+    queries = []
+    for i in rng.sample(range(args.chunks), args.queries):
+        words = rng.sample(components[i], 3)
+        query = f"Which part number is the {words[0]} {words[1]} and {words[2]} assembly, PN-{i:06d}?"
+        queries.append((query, f"PN-{i:06d}"))
+    # Embedding is the same for every N, so it is done up front
+    vectors = [embeddings.embed_query(query) for query, _ in queries]
+    reranker = Reranker(create_scorer(args.scorer), timeout=args.timeout)
+
+    print(f"{args.chunks} chunks, {args.queries} queries, k={args.k}, scorer {args.scorer}")
+    print(
+        f"{'N':>4} {'recall@k':>9} {'MRR':>6} {'search p50':>11} "
+        f"{'rerank p50':>11} {'rerank p95':>11} {'fallbacks':>10}"
+    )
+    for fetch_k in args.fetch_k:
+        found, reciprocal, search_times, rerank_times, fallbacks = 0, 0.0, [], [], 0
+        for (query, target), vector in zip(queries, vectors):
+            started = time.perf_counter()
+            candidates = index.similarity_search_by_vector(vector, k=fetch_k)
+            search_times.append(time.perf_counter() - started)
+            if fetch_k > args.k:
+                started = time.perf_counter()
+                results = reranker.rerank(query, candidates, args.k)
+                rerank_times.append(time.perf_counter() - started)
+                # Scoring stops at the first batch boundary past the budget
+                fallbacks += rerank_times[-1] > args.timeout
+            else:
+                results = candidates[:args.k]
+                rerank_times.append(0.0)
+            for rank, document in enumerate(results, start=1):
+                if target in document.page_content:
+                    found += 1
+                    reciprocal += 1 / rank
+                    break
+        print(
+            f"{fetch_k:>4} {found / len(queries):>9.3f} {reciprocal / len(queries):>6.3f} "
+            f"{np.percentile(search_times, 50) * 1000:>9.2f}ms {np.percentile(rerank_times, 50) * 1000:>9.2f}ms "
+            f"{np.percentile(rerank_times, 95) * 1000:>9.2f}ms {fallbacks:>10}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+"""
+A local stand-in for the OpenAI embeddings and chat completions APIs.
+
+The stub returns deterministic hashed bag-of-words embeddings and canned
+answers, and can inject latency and throttling so the backend can be load
+tested without network access or API quota. Point the OpenAI clients at it
+with the OPENAI_BASE_URL environment variable.
+"""
+import asyncio
+import base64
+import hashlib
+import json
+import random
+import re
+import socket
+import threading
+import time
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+EMBEDDING_DIM = 256
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def hash_embedding(text, dim: int = EMBEDDING_DIM) -> np.ndarray:
+    """
+    Returns a normalized hashed bag-of-words vector for the given input.
+
+    Args:
+        text: A string, or a list of token ids as sent by OpenAIEmbeddings.
+        dim (int): The dimensionality of the vector.
+    """
+    tokens = TOKEN_PATTERN.findall(text.lower()) if isinstance(text, str) else [str(t) for t in text]
+    vector = np.zeros(dim, dtype=np.float32)
+    for token in tokens:
+        digest = hashlib.blake2b(token.encode(), digest_size=8).digest()
+        bucket = int.from_bytes(digest[:4], "little") % dim
+        sign = 1.0 if digest[4] & 1 else -1.0
+        vector[bucket] += sign
+    norm = np.linalg.norm(vector)
+    if norm == 0:
+        vector[0] = 1.0
+        return vector
+    return vector / norm
+
+
+class StubSettings:
+    """
+    Runtime knobs of the stub server. They may be changed while it runs.
+    """
+
+    def __init__(
+        self,
+        embedding_latency: float = 0.02,
+        llm_latency: float = 0.2,
+        token_latency: float = 0.0,
+        answer_tokens: int = 40,
+        throttle_rate: float = 0.0,
+        error_rate: float = 0.0,
+    ):
+        """
+        Initializes the StubSettings.
+
+        Args:
+            embedding_latency (float): Seconds spent on each embeddings request.
+            llm_latency (float): Seconds before the first answer token.
+            token_latency (float): Seconds between streamed answer tokens.
+            answer_tokens (int): The number of words in each answer.
+            throttle_rate (float): Fraction of requests answered with 429.
+            error_rate (float): Fraction of requests answered with 500.
+        """
+        self.embedding_latency = embedding_latency
+        self.llm_latency = llm_latency
+        self.token_latency = token_latency
+        self.answer_tokens = answer_tokens
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.embedding_requests = 0
+        self.embedded_inputs = 0
+        self.chat_requests = 0
+        self.throttled = 0
+
+
+def create_stub_app(settings: StubSettings) -> FastAPI:
+    """
+    Creates the FastAPI app serving the stubbed OpenAI endpoints.
+    """
+    app = FastAPI()
+
+    def injected_failure():
+        roll = random.random()
+        if roll < settings.throttle_rate:
+            settings.throttled += 1
+            return JSONResponse(
+                status_code=429,
+                content={"error": {"message": "Rate limit reached", "type": "rate_limit_error"}},
+                headers={"retry-after-ms": "50"},
+            )
+        if roll < settings.throttle_rate + settings.error_rate:
+            return JSONResponse(status_code=500, content={"error": {"message": "Injected failure"}})
+        return None
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        await asyncio.sleep(settings.embedding_latency)
+        failure = injected_failure()
+        if failure is not None:
+            return failure
+
+        inputs = body["input"]
+        if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+        settings.embedding_requests += 1
+        settings.embedded_inputs += len(inputs)
+
+        data = []
+        for i, item in enumerate(inputs):
+            vector = hash_embedding(item)
+            if body.get("encoding_format") == "base64":
+                embedding = base64.b64encode(vector.tobytes()).decode()
+            else:
+                embedding = vector.tolist()
+            data.append({"object": "embedding", "index": i, "embedding": embedding})
+        return {
+            "object": "list",
+            "data": data,
+            "model": body.get("model", "stub"),
+            "usage": {"prompt_tokens": 0, "total_tokens": 0},
+        }
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        await asyncio.sleep(settings.llm_latency)
+        failure = injected_failure()
+        if failure is not None:
+            return failure
+
+        settings.chat_requests += 1
+        words = [f"word{i}" for i in range(settings.answer_tokens)]
+        created = int(time.time())
+        model = body.get("model", "stub")
+
+        if not body.get("stream"):
+            return {
+                "id": "chatcmpl-stub",
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": " ".join(words)},
+                    "finish_reason": "stop",
+                }],
+                "usage": {"prompt_tokens": 0, "completion_tokens": len(words), "total_tokens": len(words)},
+            }
+
+        async def event_stream():
+            for i, word in enumerate(words):
+                chunk = {
+                    "id": "chatcmpl-stub",
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": [{"index": 0, "delta": {"content": word if i == 0 else " " + word}, "finish_reason": None}],
+                }
+                yield f"data: {json.dumps(chunk)}\n\n"
+                if settings.token_latency:
+                    await asyncio.sleep(settings.token_latency)
+            final = {
+                "id": "chatcmpl-stub",
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+            }
+            yield f"data: {json.dumps(final)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+    return app
+
+
+def free_port() -> int:
+    """Returns a free TCP port on localhost."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class BackgroundServer:
+    """
+    Runs an ASGI app with uvicorn on a background thread.
+    """
+
+    def __init__(self, app, port: int = None):
+        """
+        Initializes the BackgroundServer.
+
+        Args:
+            app: The ASGI application to serve.
+            port (int): The port to listen on. A free port is chosen if omitted.
+        """
+        self.port = port or free_port()
+        config = uvicorn.Config(app, host="127.0.0.1", port=self.port, log_level="warning", lifespan="on")
+        self.server = uvicorn.Server(config)
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def __enter__(self):
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.should_exit = True
+        self.thread.join(timeout=10)
@@ -0,0 +1,533 @@
+"""
+Offline benchmark and regression suite of the ingestion and question paths.
+
+Run from the backend directory:
+
+    python -m benchmarks.suite run --output results/head.json
+    python -m benchmarks.suite compare results/base.json results/head.json
+
+Everything runs locally and deterministically. Embeddings and answers come
+from the stub OpenAI server of `benchmarks.stub_openai`, which returns
+hashed bag-of-words vectors and canned answers after a fixed latency. The
+corpus is generated by `benchmarks.synthetic_pdfs` from a fixed seed, with
+headings and tables. Every page is about one part number, and that gives
+every question a known target page. The scenarios are:
+
+- "ingest" uploads the corpus through /upload/ and waits for the ingestion
+  jobs, which run in worker threads. It reports the wall time, pages and
+  chunks per second, and the number of chunks indexed.
+- "retrieval" loads the index and runs every question through the
+  retriever of each search type, without the LLM. It reports recall@1,
+  recall@k and MRR of the target page, and p50/p95/p99 latency.
+- "ask" sends the questions to /ask/ at every concurrency level. It reports
+  requests per second, p50/p95/p99 latency, errors, and recall@k of the
+  returned sources. The answer cache is off so that every question runs the
+  whole chain.
+
+Each scenario runs in its own process, so its peak RSS, and that of the
+worker processes it starts, is measured on its own. Retrieval and ask reuse
+the index built by ingest.
+
+`run` writes the results as JSON, with the git commit, the environment and
+the parameters, so results of two commits can be diffed. `compare` prints
+the change of every metric between two result files. It exits with status 1
+if a metric got worse by more than `--tolerance`: latency, time and memory
+count as worse when higher, as do errors, and throughput and recall when
+lower. Latency results are only comparable between runs on the same host.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from benchmarks.stub_openai import BackgroundServer, StubSettings, create_stub_app
+from benchmarks.synthetic_pdfs import generate_corpus
+
+SUITE_VERSION = 1
+SCENARIOS = ("ingest", "retrieval", "ask")
+SEARCH_TYPES = ("similarity", "hybrid", "lexical")
+
+# Metric name endings, to tell whether a higher value is better or worse
+_LOWER_IS_BETTER = ("_ms", "_mb", "seconds", "errors", "jobs_failed")
+_HIGHER_IS_BETTER = ("_per_sec", "rps", "recall_at_1", "recall_at_k", "mrr")
+
+
+def _peak_rss_mb() -> Dict[str, float]:
+    """
+    Returns the peak RSS of this process and of its largest child process.
+    """
+    # ru_maxrss is in KiB on Linux
+    return {
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "peak_child_rss_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+    }
+
+
+def _latency_stats(latencies: List[float]) -> Dict[str, float]:
+    """
+    Returns the mean and p50/p95/p99 of latencies given in seconds, in ms.
+    """
+    if not latencies:
+        return {}
+    values = np.asarray(latencies) * 1000
+    return {
+        "mean_ms": float(values.mean()),
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "p99_ms": float(np.percentile(values, 99)),
+    }
+
+
+def _questions(params: Dict[str, Any]) -> List[Tuple[str, Tuple[str, int]]]:
+    """
+    Returns the questions of the suite with their target file name and page.
+    """
+    pages = params["files"] * params["pages"]
+    rng = random.Random(params["seed"])
+    topics = rng.sample(range(pages), min(params["queries"], pages))
+    return [
+        (
+            f"How do I service component PN-{topic:05d}?",
+            (f"synthetic_{topic // params['pages']:04d}.pdf", topic % params["pages"]),
+        )
+        for topic in topics
+    ]
+
+
+def _rank(sources: List[Tuple[str, Any]], target: Tuple[str, int]) -> Optional[int]:
+    """
+    Returns the 1-based rank of the target page among the retrieved
+    sources, or None if it wasn't retrieved.
+    """
+    for rank, (source, page) in enumerate(sources, start=1):
+        if (os.path.basename(source or ""), page) == target:
+            return rank
+    return None
+
+
+def _recall(ranks: List[Optional[int]], k: int) -> Dict[str, float]:
+    """
+    Returns recall@1, recall@k and the mean reciprocal rank of the targets.
+    """
+    count = max(len(ranks), 1)
+    return {
+        "recall_at_1": sum(rank == 1 for rank in ranks) / count,
+        "recall_at_k": sum(rank is not None and rank <= k for rank in ranks) / count,
+        "mrr": sum(1 / rank for rank in ranks if rank is not None) / count,
+    }
+
+
+def _configure(work_dir: str, stub_url: str):
+    """
+    Points the backend at the stub server and keeps all its state in
+    `work_dir`. Must run before the backend modules are imported.
+    """
+    os.environ["OPENAI_API_KEY"] = "stub"
+    os.environ["OPENAI_BASE_URL"] = f"{stub_url}/v1"
+
+    from langchain_openai import OpenAIEmbeddings
+    from config import Config
+
+    Config.VECTOR_STORE_PATH = os.path.join(work_dir, "faiss_index")
+    Config.UPLOAD_DIR = os.path.join(work_dir, "uploads")
+    Config.JOB_DB_PATH = os.path.join(work_dir, "jobs.sqlite3")
+    Config.EMBEDDING_CACHE_PATH = os.path.join(work_dir, "embedding_cache.sqlite3")
+    Config.COLLECTIONS_DIR = os.path.join(work_dir, "collections")
+    Config.METRICS_DIR = os.path.join(work_dir, "metrics")
+    Config.LOG_FILE = os.path.join(work_dir, "rag_app.log")
+    # Workers run as threads of this process so they share the patched embeddings
+    Config.JOB_WORKERS = 0
+    Config.JOB_POLL_INTERVAL = 0.1
+    Config.ANSWER_CACHE_ENABLED = False
+
+    from src.vector_store import VectorStore
+
+    # Send raw text instead of tiktoken ids, which need a network download
+    VectorStore._get_embeddings_model = lambda self: OpenAIEmbeddings(
+        model=self.embedding_model_name, check_embedding_ctx_length=False
+    )
+
+
+def _stub_settings(params: Dict[str, Any]) -> StubSettings:
+    return StubSettings(embedding_latency=params["embedding_latency"], llm_latency=params["llm_latency"])
+
+
+def run_ingest(work_dir: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Uploads the corpus through the API and waits for its ingestion jobs.
+    """
+    import httpx
+
+    corpus_dir = os.path.join(work_dir, "corpus")
+    paths = generate_corpus(
+        corpus_dir, files=params["files"], pages_per_file=params["pages"], seed=params["seed"], structured=True
+    )
+    batches = [paths[i:i + params["files_per_upload"]] for i in range(0, len(paths), params["files_per_upload"])]
+
+    with BackgroundServer(create_stub_app(_stub_settings(params))) as stub:
+        _configure(work_dir, stub.url)
+        from config import Config
+
+        if params["ingestion_processes"]:
+            Config.INGESTION_PROCESSES = params["ingestion_processes"]
+        import main as backend
+        from src.job_store import JobStore
+        from src.segmented_index import SegmentStore
+        from src.vector_store import VectorStore
+        from worker import run_worker
+
+        stop_event = threading.Event()
+        workers = [
+            threading.Thread(target=run_worker, args=(f"suite-{i}", stop_event, Config.JOB_DB_PATH))
+            for i in range(params["workers"])
+        ]
+        with BackgroundServer(backend.app) as server:
+            started = time.perf_counter()
+            job_ids = []
+            for batch in batches:
+                files = [("files", (os.path.basename(path), open(path, "rb"), "application/pdf")) for path in batch]
+                try:
+                    response = httpx.post(f"{server.url}/upload/", files=files, timeout=120)
+                finally:
+                    for _, (_, handle, _) in files:
+                        handle.close()
+                response.raise_for_status()
+                job_ids.append(response.json()["job_id"])
+            for worker in workers:
+                worker.start()
+
+            store = JobStore(Config.JOB_DB_PATH)
+            while True:
+                jobs = [store.get(job_id) for job_id in job_ids]
+                if all(job["status"] in ("succeeded", "failed") for job in jobs):
+                    break
+                time.sleep(0.05)
+            elapsed = time.perf_counter() - started
+            stop_event.set()
+            for worker in workers:
+                worker.join()
+
+        index = SegmentStore(Config.VECTOR_STORE_PATH).load(VectorStore().embeddings)
+        pages = params["files"] * params["pages"]
+        return {
+            "jobs_failed": sum(job["status"] != "succeeded" for job in jobs),
+            "pages": pages,
+            "chunks": index.ntotal,
+            "seconds": elapsed,
+            "pages_per_sec": pages / elapsed,
+            "chunks_per_sec": index.ntotal / elapsed,
+            **_peak_rss_mb(),
+        }
+
+
+def run_retrieval(work_dir: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Runs the questions through the retriever of every search type.
+    """
+    with BackgroundServer(create_stub_app(_stub_settings(params))) as stub:
+        _configure(work_dir, stub.url)
+        from config import Config
+        from src.retriever_handler import RetrieverHandler
+        from src.segmented_index import SegmentStore
+        from src.vector_store import VectorStore
+
+        started = time.perf_counter()
+        index = SegmentStore(Config.VECTOR_STORE_PATH).load(VectorStore().embeddings)
+        load_seconds = time.perf_counter() - started
+        k = Config.RETRIEVER_SEARCH_KWARGS.get("k", 4)
+        questions = _questions(params)
+
+        results: Dict[str, Any] = {"index_load_seconds": load_seconds, "k": k}
+        for search_type in SEARCH_TYPES:
+            Config.RETRIEVER_SEARCH_TYPE = search_type
+            retriever = RetrieverHandler(index).get_retriever()
+            # Warms up the lexical index and the embeddings client
+            retriever.invoke(questions[0][0])
+            latencies, ranks = [], []
+            for question, target in questions:
+                started = time.perf_counter()
+                documents = retriever.invoke(question)
+                latencies.append(time.perf_counter() - started)
+                ranks.append(_rank([(d.metadata.get("source"), d.metadata.get("page")) for d in documents], target))
+            results[search_type] = {**_recall(ranks, k), **_latency_stats(latencies)}
+        results.update(_peak_rss_mb())
+        return results
+
+
+async def _ask_level(url: str, questions, concurrency: int, k: int) -> Dict[str, Any]:
+    """
+    Sends every question to /ask/ from `concurrency` clients at once.
+    """
+    import httpx
+
+    latencies, ranks = [], []
+    errors = 0
+    queue = list(questions)
+
+    async def client_loop(client):
+        nonlocal errors
+        while queue:
+            question, target = queue.pop()
+            started = time.perf_counter()
+            response = await client.post(f"{url}/ask/", json={"query": question})
+            latencies.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                errors += 1
+                continue
+            sources = response.json()["source_documents"]
+            ranks.append(_rank([(source["source"], source["page"]) for source in sources], target))
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=120, limits=limits) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(client_loop(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / elapsed,
+        **_latency_stats(latencies),
+        "recall_at_k": _recall(ranks, k)["recall_at_k"],
+    }
+
+
+def run_ask(work_dir: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Sends the questions to /ask/ at every concurrency level.
+    """
+    import httpx
+
+    with BackgroundServer(create_stub_app(_stub_settings(params))) as stub:
+        _configure(work_dir, stub.url)
+        from config import Config
+        import main as backend
+
+        questions = _questions(params)
+        results: Dict[str, Any] = {}
+        with BackgroundServer(backend.app) as server:
+            # Index loading is not part of the measurement
+            httpx.post(f"{server.url}/ask/", json={"query": "warm up"}, timeout=120).raise_for_status()
+            for concurrency in params["concurrency"]:
+                results[f"concurrency_{concurrency}"] = asyncio.run(
+                    _ask_level(server.url, questions, concurrency, Config.RETRIEVER_SEARCH_KWARGS.get("k", 4))
+                )
+        results.update(_peak_rss_mb())
+        return results
+
+
+SCENARIO_FUNCTIONS = {"ingest": run_ingest, "retrieval": run_retrieval, "ask": run_ask}
+
+
+def _git_info() -> Dict[str, Any]:
+    """
+    Returns the commit of the working tree and whether it has changes.
+    """
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], check=True, capture_output=True, text=True
+        ).stdout.strip()
+        dirty = bool(subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"], check=True, capture_output=True, text=True
+        ).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
+    return {"commit": commit, "dirty": dirty}
+
+
+def _environment() -> Dict[str, Any]:
+    from config import Config
+
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": {
+            name: getattr(Config, name)
+            for name in (
+                "CHUNKER", "CHUNK_MAX_TOKENS", "CHUNK_SIZE", "RETRIEVER_SEARCH_TYPE", "RETRIEVER_SEARCH_KWARGS",
+                "RERANKER", "FAISS_INDEX_TYPE", "CONTEXT_MAX_TOKENS", "CHUNK_EXPAND_TO_SECTION",
+            )
+        },
+    }
+
+
+def _run_scenario(name: str, work_dir: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Runs a scenario in a fresh process and returns its results.
+    """
+    process = subprocess.run(
+        [sys.executable, "-m", "benchmarks.suite", "scenario", name, "--work-dir", work_dir,
+         "--params", json.dumps(params)],
+        capture_output=True, text=True,
+    )
+    if process.returncode != 0:
+        sys.stderr.write(process.stderr[-4000:])
+        raise SystemExit(f"Scenario {name} failed with status {process.returncode}.")
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def flatten(results: Dict[str, Any], prefix: str = "") -> Dict[str, float]:
+    """
+    Returns the numeric metrics of nested results, keyed by dotted path.
+    """
+    metrics = {}
+    for key, value in results.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            metrics.update(flatten(value, f"{path}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            metrics[path] = float(value)
+    return metrics
+
+
+def _direction(metric: str) -> int:
+    """
+    Returns 1 if higher values of a metric are better, -1 if lower values
+    are, and 0 for counts that only describe the run.
+    """
+    name = metric.rsplit(".", 1)[-1]
+    if name.endswith(_HIGHER_IS_BETTER):
+        return 1
+    if name.endswith(_LOWER_IS_BETTER):
+        return -1
+    return 0
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], tolerance: float) -> List[str]:
+    """
+    Prints the change of every metric and returns the regressed ones.
+
+    Args:
+        baseline (dict): The results of the reference run.
+        current (dict): The results of the run to check.
+        tolerance (float): The relative change in the wrong direction
+            allowed before a metric counts as regressed, e.g. 0.1 for 10%.
+
+    Returns:
+        List[str]: The paths of the regressed metrics.
+    """
+    before = flatten(baseline["scenarios"])
+    after = flatten(current["scenarios"])
+    print(f"baseline {baseline['git'].get('commit')}  current {current['git'].get('commit')}")
+    if baseline["parameters"] != current["parameters"] or baseline["environment"] != current["environment"]:
+        print("Warning: the runs used different parameters or environments, changes may not be regressions.")
+    print(f"{'metric':<48} {'baseline':>11} {'current':>11} {'change':>8}")
+    regressions = []
+    for metric in sorted(set(before) | set(after)):
+        if metric not in before or metric not in after:
+            print(f"{metric:<48} {before.get(metric, float('nan')):>11.3f} {after.get(metric, float('nan')):>11.3f}")
+            continue
+        old, new = before[metric], after[metric]
+        change = (new - old) / abs(old) if old else (0.0 if new == old else float("inf"))
+        direction = _direction(metric)
+        flag = ""
+        if direction and -direction * change > tolerance:
+            flag = "  REGRESSED"
+            regressions.append(metric)
+        elif not direction and new != old:
+            flag = "  changed"
+        print(f"{metric:<48} {old:>11.3f} {new:>11.3f} {change:>+8.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="Run the suite and write the results as JSON.")
+    run.add_argument("--output", help="The JSON file to write, stdout if not given.")
+    run.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    run.add_argument("--files", type=int, default=10)
+    run.add_argument("--pages", type=int, default=10)
+    run.add_argument("--files-per-upload", type=int, default=5)
+    run.add_argument("--workers", type=int, default=1)
+    run.add_argument("--ingestion-processes", type=int, default=0, help="0 for the configured number")
+    run.add_argument("--queries", type=int, default=100)
+    run.add_argument("--concurrency", type=int, nargs="+", default=[1, 8])
+    run.add_argument("--embedding-latency", type=float, default=0.005)
+    run.add_argument("--llm-latency", type=float, default=0.05)
+    run.add_argument("--seed", type=int, default=7)
+    run.add_argument("--baseline", help="A results file to compare the new results with.")
+    run.add_argument("--tolerance", type=float, default=0.1)
+
+    diff = commands.add_parser("compare", help="Compare two results files.")
+    diff.add_argument("baseline")
+    diff.add_argument("current")
+    diff.add_argument("--tolerance", type=float, default=0.1)
+
+    scenario = commands.add_parser("scenario", help=argparse.SUPPRESS)
+    scenario.add_argument("name", choices=SCENARIOS)
+    scenario.add_argument("--work-dir", required=True)
+    scenario.add_argument("--params", required=True)
+    args = parser.parse_args()
+
+    if args.command == "scenario":
+        print(json.dumps(SCENARIO_FUNCTIONS[args.name](args.work_dir, json.loads(args.params))))
+        return
+
+    if args.command == "compare":
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        with open(args.current, "r", encoding="utf-8") as f:
+            current = json.load(f)
+        sys.exit(1 if compare(baseline, current, args.tolerance) else 0)
+
+    params = {
+        "files": args.files,
+        "pages": args.pages,
+        "files_per_upload": args.files_per_upload,
+        "workers": args.workers,
+        "ingestion_processes": args.ingestion_processes,
+        "queries": args.queries,
+        "concurrency": args.concurrency,
+        "embedding_latency": args.embedding_latency,
+        "llm_latency": args.llm_latency,
+        "seed": args.seed,
+    }
+    # Retrieval and ask search the index that ingest builds
+    scenarios = ["ingest"] + [name for name in SCENARIOS[1:] if name in args.scenarios]
+    work_dir = tempfile.mkdtemp(prefix="benchmark_suite_")
+    results = {
+        "suite_version": SUITE_VERSION,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "git": _git_info(),
+        "environment": _environment(),
+        "parameters": params,
+        "scenarios": {},
+    }
+    try:
+        for name in scenarios:
+            print(f"Running {name}...", file=sys.stderr)
+            results["scenarios"][name] = _run_scenario(name, work_dir, params)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+        print(f"Wrote {args.output}", file=sys.stderr)
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        sys.exit(1 if compare(baseline, results, args.tolerance) else 0)
+
+
+if __name__ == "__main__":
+    main()
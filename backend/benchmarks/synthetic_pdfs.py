@@ -0,0 +1,134 @@
+"""
+Generator for a synthetic corpus of PDF files.
+
+Every page contains a few paragraphs of deterministic pseudo-text that
+mentions numbered topics and part numbers, so the corpus can be used both for
+throughput measurements and for retrieval quality checks. Structured corpora
+add headings in larger fonts and ruled tables, as found in real manuals.
+"""
+import os
+import random
+
+import fitz
+
+WORDS = (
+    "system maintenance schedule component pressure valve sensor calibration "
+    "procedure inspection warranty voltage assembly safety manual operator "
+    "replacement interval torque firmware diagnostic filter coolant bearing"
+).split()
+
+
+def page_text(rng: random.Random, topic: int, paragraphs: int = 4, words_per_paragraph: int = 90) -> str:
+    """
+    Returns the text of one synthetic page about `topic`.
+    """
+    lines = [f"Section {topic}: part number PN-{topic:05d}"]
+    for _ in range(paragraphs):
+        words = [rng.choice(WORDS) for _ in range(words_per_paragraph)]
+        words.insert(rng.randrange(len(words)), f"PN-{topic:05d}")
+        lines.append(" ".join(words) + ".")
+    return "\n\n".join(lines)
+
+
+def _paragraph(rng: random.Random, topic: int, words: int) -> str:
+    """
+    Returns a paragraph of sentences of 8 to 30 words mentioning `topic`.
+    """
+    sentences = []
+    while words > 0:
+        length = min(words, rng.randint(8, 30))
+        sentence = [rng.choice(WORDS) for _ in range(length)]
+        if rng.random() < 0.3:
+            sentence.insert(rng.randrange(length), f"PN-{topic:05d}")
+        sentence[0] = sentence[0].capitalize()
+        sentences.append(" ".join(sentence) + ".")
+        words -= length
+    return " ".join(sentences)
+
+
+def _write_table(page: fitz.Page, rng: random.Random, topic: int, top: float) -> float:
+    """
+    Draws a ruled table of torque values and returns its bottom edge.
+    """
+    rows = [("Component", "Interval", "Torque")] + [
+        (f"{rng.choice(WORDS)} PN-{topic:05d}-{row}", f"{rng.randint(1, 24)} months", f"{rng.randint(5, 90)} Nm")
+        for row in range(rng.randint(3, 6))
+    ]
+    columns = (50, 250, 400, 550)
+    row_height = 16
+    for row_index, row in enumerate(rows):
+        y = top + row_index * row_height
+        for column_index, cell in enumerate(row):
+            page.insert_text((columns[column_index] + 4, y + 11), cell, fontsize=9)
+    bottom = top + len(rows) * row_height
+    for row_index in range(len(rows) + 1):
+        y = top + row_index * row_height
+        page.draw_line((columns[0], y), (columns[-1], y))
+    for x in columns:
+        page.draw_line((x, top), (x, bottom))
+    return bottom
+
+
+def _write_structured_page(page: fitz.Page, rng: random.Random, topic: int):
+    """
+    Writes a page with a heading, subsections of uneven length and, on
+    every other page, a table.
+    """
+    y = 50.0
+
+    def write(text: str, fontsize: float, gap: float) -> bool:
+        """Writes a block below the previous one, if it fits on the page."""
+        nonlocal y
+        rect = fitz.Rect(50, y, 550, 800)
+        if rect.is_empty:
+            return False
+        # A negative result means the text didn't fit and nothing was written
+        left = page.insert_textbox(rect, text, fontsize=fontsize)
+        if left < 0:
+            return False
+        y += rect.height - left + gap
+        return True
+
+    write(f"{topic}. Servicing component PN-{topic:05d}", 16, 10)
+    for subsection in range(1, rng.randint(2, 4)):
+        if not write(f"{topic}.{subsection} {rng.choice(WORDS).capitalize()} procedure", 12, 6):
+            break
+        for _ in range(rng.randint(1, 3)):
+            write(_paragraph(rng, topic, rng.randint(30, 140)), 9, 8)
+        if y > 640:
+            break
+    if topic % 2 == 0 and y < 680:
+        _write_table(page, rng, topic, y + 6)
+
+
+def generate_corpus(
+    output_dir: str, files: int = 20, pages_per_file: int = 20, seed: int = 7, structured: bool = False
+) -> list:
+    """
+    Writes a synthetic PDF corpus and returns the paths of the generated files.
+
+    Args:
+        output_dir (str): The directory to write the PDF files to.
+        files (int): The number of PDF files.
+        pages_per_file (int): The number of pages in every file.
+        seed (int): The random seed, so corpora are reproducible.
+        structured (bool): Whether pages have headings, paragraphs of
+            several sentences and tables instead of uniform text.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    rng = random.Random(seed)
+    paths = []
+    for file_index in range(files):
+        pdf = fitz.open()
+        for page_index in range(pages_per_file):
+            topic = file_index * pages_per_file + page_index
+            page = pdf.new_page()
+            if structured:
+                _write_structured_page(page, rng, topic)
+            else:
+                page.insert_textbox(fitz.Rect(50, 50, 550, 800), page_text(rng, topic), fontsize=9)
+        path = os.path.join(output_dir, f"synthetic_{file_index:04d}.pdf")
+        pdf.save(path)
+        pdf.close()
+        paths.append(path)
+    return paths
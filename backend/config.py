@@ -3,21 +3,151 @@ class Config:
     Configuration for the RAG application.
     """
     # Configuration for the LLM
-    LLM_MODEL_NAME = "gpt-5"
+    LLM_PROVIDER = "openai"  # "openai", "ollama" (needs langchain-ollama) or "google" (needs langchain-google-genai)
+    LLM_MODEL_NAME = "gpt-5"  # A model name of LLM_PROVIDER
     LLM_TEMPERATURE = 0.3
     
     # Configuration for the text splitter
-    CHUNK_SIZE = 1000
+    CHUNKER = "layout"  # "layout" (PyMuPDF blocks, headings and tables, sized in tokens) or "recursive" (characters)
+    CHUNK_SIZE = 1000  # Characters per chunk of the "recursive" chunker
     CHUNK_OVERLAP = 200
+    CHUNK_MAX_TOKENS = 256  # Tokens per chunk of the "layout" chunker
+    CHUNK_OVERLAP_TOKENS = 32  # Tokens a chunk repeats from the previous chunk of its page at most
+    CHUNK_PARENT_MAX_TOKENS = 1_024  # Longer sections are split into several parent sections
+    CHUNK_DETECT_TABLES = True  # Look for ruled tables on pages with vector drawings
+    # Replace retrieved chunks by their parent section while the context fits CONTEXT_MAX_TOKENS.
+    # Off by default: when on, the source_documents returned by /ask/ are whole sections, not chunks.
+    CHUNK_EXPAND_TO_SECTION = False
 
-    # Configuration for the embedding model 
-    EMBEDDING_MODEL_NAME = "text-embedding-3-small"
+    # Configuration for the ingestion pipeline
+    INGESTION_PROCESSES = None  # Worker processes parsing PDFs in parallel, None for one per CPU
+    INGESTION_MAX_PENDING_FILES = 8  # Files parsed ahead of the splitter at most
+    INGESTION_BATCH_SIZE = 256  # Chunks sent to the vector store per embedding batch
+    INGESTION_SEGMENT_MAX_CHUNKS = 10_000  # Chunks of an upload held in memory before they are written as a segment
+
+    # Configuration for the ingestion job queue
+    JOB_DB_PATH = "../data/jobs.sqlite3"
+    JOB_WORKERS = 1  # Worker processes started with the API, 0 when running worker.py separately
+    JOB_POLL_INTERVAL = 1.0  # Seconds an idle worker waits before checking the queue again
+    JOB_HEARTBEAT_INTERVAL = 10.0  # Seconds between heartbeats of a running job
+    JOB_STALE_AFTER = 60.0  # Seconds without a heartbeat before a running job is re-queued
+    JOB_MAX_ATTEMPTS = 3  # Attempts before an abandoned job is marked as failed
+
+    # Configuration for the embedding model; an index must be searched with the model that built it
+    EMBEDDING_PROVIDER = "openai"  # "openai", "ollama", "google" or "local" (sentence-transformers, in this process on the CPU)
+    EMBEDDING_MODEL_NAME = "text-embedding-3-small"  # A model name of EMBEDDING_PROVIDER, e.g. "sentence-transformers/all-MiniLM-L6-v2" for "local"
+    OLLAMA_BASE_URL = "http://localhost:11434"
+
+    # Configuration for the "local" embedding provider
+    LOCAL_EMBEDDING_BATCH_WINDOW = 0.002  # Seconds a query waits for concurrent queries to share its forward pass
+    LOCAL_EMBEDDING_MAX_BATCH_SIZE = 64  # Queries per forward pass
+    LOCAL_EMBEDDING_DOCUMENT_BATCH_SIZE = 32  # Chunks per forward pass while ingesting
+
+    # Tokenizer used to count tokens for batching and prompt budgets
+    TOKENIZER_ENCODING = "cl100k_base"
+
+    # Configuration for the embedding scheduler
+    EMBEDDING_SCHEDULER_ENABLED = True  # Not used by the "local" provider, which has no rate limits
+    EMBEDDING_BATCH_MAX_TOKENS = 100_000  # Token budget of a single embeddings request
+    EMBEDDING_BATCH_MAX_SIZE = 512  # Inputs per embeddings request
+    EMBEDDING_MAX_CONCURRENCY = 4  # Embeddings requests in flight at once
+    EMBEDDING_REQUESTS_PER_MINUTE = 3_000
+    EMBEDDING_TOKENS_PER_MINUTE = 1_000_000
+    EMBEDDING_MAX_RETRIES = 6  # Retries per batch on 429/5xx and connection errors
+    EMBEDDING_RETRY_BASE_DELAY = 0.5  # Seconds, doubled on every retry
+    EMBEDDING_RATE_LIMIT_PATH = "../data/embedding_rate_limit.sqlite3"  # Shares the per-minute limits between the API and ingestion processes, None for per-process limits
+
+    # Configuration for the persistent embedding cache
+    EMBEDDING_CACHE_ENABLED = True
+    EMBEDDING_CACHE_PATH = "../data/embedding_cache.sqlite3"
+    EMBEDDING_CACHE_MAX_ENTRIES = 500_000  # Least recently used vectors are evicted beyond this
+
+    # Configuration for the FAISS index of large segments
+    FAISS_INDEX_TYPE = "flat"  # flat, sq8, ivf_flat, ivf_sq8, ivf_pq, hnsw or hnsw_sq8
+    FAISS_ANN_MIN_CHUNKS = 10_000  # Smaller segments always use an exact flat index
+    FAISS_TRAIN_SAMPLE_SIZE = 100_000  # Vectors sampled to train IVF/PQ/SQ indexes
+    FAISS_IVF_NLIST = None  # IVF lists, None for about 4 * sqrt(chunks)
+    FAISS_IVF_NPROBE = 16  # IVF lists scanned per query
+    FAISS_PQ_M = 64  # PQ sub-quantizers, lowered to a divisor of the embedding dimension
+    FAISS_PQ_NBITS = 8  # Bits per PQ sub-quantizer code
+    FAISS_HNSW_M = 32  # HNSW neighbours per node
+    FAISS_HNSW_EF_CONSTRUCTION = 200  # HNSW candidate list size while building
+    FAISS_HNSW_EF_SEARCH = 64  # HNSW candidate list size per query
+
+    INDEX_MMAP = True  # Memory-map segment indexes so worker processes share their pages
 
     # Configuration for the Retriever
-    RETRIEVER_SEARCH_TYPE = "similarity"
+    RETRIEVER_SEARCH_TYPE = "hybrid"  # "hybrid" (vector + BM25), "lexical" (BM25 only, no embedding call) or a vector store search type such as "similarity"
     RETRIEVER_SEARCH_KWARGS = {"k": 3}  # Number of source documents to retrieve
+    HYBRID_FETCH_K = 20  # Candidates taken from each of the vector and BM25 searches before fusion
+    HYBRID_RRF_K = 60  # Reciprocal rank fusion constant; higher values flatten the rank weights
+    BM25_K1 = 1.2  # BM25 term frequency saturation
+    BM25_B = 0.75  # BM25 document length normalization
+
+    # Configuration for metadata-filtered retrieval
+    FILTER_EXACT_SEARCH_MAX_CHUNKS = 4_096  # Filters selecting fewer chunks of a segment compare the query with those chunks only, exactly
 
-    # Path for storing the vector index
+    # Configuration for re-ranking the retrieved candidates
+    RERANKER = None  # None, "lexical" (query term and phrase overlap) or "cross-encoder" (needs sentence-transformers)
+    RERANK_FETCH_K = 20  # Candidates retrieved for re-ranking; the best RETRIEVER_SEARCH_KWARGS["k"] are kept
+    RERANK_BATCH_SIZE = 32  # Query and passage pairs scored at once
+    RERANK_TIMEOUT = 0.2  # Seconds of scoring per question before falling back to the retrieved order, None for no limit
+    RERANK_CROSS_ENCODER_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+
+    # Configuration for assembling the context of the prompt
+    CONTEXT_MAX_TOKENS = 3_000  # Token budget of the retrieved context in the prompt, None for no limit
+    CONTEXT_MERGE_CHUNKS = True  # Merge overlapping chunks of the same page into one passage
+    CONTEXT_DEDUPE_SENTENCES = True  # Remove sentences repeated across passages
+
+    # Configuration for the answer cache
+    ANSWER_CACHE_ENABLED = True
+    ANSWER_CACHE_MAX_ENTRIES = 1_000  # Least recently used answers are evicted beyond this
+    ANSWER_CACHE_TTL_SECONDS = 3_600  # Cached answers expire after this many seconds
+    ANSWER_CACHE_SIMILARITY_THRESHOLD = 0.97  # Cosine similarity of near-duplicate questions, None for exact only (always with lexical search)
+
+    # Configuration for the query path
+    QUERY_MAX_CONCURRENCY = 32  # Questions answered at the same time per worker
+    QUERY_MAX_QUEUE = 64  # Questions allowed to wait for a slot before returning 429
+    QUERY_QUEUE_TIMEOUT = 15.0  # Seconds a question may wait for a slot before returning 503
+    SEARCH_THREAD_POOL_SIZE = 4  # Threads used for CPU-bound FAISS searches
+
+    # Configuration for logging
+    LOG_FILE = "rag_app.log"
+    LOG_LEVEL = "INFO"
+    LOG_MODULE_LEVELS = {}  # Levels of single modules, e.g. {"src.segmented_index": "DEBUG", "tasks": "WARNING"}
+    LOG_JSON = True  # Write one JSON object per record instead of plain text lines
+    LOG_ROTATION = "size"  # "size", "time" or None to never rotate the log file
+    LOG_MAX_BYTES = 50 * 1024 * 1024  # Size of the log file that triggers a rotation with "size"
+    LOG_ROTATE_WHEN = "midnight"  # Rotation interval with "time", see logging.handlers.TimedRotatingFileHandler
+    LOG_BACKUP_COUNT = 5  # Rotated log files kept
+
+    # Configuration for metrics
+    METRICS_DIR = "../data/metrics"  # Ingestion worker processes publish their metrics here for /metrics
+
+    # Configuration for batch question answering
+    ASK_BATCH_MAX_QUESTIONS = 500  # Questions accepted in one /ask/batch request
+    ASK_BATCH_LLM_CONCURRENCY = 8  # LLM calls running at once for one batch
+
+    # Configuration for background compaction of index segments
+    COMPACTION_SMALL_SEGMENT_CHUNKS = 5_000  # Upper bound of the smallest tier of segments
+    COMPACTION_TIER_FACTOR = 4  # Each tier holds segments this many times larger than the one below
+    COMPACTION_MIN_SEGMENTS = 4  # Number of segments in one tier that triggers merging them
+    # Larger segments are only rewritten to drop deleted chunks. A merge holds its vectors in memory
+    # twice while the ANN index is built: about 3 GB at 1536 dimensions.
+    COMPACTION_MAX_SEGMENT_CHUNKS = 250_000
+    COMPACTION_MAX_DELETED_RATIO = 0.3  # Share of deleted chunks that triggers rewriting a segment
+
+    # Path for storing the vector index of the default collection
     VECTOR_STORE_PATH = "../data/faiss_index"
+
+    # Configuration for collections
+    DEFAULT_COLLECTION = "default"  # Collection of requests without a collection ID, stored at VECTOR_STORE_PATH
+    COLLECTIONS_DIR = "../data/collections"  # Indexes of the other collections, one directory per collection
+    COLLECTION_MAX_LOADED = 16  # Collections kept loaded per API worker; least recently used ones are evicted
+    COLLECTION_MAX_INDEX_BYTES = 4 * 1024 * 1024 * 1024  # Size on disk of the loaded indexes before evicting, None for no limit
+    COLLECTION_MIN_AVAILABLE_MEMORY_BYTES = 512 * 1024 * 1024  # System memory kept available by evicting, None to ignore
     # Path for temporary file uploads
     UPLOAD_DIR = "../data/uploads"
+    UPLOAD_MAX_FILE_BYTES = 200 * 1024 * 1024  # Larger files are rejected with 413
+    UPLOAD_MAX_TOTAL_BYTES = 1024 * 1024 * 1024  # Larger requests are rejected with 413
+    UPLOAD_WRITE_CHUNK_BYTES = 1024 * 1024  # Uploads are copied to disk in chunks of this size
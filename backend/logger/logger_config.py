@@ -1,29 +1,228 @@
+import atexit
+import contextvars
+import copy
+import json
 import logging
+import logging.handlers
+import multiprocessing
+import queue
+import threading
+
+from config import Config
 
 # Define the format for the log messages
-LOG_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+LOG_FORMAT = "%(asctime)s - %(levelname)s - %(name)s - [%(request_id)s] %(message)s"
+LOGGER_NAME = "rag_app_logger"
+
+# The ID of the API request or ingestion job being handled, "-" outside of one
+request_id_var = contextvars.ContextVar("request_id", default="-")
+
+# The handler writing the log file, the listeners feeding it queued records,
+# and the queue that child processes send their records to
+_file_handler = None
+_listeners = []
+_process_queue = None
+
+
+class RequestIdFilter(logging.Filter):
+    """
+    Adds the current request ID to every log record.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats every record as one JSON object per line.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "process": record.process,
+            "thread": record.threadName,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class RecordQueueHandler(logging.handlers.QueueHandler):
+    """
+    A QueueHandler that leaves formatting the line to the listener.
+
+    Only the message arguments and the traceback are resolved in the logging
+    thread, as they may change or go away once the call returns. The record
+    stays structured, so the listener can write it as JSON.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class ProcessQueueListener(logging.handlers.QueueListener):
+    """
+    A QueueListener for a multiprocessing queue that can be stopped at
+    interpreter shutdown, when putting a sentinel on a multiprocessing queue
+    would need a new feeder thread.
+    """
+
+    def __init__(self, log_queue, *handlers, respect_handler_level: bool = False):
+        super().__init__(log_queue, *handlers, respect_handler_level=respect_handler_level)
+        self._stopping = threading.Event()
+
+    def dequeue(self, block: bool):
+        while True:
+            try:
+                return self.queue.get(timeout=0.2)
+            except queue.Empty:
+                # Records still queued are written before stopping
+                if self._stopping.is_set():
+                    return self._sentinel
+
+    def enqueue_sentinel(self):
+        self._stopping.set()
+
+
+def _get_file_handler() -> logging.Handler:
+    """
+    Returns the handler writing to the log file, rotated as configured. The
+    file is only opened once the first record is written.
+    """
+    global _file_handler
+    if _file_handler is None:
+        if Config.LOG_ROTATION == "size":
+            handler = logging.handlers.RotatingFileHandler(
+                Config.LOG_FILE,
+                maxBytes=Config.LOG_MAX_BYTES,
+                backupCount=Config.LOG_BACKUP_COUNT,
+                encoding="utf-8",
+                delay=True,
+            )
+        elif Config.LOG_ROTATION == "time":
+            handler = logging.handlers.TimedRotatingFileHandler(
+                Config.LOG_FILE,
+                when=Config.LOG_ROTATE_WHEN,
+                backupCount=Config.LOG_BACKUP_COUNT,
+                encoding="utf-8",
+                delay=True,
+            )
+        else:
+            handler = logging.FileHandler(Config.LOG_FILE, encoding="utf-8", delay=True)
+        handler.setFormatter(JsonFormatter() if Config.LOG_JSON else logging.Formatter(LOG_FORMAT))
+        _file_handler = handler
+    return _file_handler
+
+
+def _start_listener(log_queue, listener_class=logging.handlers.QueueListener):
+    listener = listener_class(log_queue, _get_file_handler(), respect_handler_level=True)
+    listener.start()
+    _listeners.append(listener)
+
+
+def _stop_listeners():
+    """
+    Writes the records still queued and closes the log file.
+    """
+    global _file_handler
+    for listener in _listeners:
+        listener.stop()
+    _listeners.clear()
+    if _file_handler is not None:
+        _file_handler.close()
+        _file_handler = None
+
+
+def _set_queue(logger: logging.Logger, log_queue):
+    """
+    Replaces the handlers of `logger` by one that sends records to `log_queue`.
+    """
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    queue_handler = RecordQueueHandler(log_queue)
+    # The request ID lives in a contextvar, so it is read in the logging thread
+    queue_handler.addFilter(RequestIdFilter())
+    logger.addHandler(queue_handler)
+
 
 def setup_logger():
     """
-    Sets up a centralized logger that writes to a file.
+    Sets up a centralized logger that writes to a file without blocking.
+
+    Log calls only put the record on an in-memory queue; a listener thread
+    formats and writes it, so request handlers never wait for the disk.
+    Levels can be set per module with `Config.LOG_MODULE_LEVELS`.
     """
     # Create a logger instance
-    logger = logging.getLogger("rag_app_logger")
-    logger.setLevel(logging.INFO)  # Set the minimum level of messages to log
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.setLevel(Config.LOG_LEVEL)  # Set the minimum level of messages to log
 
     # Prevent adding multiple handlers if the logger is already configured
     if logger.hasHandlers():
         return logger
 
-    # Create a handler to write log messages to a file
-    file_handler = logging.FileHandler("rag_app.log")
-    file_handler.setLevel(logging.INFO)
-    file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    for module, level in Config.LOG_MODULE_LEVELS.items():
+        logging.getLogger(f"{LOGGER_NAME}.{module}").setLevel(level)
 
-    # Add handler to the logger
-    logger.addHandler(file_handler)
+    log_queue = queue.SimpleQueue()
+    _set_queue(logger, log_queue)
+    _start_listener(log_queue)
+    atexit.register(_stop_listeners)
 
     return logger
 
+
+def get_logger(name: str) -> logging.Logger:
+    """
+    Returns the logger of a module, e.g. `get_logger(__name__)`. Its records
+    go to the application log, and its level can be set on its own.
+    """
+    return logging.getLogger(f"{LOGGER_NAME}.{name}")
+
+
+def process_log_queue():
+    """
+    Returns the queue that child processes should send their records to.
+
+    In the process that owns the log file, a listener for the queue is
+    started on first use. In a child process, it is the queue the process
+    itself sends to, so grandchildren log through the same file writer.
+    Only one process ever writes the file, which keeps rotation safe.
+    """
+    global _process_queue
+    if _process_queue is None:
+        _process_queue = multiprocessing.get_context("spawn").Queue()
+        _start_listener(_process_queue, ProcessQueueListener)
+    return _process_queue
+
+
+def log_to_queue(log_queue):
+    """
+    Sends the records of this child process to its parent's log queue.
+    Used as the initializer of child processes.
+    """
+    global _process_queue
+    if log_queue is None:
+        return
+    _process_queue = log_queue
+    _stop_listeners()
+    _set_queue(logging.getLogger(LOGGER_NAME), log_queue)
+
+
 # Create a logger instance to be imported by other modules
 logger = setup_logger()
\ No newline at end of file
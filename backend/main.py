@@ -1,17 +1,31 @@
+import asyncio
+import json
 import os
 import shutil
-from contextlib import asynccontextmanager
-from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, AsyncExitStack
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from datetime import datetime, timezone
+from pydantic import BaseModel, Field, model_validator
+from typing import List, Optional
 
-from src.qa_handler import QAHandler
-from src.vector_store import VectorStore
-from src.retriever_handler import RetrieverHandler
+from src.batch_answerer import BatchAnswerer
+from src.collection_registry import CollectionRegistry, collection_index_path, list_collection_ids
+from src.metadata_index import MetadataFilter
+from src.qa_handler import SEARCH_FILTER_KEY
+from src.query_limiter import QueryLimiter, QueryLimiterFull, QueryLimiterTimeout
 from config import Config
-from tasks import process_documents_task
-from logger.logger_config import logger
+from src.document_registry import DocumentRegistry
+from src.job_store import JobStore
+from src.metrics import RequestMetricsMiddleware, registry as metrics_registry
+from worker import IngestionWorkerPool
+from logger.logger_config import get_logger
+
+logger = get_logger(__name__)
 
 
 @asynccontextmanager
@@ -19,13 +33,33 @@ async def lifespan(app: FastAPI):
     """
     Handles application startup events.
     This context manager ensures that necessary directories are created
-    when the application starts.
+    and the registry of loaded collections exists when the application starts.
+    CPU-bound FAISS searches run on a bounded thread pool that is installed
+    as the event loop's default executor. Uploaded documents are processed
+    by ingestion worker processes, so they don't compete with query traffic.
     """
     logger.info("Lifespan startup: Creating necessary directories...")
     os.makedirs(Config.UPLOAD_DIR, exist_ok=True)
     os.makedirs(os.path.dirname(Config.VECTOR_STORE_PATH), exist_ok=True)
+    os.makedirs(Config.COLLECTIONS_DIR, exist_ok=True)
     logger.info("Lifespan startup: Directories are ready.")
+    # Collections are loaded on their first query, not at startup
+    app.state.collections = CollectionRegistry()
+    app.state.query_limiter = QueryLimiter()
+    app.state.job_store = JobStore(Config.JOB_DB_PATH)
+
+    worker_pool = IngestionWorkerPool(Config.JOB_WORKERS)
+    if Config.JOB_WORKERS > 0:
+        worker_pool.start()
+
+    search_executor = ThreadPoolExecutor(
+        max_workers=Config.SEARCH_THREAD_POOL_SIZE,
+        thread_name_prefix="faiss-search"
+    )
+    asyncio.get_running_loop().set_default_executor(search_executor)
     yield
+    search_executor.shutdown(wait=False, cancel_futures=True)
+    worker_pool.stop()
 
 
 app = FastAPI(
@@ -34,6 +68,8 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+app.add_middleware(RequestMetricsMiddleware)
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -43,78 +79,475 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
 )
 
+class SearchFilter(BaseModel):
+    """
+    Pydantic model restricting the search to some chunks. Every condition
+    that is set must match. Dates without a time zone are taken as UTC.
+    """
+    sources: Optional[List[str]] = Field(None, min_length=1)  # File names, or source paths as returned in source_documents
+    page_min: Optional[int] = Field(None, ge=0)  # First page, inclusive, numbered from 0 as in source_documents
+    page_max: Optional[int] = Field(None, ge=0)  # Last page, inclusive
+    uploaded_after: Optional[datetime] = None
+    uploaded_before: Optional[datetime] = None
+
+    @model_validator(mode="after")
+    def check_ranges(self):
+        if self.page_min is not None and self.page_max is not None and self.page_min > self.page_max:
+            raise ValueError("page_min must not be greater than page_max.")
+        if self.uploaded_after and self.uploaded_before and self.uploaded_after >= self.uploaded_before:
+            raise ValueError("uploaded_after must be before uploaded_before.")
+        return self
+
+    def to_metadata_filter(self) -> MetadataFilter:
+        def timestamp(value: Optional[datetime]) -> Optional[float]:
+            if value is None:
+                return None
+            return (value if value.tzinfo else value.replace(tzinfo=timezone.utc)).timestamp()
+
+        return MetadataFilter(
+            sources=tuple(self.sources) if self.sources is not None else None,
+            page_min=self.page_min,
+            page_max=self.page_max,
+            uploaded_after=timestamp(self.uploaded_after),
+            uploaded_before=timestamp(self.uploaded_before),
+        )
+
 class Question(BaseModel):
     """Pydantic model for a user's question."""
     query: str
+    collection_id: str = Config.DEFAULT_COLLECTION
+    filter: Optional[SearchFilter] = None
+
+class BatchQuestions(BaseModel):
+    """Pydantic model for a batch of questions."""
+    queries: List[str] = Field(..., min_length=1, max_length=Config.ASK_BATCH_MAX_QUESTIONS)
+    collection_id: str = Config.DEFAULT_COLLECTION
+    filter: Optional[SearchFilter] = None  # Applies to every question of the batch
 
 class Answer(BaseModel):
     """Pydantic model for the generated answer."""
     answer: str
     source_documents: List[dict]
 
+class UploadTooLarge(Exception):
+    """Raised when an upload exceeds the configured size limits."""
+
+def _index_path(collection_id: str) -> str:
+    """
+    Returns the index directory of a collection.
+
+    Raises:
+        HTTPException: 400 if the collection ID is invalid.
+    """
+    try:
+        return collection_index_path(collection_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def _require_index(collection_id: str) -> str:
+    """
+    Returns the index directory of a collection that has documents.
+
+    Raises:
+        HTTPException: 400 if the collection ID is invalid, 404 if the
+            collection has no index yet.
+    """
+    index_path = _index_path(collection_id)
+    if not os.path.exists(index_path):
+        raise HTTPException(
+            status_code=404,
+            detail=f"Vector store of collection '{collection_id}' not found. Please upload documents first."
+        )
+    return index_path
+
+def _save_upload(file: UploadFile, path: str, total_written: int) -> int:
+    """
+    Copies an uploaded file to disk in chunks, enforcing the size limits.
+
+    Args:
+        file (UploadFile): The uploaded file.
+        path (str): The destination path.
+        total_written (int): Bytes already written for the same request.
+
+    Returns:
+        int: The number of bytes written.
+
+    Raises:
+        UploadTooLarge: If the file or the whole request is too large.
+    """
+    written = 0
+    with open(path, "wb") as buffer:
+        while chunk := file.file.read(Config.UPLOAD_WRITE_CHUNK_BYTES):
+            written += len(chunk)
+            if written > Config.UPLOAD_MAX_FILE_BYTES:
+                raise UploadTooLarge(
+                    f"{file.filename} exceeds the limit of {Config.UPLOAD_MAX_FILE_BYTES} bytes per file."
+                )
+            if total_written + written > Config.UPLOAD_MAX_TOTAL_BYTES:
+                raise UploadTooLarge(f"The upload exceeds the limit of {Config.UPLOAD_MAX_TOTAL_BYTES} bytes.")
+            buffer.write(chunk)
+    return written
+
 @app.post("/upload/", status_code=202)
 async def upload_pdfs(
-    background_tasks: BackgroundTasks,
-    files: List[UploadFile] = File(...)
+    request: Request,
+    files: List[UploadFile] = File(...),
+    collection_id: str = Form(Config.DEFAULT_COLLECTION)
 ):
     """
-    Endpoint to upload PDF files and trigger processing in the background.
+    Endpoint to upload PDF files and queue an ingestion job to process them
+    into a collection's index.
+
+    Returns the job ID; the job's progress is available from `/jobs/{job_id}`.
     """
+    index_path = _index_path(collection_id)
     if not files:
         raise HTTPException(status_code=400, detail="No files were uploaded.")
+    content_length = request.headers.get("content-length")
+    try:
+        content_length = int(content_length) if content_length else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid Content-Length header.")
+    if content_length is not None and content_length > Config.UPLOAD_MAX_TOTAL_BYTES:
+        raise HTTPException(
+            status_code=413, detail=f"The upload exceeds the limit of {Config.UPLOAD_MAX_TOTAL_BYTES} bytes."
+        )
 
-    # Recreate the upload directory to ensure it's clean for each new upload
-    if os.path.exists(Config.UPLOAD_DIR):
-        shutil.rmtree(Config.UPLOAD_DIR)
-    os.makedirs(Config.UPLOAD_DIR)
+    # Every job gets its own directory, so concurrent uploads never touch
+    # each other's files. Files are staged under a hidden name and the
+    # directory is renamed into place once all of them are written.
+    job_id = uuid.uuid4().hex
+    job_dir = os.path.join(Config.UPLOAD_DIR, job_id)
+    staging_dir = os.path.join(Config.UPLOAD_DIR, f".{job_id}.staging")
+    os.makedirs(staging_dir)
 
-    # Save uploaded files to a temporary directory
-    for file in files:
-        file_path = os.path.join(Config.UPLOAD_DIR, file.filename)
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        logger.info(f"Saved file: {file.filename}")
+    filenames = []
+    total_written = 0
+    try:
+        for file in files:
+            filename = os.path.basename(file.filename or "")
+            if not filename:
+                raise HTTPException(status_code=400, detail="Uploaded files must have a name.")
+            # Disk writes run off the event loop so they don't stall queries
+            total_written += await run_in_threadpool(
+                _save_upload, file, os.path.join(staging_dir, filename), total_written
+            )
+            filenames.append(filename)
+            logger.info("Saved file: %s", filename)
+        os.rename(staging_dir, job_dir)
+    except UploadTooLarge as e:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        raise HTTPException(status_code=413, detail=str(e))
+    except BaseException:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        raise
 
-    # Add the processing task to run in the background
-    background_tasks.add_task(process_documents_task, Config.UPLOAD_DIR, Config.VECTOR_STORE_PATH)
+    request.app.state.job_store.create(job_dir, index_path, filenames, job_id=job_id)
+    logger.info("Queued ingestion job %s for %s file(s) into collection %s.", job_id, len(filenames), collection_id)
 
-    return {"message": f"Started processing {len(files)} files. This may take a moment."}
+    return {
+        "job_id": job_id,
+        "collection_id": collection_id,
+        "message": f"Queued {len(files)} files for processing. This may take a moment.",
+    }
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str, request: Request):
+    """
+    Endpoint to get the status and stage progress of an ingestion or
+    compaction job.
+    """
+    job = request.app.state.job_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found.")
+    return {
+        "job_id": job["id"],
+        "kind": job["kind"],
+        "status": job["status"],
+        "files": job["files"],
+        "progress": job["progress"],
+        "error": job["error"],
+        "attempts": job["attempts"],
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"],
+    }
+
+def _format_sources(docs) -> List[dict]:
+    """
+    Converts retrieved documents into the source entries returned to clients.
+    """
+    return [
+        {"source": doc.metadata.get("source", "N/A"), "page": doc.metadata.get("page"), "content": doc.page_content}
+        for doc in docs
+    ]
+
+def _search_filter(search_filter: Optional[SearchFilter]) -> Optional[MetadataFilter]:
+    """
+    Returns the metadata filter of a request, or None if it sets no condition.
+    """
+    if search_filter is None:
+        return None
+    metadata_filter = search_filter.to_metadata_filter()
+    return None if metadata_filter.is_empty() else metadata_filter
+
+def _chain_config(metadata_filter: Optional[MetadataFilter]) -> dict:
+    """
+    Returns the config passing a metadata filter to the QA chain's retrieval.
+    """
+    return {"configurable": {SEARCH_FILTER_KEY: metadata_filter}} if metadata_filter is not None else {}
+
+def _sse_event(event: str, data) -> str:
+    """
+    Formats a single Server-Sent Event.
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
 @app.post("/ask/", response_model=Answer)
-async def ask_question(question: Question):
+async def ask_question(question: Question, request: Request):
     """
     Endpoint to ask a question and get an answer from the RAG chain.
+
+    An optional `filter` restricts the search to the chunks of some sources,
+    a page range or an upload date range.
     """
-    if not os.path.exists(Config.VECTOR_STORE_PATH):
-        raise HTTPException(
-            status_code=404,
-            detail="Vector store not found. Please upload documents first."
-        )
+    _require_index(question.collection_id)
 
     try:
-        logger.info(f"Received query: {question.query}")
-        vector_store = VectorStore()
-        db = vector_store.load_index(Config.VECTOR_STORE_PATH)
-        retriever_handler = RetrieverHandler(db)
-        retriever = retriever_handler.get_retriever()
-        qa_handler = QAHandler(retriever)
-        qa_chain = qa_handler.create_qa_chain()
-        
-        result = qa_chain.invoke(question.query)
+        async with request.app.state.query_limiter.slot():
+            return await _answer_question(question, request)
+    except QueryLimiterFull as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "1"})
+    except QueryLimiterTimeout as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+
+async def _answer_question(question: Question, request: Request):
+    """
+    Answers a question once a query slot has been acquired.
+    """
+    try:
+        logger.info("Received query for collection %s: %s", question.collection_id, question.query)
+        collection, pipeline = await request.app.state.collections.aget_pipeline(question.collection_id)
+        if pipeline is None:
+            raise HTTPException(
+                status_code=404,
+                detail="Vector store not found. Please upload documents first."
+            )
+
+        metadata_filter = _search_filter(question.filter)
+        # Cached answers were found without a filter, so filtered questions bypass the cache
+        answer_cache = collection.answer_cache if metadata_filter is None else None
+        if answer_cache is not None:
+            cached = await answer_cache.alookup(question.query, pipeline.version, pipeline.db.embeddings)
+            if cached is not None:
+                logger.info("Answered from the answer cache.")
+                return cached
+
+        result = await pipeline.qa_chain.ainvoke(question.query, config=_chain_config(metadata_filter))
         
         answer = result.get("answer", "No answer found.")
         source_docs = result.get("context", [])
 
-        return {
+        response = {
             "answer": answer,
-            "source_documents": [
-                {"source": doc.metadata.get("source", "N/A"), "content": doc.page_content}
-                for doc in source_docs
-            ],
+            "source_documents": _format_sources(source_docs),
         }
+        if answer_cache is not None and "answer" in result:
+            await answer_cache.astore(question.query, pipeline.version, pipeline.db.embeddings, response)
+        return response
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception("Error during question answering: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/ask/stream")
+async def ask_question_stream(question: Question, request: Request):
+    """
+    Endpoint to ask a question and stream the answer as Server-Sent Events.
+
+    The retrieved sources are sent first as a `sources` event, followed by one
+    `token` event per answer chunk as the LLM produces it, and a final `done`
+    event. Errors raised after streaming started are sent as an `error` event.
+    """
+    _require_index(question.collection_id)
+
+    # The query slot is held until the stream is fully sent
+    stack = AsyncExitStack()
+    try:
+        await stack.enter_async_context(request.app.state.query_limiter.slot())
+    except QueryLimiterFull as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "1"})
+    except QueryLimiterTimeout as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+
+    try:
+        logger.info("Received streaming query for collection %s: %s", question.collection_id, question.query)
+        collection, pipeline = await request.app.state.collections.aget_pipeline(question.collection_id)
     except Exception as e:
-        print(f"Error during question answering: {e}")
+        await stack.aclose()
+        logger.exception("Error during question answering: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
+    if pipeline is None:
+        await stack.aclose()
+        raise HTTPException(
+            status_code=404,
+            detail="Vector store not found. Please upload documents first."
+        )
+
+    metadata_filter = _search_filter(question.filter)
+    # Cached answers were found without a filter, so filtered questions bypass the cache
+    answer_cache = collection.answer_cache if metadata_filter is None else None
+
+    async def event_stream():
+        try:
+            if answer_cache is not None:
+                cached = await answer_cache.alookup(question.query, pipeline.version, pipeline.db.embeddings)
+                if cached is not None:
+                    logger.info("Answered from the answer cache.")
+                    yield _sse_event("sources", cached["source_documents"])
+                    yield _sse_event("token", {"token": cached["answer"]})
+                    yield _sse_event("done", {})
+                    return
+
+            sources, answer = [], []
+            async for chunk in pipeline.qa_chain.astream(question.query, config=_chain_config(metadata_filter)):
+                if "context" in chunk:
+                    sources = _format_sources(chunk["context"])
+                    yield _sse_event("sources", sources)
+                if chunk.get("answer"):
+                    answer.append(chunk["answer"])
+                    yield _sse_event("token", {"token": chunk["answer"]})
+            yield _sse_event("done", {})
+
+            if answer_cache is not None and answer:
+                await answer_cache.astore(
+                    question.query,
+                    pipeline.version,
+                    pipeline.db.embeddings,
+                    {"answer": "".join(answer), "source_documents": sources},
+                )
+        except Exception as e:
+            logger.exception("Error during streamed question answering: %s", e)
+            yield _sse_event("error", {"detail": str(e)})
+        finally:
+            await stack.aclose()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.post("/ask/batch")
+async def ask_batch(batch: BatchQuestions, request: Request):
+    """
+    Endpoint to answer a batch of questions against the same index.
+
+    The answers are streamed as newline-delimited JSON, one object per
+    question in the order the answers complete. Every object carries the
+    `index` of its question in the batch, and either the `answer` and
+    `source_documents` or an `error` for that question only.
+    """
+    _require_index(batch.collection_id)
+
+    # The whole batch holds one query slot and bounds its own LLM calls
+    stack = AsyncExitStack()
+    try:
+        await stack.enter_async_context(request.app.state.query_limiter.slot())
+    except QueryLimiterFull as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "1"})
+    except QueryLimiterTimeout as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+
+    try:
+        logger.info("Received a batch of %s questions for collection %s.", len(batch.queries), batch.collection_id)
+        collection, pipeline = await request.app.state.collections.aget_pipeline(batch.collection_id)
+    except Exception as e:
+        await stack.aclose()
+        logger.exception("Error during batch question answering: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+    if pipeline is None:
+        await stack.aclose()
+        raise HTTPException(
+            status_code=404,
+            detail="Vector store not found. Please upload documents first."
+        )
+
+    metadata_filter = _search_filter(batch.filter)
+    answerer = BatchAnswerer(
+        pipeline,
+        _format_sources,
+        collection.answer_cache if metadata_filter is None else None,
+        search_filter=metadata_filter,
+    )
+
+    async def result_stream():
+        try:
+            async for result in answerer.astream(batch.queries):
+                yield json.dumps(result) + "\n"
+        finally:
+            await stack.aclose()
+
+    return StreamingResponse(result_stream(), media_type="application/x-ndjson")
+
+@app.get("/cache/stats")
+def answer_cache_stats(request: Request, collection_id: str = Config.DEFAULT_COLLECTION):
+    """
+    Endpoint to report the hit rate and size of a collection's answer cache.
+    """
+    if not Config.ANSWER_CACHE_ENABLED:
+        return {"enabled": False}
+    _index_path(collection_id)
+    collection = request.app.state.collections.peek(collection_id)
+    if collection is None:
+        return {"enabled": True, "loaded": False}
+    return {"enabled": True, "loaded": True, **collection.answer_cache.stats()}
+
+@app.get("/collections/")
+def list_collections(request: Request):
+    """
+    Endpoint to list the collections that have an index, and which of them
+    are loaded in this API worker.
+    """
+    stats = request.app.state.collections.stats()
+    return {
+        "collections": [
+            {"collection_id": collection_id, "loaded": collection_id in stats["loaded"]}
+            for collection_id in list_collection_ids()
+        ],
+        **stats,
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """
+    Endpoint to expose latency, retrieval, token and ingestion histograms in
+    the Prometheus text format, including those of the ingestion workers.
+    """
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/documents/")
+def list_documents(collection_id: str = Config.DEFAULT_COLLECTION):
+    """
+    Endpoint to list the indexed documents of a collection and their IDs.
+    """
+    return {"documents": DocumentRegistry(_index_path(collection_id)).list_documents()}
+
+@app.delete("/documents/{doc_id}")
+def delete_document(doc_id: str, request: Request, collection_id: str = Config.DEFAULT_COLLECTION):
+    """
+    Endpoint to delete an indexed document of a collection by ID.
+
+    The document's chunks stop appearing in answers as soon as the new index
+    version is published; they are physically dropped by a compaction job
+    that the ingestion workers run.
+    """
+    index_path = _index_path(collection_id)
+    if not DocumentRegistry(index_path).delete_document(doc_id):
+        raise HTTPException(status_code=404, detail=f"Document {doc_id} not found.")
+    job = request.app.state.job_store.create_compaction(index_path)
+    return {"message": f"Deleted document {doc_id}.", "compaction_job_id": job["id"]}
 
 @app.get("/")
 async def root():
@@ -0,0 +1,302 @@
+from typing import Optional, Tuple
+
+import faiss
+import numpy as np
+
+from config import Config
+from logger.logger_config import get_logger
+
+logger = get_logger(__name__)
+
+# FAISS index factory strings of the supported index types. `{nlist}`, `{m}`,
+# `{nbits}` and `{hnsw_m}` are filled in from the configuration.
+INDEX_FACTORIES = {
+    "flat": "Flat",
+    "sq8": "SQ8",
+    "ivf_flat": "IVF{nlist},Flat",
+    "ivf_sq8": "IVF{nlist},SQ8",
+    "ivf_pq": "IVF{nlist},PQ{m}x{nbits}",
+    "hnsw": "HNSW{hnsw_m},Flat",
+    "hnsw_sq8": "HNSW{hnsw_m},SQ8",
+}
+
+
+def is_flat(index: faiss.Index) -> bool:
+    """
+    Returns True for exact, brute-force indexes.
+    """
+    return isinstance(index, faiss.IndexFlat)
+
+
+def is_exact(index: faiss.Index) -> bool:
+    """
+    Returns True if the index stores its vectors as floats, so they can be
+    reconstructed exactly. Quantized indexes (SQ, PQ) only store codes.
+    """
+    index = faiss.downcast_index(index)
+    if isinstance(index, (faiss.IndexFlat, faiss.IndexIVFFlat)):
+        return True
+    if isinstance(index, faiss.IndexHNSW):
+        return isinstance(faiss.downcast_index(index.storage), faiss.IndexFlat)
+    return False
+
+
+def flat_vectors(index: faiss.IndexFlat) -> np.ndarray:
+    """
+    Returns the vectors of a flat index as an array viewing the index's
+    memory, without copying them. The index must outlive the array.
+    """
+    return faiss.rev_swig_ptr(index.get_xb(), index.ntotal * index.d).reshape(index.ntotal, index.d)
+
+
+def reconstruct_range(index: faiss.Index, start: int, count: int) -> np.ndarray:
+    """
+    Returns `count` vectors of the index from position `start`. They are
+    exact only if `is_exact(index)`.
+    """
+    ivf = _ivf(index)
+    if ivf is not None and ivf.direct_map.type == faiss.DirectMap.NoMap:
+        ivf.make_direct_map()
+    return index.reconstruct_n(start, count)
+
+
+def _ivf(index: faiss.Index) -> Optional[faiss.IndexIVF]:
+    """
+    Returns the IVF part of an index, or None if it doesn't use one.
+    """
+    try:
+        return faiss.extract_index_ivf(index)
+    except RuntimeError:
+        return None
+
+
+def _hnsw(index: faiss.Index):
+    """
+    Returns the HNSW graph of an index, or None if it doesn't use one.
+    """
+    return getattr(faiss.downcast_index(index), "hnsw", None)
+
+
+def default_nlist(ntotal: int) -> int:
+    """
+    Returns the number of IVF lists for `ntotal` vectors: about 4 * sqrt(n),
+    capped so that every list gets at least 39 training points.
+    """
+    return int(max(1, min(4 * np.sqrt(ntotal), ntotal // 39)))
+
+
+def _pq_subquantizers(dimension: int, requested: int) -> int:
+    """
+    Returns the largest number of PQ sub-quantizers up to `requested` that
+    divides the vector dimension.
+    """
+    for m in range(min(requested, dimension), 0, -1):
+        if dimension % m == 0:
+            return m
+    return 1
+
+
+def factory_string(
+    index_type: str,
+    dimension: int,
+    ntotal: int,
+    nlist: Optional[int] = Config.FAISS_IVF_NLIST,
+    pq_m: int = Config.FAISS_PQ_M,
+    pq_nbits: int = Config.FAISS_PQ_NBITS,
+    hnsw_m: int = Config.FAISS_HNSW_M,
+) -> str:
+    """
+    Returns the FAISS index factory string of an index type.
+
+    Raises:
+        ValueError: If the index type is unknown.
+    """
+    if index_type not in INDEX_FACTORIES:
+        raise ValueError(f"Unknown FAISS index type '{index_type}', expected one of {sorted(INDEX_FACTORIES)}.")
+    return INDEX_FACTORIES[index_type].format(
+        nlist=nlist or default_nlist(ntotal),
+        m=_pq_subquantizers(dimension, pq_m),
+        nbits=pq_nbits,
+        hnsw_m=hnsw_m,
+    )
+
+
+def configure_search(
+    index: faiss.Index,
+    nprobe: int = Config.FAISS_IVF_NPROBE,
+    ef_search: int = Config.FAISS_HNSW_EF_SEARCH,
+) -> faiss.Index:
+    """
+    Sets the query-time accuracy/speed knobs of an index.
+
+    Args:
+        index (faiss.Index): The index to configure.
+        nprobe (int): The number of IVF lists scanned per query.
+        ef_search (int): The size of the HNSW candidate list per query.
+
+    Returns:
+        faiss.Index: The same index.
+    """
+    ivf = _ivf(index)
+    if ivf is not None:
+        ivf.nprobe = min(nprobe, ivf.nlist)
+    hnsw = _hnsw(index)
+    if hnsw is not None:
+        hnsw.efSearch = ef_search
+    return index
+
+
+def filtered_search_parameters(index: faiss.Index, positions: np.ndarray) -> faiss.SearchParameters:
+    """
+    Returns search parameters that restrict a search of `index` to the
+    vectors at `positions`, which FAISS checks before computing a distance.
+
+    IVF and HNSW searches visit a fixed share of the index, so fewer selected
+    vectors would leave fewer hits to find: `nprobe` and `efSearch` are
+    widened by the inverse of the selected share, up to a full scan.
+
+    Args:
+        index (faiss.Index): The index to search.
+        positions (np.ndarray): The sorted positions of the selected vectors.
+
+    Returns:
+        faiss.SearchParameters: The parameters to pass to `index.search`.
+    """
+    selected = np.zeros(index.ntotal, dtype=bool)
+    selected[positions] = True
+    bitmap = np.packbits(selected, bitorder="little")
+    selector = faiss.IDSelectorBitmap(index.ntotal, faiss.swig_ptr(bitmap))
+    widen = index.ntotal / max(len(positions), 1)
+
+    ivf = _ivf(index)
+    hnsw = _hnsw(index)
+    if ivf is not None:
+        params = faiss.SearchParametersIVF(sel=selector, nprobe=min(int(np.ceil(ivf.nprobe * widen)), ivf.nlist))
+    elif hnsw is not None:
+        params = faiss.SearchParametersHNSW(
+            sel=selector, efSearch=min(int(np.ceil(hnsw.efSearch * widen)), max(index.ntotal, hnsw.efSearch))
+        )
+    else:
+        params = faiss.SearchParameters(sel=selector)
+    # The selector reads the bitmap without owning it
+    params.bitmap = bitmap
+    params.selector = selector
+    return params
+
+
+def search_subset(
+    index: faiss.Index, queries: np.ndarray, positions: np.ndarray, k: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Searches only the vectors at `positions`, exactly, by reconstructing them.
+
+    For a few selected vectors this is faster than any search of the whole
+    index, and it finds the `k` nearest ones whatever the index type.
+
+    Args:
+        index (faiss.Index): The index holding the vectors.
+        queries (np.ndarray): The query vectors, one per row.
+        positions (np.ndarray): The sorted positions of the selected vectors.
+        k (int): The number of hits per query.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The squared L2 distances and the
+        positions of the hits, as returned by `index.search`.
+
+    Raises:
+        RuntimeError: If the index can't reconstruct its vectors.
+    """
+    vectors = index.reconstruct_batch(positions)
+    distances, found = faiss.knn(queries, vectors, min(k, len(positions)))
+    return distances, np.where(found >= 0, positions[np.maximum(found, 0)], -1)
+
+
+def build_index(
+    vectors: np.ndarray,
+    index_type: str = Config.FAISS_INDEX_TYPE,
+    train_sample_size: int = Config.FAISS_TRAIN_SAMPLE_SIZE,
+    ef_construction: int = Config.FAISS_HNSW_EF_CONSTRUCTION,
+    seed: int = 0,
+    **factory_kwargs,
+) -> faiss.Index:
+    """
+    Builds an L2 index of the given type over `vectors`.
+
+    Trainable indexes (IVF, PQ and SQ) are trained on a random sample of at
+    most `train_sample_size` vectors before all vectors are added.
+
+    Args:
+        vectors (np.ndarray): The vectors, one per row, in insertion order.
+        index_type (str): One of `INDEX_FACTORIES`.
+        train_sample_size (int): The maximum number of training vectors.
+        ef_construction (int): The HNSW candidate list size while adding.
+        seed (int): The seed of the training sample.
+        **factory_kwargs: Overrides of the `factory_string` parameters.
+
+    Returns:
+        faiss.Index: The built index, configured for searching.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    ntotal, dimension = vectors.shape
+    index = faiss.index_factory(dimension, factory_string(index_type, dimension, ntotal, **factory_kwargs))
+    if hasattr(index, "do_polysemous_training"):
+        # Polysemous codes only speed up Hamming-filtered search, which isn't
+        # used, and make PQ training orders of magnitude slower
+        index.do_polysemous_training = False
+    if not index.is_trained:
+        sample = vectors
+        if ntotal > train_sample_size:
+            rng = np.random.default_rng(seed)
+            sample = vectors[np.sort(rng.choice(ntotal, train_sample_size, replace=False))]
+        index.train(sample)
+    if _ivf(index) is not None:
+        # Needed to reconstruct vectors when the segment is compacted later
+        faiss.extract_index_ivf(index).set_direct_map_type(faiss.DirectMap.Array)
+    hnsw = _hnsw(index)
+    if hnsw is not None:
+        hnsw.efConstruction = ef_construction
+    index.add(vectors)
+    return configure_search(index)
+
+
+def to_flat(index: faiss.Index) -> faiss.Index:
+    """
+    Returns an exact index holding the vectors of `index`, in the same order.
+
+    Vectors of quantized indexes (SQ, PQ) are reconstructed approximately.
+    """
+    if is_flat(index):
+        return index
+    ivf = _ivf(index)
+    if ivf is not None and ivf.direct_map.type == faiss.DirectMap.NoMap:
+        ivf.make_direct_map()
+    flat = faiss.IndexFlatL2(index.d)
+    if index.ntotal:
+        flat.add(index.reconstruct_n(0, index.ntotal))
+    return flat
+
+
+def optimize_index(
+    index: faiss.Index,
+    index_type: str = Config.FAISS_INDEX_TYPE,
+    min_vectors: int = Config.FAISS_ANN_MIN_CHUNKS,
+) -> faiss.Index:
+    """
+    Converts an exact index into the configured ANN index type.
+
+    Indexes with fewer than `min_vectors` vectors are kept exact: scanning
+    them is already fast and too few vectors would train a poor index.
+    Vector positions are preserved, so docstore mappings stay valid.
+
+    Args:
+        index (faiss.Index): The exact index of a new segment.
+        index_type (str): One of `INDEX_FACTORIES`.
+        min_vectors (int): The minimum number of vectors of an ANN index.
+
+    Returns:
+        faiss.Index: The index to store.
+    """
+    if index_type == "flat" or not is_flat(index) or index.ntotal < min_vectors:
+        return index
+    logger.info("Building a %s index over %s vectors.", index_type, index.ntotal)
+    return build_index(flat_vectors(index), index_type)
@@ -0,0 +1,255 @@
+import re
+import string
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, FrozenSet, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from config import Config
+from logger.logger_config import get_logger
+from .embedding_cache import normalize_text
+
+logger = get_logger(__name__)
+
+_WORD = re.compile(r"\w+(?:[-./:]\w+)*")
+
+
+def normalize_query(query: str) -> str:
+    """
+    Normalizes a question so that differences in case, spacing and trailing
+    punctuation share a cache entry.
+    """
+    return normalize_text(query).casefold().rstrip(string.punctuation + " ")
+
+
+def identifier_tokens(query: str) -> FrozenSet[str]:
+    """
+    Returns the tokens of a question that identify something exactly: those
+    with a digit, e.g. part numbers, dates and versions, and upper case codes.
+    Questions that differ only in such a token embed almost identically but
+    must not share an answer.
+    """
+    return frozenset(
+        token.casefold() for token in _WORD.findall(normalize_text(query))
+        if any(c.isdigit() for c in token) or (len(token) > 1 and token.isupper())
+    )
+
+
+class _Entry:
+    """
+    A cached answer together with the embedding of the question it answers.
+    """
+
+    def __init__(self, response: Dict[str, Any], row: int, created_at: float, identifiers: FrozenSet[str]):
+        self.response = response
+        self.row = row
+        self.created_at = created_at
+        self.identifiers = identifiers
+
+
+class AnswerCache:
+    """
+    An in-memory cache of answers in front of the QA chain.
+
+    A question is answered from the cache if its normalized text was asked
+    before, or if the embedding of the question is at least
+    `similarity_threshold` cosine-similar to a cached one with the same
+    identifiers, e.g. part numbers and dates, see `identifier_tokens`.
+    Entries belong to the index version they were answered from and are
+    dropped as soon as a new version is published. Entries expire after
+    `ttl_seconds`, and the least recently used ones are evicted beyond
+    `max_entries`.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = Config.ANSWER_CACHE_MAX_ENTRIES,
+        ttl_seconds: float = Config.ANSWER_CACHE_TTL_SECONDS,
+        similarity_threshold: Optional[float] = Config.ANSWER_CACHE_SIMILARITY_THRESHOLD,
+    ):
+        """
+        Initializes the AnswerCache.
+
+        Args:
+            max_entries (int): The maximum number of cached answers.
+            ttl_seconds (float): The lifetime of a cached answer in seconds.
+            similarity_threshold (Optional[float]): The minimum cosine
+                similarity of a near-duplicate question, or None to only
+                serve exact matches.
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._version = None
+        # Unit-length question embeddings, one row per entry
+        self._vectors: Optional[np.ndarray] = None
+        self._row_keys: Dict[int, str] = {}
+        self._free_rows = list(range(max_entries - 1, -1, -1))
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _check_version(self, version):
+        """
+        Drops every entry if the index version changed since they were cached.
+        """
+        if version != self._version:
+            if self._entries:
+                self.invalidations += 1
+                logger.info("Index version changed, dropping %s cached answer(s).", len(self._entries))
+            self._entries.clear()
+            self._row_keys.clear()
+            self._free_rows = list(range(self.max_entries - 1, -1, -1))
+            self._version = version
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key)
+        self._row_keys.pop(entry.row, None)
+        self._free_rows.append(entry.row)
+
+    def _is_expired(self, entry: _Entry) -> bool:
+        return time.monotonic() - entry.created_at > self.ttl_seconds
+
+    @staticmethod
+    def _unit(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _lookup_exact(self, key: str, version) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            self._check_version(version)
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if self._is_expired(entry):
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            self.exact_hits += 1
+            return entry.response
+
+    def _lookup_similar(
+        self, vector: np.ndarray, identifiers: FrozenSet[str], version
+    ) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            self._check_version(version)
+            if not self._row_keys or self._vectors is None:
+                return None
+            rows = np.fromiter(self._row_keys.keys(), dtype=np.int64)
+            scores = self._vectors[rows] @ vector
+            similar = np.flatnonzero(scores >= self.similarity_threshold)
+            # The most similar question asking about the same identifiers
+            for position in similar[np.argsort(-scores[similar])]:
+                key = self._row_keys[int(rows[position])]
+                entry = self._entries[key]
+                if entry.identifiers != identifiers:
+                    continue
+                if self._is_expired(entry):
+                    self._remove(key)
+                    return None
+                self._entries.move_to_end(key)
+                self.semantic_hits += 1
+                return entry.response
+            return None
+
+    async def alookup(
+        self, query: str, version, embeddings: Embeddings, vector: Optional[List[float]] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Returns the cached response to `query` for an index version, if any.
+
+        Args:
+            query (str): The user's question.
+            version: The version of the index the question is asked against.
+            embeddings (Embeddings): The embeddings used for near-duplicate matching.
+            vector (Optional[List[float]]): The question's embedding, if it
+                was already computed.
+
+        Returns:
+            Optional[dict]: The cached answer and source documents, or None.
+        """
+        response = self._lookup_exact(normalize_query(query), version)
+        if response is None and self.similarity_threshold is not None:
+            try:
+                if vector is None:
+                    vector = await embeddings.aembed_query(query)
+                response = self._lookup_similar(self._unit(vector), identifier_tokens(query), version)
+            except Exception as e:
+                # The cache must never fail a question that the chain could answer
+                logger.warning("Answer cache similarity lookup failed: %s", e)
+        if response is None:
+            with self._lock:
+                self.misses += 1
+        return response
+
+    async def astore(
+        self,
+        query: str,
+        version,
+        embeddings: Embeddings,
+        response: Dict[str, Any],
+        vector: Optional[List[float]] = None,
+    ):
+        """
+        Caches the response to `query` for an index version.
+
+        Args:
+            query (str): The user's question.
+            version: The version of the index the answer was produced from.
+            embeddings (Embeddings): The embeddings used for near-duplicate matching.
+            response (dict): The answer and its source documents.
+            vector (Optional[List[float]]): The question's embedding, if it
+                was already computed.
+        """
+        if self.similarity_threshold is None:
+            vector = None
+        elif vector is not None:
+            vector = self._unit(vector)
+        else:
+            try:
+                # Served from the embedding cache, as the lookup embedded the same text
+                vector = self._unit(await embeddings.aembed_query(query))
+            except Exception as e:
+                logger.warning("Answer cache could not embed the question, caching it for exact hits only: %s", e)
+        key = normalize_query(query)
+        with self._lock:
+            if version != self._version:
+                # A newer index was published while the answer was produced
+                return
+            if key in self._entries:
+                self._remove(key)
+            while len(self._entries) >= self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+            row = self._free_rows.pop()
+            if vector is not None:
+                if self._vectors is None:
+                    self._vectors = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+                self._vectors[row] = vector
+                self._row_keys[row] = key
+            self._entries[key] = _Entry(response, row, time.monotonic(), identifier_tokens(query))
+
+    def stats(self) -> Dict[str, Optional[float]]:
+        """
+        Returns the hit/miss counters and the current number of cached answers.
+        """
+        with self._lock:
+            hits = self.exact_hits + self.semantic_hits
+            total = hits + self.misses
+            return {
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": hits / total if total else None,
+                "entries": len(self._entries),
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
@@ -0,0 +1,220 @@
+import asyncio
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+from langchain.docstore.document import Document
+from langchain_core.vectorstores import VectorStoreRetriever
+
+from config import Config
+from logger.logger_config import get_logger
+from .answer_cache import AnswerCache
+from .hybrid_retriever import LEXICAL, HybridRetriever
+from .metadata_index import MetadataFilter
+from .reranker import RerankingRetriever
+from .section_expander import SectionExpandingRetriever
+from .segmented_index import SegmentedIndex
+
+logger = get_logger(__name__)
+
+
+class BatchAnswerer:
+    """
+    A class to answer many questions against one pipeline snapshot.
+
+    All questions are embedded with one batched embeddings call and searched
+    with one batched FAISS search per segment. Answers found in the answer
+    cache are returned right away, and the remaining questions are answered
+    by the LLM with bounded concurrency. A failing question is reported on
+    its own and doesn't fail the rest of the batch.
+    """
+
+    def __init__(
+        self,
+        pipeline,
+        format_sources: Callable[[List[Document]], List[dict]],
+        answer_cache: Optional[AnswerCache] = None,
+        llm_concurrency: int = Config.ASK_BATCH_LLM_CONCURRENCY,
+        search_filter: Optional[MetadataFilter] = None,
+    ):
+        """
+        Initializes the BatchAnswerer.
+
+        Args:
+            pipeline: The pipeline snapshot to answer from.
+            format_sources (Callable): Converts retrieved documents into the
+                source entries returned to clients.
+            answer_cache (Optional[AnswerCache]): The answer cache, if enabled.
+            llm_concurrency (int): The maximum number of LLM calls at once.
+            search_filter (Optional[MetadataFilter]): Restricts the search of
+                every question to the chunks matching it.
+        """
+        self.pipeline = pipeline
+        self.format_sources = format_sources
+        self.answer_cache = answer_cache
+        self.llm_concurrency = llm_concurrency
+        self.search_filter = search_filter
+
+    def _reranking_retriever(self):
+        """
+        Returns the retriever under the section expander, if any.
+        """
+        retriever = self.pipeline.retriever
+        return retriever.base if isinstance(retriever, SectionExpandingRetriever) else retriever
+
+    def _base_retriever(self):
+        """
+        Returns the retriever that searches the index, under a re-ranker and
+        a section expander if any.
+        """
+        retriever = self._reranking_retriever()
+        return retriever.base if isinstance(retriever, RerankingRetriever) else retriever
+
+    def _needs_vectors(self) -> bool:
+        """
+        Returns True if the questions have to be embedded, for the search or
+        for near-duplicate lookups in the answer cache.
+        """
+        retriever = self._base_retriever()
+        if not isinstance(retriever, HybridRetriever) or retriever.mode != LEXICAL:
+            return True
+        return self.answer_cache is not None and self.answer_cache.similarity_threshold is not None
+
+    async def _aretrieve(self, queries: List[str], vectors: Optional[List[List[float]]]) -> List[Any]:
+        """
+        Retrieves the documents of every question, or the exception raised
+        while retrieving them. The candidates of all questions are re-ranked
+        together, if the pipeline re-ranks, before they are expanded to
+        their sections.
+        """
+        retriever = self._base_retriever()
+        db = self.pipeline.db
+        loop = asyncio.get_running_loop()
+        if isinstance(retriever, HybridRetriever):
+            results = await loop.run_in_executor(
+                None, retriever.retrieve_batch, queries, vectors, self.search_filter
+            )
+        elif (
+            isinstance(retriever, VectorStoreRetriever)
+            and retriever.search_type == "similarity"
+            and isinstance(db, SegmentedIndex)
+        ):
+            k = retriever.search_kwargs.get("k", 4)
+            results = await loop.run_in_executor(
+                None, lambda: db.similarity_search_by_vectors(vectors, k=k, filter=self.search_filter)
+            )
+        else:
+            # Other search types, e.g. MMR, have no batched search
+            kwargs = {"filter": self.search_filter} if self.search_filter is not None else {}
+            results = await retriever.abatch(queries, return_exceptions=True, **kwargs)
+
+        reranking = self._reranking_retriever()
+        if isinstance(reranking, RerankingRetriever):
+            results = await loop.run_in_executor(
+                None, reranking.reranker.rerank_batch, queries, results, reranking.k
+            )
+        expanding = self.pipeline.retriever
+        if isinstance(expanding, SectionExpandingRetriever):
+            results = await loop.run_in_executor(
+                None,
+                lambda: [
+                    documents if isinstance(documents, Exception)
+                    else expanding.expander.expand(documents, self.search_filter)
+                    for documents in results
+                ],
+            )
+        return results
+
+    async def _aanswer(
+        self, query: str, documents: List[Document], vector: Optional[List[float]], semaphore: asyncio.Semaphore
+    ) -> Dict[str, Any]:
+        """
+        Answers one question from its retrieved documents.
+        """
+        if isinstance(documents, Exception):
+            raise documents
+        async with semaphore:
+            answer = await self.pipeline.answer_chain.ainvoke({"context": documents, "question": query})
+        response = {"answer": answer, "source_documents": self.format_sources(documents)}
+        if self.answer_cache is not None:
+            await self.answer_cache.astore(
+                query, self.pipeline.version, self.pipeline.db.embeddings, response, vector=vector
+            )
+        return response
+
+    async def astream(self, queries: List[str]) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Answers the questions and yields one result per question, in the
+        order the answers complete.
+
+        Args:
+            queries (List[str]): The questions.
+
+        Yields:
+            dict: The `index` and `query` of a question, with either its
+            `answer`, `source_documents` and whether it was `cached`, or an
+            `error`.
+        """
+        def error(i: int, e: Exception) -> Dict[str, Any]:
+            # Called outside the except block too, so the traceback is taken from the exception
+            logger.exception("Error answering batch question %s: %s", i, e, exc_info=e)
+            return {"index": i, "query": queries[i], "error": str(e)}
+
+        vectors = None
+        if self._needs_vectors():
+            try:
+                vectors = await self.pipeline.db.embeddings.aembed_documents(list(queries))
+            except Exception as e:
+                for i in range(len(queries)):
+                    yield error(i, e)
+                return
+
+        pending = []
+        for i, query in enumerate(queries):
+            cached = None
+            if self.answer_cache is not None:
+                cached = await self.answer_cache.alookup(
+                    query,
+                    self.pipeline.version,
+                    self.pipeline.db.embeddings,
+                    vector=vectors[i] if vectors is not None else None,
+                )
+            if cached is not None:
+                yield {"index": i, "query": query, **cached, "cached": True}
+            else:
+                pending.append(i)
+        if not pending:
+            return
+
+        try:
+            retrieved = await self._aretrieve(
+                [queries[i] for i in pending],
+                [vectors[i] for i in pending] if vectors is not None else None,
+            )
+        except Exception as e:
+            for i in pending:
+                yield error(i, e)
+            return
+        logger.info(
+            "Retrieved documents for %s batch question(s), %s cached.", len(pending), len(queries) - len(pending)
+        )
+
+        semaphore = asyncio.Semaphore(self.llm_concurrency)
+        tasks = {
+            asyncio.ensure_future(self._aanswer(
+                queries[i], documents, vectors[i] if vectors is not None else None, semaphore
+            )): i
+            for i, documents in zip(pending, retrieved)
+        }
+        remaining = set(tasks)
+        try:
+            while remaining:
+                done, remaining = await asyncio.wait(remaining, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    i = tasks[task]
+                    if task.exception() is not None:
+                        yield error(i, task.exception())
+                    else:
+                        yield {"index": i, "query": queries[i], **task.result(), "cached": False}
+        finally:
+            # The client went away: don't keep calling the LLM for nobody
+            for task in remaining:
+                task.cancel()
@@ -0,0 +1,126 @@
+import json
+import mmap
+import os
+from collections.abc import Mapping
+from typing import Iterable, Iterator, Union
+
+import numpy as np
+from langchain.docstore.document import Document
+from langchain_community.docstore.base import Docstore
+
+CHUNKS_FILE = "chunks.jsonl"
+OFFSETS_FILE = "chunks.offsets.npy"
+
+
+class PositionIds(Mapping):
+    """
+    The identity mapping from FAISS vector positions to chunk store positions.
+
+    It replaces the `index_to_docstore_id` dict of a FAISS store, so loading
+    a segment doesn't build a Python object per chunk.
+    """
+
+    def __init__(self, size: int):
+        self._size = size
+
+    def __getitem__(self, position: int) -> int:
+        position = int(position)
+        if not 0 <= position < self._size:
+            raise KeyError(position)
+        return position
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(range(self._size))
+
+    def __len__(self) -> int:
+        return self._size
+
+
+class ChunkStore(Docstore):
+    """
+    A read-only, offset-indexed store of chunk texts and metadata.
+
+    Chunks are stored as one JSON record per line, and an array of byte
+    offsets locates every record. Both files are memory-mapped, so opening a
+    store costs the same regardless of its size, the pages are shared by
+    every process that opens it, and only the chunks that are actually
+    returned by a search are read and decoded.
+    """
+
+    def __init__(self, directory: str):
+        """
+        Opens the chunk store of a segment directory.
+
+        Args:
+            directory (str): The directory the store was written to.
+        """
+        self.directory = directory
+        self._offsets = np.load(os.path.join(directory, OFFSETS_FILE), mmap_mode="r")
+        self._data = None
+        if len(self._offsets) > 1 and self._offsets[-1] > 0:
+            with open(os.path.join(directory, CHUNKS_FILE), "rb") as f:
+                self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @staticmethod
+    def exists(directory: str) -> bool:
+        """
+        Returns True if `directory` holds a chunk store.
+        """
+        return os.path.exists(os.path.join(directory, OFFSETS_FILE))
+
+    @staticmethod
+    def write(directory: str, documents: Iterable[Document]) -> int:
+        """
+        Writes documents, in vector position order, as a new chunk store.
+
+        Args:
+            directory (str): The directory to write the store to.
+            documents (Iterable[Document]): The chunks to store.
+
+        Returns:
+            int: The number of stored chunks.
+        """
+        offsets = [0]
+        with open(os.path.join(directory, CHUNKS_FILE), "wb") as f:
+            for document in documents:
+                record = json.dumps(
+                    {"page_content": document.page_content, "metadata": document.metadata},
+                    ensure_ascii=False,
+                    default=str,
+                )
+                f.write(record.encode("utf-8") + b"\n")
+                offsets.append(f.tell())
+            f.flush()
+            os.fsync(f.fileno())
+        np.save(os.path.join(directory, OFFSETS_FILE), np.asarray(offsets, dtype=np.uint64))
+        return len(offsets) - 1
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def get(self, position: int) -> Document:
+        """
+        Reads and decodes the chunk at a vector position.
+        """
+        start, end = int(self._offsets[position]), int(self._offsets[position + 1])
+        record = json.loads(self._data[start:end])
+        return Document(page_content=record["page_content"], metadata=record["metadata"])
+
+    def search(self, search: Union[int, str]) -> Union[Document, str]:
+        """
+        Returns the chunk at a position, following the Docstore interface.
+        """
+        try:
+            position = int(search)
+        except (TypeError, ValueError):
+            return f"ID {search} not found."
+        if not 0 <= position < len(self):
+            return f"ID {search} not found."
+        return self.get(position)
+
+    def __iter__(self) -> Iterator[Document]:
+        for position in range(len(self)):
+            yield self.get(position)
+
+    def delete(self, ids):
+        raise NotImplementedError("Chunk stores are immutable; deleted chunks are dropped by compaction.")
@@ -0,0 +1,536 @@
+import re
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import fitz
+from langchain.docstore.document import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_community.document_loaders import PyMuPDFLoader
+
+from config import Config
+from .tokenizer import count_tokens
+
+LAYOUT_CHUNKER = "layout"
+RECURSIVE_CHUNKER = "recursive"
+
+# Separates the blocks of a page's text, and the pages of a merged section
+BLOCK_SEPARATOR = "\n\n"
+
+# Splits text after the end of a sentence
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+# Splits plain text pages into paragraphs
+_PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+
+# Font size ratios to the page's body text of level 1 and 2 headings; bold
+# or larger blocks are level 3 headings
+_HEADING_LEVEL_RATIOS = (1.6, 1.3)
+_HEADING_MIN_RATIO = 1.15
+
+# Longer blocks are body text, whatever their font
+_HEADING_MAX_CHARS = 200
+
+# PyMuPDF span flag of bold text
+_BOLD_FLAG = 16
+
+
+@dataclass
+class _Block:
+    """
+    A heading, paragraph or table of a page, in reading order.
+    """
+    kind: str  # "heading", "text" or "table"
+    text: str
+    level: int = 0  # Heading level, 1 for the largest headings
+
+
+@dataclass
+class _Unit:
+    """
+    The smallest piece of a page that chunks are made of: a heading, a
+    sentence or a table row, located by its offsets in the page's text.
+    """
+    page: int
+    kind: str
+    start: int
+    end: int
+    tokens: int
+    block: int  # Index of the block on its page
+
+
+def merge_section(chunks: List[Document]) -> str:
+    """
+    Rebuilds the text of a section from its chunks, which are slices of
+    their page's text: overlapping chunks of a page are stitched together
+    and pages are separated by a blank line.
+
+    Args:
+        chunks (List[Document]): Chunks with `page` and `start_index` metadata.
+
+    Returns:
+        str: The text of the section.
+    """
+    ordered = sorted(chunks, key=lambda chunk: (chunk.metadata.get("page", 0), chunk.metadata.get("start_index", 0)))
+    parts: List[str] = []
+    page, end = None, 0
+    for chunk in ordered:
+        start = chunk.metadata.get("start_index", 0)
+        chunk_end = start + len(chunk.page_content)
+        if parts and chunk.metadata.get("page", 0) == page and start < end:
+            # Only the part after the previous chunk is new
+            parts.append(chunk.page_content[end - start:])
+            end = max(end, chunk_end)
+            continue
+        if parts:
+            parts.append(BLOCK_SEPARATOR)
+        parts.append(chunk.page_content)
+        page, end = chunk.metadata.get("page", 0), chunk_end
+    return "".join(parts)
+
+
+class LayoutChunker:
+    """
+    Splits PDF pages into chunks along the structure PyMuPDF exposes.
+
+    Headings are detected from the font size and weight of text blocks, and
+    ruled tables with `find_tables`. Every heading starts a section, which
+    is split into parent sections of at most `parent_max_tokens` tokens at
+    block boundaries. Parents are split into chunks of at most `max_tokens`
+    tokens made of whole sentences and table rows. A chunk never spans two
+    pages or mixes a table with text, and neighbouring chunks of a page
+    share up to `overlap_tokens` tokens.
+
+    Chunks are slices of their page's text, located by `start_index`, and
+    carry the `parent_id` of their section and its heading path as
+    `section`, so a retrieved chunk can be expanded to its whole section.
+    """
+
+    def __init__(
+        self,
+        max_tokens: int = Config.CHUNK_MAX_TOKENS,
+        overlap_tokens: int = Config.CHUNK_OVERLAP_TOKENS,
+        parent_max_tokens: int = Config.CHUNK_PARENT_MAX_TOKENS,
+        detect_tables: bool = Config.CHUNK_DETECT_TABLES,
+    ):
+        """
+        Initializes the LayoutChunker.
+
+        Args:
+            max_tokens (int): The maximum number of tokens of a chunk.
+            overlap_tokens (int): The maximum number of tokens a chunk repeats
+                from the end of the previous chunk of the same page.
+            parent_max_tokens (int): The size in tokens above which sections
+                are split into several parents.
+            detect_tables (bool): Whether to look for ruled tables. Only pages
+                with vector drawings are checked, as tables without ruling
+                lines can't be told apart from text.
+        """
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        self.parent_max_tokens = parent_max_tokens
+        self.detect_tables = detect_tables
+
+    def _tables(self, page: fitz.Page) -> List[Tuple[fitz.Rect, _Block]]:
+        """
+        Returns the ruled tables of a page as blocks, one row per line.
+        """
+        if not self.detect_tables:
+            return []
+        drawings = [drawing["rect"] for drawing in page.get_cdrawings()]
+        if not drawings:
+            return []
+        # Tables are only looked for around the ruling lines, which is an
+        # order of magnitude faster than analysing the whole page
+        clip = fitz.Rect(
+            min(rect[0] for rect in drawings) - 3,
+            min(rect[1] for rect in drawings) - 3,
+            max(rect[2] for rect in drawings) + 3,
+            max(rect[3] for rect in drawings) + 3,
+        ) & page.rect
+        tables = []
+        for table in page.find_tables(clip=clip).tables:
+            rows = [
+                " | ".join(" ".join((cell or "").split()) for cell in row)
+                for row in table.extract()
+            ]
+            text = "\n".join(row for row in rows if row.strip(" |"))
+            if text:
+                tables.append((fitz.Rect(table.bbox), _Block("table", text)))
+        return tables
+
+    def _page_blocks(self, page: fitz.Page) -> List[_Block]:
+        """
+        Returns the headings, paragraphs and tables of a page in reading order.
+        """
+        tables = self._tables(page)
+        text_blocks = []
+        sizes: Counter = Counter()
+        for block in page.get_text("dict", sort=True)["blocks"]:
+            if block["type"] != 0:
+                continue
+            bbox = fitz.Rect(block["bbox"])
+            if any(bbox.intersects(rect) for rect, _ in tables):
+                continue
+            spans = [span for line in block["lines"] for span in line["spans"] if span["text"].strip()]
+            if not spans:
+                continue
+            text = " ".join(" ".join(span["text"] for span in line["spans"]).strip() for line in block["lines"])
+            text = " ".join(text.split())
+            for span in spans:
+                sizes[round(span["size"], 1)] += len(span["text"])
+            text_blocks.append((bbox, text, spans))
+
+        body_size = sizes.most_common(1)[0][0] if sizes else 0
+        blocks = []
+        for bbox, text, spans in text_blocks:
+            level = 0
+            if body_size and len(text) <= _HEADING_MAX_CHARS:
+                ratio = min(span["size"] for span in spans) / body_size
+                bold = all(span["flags"] & _BOLD_FLAG for span in spans)
+                if ratio >= _HEADING_LEVEL_RATIOS[0]:
+                    level = 1
+                elif ratio >= _HEADING_LEVEL_RATIOS[1]:
+                    level = 2
+                elif ratio >= _HEADING_MIN_RATIO or (bold and not text.endswith(".")):
+                    level = 3
+            blocks.append((bbox, _Block("heading", text, level) if level else _Block("text", text)))
+        # Text blocks keep PyMuPDF's reading order, which follows columns;
+        # a table goes before the first text block below its top edge
+        for rect, table in sorted(tables, key=lambda item: item[0].y0):
+            position = next((i for i, (bbox, _) in enumerate(blocks) if bbox.y0 >= rect.y0), len(blocks))
+            blocks.insert(position, (rect, table))
+        return [block for _, block in blocks]
+
+    def _sentence_units(self, page: int, block_index: int, text: str, offset: int) -> List[_Unit]:
+        """
+        Splits the text of a block into sentences, and sentences longer than
+        a chunk into pieces of whole words.
+        """
+        units = []
+        start = 0
+        for match in list(_SENTENCE_END.finditer(text)) + [None]:
+            end = match.start() if match is not None else len(text)
+            sentence = text[start:end]
+            if sentence:
+                tokens = count_tokens(sentence)
+                if tokens <= self.max_tokens:
+                    units.append(_Unit(page, "text", offset + start, offset + end, tokens, block_index))
+                else:
+                    units.extend(self._word_units(page, block_index, sentence, offset + start, tokens))
+            if match is not None:
+                start = match.end()
+        return units
+
+    def _word_units(self, page: int, block_index: int, text: str, offset: int, tokens: int) -> List[_Unit]:
+        """
+        Splits a sentence longer than a chunk at word boundaries.
+        """
+        # Pieces are cut by characters at the sentence's own chars per token
+        max_chars = max(1, int(len(text) * self.max_tokens / tokens))
+        units = []
+        start = 0
+        while start < len(text):
+            end = min(start + max_chars, len(text))
+            if end < len(text):
+                space = text.rfind(" ", start + 1, end)
+                end = space if space > start else end
+            piece = text[start:end]
+            units.append(_Unit(page, "text", offset + start, offset + end, count_tokens(piece), block_index))
+            start = end
+            while start < len(text) and text[start] == " ":
+                start += 1
+        return units
+
+    def _units(self, page: int, blocks: List[_Block]) -> Tuple[str, List[_Unit]]:
+        """
+        Returns the text of a page and its units.
+        """
+        units = []
+        offset = 0
+        for block_index, block in enumerate(blocks):
+            if block.kind == "heading":
+                units.append(_Unit(page, "heading", offset, offset + len(block.text), count_tokens(block.text), block_index))
+            elif block.kind == "table":
+                row_start = 0
+                for row in block.text.split("\n"):
+                    units.append(_Unit(
+                        page, "table", offset + row_start, offset + row_start + len(row), count_tokens(row), block_index
+                    ))
+                    row_start += len(row) + 1
+            else:
+                units.extend(self._sentence_units(page, block_index, block.text, offset))
+            offset += len(block.text) + len(BLOCK_SEPARATOR)
+        return BLOCK_SEPARATOR.join(block.text for block in blocks), units
+
+    def _parents(self, pages: List[Tuple[int, List[_Block]]], units: List[_Unit]) -> List[Tuple[str, List[_Unit]]]:
+        """
+        Groups the units of consecutive pages into parent sections, with the
+        heading path of each.
+        """
+        levels = {
+            (page, block_index): block.level
+            for page, blocks in pages
+            for block_index, block in enumerate(blocks) if block.kind == "heading"
+        }
+        titles = {
+            (page, block_index): block.text
+            for page, blocks in pages
+            for block_index, block in enumerate(blocks) if block.kind == "heading"
+        }
+        block_tokens: Dict[Tuple[int, int], int] = {}
+        for unit in units:
+            block_tokens[(unit.page, unit.block)] = block_tokens.get((unit.page, unit.block), 0) + unit.tokens
+
+        parents: List[Tuple[str, List[_Unit]]] = []
+        headings: List[Tuple[int, str]] = []
+        current: List[_Unit] = []
+        tokens = 0
+        has_content = False
+        previous_block = None
+
+        def close():
+            nonlocal current, tokens, has_content
+            if current:
+                parents.append((" > ".join(title for _, title in headings), current))
+            current, tokens, has_content = [], 0, False
+
+        for unit in units:
+            block = (unit.page, unit.block)
+            if unit.kind == "heading":
+                # Consecutive headings, e.g. a chapter and its first section, start one parent
+                if has_content:
+                    close()
+                level = levels[block]
+                while headings and headings[-1][0] >= level:
+                    headings.pop()
+                headings.append((level, titles[block]))
+            elif has_content:
+                # Parents are split between blocks, and within a block only if it is too long alone
+                starts_block = block != previous_block
+                upcoming = block_tokens[block] if starts_block else unit.tokens
+                if tokens + upcoming > self.parent_max_tokens and (starts_block or tokens + unit.tokens > self.parent_max_tokens):
+                    close()
+            if unit.kind != "heading":
+                has_content = True
+            current.append(unit)
+            tokens += unit.tokens
+            previous_block = block
+        close()
+        return parents
+
+    @staticmethod
+    def _joins(unit: _Unit, last: _Unit) -> bool:
+        """
+        Returns True if `unit` can be in the same chunk as `last`: chunks
+        don't span pages, and tables aren't mixed with text or other tables.
+        """
+        same_kind = (unit.kind == "table") == (last.kind == "table") and (
+            unit.kind != "table" or unit.block == last.block
+        )
+        return unit.page == last.page and same_kind
+
+    def _targets(self, units: List[_Unit]) -> List[float]:
+        """
+        Returns the target size of the chunks of every unit's run of units
+        that can be chunked together, so that a run is split into chunks of
+        even size rather than full chunks and a small remainder.
+        """
+        targets: List[float] = []
+        run: List[_Unit] = []
+        for unit in units + [None]:
+            if unit is None or (run and not self._joins(unit, run[-1])):
+                # Units are joined by whitespace, counted as one token
+                total = sum(member.tokens for member in run) + len(run) - 1
+                count = -(-total // self.max_tokens)
+                targets.extend([total / max(count, 1)] * len(run))
+                run = []
+            if unit is not None:
+                run.append(unit)
+        return targets
+
+    def _children(self, units: List[_Unit]) -> List[List[_Unit]]:
+        """
+        Packs the units of a parent into chunks.
+        """
+        chunks: List[List[_Unit]] = []
+        current: List[_Unit] = []
+        tokens = 0
+        for unit, target in zip(units, self._targets(units)):
+            if current:
+                joins = self._joins(unit, current[-1])
+                # A unit mostly past the target size starts the next chunk
+                full = tokens + unit.tokens + 1 > self.max_tokens or tokens + (unit.tokens + 1) / 2 > target
+                if not joins or full:
+                    chunks.append(current)
+                    current, tokens = [], 0
+                    if joins:
+                        # The new chunk starts with the last units of the previous one
+                        for previous in reversed(chunks[-1]):
+                            if (
+                                tokens + previous.tokens + 1 > self.overlap_tokens
+                                or tokens + previous.tokens + unit.tokens + 2 > self.max_tokens
+                            ):
+                                break
+                            current.insert(0, previous)
+                            tokens += previous.tokens + 1
+            tokens += unit.tokens + (1 if current else 0)
+            current.append(unit)
+        if current:
+            chunks.append(current)
+        # A chunk made only of overlap and a heading adds nothing
+        return [chunk for chunk in chunks if any(unit.kind != "heading" for unit in chunk) or len(chunks) == 1]
+
+    def _chunk_pages(self, pages: List[Tuple[Dict, List[_Block]]]) -> List[Document]:
+        """
+        Splits consecutive pages of one source into chunks.
+
+        Args:
+            pages: The metadata and blocks of every page, in page order.
+
+        Returns:
+            List[Document]: The chunks, in page order.
+        """
+        texts, units = {}, []
+        metadata_by_page = {}
+        numbered = []
+        for page_index, (metadata, blocks) in enumerate(pages):
+            texts[page_index], page_units = self._units(page_index, blocks)
+            metadata_by_page[page_index] = metadata
+            numbered.append((page_index, blocks))
+            units.extend(page_units)
+
+        chunks = []
+        parents_per_page: Counter = Counter()
+        for section, parent_units in self._parents(numbered, units):
+            first = metadata_by_page[parent_units[0].page]
+            parent_id = f"{first.get('source', '')}#{first.get('page', 0)}.{parents_per_page[parent_units[0].page]}"
+            parents_per_page[parent_units[0].page] += 1
+            for child in self._children(parent_units):
+                page_index = child[0].page
+                raw = texts[page_index][child[0].start:child[-1].end]
+                text = raw.strip()
+                if not text:
+                    continue
+                start = child[0].start + (len(raw) - len(raw.lstrip()))
+                metadata = dict(metadata_by_page[page_index])
+                metadata.update({
+                    "start_index": start,
+                    "parent_id": parent_id,
+                    "section": section,
+                    "chunk_type": "table" if child[-1].kind == "table" else "text",
+                })
+                chunks.append(Document(page_content=text, metadata=metadata))
+        return chunks
+
+    def split_pdf(self, pdf_path: str) -> Tuple[int, List[Document]]:
+        """
+        Parses and splits a PDF file.
+
+        Args:
+            pdf_path (str): The path to the PDF file.
+
+        Returns:
+            Tuple[int, List[Document]]: The number of pages and the chunks.
+        """
+        with fitz.open(pdf_path) as pdf:
+            file_metadata = {key: value for key, value in (pdf.metadata or {}).items() if value}
+            pages = []
+            for page in pdf:
+                metadata = dict(file_metadata)
+                metadata.update({
+                    "source": pdf_path,
+                    "file_path": pdf_path,
+                    "page": page.number,
+                    "total_pages": pdf.page_count,
+                })
+                pages.append((metadata, self._page_blocks(page)))
+            return len(pages), self._chunk_pages(pages)
+
+    def split_documents(self, documents: Iterable[Document]) -> List[Document]:
+        """
+        Splits pages that were already loaded as text. Paragraphs take the
+        place of the PDF blocks, and no headings or tables are detected.
+
+        Args:
+            documents (Iterable[Document]): The pages, with their metadata.
+
+        Returns:
+            List[Document]: The chunks.
+        """
+        by_source: Dict[str, List[Tuple[Dict, List[_Block]]]] = {}
+        for document in documents:
+            blocks = [
+                _Block("text", " ".join(paragraph.split()))
+                for paragraph in _PARAGRAPH_BREAK.split(document.page_content) if paragraph.strip()
+            ]
+            by_source.setdefault(document.metadata.get("source", ""), []).append((dict(document.metadata), blocks))
+        chunks = []
+        for pages in by_source.values():
+            chunks.extend(self._chunk_pages(pages))
+        return chunks
+
+
+class RecursiveChunker:
+    """
+    Splits page text into chunks of `chunk_size` characters with
+    LangChain's RecursiveCharacterTextSplitter, ignoring the page layout.
+    """
+
+    def __init__(self, chunk_size: int = Config.CHUNK_SIZE, chunk_overlap: int = Config.CHUNK_OVERLAP):
+        """
+        Initializes the RecursiveChunker.
+
+        Args:
+            chunk_size (int): The maximum number of characters of a chunk.
+            chunk_overlap (int): The number of characters neighbouring chunks share.
+        """
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+
+    def _splitter(self) -> RecursiveCharacterTextSplitter:
+        return RecursiveCharacterTextSplitter(
+            chunk_size=self.chunk_size,
+            chunk_overlap=self.chunk_overlap,
+            # Lets overlapping chunks be merged back when building the prompt
+            add_start_index=True,
+        )
+
+    def split_pdf(self, pdf_path: str) -> Tuple[int, List[Document]]:
+        """
+        Parses and splits a PDF file.
+
+        Args:
+            pdf_path (str): The path to the PDF file.
+
+        Returns:
+            Tuple[int, List[Document]]: The number of pages and the chunks.
+        """
+        pages = PyMuPDFLoader(pdf_path).load()
+        return len(pages), self.split_documents(pages)
+
+    def split_documents(self, documents: Iterable[Document]) -> List[Document]:
+        """
+        Splits pages that were already loaded as text.
+        """
+        return self._splitter().split_documents(list(documents))
+
+
+def create_chunker(name: Optional[str] = Config.CHUNKER):
+    """
+    Creates the chunker configured by `name`.
+
+    Args:
+        name (str): "layout" or "recursive".
+
+    Returns:
+        The chunker instance.
+
+    Raises:
+        ValueError: If the chunker is unknown.
+    """
+    if name == LAYOUT_CHUNKER:
+        return LayoutChunker()
+    if name == RECURSIVE_CHUNKER:
+        return RecursiveChunker()
+    raise ValueError(f"Unknown chunker '{name}'.")
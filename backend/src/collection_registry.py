@@ -0,0 +1,261 @@
+import asyncio
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from config import Config
+from logger.logger_config import get_logger
+from .answer_cache import AnswerCache
+from .hybrid_retriever import LEXICAL
+from .pipeline_registry import Pipeline, PipelineClients, PipelineRegistry
+
+logger = get_logger(__name__)
+
+_COLLECTION_ID = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_-]{0,63}$")
+
+
+def validate_collection_id(collection_id: str) -> str:
+    """
+    Checks that a collection ID is safe to use as a directory name.
+
+    Args:
+        collection_id (str): The collection ID.
+
+    Returns:
+        str: The collection ID.
+
+    Raises:
+        ValueError: If the ID is not 1 to 64 letters, digits, '-' or '_',
+            starting with a letter or digit.
+    """
+    if not isinstance(collection_id, str) or not _COLLECTION_ID.match(collection_id):
+        raise ValueError(
+            f"Invalid collection ID '{collection_id}': use 1 to 64 letters, digits, '-' or '_', "
+            "starting with a letter or digit."
+        )
+    return collection_id
+
+
+def collection_index_path(collection_id: str) -> str:
+    """
+    Returns the directory of a collection's index. The default collection
+    keeps the index at `Config.VECTOR_STORE_PATH`, so existing indexes stay
+    where they are.
+
+    Args:
+        collection_id (str): The collection ID.
+
+    Returns:
+        str: The directory of the collection's segmented index.
+
+    Raises:
+        ValueError: If the collection ID is invalid.
+    """
+    validate_collection_id(collection_id)
+    if collection_id == Config.DEFAULT_COLLECTION:
+        return Config.VECTOR_STORE_PATH
+    return os.path.join(Config.COLLECTIONS_DIR, collection_id)
+
+
+def list_collection_ids() -> List[str]:
+    """
+    Returns the IDs of the collections that have an index on disk.
+    """
+    collection_ids = []
+    if os.path.exists(Config.VECTOR_STORE_PATH):
+        collection_ids.append(Config.DEFAULT_COLLECTION)
+    if os.path.isdir(Config.COLLECTIONS_DIR):
+        for name in sorted(os.listdir(Config.COLLECTIONS_DIR)):
+            if name != Config.DEFAULT_COLLECTION and _COLLECTION_ID.match(name):
+                collection_ids.append(name)
+    return collection_ids
+
+
+def _available_memory_bytes() -> Optional[int]:
+    """
+    Returns the memory available to new allocations on Linux, or None
+    where /proc/meminfo does not exist.
+    """
+    try:
+        with open("/proc/meminfo", "r", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        return None
+    return None
+
+
+class Collection:
+    """
+    The loaded state of one collection: its pipeline registry and its
+    answer cache, which must not serve answers from other collections.
+    """
+
+    def __init__(self, collection_id: str, clients: PipelineClients):
+        """
+        Initializes the Collection.
+
+        Args:
+            collection_id (str): The collection ID.
+            clients (PipelineClients): The clients shared by all collections.
+        """
+        self.collection_id = collection_id
+        self.index_path = collection_index_path(collection_id)
+        self.pipeline_registry = PipelineRegistry(self.index_path, clients=clients)
+        self.answer_cache = None
+        if Config.ANSWER_CACHE_ENABLED:
+            # Lexical search never embeds questions, and neither does the cache
+            lexical = Config.RETRIEVER_SEARCH_TYPE == LEXICAL
+            self.answer_cache = AnswerCache(
+                similarity_threshold=None if lexical else Config.ANSWER_CACHE_SIMILARITY_THRESHOLD
+            )
+        # Size on disk of the loaded index, measured when a version is loaded
+        self.index_bytes = 0
+        self.version = None
+
+
+class CollectionRegistry:
+    """
+    A memory-bounded LRU of loaded collections.
+
+    A collection is loaded on its first query. When one is loaded, the least
+    recently used collections are evicted while more than `max_loaded` are
+    loaded, while their indexes take more than `max_index_bytes` on disk,
+    or while the system has less than `min_available_bytes` of memory
+    available. Requests that already hold a pipeline of an evicted
+    collection finish with it.
+    """
+
+    def __init__(
+        self,
+        max_loaded: int = Config.COLLECTION_MAX_LOADED,
+        max_index_bytes: Optional[int] = Config.COLLECTION_MAX_INDEX_BYTES,
+        min_available_bytes: Optional[int] = Config.COLLECTION_MIN_AVAILABLE_MEMORY_BYTES,
+    ):
+        """
+        Initializes the CollectionRegistry.
+
+        Args:
+            max_loaded (int): The maximum number of loaded collections.
+            max_index_bytes (Optional[int]): The maximum total size of the
+                loaded indexes, None for no limit.
+            min_available_bytes (Optional[int]): The system memory to keep
+                available, None to ignore memory pressure.
+        """
+        self.max_loaded = max_loaded
+        self.max_index_bytes = max_index_bytes
+        self.min_available_bytes = min_available_bytes
+        self._clients = PipelineClients()
+        self._collections: "OrderedDict[str, Collection]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.evictions = 0
+
+    def get(self, collection_id: str) -> Collection:
+        """
+        Returns a collection, creating its entry if it isn't loaded, and
+        marks it as the most recently used. Its index is loaded by the
+        first call to `aget_pipeline`.
+
+        Args:
+            collection_id (str): The collection ID.
+
+        Returns:
+            Collection: The collection.
+
+        Raises:
+            ValueError: If the collection ID is invalid.
+        """
+        with self._lock:
+            collection = self._collections.get(collection_id)
+            if collection is None:
+                collection = Collection(collection_id, self._clients)
+                self._collections[collection_id] = collection
+            else:
+                self._collections.move_to_end(collection_id)
+            return collection
+
+    def peek(self, collection_id: str) -> Optional[Collection]:
+        """
+        Returns a collection if it is loaded, without loading it or marking
+        it as used.
+        """
+        with self._lock:
+            return self._collections.get(collection_id)
+
+    def _over_limits(self) -> Optional[str]:
+        """
+        Returns why collections must be evicted, or None.
+        """
+        if len(self._collections) > self.max_loaded:
+            return f"more than {self.max_loaded} collections loaded"
+        if self.max_index_bytes is not None:
+            total = sum(collection.index_bytes for collection in self._collections.values())
+            if total > self.max_index_bytes:
+                return f"loaded indexes take {total} bytes"
+        if self.min_available_bytes is not None:
+            available = _available_memory_bytes()
+            if available is not None and available < self.min_available_bytes:
+                return f"{available} bytes of memory available"
+        return None
+
+    def _evict(self, keep: str):
+        """
+        Evicts least recently used collections, except `keep`, while over
+        the limits.
+        """
+        with self._lock:
+            while len(self._collections) > 1:
+                reason = self._over_limits()
+                if reason is None:
+                    return
+                collection_id = next(iter(self._collections))
+                if collection_id == keep:
+                    # The collection being queried is the most recently used
+                    self._collections.move_to_end(collection_id)
+                    collection_id = next(iter(self._collections))
+                del self._collections[collection_id]
+                self.evictions += 1
+                logger.info("Evicted collection %s: %s.", collection_id, reason)
+
+    async def aget_pipeline(self, collection_id: str) -> Tuple[Collection, Optional[Pipeline]]:
+        """
+        Returns a collection and its current pipeline, loading its index if
+        needed and evicting other collections when over the limits.
+
+        Args:
+            collection_id (str): The collection ID.
+
+        Returns:
+            Tuple[Collection, Optional[Pipeline]]: The collection, and its
+            pipeline, or None if the collection has no index yet.
+
+        Raises:
+            ValueError: If the collection ID is invalid.
+        """
+        collection = self.get(collection_id)
+        pipeline = await collection.pipeline_registry.aget_pipeline()
+        if pipeline is not None and pipeline.version != collection.version:
+            # Unlike run_in_executor, to_thread keeps the request ID for the logs
+            collection.index_bytes = await asyncio.to_thread(collection.pipeline_registry.index_bytes)
+            if collection.version is None:
+                self.loads += 1
+                logger.info("Loaded collection %s (%s bytes on disk).", collection_id, collection.index_bytes)
+            collection.version = pipeline.version
+            await asyncio.to_thread(self._evict, collection_id)
+        return collection, pipeline
+
+    def stats(self) -> Dict[str, object]:
+        """
+        Returns the loaded collections and the load and eviction counts.
+        """
+        with self._lock:
+            loaded = {
+                collection_id: {"index_bytes": collection.index_bytes}
+                for collection_id, collection in self._collections.items()
+                if collection.version is not None
+            }
+        return {"loaded": loaded, "loads": self.loads, "evictions": self.evictions}
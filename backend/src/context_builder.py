@@ -0,0 +1,240 @@
+import re
+from dataclasses import dataclass
+from typing import List, Optional, Set, Tuple
+
+from langchain.docstore.document import Document
+
+from config import Config
+from .tokenizer import count_tokens, truncate_to_tokens
+
+# Separates the passages of the context, as the chunks were joined before
+PASSAGE_SEPARATOR = "\n\n"
+
+# Splits text after the end of a sentence, keeping the whitespace that follows
+_SENTENCE_END = re.compile(r"(?<=[.!?])(\s+)")
+
+# Shorter sentences, e.g. "Yes." or list numbers, are kept even if repeated
+_MIN_DUPLICATE_CHARS = 20
+
+# Shortest text overlap taken as the splitter's chunk overlap
+_MIN_OVERLAP_CHARS = 20
+
+# Fewer tokens left in the budget are not worth a truncated passage
+_MIN_TRUNCATED_TOKENS = 32
+
+
+@dataclass
+class ContextStats:
+    """
+    What assembling the context of one question did.
+    """
+    chunks: int = 0  # Chunks retrieved
+    passages: int = 0  # Passages in the context after merging and fitting
+    retrieved_tokens: int = 0  # Tokens of the retrieved chunks joined as they are
+    context_tokens: int = 0  # Tokens of the assembled context
+    duplicate_sentences: int = 0  # Sentences removed as repeated
+    truncated: bool = False  # Whether passages were cut or dropped to fit the budget
+
+    @property
+    def tokens_saved(self) -> int:
+        return max(0, self.retrieved_tokens - self.context_tokens)
+
+
+class _Passage:
+    """
+    Contiguous text of one page, made of one or more merged chunks.
+    """
+
+    def __init__(self, key: tuple, text: str, start: Optional[int]):
+        self.key = key
+        self.text = text
+        self.start = start
+
+    @classmethod
+    def from_document(cls, document: Document) -> "_Passage":
+        metadata = document.metadata
+        return cls((metadata.get("source"), metadata.get("page")), document.page_content, metadata.get("start_index"))
+
+    @property
+    def end(self) -> Optional[int]:
+        return None if self.start is None else self.start + len(self.text)
+
+
+def _overlap(left: str, right: str, max_chars: int) -> int:
+    """
+    Returns the length of the longest suffix of `left` that starts `right`,
+    or 0 if it is shorter than `_MIN_OVERLAP_CHARS`.
+    """
+    if len(right) < _MIN_OVERLAP_CHARS:
+        return 0
+    probe = right[:_MIN_OVERLAP_CHARS]
+    position = left.find(probe, max(0, len(left) - max_chars))
+    while position != -1:
+        if right.startswith(left[position:]):
+            return len(left) - position
+        position = left.find(probe, position + 1)
+    return 0
+
+
+class ContextBuilder:
+    """
+    A class to assemble the retrieved chunks into the context of the prompt.
+
+    Chunks of the same page that overlap or touch are merged into one
+    passage, so the text shared by neighbouring chunks is sent once.
+    Sentences repeated across passages are removed, and the passages are
+    fitted into a token budget in the order they were retrieved.
+    """
+
+    def __init__(
+        self,
+        max_tokens: Optional[int] = Config.CONTEXT_MAX_TOKENS,
+        merge_chunks: bool = Config.CONTEXT_MERGE_CHUNKS,
+        dedupe_sentences: bool = Config.CONTEXT_DEDUPE_SENTENCES,
+        max_overlap_chars: int = Config.CHUNK_OVERLAP,
+    ):
+        """
+        Initializes the ContextBuilder.
+
+        Args:
+            max_tokens (Optional[int]): The token budget of the context, None
+                for no limit.
+            merge_chunks (bool): Whether to merge overlapping chunks of a page.
+            dedupe_sentences (bool): Whether to remove repeated sentences.
+            max_overlap_chars (int): The longest text overlap looked for
+                between chunks without a `start_index`.
+        """
+        self.max_tokens = max_tokens
+        self.merge_chunks = merge_chunks
+        self.dedupe_sentences = dedupe_sentences
+        self.max_overlap_chars = max_overlap_chars
+
+    def _join(self, left: _Passage, right: _Passage) -> Optional[_Passage]:
+        """
+        Returns `left` followed by `right` if they overlap or touch, or None.
+        """
+        if left.start is not None and right.start is not None:
+            if right.start < left.start or right.start > left.end:
+                return None
+            text = left.text + right.text[left.end - right.start:]
+        else:
+            overlap = _overlap(left.text, right.text, self.max_overlap_chars)
+            if not overlap:
+                return None
+            text = left.text + right.text[overlap:]
+        return _Passage(left.key, text, left.start)
+
+    def _combine(self, first: _Passage, second: _Passage) -> Optional[_Passage]:
+        """
+        Returns the passage covering both passages of a page, or None if
+        they are not contiguous.
+        """
+        if second.text in first.text:
+            return first
+        if first.text in second.text:
+            return second
+        return self._join(first, second) or self._join(second, first)
+
+    def _merge(self, documents: List[Document]) -> List[_Passage]:
+        """
+        Merges the chunks of each page into passages, ordered by their best
+        retrieved chunk.
+        """
+        passages: List[_Passage] = []
+        for document in documents:
+            current = _Passage.from_document(document)
+            position = None
+            merged = True
+            while merged:
+                merged = False
+                for i, passage in enumerate(passages):
+                    combined = self._combine(passage, current) if passage.key == current.key else None
+                    if combined is None:
+                        continue
+                    # The merged passage takes the place of the best ranked one
+                    del passages[i]
+                    current = combined
+                    position = i if position is None else min(position, i)
+                    merged = True
+                    break
+            passages.insert(len(passages) if position is None else position, current)
+        return passages
+
+    def _dedupe(self, text: str, seen: Set[str]) -> Tuple[str, int]:
+        """
+        Removes the sentences of `text` already in `seen` and adds the others.
+        """
+        parts = _SENTENCE_END.split(text)
+        kept, removed = [], 0
+        # Sentences are at even positions, the whitespace after them at odd ones
+        for i in range(0, len(parts), 2):
+            sentence = parts[i]
+            normalized = " ".join(sentence.lower().split())
+            if len(normalized) >= _MIN_DUPLICATE_CHARS:
+                if normalized in seen:
+                    removed += 1
+                    continue
+                seen.add(normalized)
+            kept.append(sentence)
+            if i + 1 < len(parts):
+                kept.append(parts[i + 1])
+        return "".join(kept).strip(), removed
+
+    def _truncate(self, text: str, max_tokens: int) -> str:
+        """
+        Cuts a passage to `max_tokens`, at the end of a sentence if one is
+        in the second half of what is kept.
+        """
+        text = truncate_to_tokens(text, max_tokens)
+        cut = max(text.rfind(". "), text.rfind("! "), text.rfind("? "), text.rfind("\n"))
+        return text[:cut + 1] if cut >= len(text) // 2 else text
+
+    def build(self, documents: List[Document]) -> Tuple[str, ContextStats]:
+        """
+        Assembles the context of a question from its retrieved chunks.
+
+        Args:
+            documents (List[Document]): The retrieved chunks, best first.
+
+        Returns:
+            Tuple[str, ContextStats]: The context text, and what was done to
+            assemble it.
+        """
+        stats = ContextStats(chunks=len(documents))
+        stats.retrieved_tokens = count_tokens(PASSAGE_SEPARATOR.join(doc.page_content for doc in documents))
+
+        if self.merge_chunks:
+            texts = [passage.text for passage in self._merge(documents)]
+        else:
+            texts = [doc.page_content for doc in documents]
+
+        if self.dedupe_sentences:
+            seen: Set[str] = set()
+            deduped = []
+            for text in texts:
+                text, removed = self._dedupe(text, seen)
+                stats.duplicate_sentences += removed
+                if text:
+                    deduped.append(text)
+            texts = deduped
+
+        if self.max_tokens is not None:
+            separator_tokens = count_tokens(PASSAGE_SEPARATOR)
+            fitted, used = [], 0
+            for text in texts:
+                tokens = count_tokens(text) + (separator_tokens if fitted else 0)
+                if used + tokens <= self.max_tokens:
+                    fitted.append(text)
+                    used += tokens
+                    continue
+                stats.truncated = True
+                remaining = self.max_tokens - used - (separator_tokens if fitted else 0)
+                if remaining >= _MIN_TRUNCATED_TOKENS:
+                    fitted.append(self._truncate(text, remaining))
+                break
+            texts = fitted
+
+        context = PASSAGE_SEPARATOR.join(texts)
+        stats.passages = len(texts)
+        stats.context_tokens = count_tokens(context)
+        return context, stats
@@ -1,25 +1,180 @@
 import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from langchain_community.document_loaders import PyMuPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from typing import List
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 from langchain.docstore.document import Document
 
 from config import Config
-from logger.logger_config import logger
+from logger.logger_config import get_logger, log_to_queue, process_log_queue
+from .chunker import create_chunker
+
+logger = get_logger(__name__)
+
+
+def _load_pdf(pdf_path: str) -> List[Document]:
+    """
+    Loads the pages of a single PDF file. Runs inside a worker process.
+
+    Args:
+        pdf_path (str): The path to the PDF file.
+
+    Returns:
+        List[Document]: The pages of the file, or an empty list on error.
+    """
+    try:
+        return PyMuPDFLoader(pdf_path).load()
+    except Exception as e:
+        logger.error("Error loading %s: %s", pdf_path, e)
+        return []
+
+
+def _split_pdf(pdf_path: str, chunker) -> Tuple[int, List[Document]]:
+    """
+    Parses and splits a single PDF file. Runs inside a worker process.
+
+    Args:
+        pdf_path (str): The path to the PDF file.
+        chunker: The chunker, pickled to the worker with its settings.
+
+    Returns:
+        Tuple[int, List[Document]]: The number of pages and the chunks of
+        the file, or no pages and no chunks on error.
+    """
+    try:
+        return chunker.split_pdf(pdf_path)
+    except Exception as e:
+        logger.error("Error loading %s: %s", pdf_path, e)
+        return 0, []
+
 
 class DocumentProcessor:
     """
     A class to handle loading and processing of documents.
     """
 
-    def __init__(self, source_dir: str):
+    def __init__(self, source_dir: str, document_metadata: Optional[Dict[str, dict]] = None, chunker=None):
         """
         Initializes the DocumentProcessor with the source directory.
 
         Args:
             source_dir (str): The path to the directory containing PDF files.
+            document_metadata (Optional[Dict[str, dict]]): Metadata to add to
+                the chunks of each file, keyed by file name. If given, only
+                these files are processed; otherwise every PDF file is.
+            chunker: Splits pages into chunks, e.g. a `LayoutChunker`. The
+                one named by `Config.CHUNKER` is used if not provided.
         """
         self.source_dir = source_dir
+        self.document_metadata = document_metadata
+        self.chunker = chunker if chunker is not None else create_chunker()
+        self.pages_loaded = 0
+        self.chunks_created = 0
+        # Files that failed to parse or had no text
+        self.empty_files = 0
+
+    def _pdf_paths(self) -> List[str]:
+        """
+        Returns the paths of all PDF files in the source directory.
+        """
+        return [
+            os.path.join(self.source_dir, file)
+            for file in sorted(os.listdir(self.source_dir))
+            if file.endswith(".pdf") and (self.document_metadata is None or file in self.document_metadata)
+        ]
+
+    def _map_files(self, function: Callable, *args) -> Iterator:
+        """
+        Runs `function(pdf_path, *args)` on every PDF file in parallel worker
+        processes and yields the results as soon as each file is done.
+
+        Only a bounded number of files are in flight at once, so memory use
+        depends on `Config.INGESTION_MAX_PENDING_FILES` and not on the number
+        of files in the directory.
+
+        Yields:
+            The result of every file, in completion order.
+        """
+        if not os.path.exists(self.source_dir):
+            logger.error("Error: Directory not found at %s", self.source_dir)
+            return
+
+        pdf_paths = self._pdf_paths()
+        logger.info("Loading %s PDF file(s) from: %s", len(pdf_paths), self.source_dir)
+        if not pdf_paths:
+            return
+
+        workers = min(Config.INGESTION_PROCESSES or os.cpu_count() or 1, len(pdf_paths))
+        if workers <= 1:
+            # A process pool only adds start-up and pickling overhead here
+            for pdf_path in pdf_paths:
+                yield function(pdf_path, *args)
+            return
+
+        max_pending = max(Config.INGESTION_MAX_PENDING_FILES, workers)
+        # "spawn" avoids forking the multi-threaded API process
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=context,
+            # Parser processes log through the process that writes the log file
+            initializer=log_to_queue,
+            initargs=(process_log_queue(),),
+        ) as executor:
+            remaining = iter(pdf_paths)
+            pending = set()
+            for pdf_path in remaining:
+                pending.add(executor.submit(function, pdf_path, *args))
+                if len(pending) >= max_pending:
+                    break
+
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+                for pdf_path in remaining:
+                    pending.add(executor.submit(function, pdf_path, *args))
+                    if len(pending) >= max_pending:
+                        break
+
+    def iter_documents(self) -> Iterator[Document]:
+        """
+        Parses the PDF files in parallel worker processes and yields their pages
+        as soon as each file is done.
+
+        Yields:
+            Document: The loaded pages, file by file in completion order.
+        """
+        for pages in self._map_files(_load_pdf):
+            self.pages_loaded += len(pages)
+            yield from pages
+        logger.info("Loaded %s document pages in total.", self.pages_loaded)
+
+    def _add_document_metadata(self, document: Document):
+        """
+        Adds the metadata given for the document's file to a page or chunk.
+        """
+        if self.document_metadata:
+            file_name = os.path.basename(document.metadata.get("source", ""))
+            document.metadata.update(self.document_metadata.get(file_name, {}))
+
+    def iter_chunks(self) -> Iterator[Document]:
+        """
+        Parses and splits the PDF files in parallel worker processes, so
+        that splitting, and its token counting, is spread over the workers
+        too, and yields the chunks as soon as each file is done.
+
+        Yields:
+            Document: The text chunks, file by file in completion order.
+        """
+        for pages, chunks in self._map_files(_split_pdf, self.chunker):
+            self.pages_loaded += pages
+            self.chunks_created += len(chunks)
+            self.empty_files += not chunks
+            for chunk in chunks:
+                self._add_document_metadata(chunk)
+                yield chunk
+        logger.info("Loaded %s document pages in total.", self.pages_loaded)
 
     def load_documents(self) -> List[Document]:
         """
@@ -29,24 +184,51 @@ class DocumentProcessor:
             List[Document]: A list of loaded document objects from LangChain.
             Returns an empty list if the directory doesn't exist or an error occurs.
         """
-        documents = []
-        if not os.path.exists(self.source_dir):
-            logger.error(f"Error: Directory not found at {self.source_dir}")
-            return documents
-        
-        logger.info(f"Loading documents from: {self.source_dir}")
-        for file in os.listdir(self.source_dir):
-            if file.endswith(".pdf"):
-                pdf_path = os.path.join(self.source_dir, file)
-                try:
-                    loader = PyMuPDFLoader(pdf_path)
-                    documents.extend(loader.load())
-                except Exception as e:
-                    logger.error(f"Error loading {pdf_path}: {e}")
-        
-        logger.info(f"Loaded {len(documents)} document pages in total.")
-        
-        return documents
+        return list(self.iter_documents())
+
+    def iter_text_chunks(self, documents: Iterable[Document]) -> Iterator[Document]:
+        """
+        Splits documents into chunks one page at a time.
+
+        Args:
+            documents (Iterable[Document]): The pages to split, e.g. from `iter_documents`.
+
+        Yields:
+            Document: The text chunks, as soon as their page has been split.
+        """
+        for document in documents:
+            self._add_document_metadata(document)
+            try:
+                chunks = self.chunker.split_documents([document])
+            except Exception as e:
+                logger.error("Error splitting text: %s", e)
+                continue
+            self.chunks_created += len(chunks)
+            yield from chunks
+
+    def iter_chunk_batches(self, batch_size: int = Config.INGESTION_BATCH_SIZE) -> Iterator[List[Document]]:
+        """
+        Streams the source directory as batches of text chunks.
+
+        Parsing, splitting and the consumer of the batches overlap: worker
+        processes keep parsing and splitting files while the current batch is
+        being embedded.
+
+        Args:
+            batch_size (int): The number of chunks per batch.
+
+        Yields:
+            List[Document]: Batches of at most `batch_size` chunks.
+        """
+        batch = []
+        for chunk in self.iter_chunks():
+            batch.append(chunk)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+        logger.info("Split documents into %s chunks.", self.chunks_created)
 
     def get_text_chunks(self, documents: List[Document]) -> List[Document]:
         """
@@ -62,15 +244,11 @@ class DocumentProcessor:
         if not documents:
             return []
         try:
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=Config.CHUNK_SIZE,
-                chunk_overlap=Config.CHUNK_OVERLAP
-            )
-            chunks = text_splitter.split_documents(documents)
-            logger.info(f"Split documents into {len(chunks)} chunks.")
-            
+            chunks = self.chunker.split_documents(documents)
+            logger.info("Split documents into %s chunks.", len(chunks))
+
             return chunks
         except Exception as e:
-            logger.error(f"Error splitting text: {e}")
-            
+            logger.error("Error splitting text: %s", e)
+
             return []
@@ -0,0 +1,123 @@
+import hashlib
+import os
+import time
+import uuid
+from typing import Any, Dict, List
+
+from logger.logger_config import get_logger
+from .segmented_index import SegmentStore
+
+logger = get_logger(__name__)
+
+_HASH_BLOCK_SIZE = 1024 * 1024
+
+
+class UploadPlan:
+    """
+    The outcome of checking a set of uploaded files against the registry.
+    """
+
+    def __init__(self):
+        # Registry entries of the files to index, keyed by file path
+        self.new_documents: Dict[str, Dict[str, Any]] = {}
+        # IDs of indexed documents replaced by a new version of the same file,
+        # keyed by the document ID of the new version
+        self.replaced_documents: Dict[str, str] = {}
+        # Paths of files whose exact content is already indexed
+        self.skipped_files: List[str] = []
+
+
+class DocumentRegistry:
+    """
+    A class to track which documents are indexed, keyed by file content hash.
+
+    The registry is stored in the index manifest, so registering documents is
+    published atomically together with the segment that holds their chunks.
+    """
+
+    def __init__(self, index_path: str):
+        """
+        Initializes the DocumentRegistry.
+
+        Args:
+            index_path (str): The directory of the segmented index.
+        """
+        self.store = SegmentStore(index_path)
+
+    @staticmethod
+    def hash_file(path: str) -> str:
+        """
+        Returns the SHA-256 hex digest of a file's content.
+        """
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(_HASH_BLOCK_SIZE), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def list_documents(self) -> List[Dict[str, Any]]:
+        """
+        Returns the registry entries of all indexed documents.
+        """
+        documents = self.store.read_manifest()["documents"]
+        return [{"doc_id": doc_id, **entry} for doc_id, entry in documents.items()]
+
+    def plan_upload(self, file_paths: List[str]) -> UploadPlan:
+        """
+        Decides what to do with each uploaded file.
+
+        Files whose content is already indexed are skipped. A file with the
+        same name as an indexed document but new content replaces it, once
+        it has produced chunks. Every other file is indexed as a new document.
+        The plan is checked again when the upload is published, as other
+        uploads may have been published since, see `SegmentStore.publish`.
+
+        Args:
+            file_paths (List[str]): The paths of the uploaded files.
+
+        Returns:
+            UploadPlan: The files to index and the documents they replace.
+        """
+        documents = self.store.read_manifest()["documents"]
+        by_hash = {entry["content_hash"]: doc_id for doc_id, entry in documents.items()}
+        by_source = {entry["source"]: doc_id for doc_id, entry in documents.items()}
+
+        plan = UploadPlan()
+        for path in file_paths:
+            source = os.path.basename(path)
+            content_hash = self.hash_file(path)
+            if content_hash in by_hash:
+                logger.info("Skipping %s: identical content is already indexed.", source)
+                plan.skipped_files.append(path)
+                continue
+            doc_id = uuid.uuid4().hex
+            if source in by_source:
+                logger.info("%s changed, replacing document %s.", source, by_source[source])
+                plan.replaced_documents[doc_id] = by_source.pop(source)
+            by_hash[content_hash] = path
+            plan.new_documents[path] = {
+                "doc_id": doc_id,
+                "source": source,
+                "content_hash": content_hash,
+                "uploaded_at": time.time(),
+            }
+        return plan
+
+    def delete_document(self, doc_id: str) -> bool:
+        """
+        Deletes a document from the index without rebuilding it.
+
+        Its chunks are hidden from searches right away and physically dropped
+        by the next compaction.
+
+        Args:
+            doc_id (str): The ID of the document to delete.
+
+        Returns:
+            bool: False if no document with this ID is indexed.
+        """
+        if doc_id not in self.store.read_manifest()["documents"]:
+            return False
+        self.store.publish(delete_documents=[doc_id])
+        logger.info("Deleted document %s.", doc_id)
+        return True
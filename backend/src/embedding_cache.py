@@ -0,0 +1,282 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from config import Config
+from logger.logger_config import get_logger
+from .embedding_scheduler import EmbeddingSchedulerError
+
+logger = get_logger(__name__)
+
+# SQLite limits the number of bound parameters per statement
+_SQL_BATCH_SIZE = 500
+# Cache hits whose access time is written in one transaction
+_TOUCH_FLUSH_SIZE = 1_000
+# Seconds after which pending access times are written on the next hit
+_TOUCH_FLUSH_INTERVAL = 60.0
+
+QUERY = "query"
+DOCUMENT = "document"
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalizes chunk text so that insignificant differences share a cache entry.
+    """
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    A persistent, content-addressed cache in front of an embeddings model.
+
+    Vectors are stored in SQLite keyed by a hash of the model name and the
+    normalized text, so identical chunks are embedded only once across uploads
+    and repeated questions reuse their query embedding. Some models embed
+    queries and documents differently, so they are cached under separate keys.
+    Lookups and writes are done in bulk, and the least recently used entries
+    are evicted once the cache grows beyond `max_entries`. The access times
+    of cache hits are written in batches, not on every lookup. When a
+    scheduled call fails part way, the batches that succeeded are still
+    stored, so a retried upload only embeds what is missing.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        model_name: str,
+        cache_path: str = Config.EMBEDDING_CACHE_PATH,
+        max_entries: int = Config.EMBEDDING_CACHE_MAX_ENTRIES,
+    ):
+        """
+        Initializes the CachedEmbeddings wrapper.
+
+        Args:
+            embeddings (Embeddings): The underlying embeddings model.
+            model_name (str): The embedding model name, part of every cache key.
+            cache_path (str): The path of the SQLite cache file.
+            max_entries (int): The maximum number of cached vectors.
+        """
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.cache_path = cache_path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # Access times of cache hits not written yet, keyed by cache key
+        self._touched: Dict[str, float] = {}
+        self._touched_since = time.monotonic()
+
+        cache_dir = os.path.dirname(os.path.abspath(cache_path))
+        os.makedirs(cache_dir, exist_ok=True)
+        self._conn = sqlite3.connect(cache_path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings(last_used)")
+        self._conn.commit()
+        self._size = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        logger.info("Embedding cache opened at %s with %s entries.", cache_path, self._size)
+
+    def _key(self, text: str, kind: str = DOCUMENT) -> str:
+        """
+        Returns the cache key for a piece of text embedded as a query or as
+        a document.
+        """
+        # Document keys are kept without the kind so existing caches stay valid
+        prefix = f"{kind}\0" if kind != DOCUMENT else ""
+        payload = f"{prefix}{self.model_name}\0{normalize_text(text)}".encode("utf-8")
+        return hashlib.sha256(payload).hexdigest()
+
+    def _flush_touched(self):
+        """
+        Writes the pending access times of cache hits. Must hold the lock.
+        """
+        if self._touched:
+            self._conn.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                [(used, key) for key, used in self._touched.items()],
+            )
+            self._touched = {}
+        self._touched_since = time.monotonic()
+
+    def _lookup(self, keys: List[str]) -> Dict[str, List[float]]:
+        """
+        Fetches the cached vectors for the given keys and marks them as used.
+        """
+        found = {}
+        now = time.time()
+        with self._lock:
+            for start in range(0, len(keys), _SQL_BATCH_SIZE):
+                batch = keys[start:start + _SQL_BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+            if found:
+                self._touched.update(dict.fromkeys(found, now))
+                if (
+                    len(self._touched) >= _TOUCH_FLUSH_SIZE
+                    or time.monotonic() - self._touched_since >= _TOUCH_FLUSH_INTERVAL
+                ):
+                    self._flush_touched()
+                    self._conn.commit()
+        return found
+
+    def _store(self, entries: Dict[str, List[float]]):
+        """
+        Writes new vectors to the cache and evicts old entries if needed.
+        """
+        if not entries:
+            return
+        now = time.time()
+        rows = [
+            (key, np.asarray(vector, dtype=np.float32).tobytes(), now)
+            for key, vector in entries.items()
+        ]
+        with self._lock:
+            # Eviction below must see the latest access times
+            self._flush_touched()
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)", rows
+            )
+            self._size += len(rows)
+            if self._size > self.max_entries:
+                self._size = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            if self._size > self.max_entries:
+                # Evict down to 90% of the limit so eviction doesn't run on every write
+                excess = self._size - int(self.max_entries * 0.9)
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE key IN "
+                    "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                    (excess,),
+                )
+                self._size -= excess
+                logger.info("Evicted %s entries from the embedding cache.", excess)
+            self._conn.commit()
+
+    def _store_completed(self, keys: List[str], error: EmbeddingSchedulerError):
+        """
+        Stores the vectors of the batches that succeeded in a failed call.
+        """
+        completed = {key: vector for key, vector in zip(keys, error.vectors) if vector is not None}
+        if completed:
+            self._store(completed)
+            logger.info("Embedding cache: kept %s vector(s) of a failed embedding call.", len(completed))
+
+    def _split(self, texts: List[str]):
+        """
+        Resolves cached texts and returns the keys, the cached vectors and the
+        unique texts that still need to be embedded.
+        """
+        keys = [self._key(text) for text in texts]
+        cached = self._lookup(list(dict.fromkeys(keys)))
+        missing = {}
+        miss_count = 0
+        for key, text in zip(keys, texts):
+            if key not in cached:
+                miss_count += 1
+                missing.setdefault(key, text)
+        self.hits += len(texts) - miss_count
+        self.misses += miss_count
+        return keys, cached, missing
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embeds documents, serving as many vectors as possible from the cache.
+
+        Args:
+            texts (List[str]): The texts to embed.
+
+        Returns:
+            List[List[float]]: One vector per input text.
+        """
+        keys, cached, missing = self._split(texts)
+        if missing:
+            try:
+                vectors = self.embeddings.embed_documents(list(missing.values()))
+            except EmbeddingSchedulerError as e:
+                self._store_completed(list(missing), e)
+                raise
+            new_entries = dict(zip(missing.keys(), vectors))
+            self._store(new_entries)
+            cached.update(new_entries)
+        logger.info(
+            "Embedding cache: embedded %s new text(s) for %s chunks, stats=%s",
+            len(missing),
+            len(texts),
+            self.stats(),
+        )
+        return [cached[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        """
+        Embeds a query, reusing the cached vector for repeated questions.
+        """
+        key = self._key(text, QUERY)
+        cached = self._lookup([key])
+        if key in cached:
+            self.hits += 1
+            return cached[key]
+        self.misses += 1
+        vector = self.embeddings.embed_query(text)
+        self._store({key: vector})
+        return vector
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Asynchronously embeds documents, serving cached vectors from SQLite.
+        """
+        loop = asyncio.get_running_loop()
+        keys, cached, missing = await loop.run_in_executor(None, self._split, texts)
+        if missing:
+            try:
+                vectors = await self.embeddings.aembed_documents(list(missing.values()))
+            except EmbeddingSchedulerError as e:
+                await loop.run_in_executor(None, self._store_completed, list(missing), e)
+                raise
+            new_entries = dict(zip(missing.keys(), vectors))
+            await loop.run_in_executor(None, self._store, new_entries)
+            cached.update(new_entries)
+        return [cached[key] for key in keys]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """
+        Asynchronously embeds a query, reusing the cached vector if present.
+        """
+        loop = asyncio.get_running_loop()
+        key = self._key(text, QUERY)
+        cached = await loop.run_in_executor(None, self._lookup, [key])
+        if key in cached:
+            self.hits += 1
+            return cached[key]
+        self.misses += 1
+        vector = await self.embeddings.aembed_query(text)
+        await loop.run_in_executor(None, self._store, {key: vector})
+        return vector
+
+    def stats(self) -> Dict[str, Optional[float]]:
+        """
+        Returns the hit/miss counters and the current number of cached vectors.
+        """
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else None,
+            "entries": self._size,
+        }
@@ -0,0 +1,448 @@
+import asyncio
+import os
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+from config import Config
+from logger.logger_config import get_logger
+from .metrics import EMBEDDING_BATCH_SIZE, span
+from .tokenizer import count_tokens
+
+logger = get_logger(__name__)
+
+
+class EmbeddingSchedulerError(RuntimeError):
+    """
+    Raised when some batches still failed after all retries.
+
+    The vectors of the batches that did succeed are carried by the error, so
+    a cache in front of the scheduler can keep them and a repeated call only
+    re-embeds the failed batches.
+    """
+
+    def __init__(
+        self,
+        message: str,
+        failed_batches: int,
+        total_batches: int,
+        vectors: Optional[List[Optional[List[float]]]] = None,
+    ):
+        super().__init__(message)
+        self.failed_batches = failed_batches
+        self.total_batches = total_batches
+        # One entry per input text, None for the texts of failed batches
+        self.vectors = vectors or []
+
+
+class RateLimiter:
+    """
+    A token-bucket limiter for requests per minute and tokens per minute.
+    """
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int):
+        """
+        Initializes the RateLimiter with full buckets.
+
+        Args:
+            requests_per_minute (int): The allowed number of requests per minute.
+            tokens_per_minute (int): The allowed number of tokens per minute.
+        """
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._requests = float(requests_per_minute)
+        self._tokens = float(tokens_per_minute)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _try_acquire(self, tokens: int) -> float:
+        """
+        Takes capacity for one request of `tokens` tokens if available.
+
+        Returns:
+            float: 0 if the capacity was taken, otherwise the seconds to wait.
+        """
+        # A single request larger than the per-minute budget must still be able to run
+        tokens = min(tokens, self.tokens_per_minute)
+        with self._lock:
+            now = time.monotonic()
+            elapsed = now - self._updated
+            self._updated = now
+            self._requests = min(self.requests_per_minute, self._requests + elapsed * self.requests_per_minute / 60)
+            self._tokens = min(self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute / 60)
+            if self._requests >= 1 and self._tokens >= tokens:
+                self._requests -= 1
+                self._tokens -= tokens
+                return 0.0
+            request_wait = max(0.0, 1 - self._requests) * 60 / self.requests_per_minute
+            token_wait = max(0.0, tokens - self._tokens) * 60 / self.tokens_per_minute
+            return max(request_wait, token_wait)
+
+    async def _atry_acquire(self, tokens: int) -> float:
+        """
+        Asynchronous counterpart of `_try_acquire`.
+        """
+        return self._try_acquire(tokens)
+
+    async def acquire(self, tokens: int):
+        """
+        Waits until one request of `tokens` tokens may be sent.
+        """
+        while True:
+            wait = await self._atry_acquire(tokens)
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    def acquire_blocking(self, tokens: int):
+        """
+        Blocks the calling thread until one request of `tokens` tokens may be sent.
+        """
+        while True:
+            wait = self._try_acquire(tokens)
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+
+class SharedRateLimiter(RateLimiter):
+    """
+    A token-bucket limiter whose buckets are stored in SQLite, so that every
+    process embedding with the same API key, i.e. the API workers and the
+    ingestion workers, draws from the same per-minute budget.
+    """
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int, db_path: str):
+        """
+        Initializes the SharedRateLimiter. The buckets start full if no
+        process created them yet.
+
+        Args:
+            requests_per_minute (int): The allowed number of requests per minute.
+            tokens_per_minute (int): The allowed number of tokens per minute.
+            db_path (str): The path of the SQLite file holding the buckets.
+        """
+        super().__init__(requests_per_minute, tokens_per_minute)
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS buckets ("
+            "id INTEGER PRIMARY KEY CHECK (id = 0), requests REAL NOT NULL, tokens REAL NOT NULL, updated REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "INSERT OR IGNORE INTO buckets (id, requests, tokens, updated) VALUES (0, ?, ?, ?)",
+            (float(requests_per_minute), float(tokens_per_minute), time.time()),
+        )
+
+    def _try_acquire(self, tokens: int) -> float:
+        tokens = min(tokens, self.tokens_per_minute)
+        with self._lock:
+            # The write lock is taken up front so two processes can't spend the same capacity
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                requests, available, updated = self._conn.execute(
+                    "SELECT requests, tokens, updated FROM buckets WHERE id = 0"
+                ).fetchone()
+                # Wall-clock time, as the buckets are shared between processes
+                now = time.time()
+                elapsed = max(0.0, now - updated)
+                requests = min(self.requests_per_minute, requests + elapsed * self.requests_per_minute / 60)
+                available = min(self.tokens_per_minute, available + elapsed * self.tokens_per_minute / 60)
+                wait = 0.0
+                if requests >= 1 and available >= tokens:
+                    requests -= 1
+                    available -= tokens
+                else:
+                    request_wait = max(0.0, 1 - requests) * 60 / self.requests_per_minute
+                    token_wait = max(0.0, tokens - available) * 60 / self.tokens_per_minute
+                    wait = max(request_wait, token_wait)
+                self._conn.execute(
+                    "UPDATE buckets SET requests = ?, tokens = ?, updated = ? WHERE id = 0", (requests, available, now)
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            return wait
+
+    async def _atry_acquire(self, tokens: int) -> float:
+        # Waiting for another process's transaction must not block the event loop
+        return await asyncio.to_thread(self._try_acquire, tokens)
+
+
+def create_rate_limiter(
+    requests_per_minute: int = Config.EMBEDDING_REQUESTS_PER_MINUTE,
+    tokens_per_minute: int = Config.EMBEDDING_TOKENS_PER_MINUTE,
+    db_path: Optional[str] = Config.EMBEDDING_RATE_LIMIT_PATH,
+) -> RateLimiter:
+    """
+    Creates the rate limiter of the embeddings API, shared between processes
+    through `db_path` unless it is None.
+
+    Args:
+        requests_per_minute (int): The allowed number of requests per minute.
+        tokens_per_minute (int): The allowed number of tokens per minute.
+        db_path (Optional[str]): The path of the SQLite file holding the
+            shared buckets, None for limits of this process only.
+
+    Returns:
+        RateLimiter: The rate limiter.
+    """
+    if db_path is None:
+        return RateLimiter(requests_per_minute, tokens_per_minute)
+    return SharedRateLimiter(requests_per_minute, tokens_per_minute, db_path)
+
+
+def _is_retryable(error: Exception) -> bool:
+    """
+    Returns True for throttling, server-side and connection errors.
+    """
+    status = getattr(error, "status_code", None)
+    if status is None and getattr(error, "response", None) is not None:
+        status = getattr(error.response, "status_code", None)
+    if status is not None:
+        return status == 429 or status >= 500
+    name = type(error).__name__
+    return isinstance(error, (ConnectionError, TimeoutError)) or "Connection" in name or "Timeout" in name
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    """
+    Returns the server-requested delay in seconds, if the error carries one.
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+class ScheduledEmbeddings(Embeddings):
+    """
+    Embeds documents in token-budgeted batches with bounded concurrency.
+
+    Batches are sent concurrently under requests/min and tokens/min limits
+    and retried with exponential backoff on 429/5xx and connection errors.
+    `max_concurrency` bounds the requests in flight; synchronous calls share
+    the bound, so several threads may embed at once, e.g. to pipeline
+    ingestion batches. If some batches still fail, the vectors of the others are
+    returned with the error for a cache to keep, see `CachedEmbeddings`.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        max_batch_tokens: int = Config.EMBEDDING_BATCH_MAX_TOKENS,
+        max_batch_size: int = Config.EMBEDDING_BATCH_MAX_SIZE,
+        max_concurrency: int = Config.EMBEDDING_MAX_CONCURRENCY,
+        requests_per_minute: int = Config.EMBEDDING_REQUESTS_PER_MINUTE,
+        tokens_per_minute: int = Config.EMBEDDING_TOKENS_PER_MINUTE,
+        max_retries: int = Config.EMBEDDING_MAX_RETRIES,
+        retry_base_delay: float = Config.EMBEDDING_RETRY_BASE_DELAY,
+        rate_limiter: Optional[RateLimiter] = None,
+    ):
+        """
+        Initializes the ScheduledEmbeddings wrapper.
+
+        Args:
+            embeddings (Embeddings): The underlying embeddings client.
+            max_batch_tokens (int): The token budget of a single request.
+            max_batch_size (int): The maximum number of inputs per request.
+            max_concurrency (int): The number of requests in flight at once.
+            requests_per_minute (int): The request rate limit.
+            tokens_per_minute (int): The token rate limit.
+            max_retries (int): Retries per batch on retryable errors.
+            retry_base_delay (float): The first retry delay in seconds.
+            rate_limiter (Optional[RateLimiter]): The limiter of the requests.
+                One is created by `create_rate_limiter` if not provided.
+        """
+        self.embeddings = embeddings
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.rate_limiter = (
+            rate_limiter if rate_limiter is not None else create_rate_limiter(requests_per_minute, tokens_per_minute)
+        )
+        # Bounds the synchronous requests in flight across concurrent calls
+        self._request_slots = threading.BoundedSemaphore(max_concurrency)
+
+    def _make_batches(self, texts: List[str]):
+        """
+        Splits texts into batches that respect the token and size budgets.
+
+        Returns:
+            list: (start index, texts, token count) for every batch.
+        """
+        batches = []
+        start, batch, batch_tokens = 0, [], 0
+        for i, text in enumerate(texts):
+            tokens = count_tokens(text)
+            if batch and (batch_tokens + tokens > self.max_batch_tokens or len(batch) >= self.max_batch_size):
+                batches.append((start, batch, batch_tokens))
+                start, batch, batch_tokens = i, [], 0
+            batch.append(text)
+            batch_tokens += tokens
+        if batch:
+            batches.append((start, batch, batch_tokens))
+        return batches
+
+    def _retry_delay(self, error: Exception, attempt: int) -> Optional[float]:
+        """
+        Returns the delay before the next attempt, or None if the error must
+        be raised.
+        """
+        if attempt >= self.max_retries or not _is_retryable(error):
+            return None
+        delay = _retry_after(error) or self.retry_base_delay * (2 ** attempt)
+        delay *= 1 + random.random() * 0.25
+        logger.warning(
+            "Embedding request failed (%s), retry %s/%s in %.2fs.",
+            type(error).__name__,
+            attempt + 1,
+            self.max_retries,
+            delay,
+        )
+        return delay
+
+    async def _with_retries(self, tokens: int, call):
+        """
+        Runs one rate-limited request, retrying retryable errors with backoff.
+        """
+        attempt = 0
+        while True:
+            await self.rate_limiter.acquire(tokens)
+            try:
+                return await call()
+            except Exception as e:
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                attempt += 1
+                await asyncio.sleep(delay)
+
+    def _with_retries_blocking(self, tokens: int, call):
+        """
+        Synchronous counterpart of `_with_retries`.
+        """
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire_blocking(tokens)
+            try:
+                return call()
+            except Exception as e:
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                attempt += 1
+                time.sleep(delay)
+
+    def _collect(self, texts: List[str], batches, outcomes) -> List[List[float]]:
+        """
+        Assembles the per-batch outcomes into one vector per text.
+
+        Raises:
+            EmbeddingSchedulerError: If any batch failed, with the vectors of
+                the batches that succeeded.
+        """
+        errors = [outcome for outcome in outcomes if isinstance(outcome, BaseException)]
+        if errors:
+            logger.error("%s of %s embedding batches failed: %s", len(errors), len(batches), errors[0])
+            vectors = []
+            for (_, batch, _), outcome in zip(batches, outcomes):
+                vectors.extend([None] * len(batch) if isinstance(outcome, BaseException) else outcome)
+            raise EmbeddingSchedulerError(
+                f"{len(errors)} of {len(batches)} embedding batches failed: {errors[0]}",
+                failed_batches=len(errors),
+                total_batches=len(batches),
+                vectors=vectors,
+            ) from errors[0]
+
+        results = [vector for outcome in outcomes for vector in outcome]
+        logger.info("Embedded %s texts in %s batch(es).", len(texts), len(batches))
+        return results
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embeds documents in concurrent, rate-limited batches.
+
+        Args:
+            texts (List[str]): The texts to embed.
+
+        Returns:
+            List[List[float]]: One vector per input text.
+
+        Raises:
+            EmbeddingSchedulerError: If some batches failed after all retries.
+        """
+        batches = self._make_batches(texts)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def run_batch(batch: List[str], tokens: int) -> List[List[float]]:
+            EMBEDDING_BATCH_SIZE.observe(len(batch))
+            async with semaphore:
+                with span("embedding_request"):
+                    return await self._with_retries(tokens, lambda: self.embeddings.aembed_documents(batch))
+
+        outcomes = await asyncio.gather(
+            *(run_batch(batch, tokens) for _, batch, tokens in batches), return_exceptions=True
+        )
+        return self._collect(texts, batches, outcomes)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embeds documents in rate-limited batches on a bounded thread pool.
+
+        Args:
+            texts (List[str]): The texts to embed.
+
+        Returns:
+            List[List[float]]: One vector per input text.
+
+        Raises:
+            EmbeddingSchedulerError: If some batches failed after all retries.
+        """
+        batches = self._make_batches(texts)
+
+        def run_batch(batch: List[str], tokens: int) -> List[List[float]]:
+            EMBEDDING_BATCH_SIZE.observe(len(batch))
+            with self._request_slots, span("embedding_request"):
+                return self._with_retries_blocking(tokens, lambda: self.embeddings.embed_documents(batch))
+
+        def run_safely(batch: List[str], tokens: int):
+            try:
+                return run_batch(batch, tokens)
+            except Exception as e:
+                return e
+
+        if len(batches) == 1:
+            outcomes = [run_safely(batches[0][1], batches[0][2])]
+        else:
+            with ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="embed") as executor:
+                outcomes = list(executor.map(lambda b: run_safely(b[1], b[2]), batches))
+        return self._collect(texts, batches, outcomes)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """
+        Embeds a single query under the same rate limits and retries.
+        """
+        return await self._with_retries(count_tokens(text), lambda: self.embeddings.aembed_query(text))
+
+    def embed_query(self, text: str) -> List[float]:
+        """
+        Synchronous counterpart of `aembed_query`.
+        """
+        return self._with_retries_blocking(count_tokens(text), lambda: self.embeddings.embed_query(text))
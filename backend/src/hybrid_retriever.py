@@ -0,0 +1,134 @@
+import asyncio
+from typing import Dict, List, Optional, Sequence
+
+from langchain.docstore.document import Document
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.retrievers import BaseRetriever
+from pydantic import ConfigDict
+
+from config import Config
+from .metadata_index import MetadataFilter
+from .segmented_index import SegmentedIndex
+
+HYBRID = "hybrid"
+LEXICAL = "lexical"
+
+
+def _document_key(document: Document) -> tuple:
+    """
+    Identifies a chunk across result lists. Hits of the two searches are
+    separate Document objects, so they are matched by content.
+    """
+    metadata = document.metadata
+    return (metadata.get("doc_id"), metadata.get("source"), metadata.get("page"), document.page_content)
+
+
+def reciprocal_rank_fusion(result_lists: Sequence[List[Document]], k: int, rrf_k: int = Config.HYBRID_RRF_K) -> List[Document]:
+    """
+    Merges ranked result lists by reciprocal rank fusion: every document
+    scores the sum of 1 / (rrf_k + rank) over the lists it appears in.
+
+    Args:
+        result_lists (Sequence[List[Document]]): Ranked results, best first.
+        k (int): The number of documents to return.
+        rrf_k (int): The fusion constant.
+
+    Returns:
+        List[Document]: The `k` best documents, best first.
+    """
+    scores: Dict[tuple, float] = {}
+    documents: Dict[tuple, Document] = {}
+    for results in result_lists:
+        for rank, document in enumerate(results, start=1):
+            key = _document_key(document)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank)
+            documents.setdefault(key, document)
+    ranked = sorted(scores, key=scores.get, reverse=True)
+    return [documents[key] for key in ranked[:k]]
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Retrieves chunks from a SegmentedIndex by combining vector and BM25 search.
+
+    In "hybrid" mode both searches run and their results are merged with
+    reciprocal rank fusion, so exact terms such as part numbers are found
+    even when their embeddings are not close to the query's. In "lexical"
+    mode only BM25 runs, which needs no embedding call.
+    """
+
+    index: SegmentedIndex
+    mode: str = HYBRID
+    k: int = 4
+    fetch_k: int = Config.HYBRID_FETCH_K
+    rrf_k: int = Config.HYBRID_RRF_K
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    def _get_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: CallbackManagerForRetrieverRun,
+        filter: Optional[MetadataFilter] = None,
+    ) -> List[Document]:
+        if self.mode == LEXICAL:
+            return self.index.lexical_search(query, k=self.k, filter=filter)
+        fetch_k = max(self.fetch_k, self.k)
+        return reciprocal_rank_fusion(
+            [
+                self.index.similarity_search(query, k=fetch_k, filter=filter),
+                self.index.lexical_search(query, k=fetch_k, filter=filter),
+            ],
+            self.k,
+            self.rrf_k,
+        )
+
+    async def _aget_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: AsyncCallbackManagerForRetrieverRun,
+        filter: Optional[MetadataFilter] = None,
+    ) -> List[Document]:
+        loop = asyncio.get_running_loop()
+        if self.mode == LEXICAL:
+            return await loop.run_in_executor(None, lambda: self.index.lexical_search(query, k=self.k, filter=filter))
+        fetch_k = max(self.fetch_k, self.k)
+        # BM25 runs in a thread while the query embedding is requested
+        vector_results, lexical_results = await asyncio.gather(
+            self.index.asimilarity_search(query, k=fetch_k, filter=filter),
+            loop.run_in_executor(None, lambda: self.index.lexical_search(query, k=fetch_k, filter=filter)),
+        )
+        return reciprocal_rank_fusion([vector_results, lexical_results], self.k, self.rrf_k)
+
+    def retrieve_batch(
+        self,
+        queries: List[str],
+        embeddings: Optional[List[List[float]]] = None,
+        filter: Optional[MetadataFilter] = None,
+    ) -> List[List[Document]]:
+        """
+        Retrieves documents for many queries, searching all query vectors
+        with one batched search per segment.
+
+        Args:
+            queries (List[str]): The query texts.
+            embeddings (Optional[List[List[float]]]): The query vectors, in the
+                same order. Not needed in "lexical" mode.
+            filter (Optional[MetadataFilter]): Restricts the search of every
+                query to the chunks matching it.
+
+        Returns:
+            List[List[Document]]: The documents of each query.
+        """
+        if self.mode == LEXICAL:
+            return [self.index.lexical_search(query, k=self.k, filter=filter) for query in queries]
+        fetch_k = max(self.fetch_k, self.k)
+        vector_results = self.index.similarity_search_by_vectors(embeddings, k=fetch_k, filter=filter)
+        return [
+            reciprocal_rank_fusion(
+                [vector, self.index.lexical_search(query, k=fetch_k, filter=filter)], self.k, self.rrf_k
+            )
+            for query, vector in zip(queries, vector_results)
+        ]
@@ -0,0 +1,192 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, Optional
+
+from config import Config
+from logger.logger_config import get_logger
+
+logger = get_logger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+# Job kinds
+INGEST = "ingest"
+COMPACT = "compact"
+
+
+class JobStore:
+    """
+    A class to persist ingestion jobs and their progress in SQLite.
+
+    The store is shared by the API, which creates jobs and reports their
+    status, and the ingestion workers, which claim queued jobs one at a time.
+    Besides ingesting uploads, jobs compact an index, so that work stays out
+    of the API workers too.
+    Because the state lives on disk, queued jobs and their history survive
+    restarts, and jobs whose worker stopped sending heartbeats are re-queued.
+    """
+
+    def __init__(self, db_path: str = Config.JOB_DB_PATH):
+        """
+        Initializes the JobStore and creates its table if needed.
+
+        Args:
+            db_path (str): The path of the SQLite database file.
+        """
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, status TEXT NOT NULL, upload_dir TEXT NOT NULL, index_path TEXT NOT NULL, "
+            "files TEXT NOT NULL, progress TEXT NOT NULL, result TEXT, error TEXT, attempts INTEGER NOT NULL, "
+            "worker TEXT, created_at REAL NOT NULL, started_at REAL, finished_at REAL, heartbeat_at REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status, created_at)")
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        if "kind" not in columns:
+            # Databases created before compaction jobs only hold ingestion jobs
+            self._conn.execute(f"ALTER TABLE jobs ADD COLUMN kind TEXT NOT NULL DEFAULT '{INGEST}'")
+
+    @staticmethod
+    def _to_dict(row: Optional[sqlite3.Row]) -> Optional[Dict[str, Any]]:
+        if row is None:
+            return None
+        job = dict(row)
+        for field in ("files", "progress", "result"):
+            job[field] = json.loads(job[field]) if job[field] else None
+        return job
+
+    def create(
+        self, upload_dir: str, index_path: str, files: list, job_id: Optional[str] = None, kind: str = INGEST
+    ) -> Dict[str, Any]:
+        """
+        Queues a new job.
+
+        Args:
+            upload_dir (str): The staging directory holding the job's files.
+            index_path (str): The index the files are added to.
+            files (list): The names of the uploaded files.
+            job_id (Optional[str]): The job ID. A new one is generated if omitted.
+            kind (str): INGEST or COMPACT.
+
+        Returns:
+            dict: The created job.
+        """
+        job_id = job_id or uuid.uuid4().hex
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, kind, status, upload_dir, index_path, files, progress, attempts, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, 0, ?)",
+                (job_id, kind, QUEUED, upload_dir, index_path, json.dumps(files), json.dumps({}), time.time()),
+            )
+        return self.get(job_id)
+
+    def create_compaction(self, index_path: str) -> Dict[str, Any]:
+        """
+        Queues a compaction of an index, unless one is already queued: it
+        will see every change published before it runs.
+
+        Args:
+            index_path (str): The index to compact.
+
+        Returns:
+            dict: The queued compaction job.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id FROM jobs WHERE kind = ? AND status = ? AND index_path = ?",
+                (COMPACT, QUEUED, index_path),
+            ).fetchone()
+        if row is not None:
+            return self.get(row["id"])
+        return self.create("", index_path, [], kind=COMPACT)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Returns a job by ID, or None if it doesn't exist.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row)
+
+    def claim_next(self, worker_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Atomically marks the oldest queued job as running for `worker_id`.
+
+        Returns:
+            Optional[dict]: The claimed job, or None if the queue is empty.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "UPDATE jobs SET status = ?, worker = ?, started_at = ?, heartbeat_at = ?, attempts = attempts + 1 "
+                "WHERE id = (SELECT id FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1) "
+                "RETURNING *",
+                (RUNNING, worker_id, now, now, QUEUED),
+            ).fetchone()
+        return self._to_dict(row)
+
+    def update_progress(self, job_id: str, progress: Dict[str, Any]):
+        """
+        Records the latest progress of a running job. Also acts as a heartbeat.
+        """
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET progress = ?, heartbeat_at = ? WHERE id = ?",
+                (json.dumps(progress), time.time(), job_id),
+            )
+
+    def heartbeat(self, job_id: str):
+        """
+        Marks a running job as still alive.
+        """
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET heartbeat_at = ? WHERE id = ?", (time.time(), job_id))
+
+    def finish(self, job_id: str, result: Optional[Dict[str, Any]] = None, error: Optional[str] = None):
+        """
+        Marks a job as succeeded, or as failed if `error` is given.
+        """
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE id = ?",
+                (FAILED if error else SUCCEEDED, json.dumps(result) if result else None, error, time.time(), job_id),
+            )
+
+    def requeue_stale(
+        self,
+        stale_after: float = Config.JOB_STALE_AFTER,
+        max_attempts: int = Config.JOB_MAX_ATTEMPTS,
+    ) -> int:
+        """
+        Re-queues running jobs whose worker stopped sending heartbeats, e.g.
+        because the process was restarted, and fails jobs that ran out of attempts.
+
+        Returns:
+            int: The number of jobs that were re-queued.
+        """
+        cutoff = time.time() - stale_after
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished_at = ? "
+                "WHERE status = ? AND heartbeat_at < ? AND attempts >= ?",
+                (FAILED, "Worker stopped while processing the job.", time.time(), RUNNING, cutoff, max_attempts),
+            )
+            requeued = self._conn.execute(
+                "UPDATE jobs SET status = ?, worker = NULL WHERE status = ? AND heartbeat_at < ?",
+                (QUEUED, RUNNING, cutoff),
+            ).rowcount
+        if requeued:
+            logger.warning("Re-queued %s ingestion job(s) abandoned by their worker.", requeued)
+        return requeued
@@ -0,0 +1,220 @@
+import json
+import math
+import os
+import re
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from config import Config
+
+TERMS_FILE = "bm25.terms.json"
+OFFSETS_FILE = "bm25.offsets.npy"
+DOCS_FILE = "bm25.docs.npy"
+FREQS_FILE = "bm25.freqs.npy"
+LENGTHS_FILE = "bm25.lengths.npy"
+
+# Words, numbers and identifiers such as "PN-00042", "v1.2" or "ISO_9001"
+_TOKEN_PATTERN = re.compile(r"\w+(?:[-./]\w+)*")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Splits text into lowercase terms. Identifiers joined by "-", ".", "/" or
+    "_" are kept as single terms, so part numbers match exactly.
+    """
+    return _TOKEN_PATTERN.findall(text.lower())
+
+
+def bm25_idf(document_frequency: int, document_count: int) -> float:
+    """
+    Returns the BM25 inverse document frequency of a term.
+    """
+    return math.log(1 + (document_count - document_frequency + 0.5) / (document_frequency + 0.5))
+
+
+class LexicalIndexWriter:
+    """
+    Builds the BM25 inverted index of a segment, one chunk at a time.
+
+    Chunks must be added in vector position order, so that posting entries
+    are the same positions as in the FAISS index and the chunk store.
+    """
+
+    def __init__(self):
+        # term -> (chunk positions, term frequencies)
+        self._postings: Dict[str, Tuple[array, array]] = {}
+        self._lengths = array("I")
+
+    def add(self, text: str):
+        """
+        Adds the next chunk to the index.
+        """
+        position = len(self._lengths)
+        counts = Counter(tokenize(text))
+        for term, count in counts.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = (array("I"), array("H"))
+            postings[0].append(position)
+            postings[1].append(min(count, 0xFFFF))
+        self._lengths.append(sum(counts.values()))
+
+    def _arrays(self) -> Tuple[List[str], Dict[str, np.ndarray]]:
+        """
+        Returns the sorted term list and the flat posting arrays, by file name.
+        """
+        terms = sorted(self._postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.uint64)
+        for i, term in enumerate(terms):
+            offsets[i + 1] = offsets[i] + len(self._postings[term][0])
+        docs = np.empty(int(offsets[-1]), dtype=np.uint32)
+        freqs = np.empty(int(offsets[-1]), dtype=np.uint16)
+        for i, term in enumerate(terms):
+            start, end = int(offsets[i]), int(offsets[i + 1])
+            docs[start:end] = self._postings[term][0]
+            freqs[start:end] = self._postings[term][1]
+        return terms, {
+            OFFSETS_FILE: offsets,
+            DOCS_FILE: docs,
+            FREQS_FILE: freqs,
+            LENGTHS_FILE: np.frombuffer(self._lengths, dtype=np.uint32),
+        }
+
+    def write(self, directory: str):
+        """
+        Writes the index as a sorted term list and flat posting arrays.
+        """
+        terms, arrays = self._arrays()
+        with open(os.path.join(directory, TERMS_FILE), "w", encoding="utf-8") as f:
+            json.dump(terms, f, ensure_ascii=False)
+        for name, values in arrays.items():
+            np.save(os.path.join(directory, name), values)
+
+    def build(self) -> "LexicalIndex":
+        """
+        Returns the index in memory, for segments that were written without one.
+        """
+        return LexicalIndex(*self._arrays())
+
+
+class LexicalIndex:
+    """
+    A read-only BM25 inverted index of one segment.
+
+    The posting and chunk length arrays are memory-mapped; only the term
+    dictionary is held in memory. Scores use collection statistics passed
+    in by the caller, so hits from different segments are comparable.
+    """
+
+    def __init__(self, terms: List[str], arrays: Dict[str, np.ndarray]):
+        """
+        Initializes the LexicalIndex. Use `open` to read a segment's index.
+
+        Args:
+            terms (List[str]): The indexed terms, sorted.
+            arrays (Dict[str, np.ndarray]): The posting and chunk length
+                arrays, by file name.
+        """
+        self._term_ids = {term: i for i, term in enumerate(terms)}
+        self._offsets = arrays[OFFSETS_FILE]
+        self._docs = arrays[DOCS_FILE]
+        self._freqs = arrays[FREQS_FILE]
+        self._lengths = arrays[LENGTHS_FILE]
+        self.document_count = len(self._lengths)
+        self.total_length = int(self._lengths.sum(dtype=np.uint64))
+
+    @classmethod
+    def open(cls, directory: str) -> "LexicalIndex":
+        """
+        Opens the inverted index of a segment directory.
+
+        Args:
+            directory (str): The directory the index was written to.
+        """
+        with open(os.path.join(directory, TERMS_FILE), "r", encoding="utf-8") as f:
+            terms = json.load(f)
+        arrays = {
+            name: np.load(os.path.join(directory, name), mmap_mode="r")
+            for name in (OFFSETS_FILE, DOCS_FILE, FREQS_FILE, LENGTHS_FILE)
+        }
+        return cls(terms, arrays)
+
+    @classmethod
+    def from_texts(cls, texts: Iterable[str]) -> "LexicalIndex":
+        """
+        Builds the index of chunk texts given in vector position order.
+        """
+        writer = LexicalIndexWriter()
+        for text in texts:
+            writer.add(text)
+        return writer.build()
+
+    @staticmethod
+    def exists(directory: str) -> bool:
+        """
+        Returns True if `directory` holds an inverted index.
+        """
+        return os.path.exists(os.path.join(directory, TERMS_FILE))
+
+    def _postings(self, term: str):
+        term_id = self._term_ids.get(term)
+        if term_id is None:
+            return None
+        start, end = int(self._offsets[term_id]), int(self._offsets[term_id + 1])
+        return self._docs[start:end], self._freqs[start:end]
+
+    def document_frequency(self, term: str) -> int:
+        """
+        Returns the number of chunks of this segment that contain `term`.
+        """
+        term_id = self._term_ids.get(term)
+        return 0 if term_id is None else int(self._offsets[term_id + 1] - self._offsets[term_id])
+
+    def top(
+        self,
+        idf: Dict[str, float],
+        average_length: float,
+        k: int,
+        k1: float = Config.BM25_K1,
+        b: float = Config.BM25_B,
+        positions: Optional[np.ndarray] = None,
+    ) -> List[Tuple[int, float]]:
+        """
+        Returns the `k` best-scoring chunk positions for the query terms.
+
+        Args:
+            idf (Dict[str, float]): The query terms with their collection-wide IDF.
+            average_length (float): The collection-wide average chunk length.
+            k (int): The number of hits to return.
+            k1 (float): The BM25 term frequency saturation.
+            b (float): The BM25 length normalization.
+            positions (Optional[np.ndarray]): The chunk positions that may be
+                returned, None for all.
+
+        Returns:
+            List[Tuple[int, float]]: Chunk positions with their scores, best first.
+        """
+        scores = None
+        for term, term_idf in idf.items():
+            postings = self._postings(term)
+            if postings is None:
+                continue
+            docs, freqs = postings
+            freqs = freqs.astype(np.float32)
+            norm = k1 * (1 - b + b * self._lengths[docs] / average_length)
+            if scores is None:
+                scores = np.zeros(self.document_count, dtype=np.float32)
+            scores[docs] += term_idf * freqs * (k1 + 1) / (freqs + norm)
+        if scores is None:
+            return []
+        if positions is None:
+            candidates = np.flatnonzero(scores)
+        else:
+            candidates = positions[scores[positions] > 0]
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [(int(position), float(scores[position])) for position in candidates]
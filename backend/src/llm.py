@@ -1,43 +1,44 @@
-from langchain_openai import ChatOpenAI
 from config import Config
+from .providers import create_chat_model
 
-from logger.logger_config import logger
+from logger.logger_config import get_logger
+
+logger = get_logger(__name__)
 
 class LLM:
     """
     A class to handle the loading of the language model.
     """
 
-    def __init__(self, model_name=Config.LLM_MODEL_NAME, temperature=Config.LLM_TEMPERATURE):
+    def __init__(self, model_name=Config.LLM_MODEL_NAME, temperature=Config.LLM_TEMPERATURE, provider=Config.LLM_PROVIDER):
         """
         Initializes the LLM with the model name and temperature.
 
         Args:
-            model_name (str): The name of the OpenAI model to use.
+            model_name (str): The name of the model to use.
             temperature (float): The temperature for the model's output.
+            provider (str): The provider of the model, see `src.providers`.
         """
         self.model_name = model_name
         self.temperature = temperature
+        self.provider = provider
 
     def load(self):
         """
-        Loads the OpenAI model.
+        Loads the model of the configured provider.
 
         Returns:
-            ChatOpenAI: The loaded language model instance.
+            BaseChatModel: The loaded language model instance.
         
         Raises:
             RuntimeError: If the model cannot be loaded.
         """
         try:
             logger.info("Loading LLM.")
-            llm = ChatOpenAI(
-                model=self.model_name,
-                temperature=self.temperature
-            )
+            llm = create_chat_model(self.provider, self.model_name, self.temperature)
             logger.info("LLM loaded successfully.")
             return llm
         except Exception as e:
-            logger.error(f"Error loading LLM: {e}")
+            logger.error("Error loading LLM: %s", e)
             # This is a critical error, so we raise it
             raise RuntimeError("Could not load the language model. Ensure the model name is correct") from e
@@ -0,0 +1,205 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, List, Tuple
+
+from langchain_core.embeddings import Embeddings
+
+from config import Config
+from logger.logger_config import get_logger
+from .metrics import EMBEDDING_BATCH_SIZE
+
+logger = get_logger(__name__)
+
+
+class MicroBatcher:
+    """
+    Merges texts submitted concurrently into one call of an encode function.
+
+    The first text of a batch waits at most `window` seconds for others to
+    join it, and a batch is run as soon as it holds `max_batch_size` texts.
+    Batches are encoded one at a time by a background thread, so callers on
+    any thread or event loop share the model's forward passes, and texts
+    submitted while a batch is being encoded form the next one.
+    """
+
+    def __init__(
+        self,
+        encode: Callable[[List[str]], List[List[float]]],
+        window: float = Config.LOCAL_EMBEDDING_BATCH_WINDOW,
+        max_batch_size: int = Config.LOCAL_EMBEDDING_MAX_BATCH_SIZE,
+    ):
+        """
+        Initializes the MicroBatcher.
+
+        Args:
+            encode (Callable): Returns the vectors of a list of texts.
+            window (float): The seconds a text waits for others to join its
+                batch.
+            max_batch_size (int): The maximum number of texts per call of
+                `encode`.
+        """
+        self.encode = encode
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self._pending: List[Tuple[str, Future, float]] = []
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def _ensure_thread(self):
+        """
+        Starts the background thread on first use. Must hold the condition.
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="embedding-microbatcher", daemon=True)
+            self._thread.start()
+
+    def _next_batch(self) -> List[Tuple[str, Future, float]]:
+        """
+        Waits for the next batch to be full or for its window to end, and
+        takes it off the queue.
+        """
+        with self._condition:
+            while not self._pending:
+                self._condition.wait()
+            deadline = self._pending[0][2] + self.window
+            while len(self._pending) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            batch = self._pending[:self.max_batch_size]
+            del self._pending[:self.max_batch_size]
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            # Callers that gave up, e.g. cancelled requests, don't need a vector
+            batch = [item for item in batch if item[1].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            EMBEDDING_BATCH_SIZE.observe(len(batch))
+            try:
+                vectors = self.encode([text for text, _, _ in batch])
+            except Exception as e:
+                logger.error("Error embedding a batch of %s queries: %s", len(batch), e)
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future, _), vector in zip(batch, vectors):
+                future.set_result(vector)
+
+    def submit(self, text: str) -> Future:
+        """
+        Queues a text for the next batch.
+
+        Args:
+            text (str): The text to embed.
+
+        Returns:
+            Future: Resolves to the vector of the text.
+        """
+        future = Future()
+        with self._condition:
+            self._ensure_thread()
+            self._pending.append((text, future, time.perf_counter()))
+            self._condition.notify()
+        return future
+
+    def embed(self, text: str) -> List[float]:
+        """
+        Returns the vector of a text, blocking until its batch is encoded.
+        """
+        return self.submit(text).result()
+
+    async def aembed(self, text: str) -> List[float]:
+        """
+        Returns the vector of a text without blocking the event loop.
+        """
+        return await asyncio.wrap_future(self.submit(text))
+
+
+class MicroBatchingEmbeddings(Embeddings):
+    """
+    Embeddings computed in this process by an encode function.
+
+    Queries are embedded through a `MicroBatcher`, so concurrent questions
+    share one forward pass instead of queueing for one pass each. Documents
+    arrive in large batches already and are encoded directly, in batches of
+    `document_batch_size`.
+    """
+
+    def __init__(
+        self,
+        encode: Callable[[List[str]], List[List[float]]],
+        window: float = Config.LOCAL_EMBEDDING_BATCH_WINDOW,
+        max_batch_size: int = Config.LOCAL_EMBEDDING_MAX_BATCH_SIZE,
+        document_batch_size: int = Config.LOCAL_EMBEDDING_DOCUMENT_BATCH_SIZE,
+    ):
+        """
+        Initializes the MicroBatchingEmbeddings.
+
+        Args:
+            encode (Callable): Returns the vectors of a list of texts.
+            window (float): The seconds a query waits for others to share
+                its forward pass.
+            max_batch_size (int): The maximum number of queries per forward
+                pass.
+            document_batch_size (int): The number of documents per forward
+                pass.
+        """
+        self.encode = encode
+        self.document_batch_size = document_batch_size
+        self.batcher = MicroBatcher(encode, window=window, max_batch_size=max_batch_size)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = []
+        for start in range(0, len(texts), self.document_batch_size):
+            batch = texts[start:start + self.document_batch_size]
+            EMBEDDING_BATCH_SIZE.observe(len(batch))
+            vectors.extend(self.encode(batch))
+        return vectors
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        # Forward passes hold the CPU, keep them off the event loop
+        return await asyncio.to_thread(self.embed_documents, texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.batcher.embed(text)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await self.batcher.aembed(text)
+
+
+class LocalEmbeddings(MicroBatchingEmbeddings):
+    """
+    Embeddings from a sentence-transformers model run in this process on the
+    CPU, which saves questions the round trip to a remote embeddings API.
+    """
+
+    def __init__(self, model_name: str = Config.EMBEDDING_MODEL_NAME, **kwargs):
+        """
+        Initializes the LocalEmbeddings and loads the model.
+
+        Args:
+            model_name (str): The name or path of the sentence-transformers
+                model.
+            **kwargs: The batching settings of `MicroBatchingEmbeddings`.
+
+        Raises:
+            ImportError: If sentence-transformers is not installed.
+        """
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name, device="cpu")
+        super().__init__(self._encode, **kwargs)
+
+    def _encode(self, texts: List[str]) -> List[List[float]]:
+        """
+        Runs one forward pass over the texts.
+        """
+        vectors = self.model.encode(
+            texts, batch_size=len(texts), normalize_embeddings=True, convert_to_numpy=True, show_progress_bar=False
+        )
+        return vectors.tolist()
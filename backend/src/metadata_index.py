@@ -0,0 +1,285 @@
+import json
+import math
+import os
+from array import array
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+NAMES_FILE = "meta.names.json"
+SOURCES_FILE = "meta.sources.npy"
+SOURCE_ORDER_FILE = "meta.source_order.npy"
+SOURCE_OFFSETS_FILE = "meta.source_offsets.npy"
+PAGES_FILE = "meta.pages.npy"
+UPLOADED_AT_FILE = "meta.uploaded_at.npy"
+DOCS_FILE = "meta.docs.npy"
+PARENTS_FILE = "meta.parents.npy"
+PARENT_ORDER_FILE = "meta.parent_order.npy"
+PARENT_OFFSETS_FILE = "meta.parent_offsets.npy"
+
+# Stored for chunks without a page or a document ID
+_MISSING = -1
+
+
+@dataclass(frozen=True)
+class MetadataFilter:
+    """
+    Restricts a search to the chunks whose metadata matches every condition
+    that is set. Chunks without the metadata a condition tests never match it.
+    """
+    sources: Optional[Tuple[str, ...]] = None  # File names or full source paths
+    page_min: Optional[int] = None  # First page, inclusive, numbered from 0 as in the `page` metadata
+    page_max: Optional[int] = None  # Last page, inclusive
+    uploaded_after: Optional[float] = None  # Unix time, inclusive
+    uploaded_before: Optional[float] = None  # Unix time, exclusive
+
+    def is_empty(self) -> bool:
+        return (
+            self.sources is None
+            and self.page_min is None
+            and self.page_max is None
+            and self.uploaded_after is None
+            and self.uploaded_before is None
+        )
+
+
+class MetadataIndexWriter:
+    """
+    Builds the metadata index of a segment, one chunk at a time.
+
+    Chunks must be added in vector position order, so that the stored
+    positions are the same as in the FAISS index and the chunk store.
+    """
+
+    def __init__(self):
+        self._source_codes: Dict[str, int] = {}
+        self._doc_codes: Dict[str, int] = {}
+        self._parent_codes: Dict[str, int] = {}
+        self._sources = array("i")
+        self._pages = array("i")
+        self._uploaded_at = array("d")
+        self._docs = array("i")
+        self._parents = array("i")
+
+    @staticmethod
+    def _code(codes: Dict[str, int], value) -> int:
+        if value is None:
+            return _MISSING
+        return codes.setdefault(str(value), len(codes))
+
+    def add(self, metadata: Dict[str, Any]):
+        """
+        Adds the metadata of the next chunk to the index.
+        """
+        self._sources.append(self._code(self._source_codes, metadata.get("source")))
+        self._docs.append(self._code(self._doc_codes, metadata.get("doc_id")))
+        self._parents.append(self._code(self._parent_codes, metadata.get("parent_id")))
+        page = metadata.get("page")
+        self._pages.append(int(page) if isinstance(page, (int, float)) and page >= 0 else _MISSING)
+        uploaded_at = metadata.get("uploaded_at")
+        self._uploaded_at.append(float(uploaded_at) if isinstance(uploaded_at, (int, float)) else math.nan)
+
+    @staticmethod
+    def _grouped(values: array, count: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Returns the codes of every chunk, the chunk positions sorted by code
+        and the offsets of each code's positions, starting with the chunks
+        without a value, stored as -1.
+        """
+        codes = np.frombuffer(values, dtype=np.int32) if values else np.empty(0, dtype=np.int32)
+        order = np.argsort(codes, kind="stable").astype(np.uint32)
+        offsets = np.searchsorted(codes[order], np.arange(-1, count + 1)).astype(np.uint64)
+        return codes, order, offsets
+
+    def _arrays(self) -> Dict[str, np.ndarray]:
+        # Chunk positions grouped by source, so a source filter reads only its
+        # own chunks, and by parent section, to expand a chunk to its section
+        sources, source_order, source_offsets = self._grouped(self._sources, len(self._source_codes))
+        parents, parent_order, parent_offsets = self._grouped(self._parents, len(self._parent_codes))
+        return {
+            SOURCES_FILE: sources,
+            SOURCE_ORDER_FILE: source_order,
+            SOURCE_OFFSETS_FILE: source_offsets,
+            PAGES_FILE: np.asarray(self._pages, dtype=np.int32),
+            UPLOADED_AT_FILE: np.asarray(self._uploaded_at, dtype=np.float64),
+            DOCS_FILE: np.asarray(self._docs, dtype=np.int32),
+            PARENTS_FILE: parents,
+            PARENT_ORDER_FILE: parent_order,
+            PARENT_OFFSETS_FILE: parent_offsets,
+        }
+
+    def _names(self) -> Dict[str, List[str]]:
+        return {
+            "sources": list(self._source_codes),
+            "doc_ids": list(self._doc_codes),
+            "parent_ids": list(self._parent_codes),
+        }
+
+    def write(self, directory: str):
+        """
+        Writes the index as a JSON table of names and flat per-chunk arrays.
+        """
+        with open(os.path.join(directory, NAMES_FILE), "w", encoding="utf-8") as f:
+            json.dump(self._names(), f, ensure_ascii=False)
+        for name, values in self._arrays().items():
+            np.save(os.path.join(directory, name), values)
+
+    def build(self) -> "MetadataIndex":
+        """
+        Returns the index in memory, for segments that were written without one.
+        """
+        return MetadataIndex(self._names(), self._arrays())
+
+
+class MetadataIndex:
+    """
+    A read-only index of the source, page, upload time, document and parent
+    section of every chunk of one segment.
+
+    It maps a `MetadataFilter`, and the documents deleted from the segment,
+    to the sorted vector positions of the chunks that remain searchable, and
+    a parent section ID to the positions of its chunks. The per-chunk arrays
+    are memory-mapped; only the tables of source names, document IDs and
+    parent IDs are held in memory.
+    """
+
+    def __init__(self, names: Dict[str, List[str]], arrays: Dict[str, np.ndarray]):
+        """
+        Initializes the MetadataIndex. Use `open` to read a segment's index.
+
+        Args:
+            names (Dict[str, List[str]]): The source names, document IDs and
+                parent IDs, in code order.
+            arrays (Dict[str, np.ndarray]): The per-chunk arrays, by file name.
+        """
+        self._sources = arrays[SOURCES_FILE]
+        self._source_order = arrays[SOURCE_ORDER_FILE]
+        self._source_offsets = arrays[SOURCE_OFFSETS_FILE]
+        self._pages = arrays[PAGES_FILE]
+        self._uploaded_at = arrays[UPLOADED_AT_FILE]
+        self._docs = arrays[DOCS_FILE]
+        self._parent_order = arrays[PARENT_ORDER_FILE]
+        self._parent_offsets = arrays[PARENT_OFFSETS_FILE]
+        self.size = len(self._sources)
+        # A source is matched by its full path or by its file name
+        self._source_codes: Dict[str, List[int]] = {}
+        for code, source in enumerate(names["sources"]):
+            self._source_codes.setdefault(source, []).append(code)
+            file_name = os.path.basename(source)
+            if file_name != source:
+                self._source_codes.setdefault(file_name, []).append(code)
+        self._doc_codes = {doc_id: code for code, doc_id in enumerate(names["doc_ids"])}
+        self._parent_codes = {parent_id: code for code, parent_id in enumerate(names["parent_ids"])}
+
+    @classmethod
+    def open(cls, directory: str) -> "MetadataIndex":
+        """
+        Opens the metadata index of a segment directory.
+
+        Args:
+            directory (str): The directory the index was written to.
+        """
+        with open(os.path.join(directory, NAMES_FILE), "r", encoding="utf-8") as f:
+            names = json.load(f)
+        arrays = {
+            name: np.load(os.path.join(directory, name), mmap_mode="r")
+            for name in (
+                SOURCES_FILE, SOURCE_ORDER_FILE, SOURCE_OFFSETS_FILE, PAGES_FILE, UPLOADED_AT_FILE, DOCS_FILE,
+                PARENTS_FILE, PARENT_ORDER_FILE, PARENT_OFFSETS_FILE,
+            )
+        }
+        return cls(names, arrays)
+
+    @classmethod
+    def from_documents(cls, documents: Iterable) -> "MetadataIndex":
+        """
+        Builds the index of chunks given in vector position order.
+        """
+        writer = MetadataIndexWriter()
+        for document in documents:
+            writer.add(document.metadata)
+        return writer.build()
+
+    @staticmethod
+    def exists(directory: str) -> bool:
+        """
+        Returns True if `directory` holds a metadata index. Indexes written
+        before parent sections were indexed don't count, so they are rebuilt.
+        """
+        return os.path.exists(os.path.join(directory, NAMES_FILE)) and os.path.exists(
+            os.path.join(directory, PARENTS_FILE)
+        )
+
+    def _source_positions(self, sources: Sequence[str]) -> np.ndarray:
+        """
+        Returns the sorted positions of the chunks of the given sources.
+        """
+        codes = sorted({code for source in sources for code in self._source_codes.get(source, ())})
+        # Offsets start with the chunks without a source, stored as -1
+        slices = [
+            self._source_order[int(self._source_offsets[code + 1]):int(self._source_offsets[code + 2])]
+            for code in codes
+        ]
+        if not slices:
+            return np.empty(0, dtype=np.int64)
+        return np.sort(np.concatenate(slices).astype(np.int64))
+
+    def parent_positions(self, parent_id: str) -> np.ndarray:
+        """
+        Returns the sorted positions of the chunks of a parent section.
+        """
+        code = self._parent_codes.get(parent_id)
+        if code is None:
+            return np.empty(0, dtype=np.int64)
+        positions = self._parent_order[int(self._parent_offsets[code + 1]):int(self._parent_offsets[code + 2])]
+        return np.sort(positions.astype(np.int64))
+
+    @staticmethod
+    def _keep(positions: Optional[np.ndarray], values: np.ndarray, condition) -> np.ndarray:
+        """
+        Returns the positions whose value meets `condition`, out of
+        `positions`, or out of all chunks if it is None.
+        """
+        if positions is None:
+            return np.flatnonzero(condition(values)).astype(np.int64)
+        return positions[condition(values[positions])]
+
+    def select(
+        self, search_filter: Optional[MetadataFilter] = None, excluded_doc_ids: Iterable[str] = ()
+    ) -> Optional[np.ndarray]:
+        """
+        Returns the positions of the chunks that match a filter and don't
+        belong to excluded documents.
+
+        Args:
+            search_filter (Optional[MetadataFilter]): The filter, if any.
+            excluded_doc_ids (Iterable[str]): IDs of documents whose chunks
+                are never returned, e.g. deleted ones.
+
+        Returns:
+            Optional[np.ndarray]: The sorted positions of the selected chunks,
+            or None if every chunk is selected.
+        """
+        positions = None
+        if search_filter is not None:
+            if search_filter.sources is not None:
+                positions = self._source_positions(search_filter.sources)
+            if search_filter.page_min is not None or search_filter.page_max is not None:
+                page_min = max(search_filter.page_min or 0, 0)
+                page_max = search_filter.page_max
+                positions = self._keep(
+                    positions,
+                    self._pages,
+                    lambda pages: (pages >= page_min) & (pages <= page_max) if page_max is not None else pages >= page_min,
+                )
+            # Chunks without an upload time are NaN, which no comparison matches
+            if search_filter.uploaded_after is not None:
+                positions = self._keep(positions, self._uploaded_at, lambda times: times >= search_filter.uploaded_after)
+            if search_filter.uploaded_before is not None:
+                positions = self._keep(positions, self._uploaded_at, lambda times: times < search_filter.uploaded_before)
+
+        excluded = [self._doc_codes[doc_id] for doc_id in excluded_doc_ids if doc_id in self._doc_codes]
+        if excluded:
+            positions = self._keep(positions, self._docs, lambda docs: ~np.isin(docs, excluded))
+        return positions
@@ -0,0 +1,362 @@
+import bisect
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Sequence, Tuple
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from config import Config
+from logger.logger_config import request_id_var
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+COUNT_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048)
+TOKEN_BUCKETS = (16, 64, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+RATE_BUCKETS = (0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+class Histogram:
+    """
+    A Prometheus histogram with optional labels.
+
+    Observing a value is a bisect and three additions under a lock, so it
+    is cheap enough for the query path.
+    """
+
+    def __init__(self, name: str, documentation: str, buckets: Sequence[float], labelnames: Sequence[str] = ()):
+        """
+        Initializes the Histogram.
+
+        Args:
+            name (str): The metric name.
+            documentation (str): The help text of the metric.
+            buckets (Sequence[float]): The upper bounds of the buckets, ascending.
+            labelnames (Sequence[str]): The names of the labels.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.labelnames = tuple(labelnames)
+        # Label values -> [per-bucket counts (the last one is +Inf), sum]
+        self._values: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str):
+        """
+        Records one observation.
+        """
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        bucket = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][bucket] += 1
+            entry[1] += value
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Returns the current values in a JSON-serializable form.
+        """
+        with self._lock:
+            return {
+                "buckets": list(self.buckets),
+                "values": [[list(key), list(counts), total] for key, (counts, total) in self._values.items()],
+            }
+
+
+def _merge(snapshots: Iterable[Dict[str, Any]]) -> Dict[Tuple[str, ...], list]:
+    """
+    Sums the values of several snapshots of the same histogram.
+    """
+    merged = {}
+    for snapshot in snapshots:
+        for key, counts, total in snapshot["values"]:
+            entry = merged.setdefault(tuple(key), [[0] * len(counts), 0.0])
+            entry[0] = [a + b for a, b in zip(entry[0], counts)]
+            entry[1] += total
+    return merged
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], le: str = None) -> str:
+    """
+    Formats label names and values as a Prometheus label set.
+    """
+    pairs = list(zip(names, values))
+    if le is not None:
+        pairs.append(("le", le))
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _is_running(pid: int) -> bool:
+    """
+    Returns True if a process with the given PID exists.
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class MetricsRegistry:
+    """
+    The histograms of one process, rendered in the Prometheus text format.
+
+    Ingestion runs in separate worker processes, which write snapshots of
+    their registry to `Config.METRICS_DIR`. The API process merges them into
+    its own metrics when `/metrics` is scraped.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, Histogram] = {}
+
+    def histogram(
+        self, name: str, documentation: str, buckets: Sequence[float], labelnames: Sequence[str] = ()
+    ) -> Histogram:
+        """
+        Registers a histogram, or returns the one already registered under `name`.
+        """
+        if name not in self._metrics:
+            self._metrics[name] = Histogram(name, documentation, buckets, labelnames)
+        return self._metrics[name]
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Returns the values of every histogram in a JSON-serializable form.
+        """
+        return {name: metric.snapshot() for name, metric in self._metrics.items()}
+
+    def write_snapshot(self, directory: str = Config.METRICS_DIR):
+        """
+        Atomically writes this process's snapshot to `directory`.
+        """
+        os.makedirs(directory, exist_ok=True)
+        # Temporary files carry the PID too, so a crash mid-write can be cleaned up
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f"{os.getpid()}.", suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp_path, os.path.join(directory, f"{os.getpid()}.json"))
+
+    @staticmethod
+    def remove_snapshot(pid: int, directory: str = Config.METRICS_DIR):
+        """
+        Removes the snapshot of a worker process that has exited.
+        """
+        try:
+            os.remove(os.path.join(directory, f"{pid}.json"))
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def clear_stale_snapshots(directory: str = Config.METRICS_DIR):
+        """
+        Removes the snapshots of worker processes that are no longer running,
+        e.g. after a crash. Snapshots of running workers, including those
+        started by other API processes, are kept.
+        """
+        if not os.path.isdir(directory):
+            return
+        for name in os.listdir(directory):
+            if not (name.endswith(".json") or name.endswith(".tmp")):
+                continue
+            pid = name.split(".", 1)[0]
+            if pid.isdigit() and _is_running(int(pid)):
+                continue
+            try:
+                os.remove(os.path.join(directory, name))
+            except FileNotFoundError:
+                pass
+
+    @staticmethod
+    def _read_snapshots(directory: str):
+        if not os.path.isdir(directory):
+            return []
+        snapshots = []
+        for name in os.listdir(directory):
+            # Threads of this process record into this registry directly
+            if not name.endswith(".json") or name == f"{os.getpid()}.json":
+                continue
+            try:
+                with open(os.path.join(directory, name), "r", encoding="utf-8") as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    def render(self, directory: str = Config.METRICS_DIR) -> str:
+        """
+        Renders the histograms of this process and of the worker snapshots
+        in `directory` in the Prometheus text exposition format.
+        """
+        worker_snapshots = self._read_snapshots(directory)
+        lines = []
+        for name, metric in self._metrics.items():
+            values = _merge(
+                [metric.snapshot()] + [snapshot[name] for snapshot in worker_snapshots if name in snapshot]
+            )
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} histogram")
+            for key in sorted(values):
+                counts, total = values[key]
+                cumulative = 0
+                for bound, count in zip(metric.buckets + (float("inf"),), counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(float(bound))
+                    lines.append(f"{name}_bucket{_format_labels(metric.labelnames, key, le)} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(metric.labelnames, key)} {total}")
+                lines.append(f"{name}_count{_format_labels(metric.labelnames, key)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+STAGE_SECONDS = registry.histogram(
+    "rag_stage_duration_seconds", "Time spent in each stage of answering and ingestion.", LATENCY_BUCKETS, ("stage",)
+)
+REQUEST_SECONDS = registry.histogram(
+    "rag_http_request_duration_seconds",
+    "Time from receiving an API request to sending the last byte of its response.",
+    LATENCY_BUCKETS,
+    ("method", "route", "status"),
+)
+CHUNKS_RETRIEVED = registry.histogram(
+    "rag_chunks_retrieved", "Number of chunks placed in the prompt of a question.", COUNT_BUCKETS
+)
+LLM_TOKENS = registry.histogram(
+    "rag_llm_tokens", "Prompt and completion tokens per LLM call.", TOKEN_BUCKETS, ("kind",)
+)
+CONTEXT_TOKENS = registry.histogram(
+    "rag_context_tokens",
+    "Tokens of the retrieved chunks, of the context placed in the prompt, and saved between the two.",
+    TOKEN_BUCKETS,
+    ("kind",),
+)
+EMBEDDING_BATCH_SIZE = registry.histogram(
+    "rag_embedding_batch_size", "Number of texts sent in one embeddings request.", COUNT_BUCKETS
+)
+INGESTION_PAGES_PER_SECOND = registry.histogram(
+    "rag_ingestion_pages_per_second", "Pages ingested per second of an ingestion job.", RATE_BUCKETS
+)
+
+
+@contextmanager
+def span(stage: str):
+    """
+    Times the enclosed block as one `stage` of `rag_stage_duration_seconds`.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage=stage)
+
+
+class LLMMetricsCallback(BaseCallbackHandler):
+    """
+    Records the latency, time to first token and token usage of LLM calls.
+    """
+
+    # Called on the event loop instead of a thread, as recording is cheap
+    run_inline = True
+
+    def __init__(self):
+        self._started: Dict[Any, float] = {}
+        self._first_token: Dict[Any, bool] = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._started[run_id] = time.perf_counter()
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._started[run_id] = time.perf_counter()
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        started = self._started.get(run_id)
+        if started is not None and run_id not in self._first_token:
+            self._first_token[run_id] = True
+            STAGE_SECONDS.observe(time.perf_counter() - started, stage="llm_first_token")
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        started = self._started.pop(run_id, None)
+        self._first_token.pop(run_id, None)
+        if started is not None:
+            STAGE_SECONDS.observe(time.perf_counter() - started, stage="llm")
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        if not usage:
+            for generations in response.generations:
+                for generation in generations:
+                    metadata = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                    if metadata:
+                        usage = {
+                            "prompt_tokens": metadata.get("input_tokens"),
+                            "completion_tokens": metadata.get("output_tokens"),
+                        }
+        if usage.get("prompt_tokens") is not None:
+            LLM_TOKENS.observe(usage["prompt_tokens"], kind="prompt")
+        if usage.get("completion_tokens") is not None:
+            LLM_TOKENS.observe(usage["completion_tokens"], kind="completion")
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._started.pop(run_id, None)
+        self._first_token.pop(run_id, None)
+
+
+class RequestMetricsMiddleware:
+    """
+    ASGI middleware that gives every request an ID and times it.
+
+    The ID is taken from the `X-Request-ID` header or generated, set for the
+    logs of the request, and returned in the response's `X-Request-ID`
+    header. The duration covers streamed responses until their last byte.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = ""
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")[:64]
+                break
+        request_id = request_id or uuid.uuid4().hex
+        token = request_id_var.set(request_id)
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_request_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-request-id", request_id.encode("latin-1"))
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            route = scope.get("route")
+            REQUEST_SECONDS.observe(
+                time.perf_counter() - started,
+                method=scope["method"],
+                route=getattr(route, "path", "unmatched"),
+                status=status,
+            )
+            request_id_var.reset(token)
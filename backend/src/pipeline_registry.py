@@ -0,0 +1,182 @@
+import asyncio
+import os
+import threading
+from typing import Dict, Optional
+
+from config import Config
+from logger.logger_config import get_logger
+from .llm import LLM
+from .metrics import span
+from .qa_handler import QAHandler
+from .reranker import Reranker
+from .retriever_handler import RetrieverHandler
+from .segmented_index import SegmentStore
+from .vector_store import VectorStore
+
+logger = get_logger(__name__)
+
+
+class Pipeline:
+    """
+    An immutable snapshot of a loaded index and the QA chain built on top of it.
+    """
+
+    def __init__(self, version, db, retriever, qa_chain, answer_chain=None):
+        """
+        Initializes the Pipeline snapshot.
+
+        Args:
+            version: The on-disk version of the index this snapshot was built from.
+            db: The loaded segmented vector store.
+            retriever: The retriever built from the vector store.
+            qa_chain: The RAG chain built from the retriever.
+            answer_chain: The chain that answers from already retrieved documents.
+        """
+        self.version = version
+        self.db = db
+        self.retriever = retriever
+        self.qa_chain = qa_chain
+        self.answer_chain = answer_chain
+
+
+class PipelineClients:
+    """
+    The embedding, LLM and re-ranking clients, created on first use and
+    shared by the pipelines of every index.
+    """
+
+    def __init__(self):
+        self.vector_store = None
+        self.llm = None
+        self.reranker = None
+        self._lock = threading.Lock()
+
+    def ensure(self):
+        """
+        Creates the clients that don't exist yet.
+        """
+        with self._lock:
+            if self.vector_store is None:
+                self.vector_store = VectorStore()
+            if self.llm is None:
+                self.llm = LLM().load()
+            if self.reranker is None and Config.RERANKER:
+                self.reranker = Reranker()
+
+
+class PipelineRegistry:
+    """
+    A long-lived registry that keeps one warm retrieval/QA pipeline in process.
+
+    The embedding and LLM clients are created once and shared. The index is
+    reloaded only when a new manifest is published, only segments that are
+    not in memory yet are read from disk, and the new pipeline is
+    published by swapping a single reference, so requests that already hold
+    the previous snapshot keep working while a new index is being published.
+    """
+
+    def __init__(self, index_path: str = Config.VECTOR_STORE_PATH, clients: Optional[PipelineClients] = None):
+        """
+        Initializes the PipelineRegistry.
+
+        Args:
+            index_path (str): The directory of the segmented index on disk.
+            clients (Optional[PipelineClients]): Clients shared with the
+                registries of other indexes. New ones are created if not
+                provided.
+        """
+        self.index_path = index_path
+        self._segment_store = SegmentStore(index_path)
+        # Segments are immutable, so ones already in memory are reused on reload
+        self._loaded_segments: Dict[str, object] = {}
+        self._clients = clients if clients is not None else PipelineClients()
+        self._pipeline: Optional[Pipeline] = None
+        self._lock = threading.Lock()
+
+    def _index_version(self):
+        """
+        Returns a cheap fingerprint of the published index manifest, or None
+        if the index does not exist yet.
+        """
+        return self._segment_store.version()
+
+    def _build(self, version) -> Pipeline:
+        """
+        Loads the index from disk and builds a new pipeline snapshot.
+        """
+        self._clients.ensure()
+        with span("index_load"):
+            db = self._clients.vector_store.load_index(self.index_path, self._loaded_segments)
+        retriever = RetrieverHandler(db, reranker=self._clients.reranker).get_retriever()
+        qa_handler = QAHandler(retriever, llm=self._clients.llm)
+        # The version recorded while loading matches the segments that were read
+        return Pipeline(
+            db.version or version, db, retriever, qa_handler.create_qa_chain(), qa_handler.create_answer_chain()
+        )
+
+    def get_pipeline(self) -> Optional[Pipeline]:
+        """
+        Returns the current pipeline, reloading it if the index on disk changed.
+
+        Returns:
+            Optional[Pipeline]: The current pipeline snapshot, or None if no
+            index has been created yet.
+        """
+        version = self._index_version()
+        pipeline = self._pipeline
+        if version is None:
+            return pipeline
+        if pipeline is not None and pipeline.version == version:
+            return pipeline
+
+        with self._lock:
+            # Another request may have reloaded the index while we waited.
+            pipeline = self._pipeline
+            version = self._index_version()
+            if pipeline is not None and (version is None or pipeline.version == version):
+                return pipeline
+
+            logger.info("Index at %s changed, reloading pipeline.", self.index_path)
+            try:
+                new_pipeline = self._build(version)
+            except Exception as e:
+                if pipeline is None:
+                    raise
+                logger.error("Failed to reload index, keeping previous version: %s", e)
+                return pipeline
+
+            # The index may have been rewritten while we were loading it. Publish
+            # what we loaded anyway and let the next request pick up the change.
+            self._pipeline = new_pipeline
+            logger.info("Pipeline reloaded successfully.")
+            return new_pipeline
+
+    def index_bytes(self) -> int:
+        """
+        Returns the size on disk of the segments in memory, which bounds the
+        memory the loaded index can take.
+        """
+        total = 0
+        for segment_id in list(self._loaded_segments):
+            directory = os.path.join(self._segment_store.segments_dir, segment_id)
+            try:
+                total += sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file())
+            except OSError:
+                continue
+        return total
+
+    async def aget_pipeline(self) -> Optional[Pipeline]:
+        """
+        Returns the current pipeline without blocking the event loop.
+
+        The version check is a single stat call and runs inline; loading a
+        changed index is offloaded to the default executor.
+
+        Returns:
+            Optional[Pipeline]: The current pipeline snapshot, or None if no
+            index has been created yet.
+        """
+        pipeline = self._pipeline
+        if pipeline is not None and pipeline.version == self._index_version():
+            return pipeline
+        return await asyncio.get_running_loop().run_in_executor(None, self.get_pipeline)
@@ -0,0 +1,123 @@
+from typing import Callable, Dict
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models import BaseChatModel
+
+from config import Config
+from logger.logger_config import get_logger
+
+logger = get_logger(__name__)
+
+OPENAI = "openai"
+OLLAMA = "ollama"
+GOOGLE = "google"
+LOCAL = "local"
+
+
+def _openai_embeddings(model_name: str) -> Embeddings:
+    from langchain_openai import OpenAIEmbeddings
+    return OpenAIEmbeddings(model=model_name)
+
+
+def _ollama_embeddings(model_name: str) -> Embeddings:
+    from langchain_ollama import OllamaEmbeddings
+    return OllamaEmbeddings(model=model_name, base_url=Config.OLLAMA_BASE_URL)
+
+
+def _google_embeddings(model_name: str) -> Embeddings:
+    from langchain_google_genai import GoogleGenerativeAIEmbeddings
+    return GoogleGenerativeAIEmbeddings(model=model_name)
+
+
+def _local_embeddings(model_name: str) -> Embeddings:
+    from .local_embeddings import LocalEmbeddings
+    return LocalEmbeddings(model_name)
+
+
+def _openai_chat_model(model_name: str, temperature: float) -> BaseChatModel:
+    from langchain_openai import ChatOpenAI
+    # Report token usage for streamed answers too
+    return ChatOpenAI(model=model_name, temperature=temperature, stream_usage=True)
+
+
+def _ollama_chat_model(model_name: str, temperature: float) -> BaseChatModel:
+    from langchain_ollama import ChatOllama
+    return ChatOllama(model=model_name, temperature=temperature, base_url=Config.OLLAMA_BASE_URL)
+
+
+def _google_chat_model(model_name: str, temperature: float) -> BaseChatModel:
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    return ChatGoogleGenerativeAI(model=model_name, temperature=temperature)
+
+
+# Provider packages are imported when a provider is created, so only the
+# configured ones have to be installed
+EMBEDDING_PROVIDERS: Dict[str, Callable[[str], Embeddings]] = {
+    OPENAI: _openai_embeddings,
+    OLLAMA: _ollama_embeddings,
+    GOOGLE: _google_embeddings,
+    LOCAL: _local_embeddings,
+}
+
+LLM_PROVIDERS: Dict[str, Callable[[str, float], BaseChatModel]] = {
+    OPENAI: _openai_chat_model,
+    OLLAMA: _ollama_chat_model,
+    GOOGLE: _google_chat_model,
+}
+
+
+def is_in_process(provider: str) -> bool:
+    """
+    Returns True if the provider computes embeddings in this process, so
+    requests have no rate limits or network errors to schedule around.
+    """
+    return provider == LOCAL
+
+
+def create_embeddings(
+    provider: str = Config.EMBEDDING_PROVIDER, model_name: str = Config.EMBEDDING_MODEL_NAME
+) -> Embeddings:
+    """
+    Creates the embedding model of a provider.
+
+    Args:
+        provider (str): "openai", "ollama", "google" or "local".
+        model_name (str): The name of the provider's model.
+
+    Returns:
+        Embeddings: The embedding model.
+
+    Raises:
+        ValueError: If the provider is unknown.
+        ImportError: If the provider's package is not installed.
+    """
+    if provider not in EMBEDDING_PROVIDERS:
+        raise ValueError(f"Unknown embedding provider '{provider}'.")
+    logger.info("Initializing %s embedding model: %s", provider, model_name)
+    return EMBEDDING_PROVIDERS[provider](model_name)
+
+
+def create_chat_model(
+    provider: str = Config.LLM_PROVIDER,
+    model_name: str = Config.LLM_MODEL_NAME,
+    temperature: float = Config.LLM_TEMPERATURE,
+) -> BaseChatModel:
+    """
+    Creates the chat model of a provider.
+
+    Args:
+        provider (str): "openai", "ollama" or "google".
+        model_name (str): The name of the provider's model.
+        temperature (float): The temperature for the model's output.
+
+    Returns:
+        BaseChatModel: The chat model.
+
+    Raises:
+        ValueError: If the provider is unknown.
+        ImportError: If the provider's package is not installed.
+    """
+    if provider not in LLM_PROVIDERS:
+        raise ValueError(f"Unknown LLM provider '{provider}'.")
+    logger.info("Initializing %s LLM: %s", provider, model_name)
+    return LLM_PROVIDERS[provider](model_name, temperature)
@@ -1,40 +1,93 @@
 from langchain.prompts import PromptTemplate
-from langchain_core.runnables import RunnablePassthrough, RunnableParallel
+from langchain_core.runnables import RunnableLambda, RunnablePassthrough, RunnableParallel
 from langchain_core.output_parsers import StrOutputParser
+from .context_builder import ContextBuilder
 from .llm import LLM
+from .metrics import CHUNKS_RETRIEVED, CONTEXT_TOKENS, LLMMetricsCallback, span
 from dotenv import load_dotenv
 
-from logger.logger_config import logger
+from logger.logger_config import get_logger
 
 load_dotenv()
 
+logger = get_logger(__name__)
+
+# Key of the chain config's "configurable" dict holding the MetadataFilter of a question
+SEARCH_FILTER_KEY = "search_filter"
+
 class QAHandler:
     """
     A class to handle the creation of the RAG chain.
     """
 
-    def __init__(self, retriever):
+    def __init__(self, retriever, llm=None, context_builder=None):
         """
         Initializes the QAHandler with a retriever instance.
 
         Args:
             retriever: The retriever instance to use for the RAG chain.
+            llm: An already loaded language model to reuse. A new one is
+                loaded if not provided.
+            context_builder (ContextBuilder): Assembles the retrieved
+                documents into the context of the prompt. One configured from
+                `Config` is used if not provided.
         """
         self.retriever = retriever
-        self.llm = LLM().load()
+        self.llm = llm if llm is not None else LLM().load()
+        self.llm_metrics = LLMMetricsCallback()
+        self.context_builder = context_builder if context_builder is not None else ContextBuilder()
 
     def _format_docs(self, docs):
         """
-        Helper function to format retrieved documents into a single string.
+        Helper function to format retrieved documents into a single string,
+        merged, deduplicated and fitted into the context token budget.
         """
-        return "\n\n".join(doc.page_content for doc in docs)
+        CHUNKS_RETRIEVED.observe(len(docs))
+        with span("prompt_build"):
+            context, stats = self.context_builder.build(docs)
+        CONTEXT_TOKENS.observe(stats.retrieved_tokens, kind="retrieved")
+        CONTEXT_TOKENS.observe(stats.context_tokens, kind="prompt")
+        CONTEXT_TOKENS.observe(stats.tokens_saved, kind="saved")
+        logger.info(
+            "Context of %s chunk(s): %s passage(s), %s -> %s tokens (%s saved, %s duplicate sentence(s) removed%s).",
+            stats.chunks,
+            stats.passages,
+            stats.retrieved_tokens,
+            stats.context_tokens,
+            stats.tokens_saved,
+            stats.duplicate_sentences,
+            ", truncated to the budget" if stats.truncated else "",
+        )
+        return context
 
-    def create_qa_chain(self):
+    def _timed_retriever(self):
         """
-        Creates and returns the RAG chain.
+        Wraps the retriever so that every retrieval is timed, and restricted
+        to the `MetadataFilter` passed in the `search_filter` configurable
+        of the chain's config, if any.
+        """
+        def search_kwargs(config):
+            search_filter = config.get("configurable", {}).get(SEARCH_FILTER_KEY)
+            return {"filter": search_filter} if search_filter is not None else {}
+
+        def retrieve(query, config):
+            with span("retrieval"):
+                return self.retriever.invoke(query, config, **search_kwargs(config))
+
+        async def aretrieve(query, config):
+            with span("retrieval"):
+                return await self.retriever.ainvoke(query, config, **search_kwargs(config))
+
+        return RunnableLambda(retrieve, afunc=aretrieve, name="timed_retriever")
+
+    def create_answer_chain(self):
+        """
+        Creates the chain that answers a question from documents that were
+        already retrieved. It takes a dict with the `context` documents and
+        the `question`, and returns the answer text.
 
         Returns:
-            The RAG chain instance.
+            The answer chain instance.
         """
         prompt_template = """
         Use the following pieces of information to answer the user's question.
@@ -50,19 +103,27 @@ class QAHandler:
             input_variables=["context", "question"]
         )
 
-        rag_chain = (
-            RunnableParallel(
-                {"context": self.retriever | self._format_docs, "question": RunnablePassthrough()}
-            )
+        return (
+            RunnablePassthrough.assign(context=lambda x: self._format_docs(x["context"]))
             | prompt
-            | self.llm
+            | self.llm.with_config(callbacks=[self.llm_metrics])
             | StrOutputParser()
         )
 
-        # To also return the source documents, we can construct a parallel chain
+    def create_qa_chain(self):
+        """
+        Creates and returns the RAG chain.
+
+        Returns:
+            The RAG chain instance.
+        """
+        # Builds the answer from documents that were already retrieved
+        rag_chain_from_docs = self.create_answer_chain()
+
+        # Retrieve once, then feed the same documents to the prompt and the response
         rag_chain_with_source = RunnableParallel(
-            {"answer": rag_chain, "context": self.retriever}
-        )
+            {"context": self._timed_retriever(), "question": RunnablePassthrough()}
+        ).assign(answer=rag_chain_from_docs)
 
         logger.info("RAG chain created successfully.")
         return rag_chain_with_source
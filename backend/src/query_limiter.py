@@ -0,0 +1,72 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+from config import Config
+
+
+class QueryLimiterFull(Exception):
+    """Raised when the waiting queue is full and a request must be rejected."""
+
+
+class QueryLimiterTimeout(Exception):
+    """Raised when a request waited too long for a free slot."""
+
+
+class QueryLimiter:
+    """
+    A class to bound the number of questions answered concurrently.
+
+    Up to `max_concurrency` requests run at once, up to `max_queue` more may
+    wait for a slot, and anything beyond that is rejected immediately so that
+    a saturated worker sheds load instead of queueing without limit.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = Config.QUERY_MAX_CONCURRENCY,
+        max_queue: int = Config.QUERY_MAX_QUEUE,
+        queue_timeout: float = Config.QUERY_QUEUE_TIMEOUT,
+    ):
+        """
+        Initializes the QueryLimiter.
+
+        Args:
+            max_concurrency (int): The maximum number of requests running at once.
+            max_queue (int): The maximum number of requests waiting for a slot.
+            queue_timeout (float): Seconds a request may wait for a slot.
+        """
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._waiting = 0
+
+    @property
+    def waiting(self) -> int:
+        """The number of requests currently waiting for a slot."""
+        return self._waiting
+
+    @asynccontextmanager
+    async def slot(self):
+        """
+        Holds one concurrency slot for the duration of the context.
+
+        Raises:
+            QueryLimiterFull: If the waiting queue is already full.
+            QueryLimiterTimeout: If no slot became free within the timeout.
+        """
+        if self._semaphore.locked() and self._waiting >= self.max_queue:
+            raise QueryLimiterFull("Too many questions are waiting to be answered.")
+
+        self._waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError as e:
+            raise QueryLimiterTimeout("Timed out waiting for a free query slot.") from e
+        finally:
+            self._waiting -= 1
+
+        try:
+            yield
+        finally:
+            self._semaphore.release()
@@ -0,0 +1,310 @@
+import asyncio
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import List, Optional, Sequence, Tuple
+
+from langchain.docstore.document import Document
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.retrievers import BaseRetriever
+from pydantic import ConfigDict
+
+from config import Config
+from logger.logger_config import get_logger
+from .lexical_index import bm25_idf, tokenize
+from .metadata_index import MetadataFilter
+from .metrics import span
+
+logger = get_logger(__name__)
+
+LEXICAL_SCORER = "lexical"
+CROSS_ENCODER_SCORER = "cross-encoder"
+
+
+class LexicalOverlapScorer:
+    """
+    Scores passages by their overlap with the query's terms.
+
+    Terms are weighted by BM25 over the candidates of the query, so terms
+    found in every candidate count little. Query bigrams found in the same
+    order in a passage add the weight of both terms again, which favours
+    passages that contain the query's phrases.
+    """
+
+    def __init__(self, k1: float = Config.BM25_K1, b: float = Config.BM25_B):
+        """
+        Initializes the LexicalOverlapScorer.
+
+        Args:
+            k1 (float): BM25 term frequency saturation.
+            b (float): BM25 document length normalization.
+        """
+        self.k1 = k1
+        self.b = b
+
+    def score(self, pairs: Sequence[Tuple[str, str]]) -> List[float]:
+        """
+        Scores (query, passage) pairs. The pairs of one query are expected
+        to be passed together, as they share the term weights.
+
+        Args:
+            pairs (Sequence[Tuple[str, str]]): The query and passage texts.
+
+        Returns:
+            List[float]: The score of every pair, higher is more relevant.
+        """
+        scores = [0.0] * len(pairs)
+        by_query = {}
+        for i, (query, _) in enumerate(pairs):
+            by_query.setdefault(query, []).append(i)
+
+        for query, positions in by_query.items():
+            query_terms = tokenize(query)
+            terms = set(query_terms)
+            bigrams = set(zip(query_terms, query_terms[1:]))
+            passages = [tokenize(pairs[i][1]) for i in positions]
+            counts = [Counter(tokens) for tokens in passages]
+            average_length = max(sum(len(tokens) for tokens in passages) / len(passages), 1.0)
+            idf = {
+                term: bm25_idf(sum(term in count for count in counts), len(passages))
+                for term in terms
+            }
+            for i, tokens, count in zip(positions, passages, counts):
+                norm = self.k1 * (1 - self.b + self.b * len(tokens) / average_length)
+                score = sum(
+                    idf[term] * count[term] * (self.k1 + 1) / (count[term] + norm)
+                    for term in terms if term in count
+                )
+                if bigrams:
+                    score += sum(
+                        idf[first] + idf[second] for first, second in bigrams & set(zip(tokens, tokens[1:]))
+                    )
+                scores[i] = score
+        return scores
+
+
+class CrossEncoderScorer:
+    """
+    Scores (query, passage) pairs with a local cross-encoder model from
+    sentence-transformers, run on the CPU.
+    """
+
+    def __init__(self, model_name: str = Config.RERANK_CROSS_ENCODER_MODEL):
+        """
+        Initializes the CrossEncoderScorer and loads the model.
+
+        Args:
+            model_name (str): The name or path of the cross-encoder model.
+
+        Raises:
+            ImportError: If sentence-transformers is not installed.
+        """
+        from sentence_transformers import CrossEncoder
+        self.model = CrossEncoder(model_name, device="cpu")
+
+    def score(self, pairs: Sequence[Tuple[str, str]]) -> List[float]:
+        """
+        Scores (query, passage) pairs, higher is more relevant.
+        """
+        return [float(score) for score in self.model.predict(list(pairs), batch_size=len(pairs))]
+
+
+def create_scorer(name: str = Config.RERANKER):
+    """
+    Creates the scorer configured by `name`. The cross-encoder falls back to
+    lexical overlap if its model cannot be loaded.
+
+    Args:
+        name (str): "lexical" or "cross-encoder".
+
+    Returns:
+        The scorer instance.
+    """
+    if name == CROSS_ENCODER_SCORER:
+        try:
+            return CrossEncoderScorer()
+        except Exception as e:
+            logger.warning("Cross-encoder unavailable, re-ranking by lexical overlap: %s", e)
+            return LexicalOverlapScorer()
+    if name == LEXICAL_SCORER:
+        return LexicalOverlapScorer()
+    raise ValueError(f"Unknown reranker '{name}'.")
+
+
+class Reranker:
+    """
+    A class to re-order retrieved candidates by a relevance scorer.
+
+    Candidates are scored in batches on a worker thread, and each batch is
+    waited for only until the latency budget runs out. If scoring has not
+    finished by then, the candidates keep the order they were retrieved in,
+    so a slow scorer delays an answer by at most the budget. A batch that
+    runs past the budget finishes in the background and its scores are
+    dropped.
+    """
+
+    def __init__(
+        self,
+        scorer=None,
+        batch_size: int = Config.RERANK_BATCH_SIZE,
+        timeout: Optional[float] = Config.RERANK_TIMEOUT,
+    ):
+        """
+        Initializes the Reranker.
+
+        Args:
+            scorer: Scores (query, passage) pairs, e.g. a LexicalOverlapScorer.
+                The scorer configured by `Config.RERANKER` if not provided.
+            batch_size (int): The number of pairs scored at once.
+            timeout (Optional[float]): The latency budget per query in
+                seconds, None for no limit.
+        """
+        self.scorer = scorer if scorer is not None else create_scorer()
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(thread_name_prefix="rerank")
+
+    def _batches(self, pairs: List[Tuple[str, str]]) -> List[Tuple[int, int]]:
+        """
+        Splits the pairs into ranges of at most `batch_size` pairs. The pairs
+        of a query stay in one batch unless they don't fit in any.
+        """
+        batches: List[List[int]] = []
+        start = 0
+        while start < len(pairs):
+            end = start + 1
+            while end < len(pairs) and pairs[end][0] == pairs[start][0]:
+                end += 1
+            for batch_start in range(start, end, self.batch_size):
+                batch_end = min(batch_start + self.batch_size, end)
+                if batches and batch_end - batches[-1][0] <= self.batch_size:
+                    batches[-1][1] = batch_end
+                else:
+                    batches.append([batch_start, batch_end])
+            start = end
+        return [(batch_start, batch_end) for batch_start, batch_end in batches]
+
+    def _score(self, pairs: List[Tuple[str, str]], budget: Optional[float]) -> Optional[List[float]]:
+        """
+        Scores the pairs batch by batch, or returns None once `budget`
+        seconds have passed.
+        """
+        deadline = None if budget is None else time.perf_counter() + budget
+        scores: List[float] = []
+        for start, end in self._batches(pairs):
+            if deadline is None:
+                scores.extend(self.scorer.score(pairs[start:end]))
+                continue
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                return None
+            future = self._executor.submit(self.scorer.score, pairs[start:end])
+            try:
+                scores.extend(future.result(timeout=remaining))
+            except FutureTimeoutError:
+                return None
+        return scores
+
+    def rerank_batch(self, queries: List[str], candidates: List, k: int) -> List:
+        """
+        Re-orders the candidates of many queries and keeps the best `k` of each.
+
+        Args:
+            queries (List[str]): The query texts.
+            candidates (List): The retrieved documents of each query, or the
+                exception raised while retrieving them, which is passed on.
+            k (int): The number of documents to keep per query.
+
+        Returns:
+            List: The best `k` documents of each query, or its exception.
+        """
+        pairs, owners, scored_queries = [], [], 0
+        for i, (query, documents) in enumerate(zip(queries, candidates)):
+            if isinstance(documents, Exception):
+                continue
+            scored_queries += 1
+            for j, document in enumerate(documents):
+                pairs.append((query, document.page_content))
+                owners.append((i, j))
+
+        # The latency budget is per query
+        budget = None if self.timeout is None else self.timeout * scored_queries
+        with span("rerank"):
+            try:
+                scores = self._score(pairs, budget) if pairs else []
+            except Exception as e:
+                logger.error("Error re-ranking %s candidate(s): %s", len(pairs), e)
+                scores = None
+        if scores is None:
+            logger.warning(
+                "Re-ranking %s candidate(s) exceeded its budget or failed, keeping the retrieved order.", len(pairs)
+            )
+            return [
+                documents if isinstance(documents, Exception) else documents[:k] for documents in candidates
+            ]
+
+        ranked = [[] for _ in candidates]
+        for (i, j), score in zip(owners, scores):
+            ranked[i].append((score, j))
+        results = []
+        for documents, scored in zip(candidates, ranked):
+            if isinstance(documents, Exception):
+                results.append(documents)
+                continue
+            # Ties keep the retrieved order
+            order = sorted(scored, key=lambda item: (-item[0], item[1]))
+            results.append([documents[j] for _, j in order[:k]])
+        return results
+
+    def rerank(self, query: str, documents: List[Document], k: int) -> List[Document]:
+        """
+        Re-orders the candidates of one query and keeps the best `k`.
+
+        Args:
+            query (str): The query text.
+            documents (List[Document]): The retrieved candidates, best first.
+            k (int): The number of documents to keep.
+
+        Returns:
+            List[Document]: The best `k` documents, best first.
+        """
+        return self.rerank_batch([query], [documents], k)[0]
+
+
+class RerankingRetriever(BaseRetriever):
+    """
+    Over-fetches candidates from another retriever and re-ranks them.
+
+    The base retriever is configured to return `Config.RERANK_FETCH_K`
+    candidates; only the best `k` after re-ranking reach the prompt.
+    """
+
+    base: BaseRetriever
+    reranker: Reranker
+    k: int = 4
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    def _get_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: CallbackManagerForRetrieverRun,
+        filter: Optional[MetadataFilter] = None,
+    ) -> List[Document]:
+        kwargs = {"filter": filter} if filter is not None else {}
+        documents = self.base.invoke(query, {"callbacks": run_manager.get_child()}, **kwargs)
+        return self.reranker.rerank(query, documents, self.k)
+
+    async def _aget_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: AsyncCallbackManagerForRetrieverRun,
+        filter: Optional[MetadataFilter] = None,
+    ) -> List[Document]:
+        kwargs = {"filter": filter} if filter is not None else {}
+        documents = await self.base.ainvoke(query, {"callbacks": run_manager.get_child()}, **kwargs)
+        # Scoring is CPU-bound, so it runs in a thread
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.reranker.rerank, query, documents, self.k)
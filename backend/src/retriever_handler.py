@@ -1,23 +1,32 @@
-from langchain_community.vectorstores import FAISS
+from langchain_core.vectorstores import VectorStore
 from config import Config
 
-from logger.logger_config import logger
+from logger.logger_config import get_logger
+from .hybrid_retriever import HYBRID, LEXICAL, HybridRetriever
+from .reranker import Reranker, RerankingRetriever
+from .section_expander import SectionExpander, SectionExpandingRetriever
+from .segmented_index import SegmentedIndex
+
+logger = get_logger(__name__)
 
 class RetrieverHandler:
     """
-    A class to handle the creation of a retriever from a FAISS vector store.
+    A class to handle the creation of a retriever from a vector store.
     """
 
-    def __init__(self, db: FAISS):
+    def __init__(self, db: VectorStore, reranker: Reranker = None):
         """
-        Initializes the RetrieverHandler with a FAISS vector store.
+        Initializes the RetrieverHandler with a vector store.
 
         Args:
-            db (FAISS): The FAISS vector store instance.
+            db (VectorStore): The vector store instance, e.g. a SegmentedIndex.
+            reranker (Reranker): An already created reranker to reuse when
+                `Config.RERANKER` is set. A new one is created if not provided.
         """
-        if not isinstance(db, FAISS):
-            raise TypeError("Input 'db' must be a FAISS vector store instance.")
+        if not isinstance(db, VectorStore):
+            raise TypeError("Input 'db' must be a LangChain vector store instance.")
         self.db = db
+        self.reranker = reranker
 
     def get_retriever(self):
         """
@@ -30,13 +39,35 @@ class RetrieverHandler:
             Exception: If there is an error creating the retriever.
         """
         try:
-            retriever = self.db.as_retriever(
-                search_type=Config.RETRIEVER_SEARCH_TYPE,
-                search_kwargs=Config.RETRIEVER_SEARCH_KWARGS
-            )
+            search_kwargs = dict(Config.RETRIEVER_SEARCH_KWARGS)
+            k = search_kwargs.get("k", 4)
+            if Config.RERANKER:
+                # Over-fetch candidates for the re-ranker to choose from
+                search_kwargs["k"] = max(Config.RERANK_FETCH_K, k)
+
+            if Config.RETRIEVER_SEARCH_TYPE in (HYBRID, LEXICAL):
+                if not isinstance(self.db, SegmentedIndex):
+                    raise TypeError(f"The '{Config.RETRIEVER_SEARCH_TYPE}' search type needs a SegmentedIndex.")
+                retriever = HybridRetriever(
+                    index=self.db,
+                    mode=Config.RETRIEVER_SEARCH_TYPE,
+                    **search_kwargs
+                )
+            else:
+                retriever = self.db.as_retriever(
+                    search_type=Config.RETRIEVER_SEARCH_TYPE,
+                    search_kwargs=search_kwargs
+                )
+
+            if Config.RERANKER:
+                reranker = self.reranker if self.reranker is not None else Reranker()
+                retriever = RerankingRetriever(base=retriever, reranker=reranker, k=k)
+            if Config.CHUNK_EXPAND_TO_SECTION and isinstance(self.db, SegmentedIndex):
+                # Expands the final hits, after re-ranking
+                retriever = SectionExpandingRetriever(base=retriever, expander=SectionExpander(self.db))
             logger.info("Retriever created successfully.")
             
             return retriever
         except Exception as e:
-            logger.error(f"Error creating retriever: {e}")
+            logger.error("Error creating retriever: %s", e)
             raise
@@ -0,0 +1,142 @@
+import asyncio
+from typing import Dict, List, Optional
+
+from langchain.docstore.document import Document
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.retrievers import BaseRetriever
+from pydantic import ConfigDict
+
+from config import Config
+from logger.logger_config import get_logger
+from .chunker import merge_section
+from .metadata_index import MetadataFilter
+from .metrics import span
+from .segmented_index import SegmentedIndex
+from .tokenizer import count_tokens
+
+logger = get_logger(__name__)
+
+
+class SectionExpander:
+    """
+    Replaces retrieved chunks by the whole parent section they belong to.
+
+    Small chunks are precise to retrieve but often miss the sentences around
+    the answer. Going through the hits best first, each hit is replaced by
+    its section, rebuilt from the section's chunks, as long as the context
+    stays within `max_tokens`; other hits of an expanded section are dropped.
+    Chunks without a `parent_id`, e.g. from the recursive chunker, are kept
+    as they are. Sections are rebuilt only from chunks that match the
+    search's metadata filter, so a filtered search never returns text from
+    outside the filter.
+    """
+
+    def __init__(self, index: SegmentedIndex, max_tokens: Optional[int] = Config.CONTEXT_MAX_TOKENS):
+        """
+        Initializes the SectionExpander.
+
+        Args:
+            index (SegmentedIndex): The index holding the sections' chunks.
+            max_tokens (Optional[int]): The token budget of the expanded
+                hits, None for no limit.
+        """
+        self.index = index
+        self.max_tokens = max_tokens
+
+    def _section(
+        self, hit: Document, parent_id: str, search_filter: Optional[MetadataFilter]
+    ) -> Optional[Document]:
+        """
+        Returns the section of a hit as one document, or None if the index
+        has no other chunk of it that matches the filter.
+        """
+        chunks = self.index.section_chunks(parent_id, filter=search_filter)
+        if len(chunks) <= 1:
+            return None
+        metadata = {key: value for key, value in hit.metadata.items() if key != "start_index"}
+        metadata["section_chunks"] = len(chunks)
+        return Document(page_content=merge_section(chunks), metadata=metadata)
+
+    def expand(self, documents: List[Document], search_filter: Optional[MetadataFilter] = None) -> List[Document]:
+        """
+        Expands retrieved chunks to their sections within the token budget.
+
+        Args:
+            documents (List[Document]): The retrieved chunks, best first.
+            search_filter (Optional[MetadataFilter]): The filter the chunks
+                were retrieved with.
+
+        Returns:
+            List[Document]: The sections and the chunks that weren't
+            expanded, in the order of their best hit.
+        """
+        tokens = [count_tokens(document.page_content) for document in documents]
+        hit_tokens: Dict[str, int] = {}
+        for document, count in zip(documents, tokens):
+            parent_id = document.metadata.get("parent_id")
+            if parent_id is not None:
+                hit_tokens[parent_id] = hit_tokens.get(parent_id, 0) + count
+        total = sum(tokens)
+
+        expanded: Dict[str, Optional[Document]] = {}
+        results = []
+        with span("section_expansion"):
+            for document in documents:
+                parent_id = document.metadata.get("parent_id")
+                if parent_id is None:
+                    results.append(document)
+                    continue
+                if parent_id not in expanded:
+                    section = self._section(document, parent_id, search_filter)
+                    if section is not None:
+                        # The section replaces every hit of its own
+                        added = count_tokens(section.page_content) - hit_tokens[parent_id]
+                        if self.max_tokens is not None and total + added > self.max_tokens:
+                            section = None
+                        else:
+                            total += added
+                    expanded[parent_id] = section
+                    if section is not None:
+                        results.append(section)
+                if expanded[parent_id] is None:
+                    results.append(document)
+        sections = sum(section is not None for section in expanded.values())
+        if sections:
+            logger.debug("Expanded %s hit(s) to %s section(s).", len(documents), sections)
+        return results
+
+
+class SectionExpandingRetriever(BaseRetriever):
+    """
+    Retrieves chunks with another retriever and expands them to their
+    parent sections with a `SectionExpander`.
+    """
+
+    base: BaseRetriever
+    expander: SectionExpander
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    def _get_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: CallbackManagerForRetrieverRun,
+        filter: Optional[MetadataFilter] = None,
+    ) -> List[Document]:
+        kwargs = {"filter": filter} if filter is not None else {}
+        documents = self.base.invoke(query, {"callbacks": run_manager.get_child()}, **kwargs)
+        return self.expander.expand(documents, filter)
+
+    async def _aget_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: AsyncCallbackManagerForRetrieverRun,
+        filter: Optional[MetadataFilter] = None,
+    ) -> List[Document]:
+        kwargs = {"filter": filter} if filter is not None else {}
+        documents = await self.base.ainvoke(query, {"callbacks": run_manager.get_child()}, **kwargs)
+        # Sections are read from the segments' chunk stores, off the event loop
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.expander.expand, documents, filter)
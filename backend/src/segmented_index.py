@@ -0,0 +1,962 @@
+import asyncio
+import heapq
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import faiss
+import numpy as np
+from langchain.docstore.document import Document
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore as LangChainVectorStore
+
+from config import Config
+from logger.logger_config import get_logger
+from .ann_index import (
+    configure_search,
+    filtered_search_parameters,
+    flat_vectors,
+    is_exact,
+    is_flat,
+    optimize_index,
+    reconstruct_range,
+    search_subset,
+)
+from .chunk_store import ChunkStore, PositionIds
+from .lexical_index import LexicalIndex, LexicalIndexWriter, bm25_idf, tokenize
+from .metadata_index import MetadataFilter, MetadataIndex, MetadataIndexWriter
+from .metrics import span
+
+try:
+    import fcntl
+except ImportError:  # Windows: writers are only serialized within one process
+    fcntl = None
+
+logger = get_logger(__name__)
+
+MANIFEST_NAME = "manifest.json"
+WRITER_LOCK_NAME = ".writer.lock"
+SEGMENTS_DIR = "segments"
+LEGACY_FILES = ("index.faiss", "index.pkl")
+INDEX_FILE = "index.faiss"
+# Exact float vectors of segments whose index is quantized, kept for compaction
+VECTORS_FILE = "vectors.npy"
+# Vectors copied at a time when segments are merged
+_MERGE_BATCH_SIZE = 16_384
+
+
+def document_segments(entry: Dict[str, Any]) -> Dict[str, int]:
+    """
+    Returns the number of chunks a document or tombstone entry of the
+    manifest has in each segment. Entries written before an upload could span
+    several segments name a single `segment`.
+    """
+    if "segments" in entry:
+        return entry["segments"]
+    return {entry["segment"]: entry["chunks"]} if entry.get("segment") is not None else {}
+
+
+class SegmentedIndex(LangChainVectorStore):
+    """
+    A read-only view over the immutable FAISS segments of one manifest version.
+
+    Every query searches each segment and merges the per-segment hits by
+    distance, so adding documents never requires rewriting existing segments.
+    Searches can be restricted by a `MetadataFilter`. The segment's metadata
+    index maps it, with the documents deleted from the segment, to the
+    positions of the searchable chunks, and only those are searched.
+    """
+
+    def __init__(
+        self,
+        embedding: Embeddings,
+        segments: List[Tuple[str, FAISS]],
+        version=None,
+        deleted: Optional[Dict[str, Tuple[Set[str], int]]] = None,
+    ):
+        """
+        Initializes the SegmentedIndex.
+
+        Args:
+            embedding (Embeddings): The embeddings used to embed queries.
+            segments (List[Tuple[str, FAISS]]): The loaded segments with their IDs.
+            version: The manifest version the segments were loaded from.
+            deleted (Optional[Dict[str, Tuple[Set[str], int]]]): Per segment ID,
+                the IDs of deleted documents whose chunks are still stored in
+                it and the number of those chunks.
+        """
+        self.embedding = embedding
+        self.segments = segments
+        self.version = version
+        self.deleted = deleted or {}
+        # Per segment ID, the positions of its live chunks when some are deleted
+        self._live_positions: Dict[str, np.ndarray] = {}
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding
+
+    @property
+    def ntotal(self) -> int:
+        """The total number of vectors across all segments."""
+        return sum(db.index.ntotal for _, db in self.segments)
+
+    @staticmethod
+    def _metadata_index(segment_id: str, db: FAISS) -> MetadataIndex:
+        """
+        Returns the metadata index of a segment. Segments written before
+        metadata indexes were introduced get one built from their chunks on
+        first use, until compaction rewrites them.
+        """
+        metadata_index = getattr(db, "metadata_index", None)
+        if metadata_index is None:
+            logger.info("Building the metadata index of segment %s from its chunks.", segment_id)
+            metadata_index = MetadataIndex.from_documents(
+                db.docstore.search(db.index_to_docstore_id[position]) for position in range(db.index.ntotal)
+            )
+            db.metadata_index = metadata_index
+        return metadata_index
+
+    @staticmethod
+    def _lexical_index(segment_id: str, db: FAISS) -> LexicalIndex:
+        """
+        Returns the BM25 inverted index of a segment. Segments written before
+        inverted indexes were introduced, e.g. migrated legacy indexes, get
+        one built from their chunks on first use, until compaction rewrites
+        them.
+        """
+        lexical_index = getattr(db, "lexical_index", None)
+        if lexical_index is None:
+            logger.info("Building the inverted index of segment %s from its chunks.", segment_id)
+            lexical_index = LexicalIndex.from_texts(
+                db.docstore.search(db.index_to_docstore_id[position]).page_content
+                for position in range(db.index.ntotal)
+            )
+            db.lexical_index = lexical_index
+        return lexical_index
+
+    def _selected_positions(
+        self, segment_id: str, db: FAISS, search_filter: Optional[MetadataFilter]
+    ) -> Optional[np.ndarray]:
+        """
+        Returns the positions of the chunks of a segment that match the
+        filter and aren't deleted, or None if all of them are searchable.
+        """
+        deleted_ids = self.deleted.get(segment_id, (set(), 0))[0]
+        if search_filter is not None and not search_filter.is_empty():
+            return self._metadata_index(segment_id, db).select(search_filter, deleted_ids)
+        if not deleted_ids:
+            return None
+        # Deleted documents only change with the version, so this is computed once
+        positions = self._live_positions.get(segment_id)
+        if positions is None:
+            positions = self._metadata_index(segment_id, db).select(None, deleted_ids)
+            self._live_positions[segment_id] = positions
+        return positions
+
+    @staticmethod
+    def _search_segment(
+        db: FAISS, queries: np.ndarray, k: int, positions: Optional[np.ndarray]
+    ) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Searches the query vectors in one segment, restricted to `positions`
+        unless it is None, and returns the distances and positions of the
+        hits, or None if there is nothing to search.
+        """
+        index = db.index
+        if positions is None:
+            return index.search(queries, min(k, index.ntotal)) if index.ntotal else None
+        if not len(positions):
+            return None
+        if len(positions) <= Config.FILTER_EXACT_SEARCH_MAX_CHUNKS:
+            try:
+                return search_subset(index, queries, positions, k)
+            except RuntimeError as e:
+                logger.debug("Can't reconstruct the selected vectors, searching with a selector: %s", e)
+        return index.search(queries, min(k, len(positions)), params=filtered_search_parameters(index, positions))
+
+    def similarity_search_with_score_by_vectors(
+        self, embeddings: List[List[float]], k: int = 4, filter: Optional[MetadataFilter] = None
+    ) -> List[List[Tuple[Document, float]]]:
+        """
+        Searches many query vectors at once, with one FAISS search of the
+        whole query matrix per segment.
+
+        Args:
+            embeddings (List[List[float]]): The query vectors.
+            k (int): The number of documents to return per query.
+            filter (Optional[MetadataFilter]): Restricts the search to the
+                chunks matching it.
+
+        Returns:
+            List[List[Tuple[Document, float]]]: Per query, documents with
+            their L2 distance, closest first.
+        """
+        queries = np.asarray(embeddings, dtype=np.float32).reshape(len(embeddings), -1)
+        hits = [[] for _ in range(len(queries))]
+        for segment_id, db in self.segments:
+            found = self._search_segment(db, queries, k, self._selected_positions(segment_id, db, filter))
+            if found is None:
+                continue
+            for query_hits, row_distances, row_positions in zip(hits, *found):
+                for distance, position in zip(row_distances, row_positions):
+                    if position < 0:
+                        break
+                    document = db.docstore.search(db.index_to_docstore_id[int(position)])
+                    query_hits.append((document, float(distance)))
+        return [heapq.nsmallest(k, query_hits, key=lambda hit: hit[1]) for query_hits in hits]
+
+    def similarity_search_with_score_by_vector(
+        self, embedding: List[float], k: int = 4, filter: Optional[MetadataFilter] = None, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        """
+        Searches every segment and returns the `k` closest documents overall.
+
+        Args:
+            embedding (List[float]): The query vector.
+            k (int): The number of documents to return.
+            filter (Optional[MetadataFilter]): Restricts the search to the
+                chunks matching it.
+            **kwargs: Other search arguments of the LangChain interface,
+                ignored.
+
+        Returns:
+            List[Tuple[Document, float]]: Documents with their L2 distance,
+            closest first.
+        """
+        return self.similarity_search_with_score_by_vectors([embedding], k=k, filter=filter)[0]
+
+    def section_chunks(self, parent_id: str, filter: Optional[MetadataFilter] = None) -> List[Document]:
+        """
+        Returns the chunks of a parent section, from every segment, without
+        the chunks of deleted documents. Sections may span several pages, so
+        with a filter only the chunks matching it are returned.
+
+        Args:
+            parent_id (str): The `parent_id` metadata of a chunk.
+            filter (Optional[MetadataFilter]): Restricts the section to the
+                chunks the search was restricted to.
+
+        Returns:
+            List[Document]: The chunks of the section, in no particular order.
+        """
+        chunks = []
+        for segment_id, db in self.segments:
+            positions = self._metadata_index(segment_id, db).parent_positions(parent_id)
+            if not len(positions):
+                continue
+            live = self._selected_positions(segment_id, db, filter)
+            if live is not None:
+                positions = positions[np.isin(positions, live)]
+            chunks.extend(db.docstore.search(db.index_to_docstore_id[int(position)]) for position in positions)
+        return chunks
+
+    def similarity_search_by_vectors(
+        self, embeddings: List[List[float]], k: int = 4, filter: Optional[MetadataFilter] = None
+    ) -> List[List[Document]]:
+        with span("batch_vector_search"):
+            hits = self.similarity_search_with_score_by_vectors(embeddings, k=k, filter=filter)
+        return [[doc for doc, _ in query_hits] for query_hits in hits]
+
+    def lexical_search_with_score(
+        self, query: str, k: int = 4, filter: Optional[MetadataFilter] = None
+    ) -> List[Tuple[Document, float]]:
+        """
+        Ranks chunks by BM25 over the segments' inverted indexes. No
+        embedding is computed.
+
+        Args:
+            query (str): The query text.
+            k (int): The number of documents to return.
+            filter (Optional[MetadataFilter]): Restricts the search to the
+                chunks matching it. Term statistics stay collection-wide.
+
+        Returns:
+            List[Tuple[Document, float]]: Documents with their BM25 score,
+            best first.
+        """
+        lexical_segments = [
+            (segment_id, db, self._lexical_index(segment_id, db)) for segment_id, db in self.segments
+        ]
+        terms = set(tokenize(query))
+        document_count = sum(lexical.document_count for _, _, lexical in lexical_segments)
+        if not terms or not document_count:
+            return []
+        average_length = max(sum(lexical.total_length for _, _, lexical in lexical_segments) / document_count, 1.0)
+        idf = {}
+        for term in terms:
+            frequency = sum(lexical.document_frequency(term) for _, _, lexical in lexical_segments)
+            if frequency:
+                idf[term] = bm25_idf(frequency, document_count)
+
+        hits = []
+        for segment_id, db, lexical in lexical_segments:
+            positions = self._selected_positions(segment_id, db, filter)
+            if positions is not None and not len(positions):
+                continue
+            for position, score in lexical.top(idf, average_length, k, positions=positions):
+                hits.append((db.docstore.search(db.index_to_docstore_id[position]), score))
+        return heapq.nlargest(k, hits, key=lambda hit: hit[1])
+
+    def lexical_search(self, query: str, k: int = 4, filter: Optional[MetadataFilter] = None) -> List[Document]:
+        with span("lexical_search"):
+            return [doc for doc, _ in self.lexical_search_with_score(query, k=k, filter=filter)]
+
+    def similarity_search_with_score(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        with span("query_embedding"):
+            embedding = self.embedding.embed_query(query)
+        with span("vector_search"):
+            return self.similarity_search_with_score_by_vector(embedding, k=k, **kwargs)
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k=k, **kwargs)]
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k=k, **kwargs)]
+
+    async def asimilarity_search_with_score(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        """
+        Embeds the query asynchronously and runs the CPU-bound search on the
+        default executor.
+        """
+        with span("query_embedding"):
+            embedding = await self.embedding.aembed_query(query)
+
+        def search():
+            with span("vector_search"):
+                return self.similarity_search_with_score_by_vector(embedding, k=k, **kwargs)
+
+        return await asyncio.get_running_loop().run_in_executor(None, search)
+
+    async def asimilarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in await self.asimilarity_search_with_score(query, k=k, **kwargs)]
+
+    def _select_relevance_score_fn(self):
+        return self._euclidean_relevance_score_fn
+
+    def add_texts(self, texts, metadatas=None, **kwargs):
+        raise NotImplementedError("Segments are immutable; publish a new segment with SegmentStore instead.")
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, **kwargs):
+        raise NotImplementedError("Build segments with SegmentStore.write_segment instead.")
+
+
+class SegmentStore:
+    """
+    A class to manage a segmented FAISS index on disk.
+
+    Each upload is written as a new immutable segment directory, and the set
+    of live segments is recorded in a manifest. New versions are published by
+    atomically replacing the manifest, so readers always see either the old
+    or the new set of segments, and a crash mid-write leaves the previous
+    version intact.
+
+    Writers (publishing and compaction) are serialized by an exclusive lock
+    on a file in the index directory, which works across threads and
+    processes; readers never take the lock.
+    """
+
+    # Serializes writers of this process whose platform has no file locks
+    _process_lock = threading.RLock()
+
+    def __init__(self, root: str):
+        """
+        Initializes the SegmentStore.
+
+        Args:
+            root (str): The directory holding the manifest and the segments.
+        """
+        self.root = root
+        self.manifest_path = os.path.join(root, MANIFEST_NAME)
+        self.segments_dir = os.path.join(root, SEGMENTS_DIR)
+        self._lock = threading.RLock()
+        self._lock_depth = 0
+        self._lock_file = None
+
+    @contextmanager
+    def writer_lock(self):
+        """
+        Holds the index's single-writer lock. The lock is reentrant for the
+        same SegmentStore, so compaction can publish while holding it.
+        """
+        with self._lock:
+            if self._lock_depth == 0:
+                os.makedirs(self.root, exist_ok=True)
+                if fcntl is not None:
+                    self._lock_file = open(os.path.join(self.root, WRITER_LOCK_NAME), "a")
+                    fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX)
+                else:
+                    self._process_lock.acquire()
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+                if self._lock_depth == 0:
+                    if self._lock_file is not None:
+                        # Closing the file releases the lock
+                        self._lock_file.close()
+                        self._lock_file = None
+                    else:
+                        self._process_lock.release()
+
+    def _has_legacy_index(self) -> bool:
+        """
+        Returns True if the root still holds a single-file index from before
+        segments were introduced.
+        """
+        return all(os.path.exists(os.path.join(self.root, name)) for name in LEGACY_FILES)
+
+    def version(self) -> Optional[Tuple[int, ...]]:
+        """
+        Returns a cheap fingerprint of the published manifest, or None if no
+        index exists. Every publish replaces the manifest file, so the
+        fingerprint changes with every new version.
+        """
+        try:
+            st = os.stat(self.manifest_path)
+            return (st.st_ino, st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            pass
+        if self._has_legacy_index():
+            stats = [os.stat(os.path.join(self.root, name)) for name in LEGACY_FILES]
+            return tuple(value for st in stats for value in (st.st_mtime_ns, st.st_size))
+        return None
+
+    def read_manifest(self) -> Dict[str, Any]:
+        """
+        Returns the published manifest, or an empty one if none exists yet.
+        """
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            manifest = {"version": 0, "segments": []}
+        manifest.setdefault("documents", {})
+        manifest.setdefault("deleted", {})
+        return manifest
+
+    def _write_manifest(self, manifest: Dict[str, Any]):
+        """
+        Atomically replaces the manifest with `manifest`.
+        """
+        fd, tmp_path = tempfile.mkstemp(prefix=".manifest_", dir=self.root)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(manifest, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.manifest_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _new_segment_id(self) -> str:
+        return f"{time.time_ns():x}-{uuid.uuid4().hex[:8]}"
+
+    def write_segment(self, db: FAISS) -> Dict[str, Any]:
+        """
+        Writes a FAISS store as a new, not yet published segment.
+
+        Large segments are converted to the configured ANN index type
+        (`Config.FAISS_INDEX_TYPE`) before they are written. The vectors are
+        written as a FAISS index file and the chunks as a `ChunkStore` with
+        a BM25 `LexicalIndex` and a `MetadataIndex` built in the same pass,
+        so all of them can be memory-mapped when the segment is loaded. If
+        the index quantizes the vectors, the exact vectors are also written
+        to `VECTORS_FILE`, so compaction never merges approximate vectors.
+
+        Args:
+            db (FAISS): The FAISS store holding the new chunks.
+
+        Returns:
+            dict: The manifest entry describing the segment.
+        """
+        exact = db.index
+        db.index = optimize_index(db.index)
+        keep_vectors = not is_exact(db.index) and is_flat(exact)
+        os.makedirs(self.segments_dir, exist_ok=True)
+        segment_id = self._new_segment_id()
+        tmp_dir = tempfile.mkdtemp(prefix=f".{segment_id}_", dir=self.segments_dir)
+        try:
+            faiss.write_index(db.index, os.path.join(tmp_dir, INDEX_FILE))
+            if keep_vectors:
+                np.save(os.path.join(tmp_dir, VECTORS_FILE), flat_vectors(exact))
+            del exact
+            lexical = LexicalIndexWriter()
+            metadata = MetadataIndexWriter()
+
+            def documents():
+                for i in range(db.index.ntotal):
+                    document = db.docstore.search(db.index_to_docstore_id[i])
+                    lexical.add(document.page_content)
+                    metadata.add(document.metadata)
+                    yield document
+
+            ChunkStore.write(tmp_dir, documents())
+            lexical.write(tmp_dir)
+            metadata.write(tmp_dir)
+            os.rename(tmp_dir, os.path.join(self.segments_dir, segment_id))
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        logger.info("Wrote segment %s with %s chunks.", segment_id, db.index.ntotal)
+        return {
+            "id": segment_id,
+            "chunks": db.index.ntotal,
+            "created_at": time.time(),
+            "exact_vectors": keep_vectors or is_exact(db.index),
+        }
+
+    def discard_segments(self, segment_ids: List[str]):
+        """
+        Deletes segments that were written but will not be published, e.g.
+        because the upload writing them failed.
+
+        Args:
+            segment_ids (List[str]): The IDs of the unpublished segments.
+        """
+        self._remove_segments(segment_ids)
+
+    def _migrate_legacy_index(self, manifest: Dict[str, Any]) -> bool:
+        """
+        Links a pre-segment index into a segment and records it in the
+        manifest. The legacy files stay in place until the manifest naming
+        the segment is published, see `_remove_legacy_files`, so a crash in
+        between leaves the legacy index usable.
+
+        Returns:
+            bool: True if the legacy files must be removed once the manifest
+            is published.
+        """
+        if not self._has_legacy_index():
+            return False
+        if manifest.get("legacy_migrated"):
+            # An earlier migration published its manifest but didn't remove the files
+            return True
+        os.makedirs(self.segments_dir, exist_ok=True)
+        segment_id = self._new_segment_id()
+        tmp_dir = tempfile.mkdtemp(prefix=f".{segment_id}_", dir=self.segments_dir)
+        try:
+            for name in LEGACY_FILES:
+                source, target = os.path.join(self.root, name), os.path.join(tmp_dir, name)
+                try:
+                    os.link(source, target)
+                except OSError:
+                    shutil.copy2(source, target)
+            ntotal = faiss.read_index(os.path.join(tmp_dir, INDEX_FILE)).ntotal
+            os.rename(tmp_dir, os.path.join(self.segments_dir, segment_id))
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        logger.info("Migrated legacy index into segment %s.", segment_id)
+        manifest["segments"].append({"id": segment_id, "chunks": ntotal, "created_at": time.time()})
+        manifest["legacy_migrated"] = True
+        return True
+
+    def _remove_legacy_files(self):
+        """
+        Removes the files of a legacy index once a manifest has taken it over.
+        """
+        for name in LEGACY_FILES:
+            try:
+                os.remove(os.path.join(self.root, name))
+            except FileNotFoundError:
+                pass
+
+    def publish(
+        self,
+        add: List[Dict[str, Any]] = (),
+        remove: List[str] = (),
+        replace_all: bool = False,
+        add_documents: Optional[Dict[str, Dict[str, Any]]] = None,
+        delete_documents: List[str] = (),
+        moved_segments: Optional[Dict[str, str]] = None,
+    ) -> int:
+        """
+        Publishes a new manifest version.
+
+        Args:
+            add (List[dict]): Entries of written segments to add.
+            remove (List[str]): IDs of segments to drop.
+            replace_all (bool): Drop every existing segment and document.
+            add_documents (Optional[Dict[str, dict]]): Registry entries of the
+                documents stored in the added segments, keyed by document ID.
+                They are re-checked against the published documents, see
+                `_register_documents`.
+            delete_documents (List[str]): IDs of documents to delete. Their
+                chunks are hidden from searches until compaction drops them.
+            moved_segments (Optional[Dict[str, str]]): Old to new segment IDs
+                for documents whose chunks were moved by compaction.
+                Documents record their chunk count per segment, as one upload
+                may be written as several segments.
+
+        Returns:
+            int: The new manifest version.
+        """
+        with self.writer_lock():
+            manifest = self.read_manifest()
+            migrated = self._migrate_legacy_index(manifest)
+            if replace_all:
+                dropped = {segment["id"] for segment in manifest["segments"]}
+                manifest["documents"], manifest["deleted"] = {}, {}
+            else:
+                dropped = set(remove)
+            manifest["segments"] = [s for s in manifest["segments"] if s["id"] not in dropped] + list(add)
+
+            for doc_id in delete_documents:
+                entry = manifest["documents"].pop(doc_id, None)
+                if entry is not None:
+                    manifest["deleted"][doc_id] = {"segments": document_segments(entry), "chunks": entry["chunks"]}
+            for doc_id, entry in manifest["documents"].items():
+                segments = {}
+                for segment_id, chunks in document_segments(entry).items():
+                    segment_id = (moved_segments or {}).get(segment_id, segment_id)
+                    segments[segment_id] = segments.get(segment_id, 0) + chunks
+                entry.pop("segment", None)
+                entry["segments"] = segments
+            # Tombstones of dropped segments are gone together with their chunks
+            deleted = {}
+            for doc_id, entry in manifest["deleted"].items():
+                segments = {
+                    segment_id: chunks for segment_id, chunks in document_segments(entry).items()
+                    if segment_id not in dropped
+                }
+                if segments:
+                    deleted[doc_id] = {"segments": segments, "chunks": sum(segments.values())}
+            manifest["deleted"] = deleted
+            self._register_documents(manifest, add_documents or {})
+
+            manifest["version"] += 1
+            manifest["published_at"] = time.time()
+            self._write_manifest(manifest)
+            if migrated:
+                self._remove_legacy_files()
+            logger.info(
+                "Published index version %s with %s segment(s) and %s document(s).",
+                manifest["version"],
+                len(manifest["segments"]),
+                len(manifest["documents"]),
+            )
+            self._remove_segments(dropped)
+            return manifest["version"]
+
+    @staticmethod
+    def _register_documents(manifest: Dict[str, Any], add_documents: Dict[str, Dict[str, Any]]):
+        """
+        Adds registry entries to a manifest, re-checking the upload plan they
+        were made from against the documents published since.
+
+        Uploads are planned from a manifest read without the writer lock, so
+        a concurrent upload may have published the same content or another
+        version of the same file in the meantime. A document whose content is
+        already registered is deleted right away instead of being indexed
+        twice, and an older version of the same file is deleted, so the last
+        published version wins.
+        """
+        documents = manifest["documents"]
+        by_hash = {entry["content_hash"]: doc_id for doc_id, entry in documents.items()}
+        by_source = {entry["source"]: doc_id for doc_id, entry in documents.items()}
+        for doc_id, entry in add_documents.items():
+            if entry["content_hash"] in by_hash:
+                logger.info(
+                    "%s was indexed concurrently as document %s, deleting the duplicate %s.",
+                    entry["source"], by_hash[entry["content_hash"]], doc_id,
+                )
+                manifest["deleted"][doc_id] = {"segments": document_segments(entry), "chunks": entry["chunks"]}
+                continue
+            previous = by_source.get(entry["source"])
+            if previous is not None:
+                logger.info(
+                    "%s was replaced concurrently, deleting document %s in favor of %s.",
+                    entry["source"], previous, doc_id,
+                )
+                replaced = documents.pop(previous)
+                del by_hash[replaced["content_hash"]]
+                manifest["deleted"][previous] = {
+                    "segments": document_segments(replaced), "chunks": replaced["chunks"],
+                }
+            documents[doc_id] = entry
+            by_hash[entry["content_hash"]] = doc_id
+            by_source[entry["source"]] = doc_id
+
+    def _remove_segments(self, segment_ids):
+        """
+        Deletes the directories of segments that are no longer published.
+        Snapshots that still use them are not affected: their index files are
+        memory-mapped or read into memory and their chunk stores are open, and
+        on POSIX systems unlinked files stay readable through open mappings
+        and descriptors until those are closed.
+        """
+        for segment_id in segment_ids:
+            shutil.rmtree(os.path.join(self.segments_dir, segment_id), ignore_errors=True)
+
+    def load_segment(self, segment_id: str, embeddings: Embeddings, use_mmap: bool = Config.INDEX_MMAP) -> FAISS:
+        """
+        Opens one segment as a FAISS store.
+
+        The FAISS index is memory-mapped when `use_mmap` is set, and chunks
+        are read lazily from the segment's chunk store, so opening a segment
+        takes about the same time whatever its size, and the pages are shared
+        by all processes serving the same index. Segments written before
+        chunk stores were introduced are still read from their pickle.
+
+        Args:
+            segment_id (str): The ID of the segment.
+            embeddings (Embeddings): The embeddings used for queries.
+            use_mmap (bool): Memory-map the FAISS index instead of reading it.
+
+        Returns:
+            FAISS: The opened segment.
+        """
+        directory = os.path.join(self.segments_dir, segment_id)
+        if not ChunkStore.exists(directory):
+            logger.info("Segment %s uses the pickle format, it is rewritten by the next compaction.", segment_id)
+            db = FAISS.load_local(directory, embeddings, allow_dangerous_deserialization=True)
+            configure_search(db.index)
+            return db
+
+        # MMAP_IFC maps the stored vectors/codes without copying them
+        flags = faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY if use_mmap else 0
+        index = faiss.read_index(os.path.join(directory, INDEX_FILE), flags)
+        configure_search(index)
+        db = FAISS(
+            embedding_function=embeddings,
+            index=index,
+            docstore=ChunkStore(directory),
+            index_to_docstore_id=PositionIds(index.ntotal),
+        )
+        db.lexical_index = LexicalIndex.open(directory) if LexicalIndex.exists(directory) else None
+        db.metadata_index = MetadataIndex.open(directory) if MetadataIndex.exists(directory) else None
+        return db
+
+    def load(self, embeddings: Embeddings, loaded_segments: Optional[Dict[str, FAISS]] = None) -> SegmentedIndex:
+        """
+        Loads the published segments into a SegmentedIndex.
+
+        Args:
+            embeddings (Embeddings): The embeddings used for queries.
+            loaded_segments (Optional[Dict[str, FAISS]]): Segments already in
+                memory, keyed by ID. Segments are immutable, so these are
+                reused instead of being read again. The dict is updated to
+                hold exactly the segments of the loaded version.
+
+        Returns:
+            SegmentedIndex: The loaded index.
+        """
+        version = self.version()
+        manifest = self.read_manifest()
+        if not manifest["segments"] and not manifest.get("legacy_migrated") and self._has_legacy_index():
+            db = FAISS.load_local(self.root, embeddings, allow_dangerous_deserialization=True)
+            return SegmentedIndex(embeddings, [("legacy", db)], version)
+
+        cache = loaded_segments if loaded_segments is not None else {}
+        segments = []
+        for entry in manifest["segments"]:
+            segment_id = entry["id"]
+            db = cache.get(segment_id)
+            if db is None:
+                db = self.load_segment(segment_id, embeddings)
+            segments.append((segment_id, db))
+
+        deleted = {}
+        for doc_id, entry in manifest["deleted"].items():
+            for segment_id, segment_chunks in document_segments(entry).items():
+                doc_ids, chunks = deleted.get(segment_id, (set(), 0))
+                doc_ids.add(doc_id)
+                deleted[segment_id] = (doc_ids, chunks + segment_chunks)
+
+        cache.clear()
+        cache.update(segments)
+        return SegmentedIndex(embeddings, segments, version, deleted)
+
+    def compact(
+        self,
+        embeddings: Embeddings,
+        small_segment_chunks: int = Config.COMPACTION_SMALL_SEGMENT_CHUNKS,
+        min_segments: int = Config.COMPACTION_MIN_SEGMENTS,
+        max_deleted_ratio: float = Config.COMPACTION_MAX_DELETED_RATIO,
+        tier_factor: int = Config.COMPACTION_TIER_FACTOR,
+        max_segment_chunks: int = Config.COMPACTION_MAX_SEGMENT_CHUNKS,
+    ) -> bool:
+        """
+        Merges segments of similar size into larger ones, and rewrites
+        segments in which too many chunks belong to deleted documents.
+        Chunks of deleted documents are dropped from the merged segment.
+
+        Segments are grouped into tiers by size: tier 0 holds segments with
+        fewer than `small_segment_chunks` chunks, and every following tier
+        segments up to `tier_factor` times larger. Once a tier holds
+        `min_segments` segments they are merged into one of a higher tier,
+        which may fill that tier in turn, so merging is repeated until no
+        tier is full. Many small uploads thus end up in a few large segments,
+        which are written as ANN indexes once they reach
+        `Config.FAISS_ANN_MIN_CHUNKS`, and the number of segments grows with
+        the logarithm of the index size.
+
+        Args:
+            embeddings (Embeddings): The embeddings the segments were built with.
+            small_segment_chunks (int): The size bound of the smallest tier.
+            min_segments (int): The number of segments in one tier that
+                triggers a merge.
+            max_deleted_ratio (float): The share of deleted chunks that makes a
+                segment eligible for rewriting.
+            tier_factor (int): The size ratio between consecutive tiers.
+            max_segment_chunks (int): Segments are not merged beyond this size.
+
+        Returns:
+            bool: True if a compacted version was published.
+        """
+        compacted = False
+        while True:
+            # The lock is held from reading the manifest until publishing, so
+            # documents deleted meanwhile can't be resurrected by the merge.
+            # It is released between merges to let uploads publish.
+            with self.writer_lock():
+                if not self._compact(
+                    embeddings, small_segment_chunks, min_segments, max_deleted_ratio, tier_factor, max_segment_chunks
+                ):
+                    return compacted
+            compacted = True
+
+    @staticmethod
+    def _merge_candidates(
+        segments: List[Dict[str, Any]],
+        small_segment_chunks: int,
+        min_segments: int,
+        tier_factor: int,
+        max_segment_chunks: int,
+    ) -> List[Dict[str, Any]]:
+        """
+        Returns the segments of the smallest full tier, smallest first and
+        up to `max_segment_chunks` chunks in total, or an empty list.
+        """
+        tiers: Dict[int, List[Dict[str, Any]]] = {}
+        for segment in segments:
+            if segment["chunks"] >= max_segment_chunks:
+                continue
+            tier, bound = 0, small_segment_chunks
+            while segment["chunks"] >= bound:
+                tier, bound = tier + 1, bound * tier_factor
+            tiers.setdefault(tier, []).append(segment)
+        for tier in sorted(tiers):
+            if len(tiers[tier]) < min_segments:
+                continue
+            group, chunks = [], 0
+            for segment in sorted(tiers[tier], key=lambda s: s["chunks"]):
+                if group and chunks + segment["chunks"] > max_segment_chunks:
+                    break
+                group.append(segment)
+                chunks += segment["chunks"]
+            if len(group) > 1:
+                return group
+        return []
+
+    def _has_exact_vectors(self, segment: Dict[str, Any]) -> bool:
+        """
+        Returns True if the exact vectors of a segment can be read, from its
+        index or its `VECTORS_FILE`. Segments written before this was recorded
+        in the manifest are checked by opening their index.
+        """
+        if "exact_vectors" in segment:
+            return segment["exact_vectors"]
+        directory = os.path.join(self.segments_dir, segment["id"])
+        if os.path.exists(os.path.join(directory, VECTORS_FILE)):
+            return True
+        index = faiss.read_index(os.path.join(directory, INDEX_FILE), faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+        return is_exact(index)
+
+    def _add_live_chunks(
+        self, entry: Dict[str, Any], db: FAISS, deleted_ids: Set[str], index: faiss.Index, documents: List[Document]
+    ):
+        """
+        Adds the vectors and chunks of a segment that don't belong to deleted
+        documents to a merged index, `_MERGE_BATCH_SIZE` vectors at a time.
+        """
+        vectors_path = os.path.join(self.segments_dir, entry["id"], VECTORS_FILE)
+        stored = np.load(vectors_path, mmap_mode="r") if os.path.exists(vectors_path) else None
+        if stored is None and not is_exact(db.index):
+            # Only reached when such a segment must drop deleted chunks
+            logger.warning("Segment %s has no exact vectors, rewriting it from its quantized codes.", entry["id"])
+        for start in range(0, db.index.ntotal, _MERGE_BATCH_SIZE):
+            count = min(_MERGE_BATCH_SIZE, db.index.ntotal - start)
+            keep = []
+            for offset in range(count):
+                document = db.docstore.search(db.index_to_docstore_id[start + offset])
+                if document.metadata.get("doc_id") not in deleted_ids:
+                    keep.append(offset)
+                    documents.append(document)
+            if not keep:
+                continue
+            batch = stored[start:start + count] if stored is not None else reconstruct_range(db.index, start, count)
+            index.add(np.ascontiguousarray(batch[keep], dtype=np.float32))
+
+    def _compact(
+        self, embeddings, small_segment_chunks, min_segments, max_deleted_ratio, tier_factor, max_segment_chunks
+    ) -> bool:
+        manifest = self.read_manifest()
+        deleted_chunks, deleted_ids = {}, set()
+        for doc_id, entry in manifest["deleted"].items():
+            for segment_id, chunks in document_segments(entry).items():
+                deleted_chunks[segment_id] = deleted_chunks.get(segment_id, 0) + chunks
+            deleted_ids.add(doc_id)
+
+        # Quantized segments without exact vectors would lose precision with
+        # every merge, so they are only rewritten to drop deleted chunks
+        mergeable = [s for s in manifest["segments"] if self._has_exact_vectors(s)]
+        merged_tier = self._merge_candidates(
+            mergeable, small_segment_chunks, min_segments, tier_factor, max_segment_chunks
+        )
+        dirty = [
+            s for s in manifest["segments"]
+            if s["chunks"] and deleted_chunks.get(s["id"], 0) / s["chunks"] >= max_deleted_ratio
+        ]
+        candidates = list({s["id"]: s for s in merged_tier + dirty}.values())
+        if not candidates:
+            return False
+
+        logger.info("Compacting %s segment(s).", len(candidates))
+        # Segments are merged as exact vectors into a flat index, which is
+        # re-indexed when written; each segment is opened in turn
+        index, documents = None, []
+        for entry in candidates:
+            db = self.load_segment(entry["id"], embeddings, use_mmap=False)
+            if index is None:
+                index = faiss.IndexFlatL2(db.index.d)
+            self._add_live_chunks(entry, db, deleted_ids, index, documents)
+            del db
+
+        merged = None
+        if documents:
+            merged = FAISS(
+                embedding_function=embeddings,
+                index=index,
+                docstore=InMemoryDocstore({str(i): document for i, document in enumerate(documents)}),
+                index_to_docstore_id={i: str(i) for i in range(len(documents))},
+            )
+
+        removed = [entry["id"] for entry in candidates]
+        if merged is None:
+            self.publish(remove=removed)
+            return True
+        segment = self.write_segment(merged)
+        self.publish(
+            add=[segment],
+            remove=removed,
+            moved_segments={segment_id: segment["id"] for segment_id in removed},
+        )
+        return True
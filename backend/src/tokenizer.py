@@ -0,0 +1,63 @@
+from functools import lru_cache
+
+from config import Config
+from logger.logger_config import get_logger
+
+logger = get_logger(__name__)
+
+# Average number of characters per token for English text with OpenAI encodings
+_CHARS_PER_TOKEN = 4
+
+
+@lru_cache(maxsize=None)
+def _get_encoding(encoding_name: str):
+    """
+    Returns the tiktoken encoding, or None if it cannot be loaded (for example
+    when tiktoken is missing or its encoding files can't be downloaded).
+    """
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(encoding_name)
+    except Exception as e:
+        logger.warning("Tokenizer '%s' unavailable, estimating token counts: %s", encoding_name, e)
+        return None
+
+
+def count_tokens(text: str, encoding_name: str = Config.TOKENIZER_ENCODING) -> int:
+    """
+    Counts the tokens in a piece of text.
+
+    Args:
+        text (str): The text to count.
+        encoding_name (str): The tiktoken encoding to use.
+
+    Returns:
+        int: The exact token count, or an estimate if the tokenizer is unavailable.
+    """
+    encoding = _get_encoding(encoding_name)
+    if encoding is None:
+        return max(1, len(text) // _CHARS_PER_TOKEN) if text else 0
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text: str, max_tokens: int, encoding_name: str = Config.TOKENIZER_ENCODING) -> str:
+    """
+    Cuts a piece of text down to at most `max_tokens` tokens.
+
+    Args:
+        text (str): The text to cut.
+        max_tokens (int): The maximum number of tokens to keep.
+        encoding_name (str): The tiktoken encoding to use.
+
+    Returns:
+        str: The start of `text` that fits in `max_tokens` tokens.
+    """
+    if max_tokens <= 0:
+        return ""
+    encoding = _get_encoding(encoding_name)
+    if encoding is None:
+        return text[:max_tokens * _CHARS_PER_TOKEN]
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])
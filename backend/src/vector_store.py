@@ -1,103 +1,274 @@
-from langchain_openai import OpenAIEmbeddings
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from langchain_community.vectorstores import FAISS
-from typing import List
+from typing import Any, Callable, Dict, Iterable, List, Optional
 from langchain.docstore.document import Document
 from dotenv import load_dotenv
 from config import Config
+from .embedding_cache import CachedEmbeddings
+from .embedding_scheduler import ScheduledEmbeddings
+from .metrics import span
+from .providers import OPENAI, create_embeddings, is_in_process
+from .segmented_index import SegmentStore, SegmentedIndex
 
-from logger.logger_config import logger
+from logger.logger_config import get_logger
 
 load_dotenv()
 
+logger = get_logger(__name__)
+
 class VectorStore:
     """
-    A class to handle the creation, loading, and updating of a FAISS vector store.
+    A class to handle the creation, loading, and updating of a segmented FAISS vector store.
     """
 
-    def __init__(self, embedding_model_name=Config.EMBEDDING_MODEL_NAME):
+    def __init__(self, embedding_model_name=Config.EMBEDDING_MODEL_NAME, provider=Config.EMBEDDING_PROVIDER):
         """
         Initializes the VectorStore with the embedding model name.
 
         Args:
-            embedding_model_name (str): The name of the OpenAI embedding model to use.
+            embedding_model_name (str): The name of the embedding model to use.
+            provider (str): The provider of the embedding model, see
+                `src.providers`.
         """
         self.embedding_model_name = embedding_model_name
+        self.provider = provider
         self.embeddings = self._get_embeddings_model()
+        # Models in this process have no rate limits to schedule around
+        if Config.EMBEDDING_SCHEDULER_ENABLED and not is_in_process(self.provider):
+            self.embeddings = ScheduledEmbeddings(self.embeddings)
+        if Config.EMBEDDING_CACHE_ENABLED:
+            # OpenAI keys are kept unprefixed so existing caches stay valid
+            cache_model = (
+                self.embedding_model_name if self.provider == OPENAI
+                else f"{self.provider}:{self.embedding_model_name}"
+            )
+            self.embeddings = CachedEmbeddings(self.embeddings, cache_model)
 
     def _get_embeddings_model(self):
         """
-        Initializes and returns the OpenAI embedding model.
+        Initializes and returns the embedding model of the configured provider.
         """
-        logger.info(f"Initializing embedding model: {self.embedding_model_name}")
-        return OpenAIEmbeddings(model=self.embedding_model_name)
+        return create_embeddings(self.provider, self.embedding_model_name)
+
+    def _build_segment(self, text_chunks: List[Document]) -> FAISS:
+        """
+        Embeds text chunks into a new in-memory FAISS store.
+        """
+        return FAISS.from_documents(documents=text_chunks, embedding=self.embeddings)
 
     def create_index(self, text_chunks: List[Document], save_path: str):
         """
-        Creates a new FAISS vector store and saves it to the specified path.
+        Creates a new vector index at the specified path, replacing any
+        segments that were published there before.
 
         Args:
             text_chunks (List[Document]): A list of text chunks to be embedded.
-            save_path (str): The file path where the FAISS index will be saved.
+            save_path (str): The directory where the segmented index is stored.
         """
         if not text_chunks:
             logger.info("No text chunks provided to create vector store.")
             return
         try:
             logger.info("Creating vector store from documents...")
-            vectorstore = FAISS.from_documents(documents=text_chunks, embedding=self.embeddings)
-            
-            logger.info(f"Saving vector store to: {save_path}")
-            vectorstore.save_local(save_path)
-            
+            store = SegmentStore(save_path)
+            segment = store.write_segment(self._build_segment(text_chunks))
+
+            logger.info("Publishing vector store at: %s", save_path)
+            store.publish(add=[segment], replace_all=True)
+
             logger.info("Vector store saved successfully.")
         except Exception as e:
-            logger.error(f"Error creating and saving vector store: {e}")
+            logger.error("Error creating and saving vector store: %s", e)
 
-    def load_index(self, load_path: str):
+    def load_index(self, load_path: str, loaded_segments: Optional[Dict[str, FAISS]] = None) -> SegmentedIndex:
         """
-        Loads an existing FAISS vector store from the specified path.
+        Loads the published segments of the index at the specified path.
 
         Args:
-            load_path (str): The file path from where the FAISS index will be loaded.
+            load_path (str): The directory of the segmented index.
+            loaded_segments (Optional[Dict[str, FAISS]]): Segments already in
+                memory that can be reused, see `SegmentStore.load`.
 
         Returns:
-            FAISS: The loaded FAISS vector store object.
+            SegmentedIndex: The loaded index, searching across all segments.
         """
         try:
-            logger.info(f"loading vector store from: {load_path}")
-            vectorstore = FAISS.load_local(load_path, self.embeddings, allow_dangerous_deserialization=True)
-            
-            logger.info("Vector store loaded successfully")
-            
+            logger.info("loading vector store from: %s", load_path)
+            vectorstore = SegmentStore(load_path).load(self.embeddings, loaded_segments)
+
+            logger.info("Vector store loaded successfully with %s segment(s)", len(vectorstore.segments))
+
             return vectorstore
         except Exception as e:
-            logger.error(f"Error loading vector store: {e}")
+            logger.error("Error loading vector store: %s", e)
             raise
 
     def update_index(self, new_text_chunks: List[Document], index_path: str):
         """
-        Loads an existing FAISS index, adds new documents, and saves it back.
-        
+        Adds new documents to the index as a new segment. Existing segments
+        are neither loaded nor rewritten.
+
         Args:
             new_text_chunks (List[Document]): The new document chunks to add.
-            index_path (str): The path to the existing FAISS index.
+            index_path (str): The directory of the segmented index.
         """
         if not new_text_chunks:
             logger.info("No new text chunks to add.")
             return
         try:
-            logger.info("Loading existing index to update.")
-            db = self.load_index(index_path)
-            
-            logger.info(f"Adding {len(new_text_chunks)} new chunks to the index.")
-            db.add_documents(new_text_chunks)
-            
-            logger.info(f"Saving updated index back to {index_path}.")
-            db.save_local(index_path)
-            
-            logger.info("Index updated and saved successfully.")
+            logger.info("Adding %s new chunks to the index as a new segment.", len(new_text_chunks))
+            store = SegmentStore(index_path)
+            segment = store.write_segment(self._build_segment(new_text_chunks))
+            store.publish(add=[segment])
+
+            logger.info("Index updated successfully.")
+        except Exception as e:
+            logger.error("Failed to update FAISS index: %s", e)
+            raise
+
+    def add_batches(
+        self,
+        batches: Iterable[List[Document]],
+        index_path: str,
+        documents: Optional[List[Dict[str, Any]]] = None,
+        replaced_documents: Optional[Dict[str, str]] = None,
+        on_batch: Optional[Callable[[int], None]] = None,
+        segment_max_chunks: int = Config.INGESTION_SEGMENT_MAX_CHUNKS,
+    ) -> int:
+        """
+        Embeds chunk batches as they arrive and publishes them as new segments.
+
+        Batches are embedded while the next ones are parsed and split, with
+        up to `Config.EMBEDDING_MAX_CONCURRENCY` batches in flight for remote
+        providers. Embedded batches are added in order to an in-memory FAISS
+        store, which is written to disk as an unpublished segment whenever it
+        holds `segment_max_chunks` chunks. Memory therefore grows with the segment
+        size, not with the size of the upload or of the existing index. All
+        segments of the upload are published together at the end, so readers
+        see either none or all of its documents; if the upload fails, the
+        segments already written are deleted.
+
+        Args:
+            batches (Iterable[List[Document]]): Batches of text chunks to add.
+            index_path (str): The directory of the segmented index.
+            documents (Optional[List[dict]]): Registry entries of the uploaded
+                documents. Chunks are matched to them by their `doc_id` metadata.
+                Documents without chunks, e.g. files that failed to parse, are
+                not registered, so uploading them again isn't skipped as a
+                duplicate.
+            replaced_documents (Optional[Dict[str, str]]): IDs of documents
+                superseded by this upload, keyed by the ID of the new version.
+                They are deleted in the same publish, unless the new version
+                has no chunks.
+            on_batch (Optional[Callable[[int], None]]): Called with the number of
+                chunks embedded so far after every batch.
+            segment_max_chunks (int): The number of chunks held in memory
+                before they are written as a segment.
+
+        Returns:
+            int: The number of chunks added to the index.
+        """
+        store = SegmentStore(index_path)
+        segments = []
+        # Per document ID, the number of its chunks in each written segment
+        document_segments: Dict[str, Dict[str, int]] = {}
+        db = None
+        db_chunks: Dict[str, int] = {}
+        added = 0
+        # A model in this process gains nothing from concurrent calls
+        max_in_flight = 1 if is_in_process(self.provider) else Config.EMBEDDING_MAX_CONCURRENCY
+        executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="ingest-embed")
+        in_flight = deque()
+
+        def flush():
+            nonlocal db, db_chunks
+            with span("segment_write"):
+                segment = store.write_segment(db)
+            segments.append(segment)
+            for doc_id, chunks in db_chunks.items():
+                document_segments.setdefault(doc_id, {})[segment["id"]] = chunks
+            db, db_chunks = None, {}
+
+        def add_next():
+            nonlocal db, added
+            batch, future = in_flight.popleft()
+            with span("embed_and_add"):
+                text_embeddings = list(zip((chunk.page_content for chunk in batch), future.result()))
+                metadatas = [chunk.metadata for chunk in batch]
+                if db is None:
+                    db = FAISS.from_embeddings(text_embeddings, self.embeddings, metadatas=metadatas)
+                else:
+                    db.add_embeddings(text_embeddings, metadatas=metadatas)
+            for chunk in batch:
+                doc_id = chunk.metadata.get("doc_id")
+                db_chunks[doc_id] = db_chunks.get(doc_id, 0) + 1
+            added += len(batch)
+            logger.info("Embedded and indexed %s chunks so far.", added)
+            if on_batch is not None:
+                on_batch(added)
+            if db.index.ntotal >= segment_max_chunks:
+                flush()
+
+        try:
+            batches = iter(batches)
+            while True:
+                # Pulling a batch parses and splits the pages it is made of
+                with span("parse_and_split"):
+                    batch = next(batches, None)
+                if batch is None:
+                    break
+                if not batch:
+                    continue
+                texts = [chunk.page_content for chunk in batch]
+                in_flight.append((batch, executor.submit(self.embeddings.embed_documents, texts)))
+                if len(in_flight) >= max_in_flight:
+                    add_next()
+            while in_flight:
+                add_next()
+
+            if db is not None:
+                flush()
+            if not segments:
+                logger.info("No text chunks provided to index.")
+                return 0
+
+            registry_entries, deleted_documents = {}, []
+            for entry in documents or []:
+                entry = dict(entry)
+                doc_id = entry.pop("doc_id")
+                if doc_id not in document_segments:
+                    logger.warning("%s produced no chunks, it is not registered.", entry.get("source", doc_id))
+                    continue
+                entry["segments"] = document_segments[doc_id]
+                entry["chunks"] = sum(entry["segments"].values())
+                registry_entries[doc_id] = entry
+                if doc_id in (replaced_documents or {}):
+                    deleted_documents.append(replaced_documents[doc_id])
+
+            logger.info("Publishing %s new segment(s) with %s chunks at %s.", len(segments), added, index_path)
+            with span("publish"):
+                store.publish(add=segments, add_documents=registry_entries, delete_documents=deleted_documents)
+        except BaseException:
+            store.discard_segments([segment["id"] for segment in segments])
+            raise
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+        return added
+
+    def compact_index(self, index_path: str) -> bool:
+        """
+        Merges segments of the index tier by tier, see `SegmentStore.compact`.
+
+        Args:
+            index_path (str): The directory of the segmented index.
+
+        Returns:
+            bool: True if a compacted version was published.
+        """
+        try:
+            with span("compaction"):
+                return SegmentStore(index_path).compact(self.embeddings)
         except Exception as e:
-            logger.error(f"Failed to update FAISS index: {e}")
-            
-            logger.info("Falling back to creating a new index from the new chunks.")
-            self.create_index(new_text_chunks, index_path)
+            logger.error("Failed to compact FAISS index: %s", e)
+            return False
@@ -1,60 +1,165 @@
 import os
 import shutil
+import time
+from typing import Any, Callable, Dict, Optional
 
-from logger.logger_config import logger
+from config import Config
+from logger.logger_config import get_logger
 from src.document_processor import DocumentProcessor
+from src.document_registry import DocumentRegistry
+from src.metrics import INGESTION_PAGES_PER_SECOND, STAGE_SECONDS, span
 from src.vector_store import VectorStore
 
-def process_documents_task(upload_dir: str, vector_store_path: str):
+logger = get_logger(__name__)
+
+def process_documents_task(
+    upload_dir: str,
+    vector_store_path: str,
+    progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> Dict[str, Any]:
     """
-    Background task to process uploaded PDF documents with enhanced logging.
+    Ingestion job that processes uploaded PDF documents with enhanced logging.
 
     Args:
         upload_dir (str): The directory containing the uploaded files to process.
         vector_store_path (str): The path to the FAISS vector store index.
+        progress (Optional[Callable[[dict], None]]): Called with the current
+            stage and counters (pages parsed, chunks created, chunks embedded,
+            chunks indexed) whenever they change.
+
+    Returns:
+        dict: The final counters of the job.
+
+    Raises:
+        Exception: Any processing error, after it has been logged, so that the
+            caller can mark the job as failed.
     """
-    logger.info("--- Starting document processing background task ---")
+    status = {
+        "stage": "checking",
+        "files": 0,
+        "skipped_files": 0,
+        "empty_files": 0,
+        "pages_parsed": 0,
+        "chunks": 0,
+        "embedded": 0,
+        "indexed": 0,
+    }
+
+    def report(**changes):
+        status.update(changes)
+        if progress is not None:
+            progress(dict(status))
+
+    logger.info("--- Starting document processing job ---")
+    started = time.perf_counter()
     try:
-        logger.info(f"1. Loading documents from: {upload_dir}")
-        doc_processor = DocumentProcessor(upload_dir)
-        raw_documents = doc_processor.load_documents()
-        if not raw_documents:
-            logger.warning("No documents found to process. Exiting task.")
-            return
-        logger.info(f"Successfully loaded {len(raw_documents)} document(s).")
-
-        logger.info("2. Splitting documents into text chunks...")
-        text_chunks = doc_processor.get_text_chunks(raw_documents)
-        if not text_chunks:
-            logger.error("Failed to create text chunks. Exiting task.")
-            return
-        logger.info(f"Successfully created {len(text_chunks)} text chunks.")
+        logger.info("1. Checking uploaded files in %s against the document registry...", upload_dir)
+        registry = DocumentRegistry(vector_store_path)
+        pdf_paths = [
+            os.path.join(upload_dir, file) for file in sorted(os.listdir(upload_dir)) if file.endswith(".pdf")
+        ]
+        with span("document_check"):
+            plan = registry.plan_upload(pdf_paths)
+        report(files=len(plan.new_documents), skipped_files=len(plan.skipped_files))
+        if not plan.new_documents:
+            logger.info("All %s uploaded file(s) are already indexed. Exiting task.", len(plan.skipped_files))
+            report(stage="done")
+            return status
+        logger.info(
+            "%s new file(s), %s replacing an older version, %s skipped as duplicates.",
+            len(plan.new_documents),
+            len(plan.replaced_documents),
+            len(plan.skipped_files),
+        )
+
+        doc_processor = DocumentProcessor(
+            upload_dir,
+            document_metadata={
+                os.path.basename(path): {"doc_id": entry["doc_id"], "uploaded_at": entry["uploaded_at"]}
+                for path, entry in plan.new_documents.items()
+            },
+        )
+        batches = doc_processor.iter_chunk_batches(Config.INGESTION_BATCH_SIZE)
 
+        # Pages are parsed in worker processes, split incrementally and embedded
+        # batch by batch; embedded chunks are written to disk as a segment every
+        # INGESTION_SEGMENT_MAX_CHUNKS, so memory doesn't grow with the upload
+        logger.info("2. Splitting, embedding and indexing chunks into %s...", vector_store_path)
+        report(stage="embedding")
         vector_store = VectorStore()
-        # Check if an index already exists
-        if os.path.exists(vector_store_path):
-            logger.info(f"3. Found existing vector store. Updating index at {vector_store_path}...")
-            vector_store.update_index(text_chunks, vector_store_path)
-            logger.info("Successfully updated existing vector store.")
-        else:
-            logger.info(f"3. No existing vector store found. Creating new index at {vector_store_path}...")
-            vector_store.create_index(text_chunks, vector_store_path)
-            logger.info("Successfully created and saved new vector store.")
-
-        logger.info("--- Document processing task completed successfully! ---")
+        added = vector_store.add_batches(
+            batches,
+            vector_store_path,
+            documents=list(plan.new_documents.values()),
+            replaced_documents=plan.replaced_documents,
+            on_batch=lambda embedded: report(
+                pages_parsed=doc_processor.pages_loaded,
+                chunks=doc_processor.chunks_created,
+                embedded=embedded,
+            ),
+        )
+        if not added:
+            logger.warning("No text found in the uploaded documents.")
+        if doc_processor.empty_files:
+            logger.warning(
+                "%s file(s) failed to parse or had no text; they were not indexed and replaced nothing.",
+                doc_processor.empty_files,
+            )
+        report(
+            stage="indexed",
+            empty_files=doc_processor.empty_files,
+            pages_parsed=doc_processor.pages_loaded,
+            chunks=doc_processor.chunks_created,
+            embedded=added,
+            indexed=added,
+        )
+        logger.info(
+            "3. Successfully indexed %s text chunks from %s page(s).", added, doc_processor.pages_loaded
+        )
+        if doc_processor.pages_loaded:
+            INGESTION_PAGES_PER_SECOND.observe(doc_processor.pages_loaded / (time.perf_counter() - started))
+
+        # New uploads add segments; merge them tier by tier once enough accumulate
+        if vector_store.compact_index(vector_store_path):
+            logger.info("Compacted index segments.")
+
+        report(stage="done")
+        logger.info("--- Document processing job completed successfully! ---")
+        return status
     except Exception as e:
-        logger.error(f"ERROR in background task")
-        logger.error(f"Error Type: {type(e).__name__}")
-        logger.error(f"Error Details: {e}")
+        logger.error("ERROR in document processing job")
+        logger.error("Error Type: %s", type(e).__name__)
+        logger.error("Error Details: %s", e)
         logger.error("Traceback:", exc_info=True)
+        raise
     finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage="ingestion")
         # Clean up uploaded files after processing
         logger.info("4. Cleaning up uploaded files...")
         # A check to ensure the directory exists before trying to clean it up
         if os.path.isdir(upload_dir):
             shutil.rmtree(upload_dir)
-            logger.info(f"   Successfully cleaned up and removed directory: {upload_dir}")
-        logger.info("--- Background task finished ---")
+            logger.info("   Successfully cleaned up and removed directory: %s", upload_dir)
+        logger.info("--- Document processing job finished ---")
+
+
+def compact_index_task(vector_store_path: str) -> dict:
+    """
+    Compaction job of an index, e.g. after documents were deleted. Run by
+    the ingestion workers, see `JobStore.create_compaction`.
+
+    Args:
+        vector_store_path (str): The path to the FAISS vector store index.
+
+    Returns:
+        dict: Whether a compacted version was published.
+    """
+    logger.info("--- Starting index compaction job ---")
+    compacted = VectorStore().compact_index(vector_store_path)
+    if compacted:
+        logger.info("Compacted index segments.")
+    logger.info("--- Index compaction job finished ---")
+    return {"compacted": compacted}
 
 
 # def process_documents_task(upload_dir: str):
@@ -0,0 +1,15 @@
+import os
+import tempfile
+
+from config import Config
+
+# Defaults of the modules under test bind to Config when they are imported,
+# so the paths are redirected before any of them is
+_data_dir = tempfile.mkdtemp(prefix="rag_tests_")
+Config.LOG_FILE = os.path.join(_data_dir, "rag_app.log")
+Config.EMBEDDING_CACHE_PATH = os.path.join(_data_dir, "embedding_cache.sqlite3")
+Config.JOB_DB_PATH = os.path.join(_data_dir, "jobs.sqlite3")
+Config.METRICS_DIR = os.path.join(_data_dir, "metrics")
+Config.VECTOR_STORE_PATH = os.path.join(_data_dir, "faiss_index")
+Config.COLLECTIONS_DIR = os.path.join(_data_dir, "collections")
+Config.UPLOAD_DIR = os.path.join(_data_dir, "uploads")
@@ -0,0 +1,65 @@
+import asyncio
+
+from langchain_core.embeddings import Embeddings
+
+from config import Config
+from src.answer_cache import AnswerCache
+from src.collection_registry import Collection
+from src.pipeline_registry import PipelineClients
+
+
+class RecordingEmbeddings(Embeddings):
+    """Returns the same vector for every text and records the embedded queries."""
+
+    def __init__(self):
+        self.queries = []
+
+    def embed_documents(self, texts):
+        return [[1.0, 0.0] for _ in texts]
+
+    def embed_query(self, text):
+        self.queries.append(text)
+        return [1.0, 0.0]
+
+
+def test_lexical_search_caches_answers_without_embedding_questions(monkeypatch):
+    monkeypatch.setattr(Config, "RETRIEVER_SEARCH_TYPE", "lexical")
+    cache = Collection("lexical", PipelineClients()).answer_cache
+    embeddings = RecordingEmbeddings()
+    response = {"answer": "42", "source_documents": []}
+
+    async def ask():
+        # As the API does, the question is looked up before its answer is stored
+        assert await cache.alookup("What is the answer?", 1, embeddings) is None
+        await cache.astore("What is the answer?", 1, embeddings, response)
+        return (
+            await cache.alookup("what is the answer", 1, embeddings),
+            await cache.alookup("What is the question?", 1, embeddings),
+        )
+
+    exact, other = asyncio.run(ask())
+    assert exact == response
+    assert other is None
+    assert embeddings.queries == []
+
+
+def test_near_duplicate_questions_about_other_identifiers_are_not_served():
+    # Every question embeds to the same vector, as questions differing in one part number nearly do
+    cache = AnswerCache(similarity_threshold=0.97)
+    embeddings = RecordingEmbeddings()
+    response = {"answer": "Every 6 months.", "source_documents": []}
+
+    async def ask():
+        await cache.alookup("What is the calibration interval of valve PN-00042?", 1, embeddings)
+        await cache.astore("What is the calibration interval of valve PN-00042?", 1, embeddings, response)
+        return (
+            await cache.alookup("what's the calibration interval for valve PN-00042", 1, embeddings),
+            await cache.alookup("What is the calibration interval of valve PN-00043?", 1, embeddings),
+            await cache.alookup("What was the calibration interval of valve PN-00042 in 2023?", 1, embeddings),
+        )
+
+    same, other_part, other_year = asyncio.run(ask())
+    assert same == response
+    assert other_part is None
+    assert other_year is None
+    assert cache.stats()["semantic_hits"] == 1
@@ -0,0 +1,15 @@
+from fastapi.testclient import TestClient
+
+import main
+
+
+def test_upload_with_a_malformed_content_length_is_rejected():
+    # Without the lifespan no worker processes are started
+    client = TestClient(main.app)
+    request = client.build_request("POST", "/upload/", files={"files": ("a.pdf", b"%PDF-1.4", "application/pdf")})
+    request.headers["content-length"] = "not-a-number"
+
+    response = client.send(request)
+
+    assert response.status_code == 400
+    assert "Content-Length" in response.json()["detail"]
@@ -0,0 +1,44 @@
+import sqlite3
+
+from langchain_core.embeddings import Embeddings
+
+from src.embedding_cache import CachedEmbeddings
+
+
+class AsymmetricEmbeddings(Embeddings):
+    """Embeds queries and documents differently, as some providers do."""
+
+    def embed_documents(self, texts):
+        return [[1.0, 0.0] for _ in texts]
+
+    def embed_query(self, text):
+        return [0.0, 1.0]
+
+
+def test_query_and_document_vectors_of_a_text_are_cached_separately(tmp_path):
+    cache = CachedEmbeddings(AsymmetricEmbeddings(), "model", cache_path=str(tmp_path / "cache.sqlite3"))
+
+    assert cache.embed_documents(["valve"]) == [[1.0, 0.0]]
+    assert cache.embed_query("valve") == [0.0, 1.0]
+    assert cache.embed_documents(["valve"]) == [[1.0, 0.0]]
+    assert cache.embed_query("valve") == [0.0, 1.0]
+    assert cache.stats()["hits"] == 2
+
+
+def test_cache_hits_do_not_write_access_times_on_every_lookup(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    cache = CachedEmbeddings(AsymmetricEmbeddings(), "model", cache_path=path)
+    cache.embed_query("valve")
+
+    def last_used():
+        with sqlite3.connect(path) as conn:
+            return conn.execute("SELECT last_used FROM embeddings").fetchone()[0]
+
+    stored = last_used()
+    cache.embed_query("valve")
+    assert last_used() == stored
+
+    # Pending access times are written with the next new vector
+    cache.embed_query("pump")
+    with sqlite3.connect(path) as conn:
+        assert min(row[0] for row in conn.execute("SELECT last_used FROM embeddings")) > stored
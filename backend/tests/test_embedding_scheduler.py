@@ -0,0 +1,55 @@
+import pytest
+from langchain_core.embeddings import Embeddings
+
+from src.embedding_cache import CachedEmbeddings
+from src.embedding_scheduler import EmbeddingSchedulerError, RateLimiter, ScheduledEmbeddings, SharedRateLimiter
+
+
+class FlakyEmbeddings(Embeddings):
+    """Fails every batch containing a text in `failing`, and records the embedded texts."""
+
+    def __init__(self):
+        self.failing = set()
+        self.embedded = []
+
+    def embed_documents(self, texts):
+        if self.failing & set(texts):
+            raise ValueError("bad request")
+        self.embedded.extend(texts)
+        return [[float(len(text)), 1.0] for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+def scheduled(model):
+    return ScheduledEmbeddings(
+        model, max_batch_size=2, max_retries=0, rate_limiter=RateLimiter(1_000_000, 1_000_000_000)
+    )
+
+
+def test_failed_call_keeps_the_finished_batches_in_the_cache(tmp_path):
+    model = FlakyEmbeddings()
+    cache = CachedEmbeddings(scheduled(model), "flaky", cache_path=str(tmp_path / "cache.sqlite3"))
+    texts = ["a", "bb", "ccc", "dddd", "eeeee"]
+    model.failing = {"ccc"}
+
+    with pytest.raises(EmbeddingSchedulerError) as error:
+        cache.embed_documents(texts)
+
+    assert error.value.failed_batches == 1
+    assert error.value.vectors == [[1.0, 1.0], [2.0, 1.0], None, None, [5.0, 1.0]]
+    model.failing, model.embedded = set(), []
+    assert cache.embed_documents(texts) == [[float(len(text)), 1.0] for text in texts]
+    assert model.embedded == ["ccc", "dddd"]
+
+
+def test_shared_rate_limiter_spends_one_budget_across_instances(tmp_path):
+    path = str(tmp_path / "limits.sqlite3")
+    first = SharedRateLimiter(requests_per_minute=3, tokens_per_minute=1_000, db_path=path)
+    second = SharedRateLimiter(requests_per_minute=3, tokens_per_minute=1_000, db_path=path)
+
+    waits = [first._try_acquire(10), second._try_acquire(10), first._try_acquire(10), second._try_acquire(10)]
+
+    assert waits[:3] == [0.0, 0.0, 0.0]
+    assert waits[3] > 0
@@ -0,0 +1,36 @@
+import sqlite3
+
+from src.job_store import COMPACT, INGEST, QUEUED, JobStore
+
+
+def test_deletions_queue_one_compaction_per_index(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite3"))
+
+    first = store.create_compaction("index-a")
+    second = store.create_compaction("index-a")
+    other = store.create_compaction("index-b")
+
+    assert first["kind"] == COMPACT and first["status"] == QUEUED
+    assert second["id"] == first["id"]
+    assert other["id"] != first["id"]
+    assert store.claim_next("worker")["id"] == first["id"]
+    # A compaction already running may miss later deletions, so a new one is queued
+    assert store.create_compaction("index-a")["id"] != first["id"]
+
+
+def test_job_databases_without_kinds_hold_ingestion_jobs(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+    with sqlite3.connect(path) as conn:
+        conn.execute(
+            "CREATE TABLE jobs ("
+            "id TEXT PRIMARY KEY, status TEXT NOT NULL, upload_dir TEXT NOT NULL, index_path TEXT NOT NULL, "
+            "files TEXT NOT NULL, progress TEXT NOT NULL, result TEXT, error TEXT, attempts INTEGER NOT NULL, "
+            "worker TEXT, created_at REAL NOT NULL, started_at REAL, finished_at REAL, heartbeat_at REAL)"
+        )
+        conn.execute(
+            "INSERT INTO jobs (id, status, upload_dir, index_path, files, progress, attempts, created_at) "
+            "VALUES ('old', 'queued', 'uploads/old', 'index', '[\"a.pdf\"]', '{}', 0, 0)"
+        )
+    conn.close()
+
+    assert JobStore(path).claim_next("worker")["kind"] == INGEST
@@ -0,0 +1,24 @@
+import os
+import subprocess
+import sys
+
+from src.metrics import MetricsRegistry
+
+
+def test_only_snapshots_of_exited_workers_are_cleared(tmp_path):
+    directory = str(tmp_path)
+    exited = subprocess.Popen([sys.executable, "-c", "pass"])
+    exited.wait()
+    running = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"])
+    try:
+        for pid in (exited.pid, running.pid, os.getpid()):
+            with open(os.path.join(directory, f"{pid}.json"), "w", encoding="utf-8") as f:
+                f.write("{}")
+        open(os.path.join(directory, f"{exited.pid}.abc123.tmp"), "w").close()
+
+        MetricsRegistry.clear_stale_snapshots(directory)
+
+        assert sorted(os.listdir(directory)) == sorted([f"{running.pid}.json", f"{os.getpid()}.json"])
+    finally:
+        running.kill()
+        running.wait()
@@ -0,0 +1,61 @@
+import asyncio
+from typing import List
+
+from langchain.docstore.document import Document
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.retrievers import BaseRetriever
+
+from src.qa_handler import QAHandler
+
+
+class CountingRetriever(BaseRetriever):
+    """Returns one fixed document and counts the retrievals."""
+
+    calls: List[str] = []
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        self.calls.append(query)
+        return [Document(page_content=f"The answer to {query} is 42.", metadata={"source": "a.pdf", "page": 0})]
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        return self._get_relevant_documents(query, run_manager=run_manager)
+
+
+def make_chain(answers=2):
+    retriever = CountingRetriever(calls=[])
+    llm = FakeListChatModel(responses=["42"] * answers)
+    return retriever, QAHandler(retriever, llm=llm).create_qa_chain()
+
+
+def test_invoke_retrieves_once_and_returns_the_retrieved_context():
+    retriever, chain = make_chain()
+
+    result = chain.invoke("what is it?")
+
+    assert retriever.calls == ["what is it?"]
+    assert result["answer"] == "42"
+    assert [doc.page_content for doc in result["context"]] == ["The answer to what is it? is 42."]
+
+
+def test_ainvoke_and_astream_retrieve_once_per_question():
+    retriever, chain = make_chain()
+
+    async def run():
+        await chain.ainvoke("first?")
+        return [chunk async for chunk in chain.astream("second?")]
+
+    chunks = asyncio.run(run())
+
+    assert retriever.calls == ["first?", "second?"]
+    assert sum("context" in chunk for chunk in chunks) == 1
+
+
+def test_batch_retrieves_once_per_question():
+    retriever, chain = make_chain(answers=3)
+
+    chain.batch(["a?", "b?", "c?"])
+
+    assert sorted(retriever.calls) == ["a?", "b?", "c?"]
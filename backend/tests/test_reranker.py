@@ -0,0 +1,24 @@
+import time
+
+from langchain.docstore.document import Document
+
+from src.reranker import Reranker
+
+
+class SlowScorer:
+    """Prefers the last candidate, but takes a second to say so."""
+
+    def score(self, pairs):
+        time.sleep(1.0)
+        return [float(i) for i in range(len(pairs))]
+
+
+def test_slow_scorer_falls_back_to_the_retrieved_order_within_the_budget():
+    documents = [Document(page_content=f"passage {i}") for i in range(5)]
+    reranker = Reranker(scorer=SlowScorer(), batch_size=32, timeout=0.2)
+
+    started = time.perf_counter()
+    reranked = reranker.rerank("query", documents, k=3)
+
+    assert time.perf_counter() - started < 0.6
+    assert reranked == documents[:3]
@@ -0,0 +1,30 @@
+from langchain.docstore.document import Document
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from src.metadata_index import MetadataFilter
+from src.section_expander import SectionExpander
+from src.segmented_index import SegmentStore
+
+EMBEDDINGS = DeterministicFakeEmbedding(size=16)
+
+
+def test_sections_are_expanded_only_within_the_search_filter(tmp_path):
+    # One section spanning pages 0 to 2
+    chunks = [
+        Document(
+            page_content=f"page {page} text",
+            metadata={"source": "a.pdf", "page": page, "parent_id": "a.pdf#0.0", "start_index": 0},
+        )
+        for page in range(3)
+    ]
+    store = SegmentStore(str(tmp_path / "index"))
+    store.publish(add=[store.write_segment(FAISS.from_documents(chunks, EMBEDDINGS))])
+    expander = SectionExpander(store.load(EMBEDDINGS), max_tokens=None)
+
+    unfiltered = expander.expand([chunks[1]])
+    filtered = expander.expand([chunks[1]], MetadataFilter(page_min=1, page_max=2))
+
+    assert unfiltered[0].metadata["section_chunks"] == 3
+    assert filtered[0].metadata["section_chunks"] == 2
+    assert "page 0" not in filtered[0].page_content
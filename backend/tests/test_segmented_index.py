@@ -0,0 +1,111 @@
+import functools
+import os
+
+import pytest
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from src import segmented_index
+import numpy as np
+
+from src.ann_index import build_index, is_flat, optimize_index
+from src.segmented_index import LEGACY_FILES, VECTORS_FILE, SegmentStore
+
+EMBEDDINGS = DeterministicFakeEmbedding(size=16)
+
+
+def write_legacy_index(root, texts=("alpha", "beta", "gamma")):
+    FAISS.from_texts(list(texts), EMBEDDINGS).save_local(root)
+
+
+def test_legacy_index_is_migrated_into_a_segment(tmp_path):
+    root = str(tmp_path / "index")
+    write_legacy_index(root)
+    store = SegmentStore(root)
+
+    store.publish()
+
+    manifest = store.read_manifest()
+    assert [segment["chunks"] for segment in manifest["segments"]] == [3]
+    assert not any(os.path.exists(os.path.join(root, name)) for name in LEGACY_FILES)
+    assert store.load(EMBEDDINGS).ntotal == 3
+
+
+def test_lexical_search_covers_a_migrated_legacy_index(tmp_path):
+    root = str(tmp_path / "index")
+    write_legacy_index(root, texts=("pump PN-00042 maintenance", "valve calibration", "gasket sizes"))
+    store = SegmentStore(root)
+    store.publish()
+
+    hits = store.load(EMBEDDINGS).lexical_search("calibration of the valve", k=2)
+
+    assert [hit.page_content for hit in hits] == ["valve calibration"]
+
+
+def test_crash_before_the_manifest_is_published_keeps_the_legacy_index(tmp_path, monkeypatch):
+    root = str(tmp_path / "index")
+    write_legacy_index(root)
+    store = SegmentStore(root)
+
+    def crash(manifest):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(store, "_write_manifest", crash)
+    with pytest.raises(OSError):
+        store.publish()
+
+    assert all(os.path.exists(os.path.join(root, name)) for name in LEGACY_FILES)
+    assert SegmentStore(root).load(EMBEDDINGS).ntotal == 3
+    monkeypatch.undo()
+    store.publish()
+    assert SegmentStore(root).load(EMBEDDINGS).ntotal == 3
+
+
+def test_many_small_uploads_are_compacted_into_ann_segments(tmp_path, monkeypatch):
+    # Segments of 200 chunks or more are written as HNSW indexes
+    monkeypatch.setattr(
+        segmented_index, "optimize_index", functools.partial(optimize_index, index_type="hnsw", min_vectors=200)
+    )
+    store = SegmentStore(str(tmp_path / "index"))
+    compaction = dict(small_segment_chunks=50, min_segments=4, tier_factor=4, max_segment_chunks=100_000)
+
+    for upload in range(64):
+        texts = [f"upload {upload} chunk {i}" for i in range(10)]
+        store.publish(add=[store.write_segment(FAISS.from_texts(texts, EMBEDDINGS))])
+        store.compact(EMBEDDINGS, **compaction)
+
+    index = store.load(EMBEDDINGS)
+    ann_chunks = sum(db.index.ntotal for _, db in index.segments if not is_flat(db.index))
+    assert index.ntotal == 640
+    assert ann_chunks >= 0.75 * index.ntotal
+    assert len(index.segments) < 10
+
+
+def test_quantized_segments_are_merged_from_their_exact_vectors(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        segmented_index, "optimize_index", functools.partial(optimize_index, index_type="sq8", min_vectors=20)
+    )
+    store = SegmentStore(str(tmp_path / "index"))
+    for upload in range(8):
+        texts = [f"upload {upload} chunk {i}" for i in range(30)]
+        store.publish(add=[store.write_segment(FAISS.from_texts(texts, EMBEDDINGS))])
+
+    assert store.compact(EMBEDDINGS, small_segment_chunks=100, min_segments=4, tier_factor=4, max_segment_chunks=1_000)
+
+    (segment,) = store.read_manifest()["segments"]
+    db = store.load_segment(segment["id"], EMBEDDINGS)
+    texts = [db.docstore.search(db.index_to_docstore_id[i]).page_content for i in range(db.index.ntotal)]
+    stored = np.load(os.path.join(store.segments_dir, segment["id"], VECTORS_FILE))
+    assert len(texts) == 240
+    assert np.array_equal(stored, np.asarray(EMBEDDINGS.embed_documents(texts), dtype=np.float32))
+
+
+def test_quantized_segments_without_exact_vectors_are_not_merged(tmp_path):
+    store = SegmentStore(str(tmp_path / "index"))
+    for upload in range(4):
+        db = FAISS.from_texts([f"upload {upload} chunk {i}" for i in range(30)], EMBEDDINGS)
+        db.index = build_index(db.index.reconstruct_n(0, db.index.ntotal), "sq8")
+        store.publish(add=[store.write_segment(db)])
+
+    assert not store.compact(EMBEDDINGS, small_segment_chunks=100, min_segments=4)
+    assert len(store.read_manifest()["segments"]) == 4
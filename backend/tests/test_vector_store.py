@@ -0,0 +1,140 @@
+import os
+
+from langchain.docstore.document import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from src.document_registry import DocumentRegistry
+from src.segmented_index import SegmentStore
+from src.vector_store import VectorStore
+
+
+class FakeVectorStore(VectorStore):
+    """A VectorStore embedding with deterministic fake vectors, without cache or scheduler."""
+
+    def __init__(self):
+        self.embedding_model_name = "fake"
+        self.provider = "fake"
+        self.embeddings = DeterministicFakeEmbedding(size=16)
+
+
+def chunk_batches(doc_id, chunks, batch_size=10):
+    chunks = [
+        Document(page_content=f"{doc_id} chunk {i}", metadata={"doc_id": doc_id, "source": f"{doc_id}.pdf", "page": i})
+        for i in range(chunks)
+    ]
+    return [chunks[i:i + batch_size] for i in range(0, len(chunks), batch_size)]
+
+
+def entry(doc_id):
+    return {"doc_id": doc_id, "source": f"{doc_id}.pdf", "content_hash": doc_id, "uploaded_at": 0.0}
+
+
+def test_large_upload_is_written_as_several_segments_published_together(tmp_path):
+    index_path = str(tmp_path / "index")
+    store = FakeVectorStore()
+
+    added = store.add_batches(chunk_batches("a", 95), index_path, documents=[entry("a")], segment_max_chunks=30)
+
+    manifest = SegmentStore(index_path).read_manifest()
+    assert added == 95
+    assert [segment["chunks"] for segment in manifest["segments"]] == [30, 30, 30, 5]
+    assert manifest["documents"]["a"]["chunks"] == 95
+    assert sorted(manifest["documents"]["a"]["segments"].values()) == [5, 30, 30, 30]
+    assert store.load_index(index_path).ntotal == 95
+
+
+def test_deleting_a_document_spanning_segments_hides_all_its_chunks(tmp_path):
+    index_path = str(tmp_path / "index")
+    store = FakeVectorStore()
+    store.add_batches(chunk_batches("a", 45), index_path, documents=[entry("a")], segment_max_chunks=20)
+    store.add_batches(chunk_batches("b", 5), index_path, documents=[entry("b")], segment_max_chunks=20)
+
+    SegmentStore(index_path).publish(delete_documents=["a"])
+    index = store.load_index(index_path)
+    hits = index.similarity_search("a chunk 1", k=50)
+
+    assert {doc.metadata["doc_id"] for doc in hits} == {"b"}
+    assert store.compact_index(index_path)
+    manifest = SegmentStore(index_path).read_manifest()
+    assert manifest["deleted"] == {}
+    assert sum(segment["chunks"] for segment in manifest["segments"]) == 5
+
+
+def test_failed_upload_discards_the_segments_it_wrote(tmp_path):
+    index_path = str(tmp_path / "index")
+
+    def failing_batches():
+        yield from chunk_batches("a", 40)
+        raise RuntimeError("parse error")
+
+    try:
+        FakeVectorStore().add_batches(failing_batches(), index_path, documents=[entry("a")], segment_max_chunks=10)
+    except RuntimeError:
+        pass
+
+    assert SegmentStore(index_path).read_manifest()["segments"] == []
+    assert os.listdir(os.path.join(index_path, "segments")) == []
+
+
+def test_documents_without_chunks_are_not_registered_and_replace_nothing(tmp_path):
+    index_path = str(tmp_path / "index")
+    store = FakeVectorStore()
+    store.add_batches(chunk_batches("a", 5), index_path, documents=[entry("a")])
+
+    # A new version of a.pdf that failed to parse, uploaded with another file
+    broken = {**entry("a2"), "source": "a.pdf"}
+    store.add_batches(
+        chunk_batches("b", 5), index_path, documents=[broken, entry("b")], replaced_documents={"a2": "a"}
+    )
+
+    documents = SegmentStore(index_path).read_manifest()["documents"]
+    assert sorted(documents) == ["a", "b"]
+    assert store.load_index(index_path).ntotal == 10
+
+
+def upload_concurrently(store, index_path, files):
+    """Plans every upload before any is published, as concurrent jobs do."""
+    plans = [DocumentRegistry(index_path).plan_upload([path]) for path in files]
+    for path, plan in zip(files, plans):
+        registry_entry = plan.new_documents[path]
+        store.add_batches(
+            chunk_batches(registry_entry["doc_id"], 5),
+            index_path,
+            documents=[registry_entry],
+            replaced_documents=plan.replaced_documents,
+        )
+
+
+def test_concurrent_uploads_of_the_same_file_index_it_once(tmp_path):
+    index_path = str(tmp_path / "index")
+    first, second = tmp_path / "one" / "a.pdf", tmp_path / "two" / "a.pdf"
+    for path in (first, second):
+        path.parent.mkdir()
+        path.write_bytes(b"version 1")
+    store = FakeVectorStore()
+
+    upload_concurrently(store, index_path, [str(first), str(second)])
+
+    documents = SegmentStore(index_path).read_manifest()["documents"]
+    assert len(documents) == 1
+    assert len(store.load_index(index_path).similarity_search("chunk", k=20)) == 5
+
+
+def test_concurrent_revisions_of_a_file_keep_the_last_published(tmp_path):
+    index_path = str(tmp_path / "index")
+    store = FakeVectorStore()
+    original = tmp_path / "a.pdf"
+    original.write_bytes(b"version 1")
+    upload_concurrently(store, index_path, [str(original)])
+    revisions = []
+    for name, content in (("two", b"version 2"), ("three", b"version 3")):
+        path = tmp_path / name / "a.pdf"
+        path.parent.mkdir()
+        path.write_bytes(content)
+        revisions.append(str(path))
+
+    upload_concurrently(store, index_path, revisions)
+
+    documents = SegmentStore(index_path).read_manifest()["documents"]
+    assert [entry["content_hash"] for entry in documents.values()] == [DocumentRegistry.hash_file(revisions[1])]
+    assert len(store.load_index(index_path).similarity_search("chunk", k=20)) == 5
@@ -0,0 +1,169 @@
+"""
+Ingestion workers that process queued upload and compaction jobs outside the
+API workers.
+
+The API starts `Config.JOB_WORKERS` worker processes on startup. To run the
+workers separately instead, set `JOB_WORKERS = 0` and start them from the
+backend directory with:
+
+    python worker.py --processes 2
+"""
+import argparse
+import multiprocessing
+import os
+import signal
+import threading
+from typing import List
+
+from config import Config
+from logger.logger_config import get_logger, log_to_queue, process_log_queue, request_id_var
+from src.job_store import COMPACT, JobStore
+from src.metrics import MetricsRegistry, registry
+from tasks import compact_index_task, process_documents_task
+
+logger = get_logger(__name__)
+
+
+def run_worker(worker_id: str, stop_event, db_path: str = Config.JOB_DB_PATH, log_queue=None):
+    """
+    Claims and processes queued ingestion and compaction jobs until
+    `stop_event` is set.
+
+    Args:
+        worker_id (str): The name recorded on the jobs this worker claims.
+        stop_event: A multiprocessing event that stops the worker.
+        db_path (str): The path of the job database.
+        log_queue: The queue of the parent process's log writer, when
+            running in a worker process.
+    """
+    log_to_queue(log_queue)
+    # Shutdown is driven by the stop event, not by Ctrl+C reaching the child
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+    store = JobStore(db_path)
+    logger.info("Ingestion worker %s started.", worker_id)
+    while not stop_event.is_set():
+        store.requeue_stale()
+        job = store.claim_next(worker_id)
+        if job is None:
+            stop_event.wait(Config.JOB_POLL_INTERVAL)
+            continue
+
+        # Logs of the job carry its ID
+        token = request_id_var.set(job["id"])
+        logger.info("Worker %s processing job %s (attempt %s).", worker_id, job["id"], job["attempts"])
+        job_done = threading.Event()
+
+        def send_heartbeats(job_id=job["id"]):
+            while not job_done.wait(Config.JOB_HEARTBEAT_INTERVAL):
+                store.heartbeat(job_id)
+
+        heartbeat = threading.Thread(target=send_heartbeats, daemon=True)
+        heartbeat.start()
+        try:
+            if job["kind"] == COMPACT:
+                result = compact_index_task(job["index_path"])
+            else:
+                result = process_documents_task(
+                    job["upload_dir"],
+                    job["index_path"],
+                    progress=lambda status, job_id=job["id"]: store.update_progress(job_id, status),
+                )
+            store.finish(job["id"], result=result)
+            logger.info("Job %s succeeded.", job["id"])
+        except Exception as e:
+            store.finish(job["id"], error=f"{type(e).__name__}: {e}")
+            logger.error("Job %s failed.", job["id"], exc_info=True)
+        finally:
+            job_done.set()
+            heartbeat.join()
+            request_id_var.reset(token)
+            try:
+                registry.write_snapshot()
+            except OSError as e:
+                logger.warning("Could not write the metrics of worker %s: %s", worker_id, e)
+    logger.info("Ingestion worker %s stopped.", worker_id)
+
+
+class IngestionWorkerPool:
+    """
+    A class to run ingestion workers in separate processes.
+
+    The workers are not daemonic, because PDF parsing starts its own process
+    pool inside each worker.
+    """
+
+    def __init__(self, processes: int = Config.JOB_WORKERS, db_path: str = Config.JOB_DB_PATH):
+        """
+        Initializes the IngestionWorkerPool.
+
+        Args:
+            processes (int): The number of worker processes.
+            db_path (str): The path of the job database.
+        """
+        self.processes = processes
+        self.db_path = db_path
+        self._context = multiprocessing.get_context("spawn")
+        self._stop_event = self._context.Event()
+        self._workers: List[multiprocessing.Process] = []
+
+    def start(self):
+        """
+        Re-queues jobs abandoned by a previous run and starts the workers.
+
+        Only jobs without a recent heartbeat are re-queued, and only metrics
+        snapshots of workers that are no longer running are removed, so the
+        workers started by another process are left alone.
+        """
+        JobStore(self.db_path).requeue_stale()
+        # Metrics of workers from a previous run would be added to the new ones
+        MetricsRegistry.clear_stale_snapshots()
+        for i in range(self.processes):
+            worker = self._context.Process(
+                target=run_worker,
+                args=(f"{os.getpid()}-{i}", self._stop_event, self.db_path, process_log_queue()),
+                name=f"ingestion-worker-{i}",
+            )
+            worker.start()
+            self._workers.append(worker)
+        logger.info("Started %s ingestion worker process(es).", self.processes)
+
+    def join(self):
+        """
+        Waits for all workers to exit.
+        """
+        for worker in self._workers:
+            worker.join()
+
+    def stop(self, timeout: float = 10.0):
+        """
+        Stops the workers. A job still running after `timeout` is interrupted
+        and re-queued on the next start.
+
+        Args:
+            timeout (float): Seconds to wait for running jobs to finish.
+        """
+        self._stop_event.set()
+        for worker in self._workers:
+            worker.join(timeout)
+            if worker.is_alive():
+                logger.warning("%s did not stop in time, terminating it.", worker.name)
+                worker.terminate()
+                worker.join()
+            MetricsRegistry.remove_snapshot(worker.pid)
+        self._workers = []
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run ingestion workers.")
+    parser.add_argument("--processes", type=int, default=max(Config.JOB_WORKERS, 1))
+    args = parser.parse_args()
+
+    pool = IngestionWorkerPool(args.processes)
+    pool.start()
+    try:
+        pool.join()
+    except KeyboardInterrupt:
+        logger.info("Stopping ingestion workers...")
+    finally:
+        pool.stop()
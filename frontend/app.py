@@ -1,9 +1,78 @@
 import streamlit as st
 import requests
+import json
 import time
 import config
 
 
+def iter_sse_events(response):
+    """
+    Parses a Server-Sent Events response into (event, data) pairs.
+
+    Args:
+        response (requests.Response): A streamed response from the backend.
+
+    Yields:
+        tuple: The event name and its JSON-decoded data.
+    """
+    event, data_lines = "message", []
+    for line in response.iter_lines(decode_unicode=True):
+        if line is None:
+            continue
+        if line == "":
+            if data_lines:
+                yield event, json.loads("\n".join(data_lines))
+            event, data_lines = "message", []
+        elif line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data_lines.append(line[len("data:"):].strip())
+
+
+def wait_for_job(job_id, poll_interval=1.0, timeout=config.JOB_WAIT_TIMEOUT):
+    """
+    Polls an ingestion job and shows its progress until it finishes.
+
+    Args:
+        job_id (str): The ID returned by the upload endpoint.
+        poll_interval (float): Seconds between two status requests.
+        timeout (float): Seconds to wait for the job to finish.
+
+    Returns:
+        dict: The final job status.
+
+    Raises:
+        TimeoutError: If the job hasn't finished within `timeout` seconds.
+    """
+    status_text = st.empty()
+    progress_bar = st.progress(0.0)
+    deadline = time.monotonic() + timeout
+    while True:
+        response = requests.get(f"{config.BACKEND_URL}/jobs/{job_id}", timeout=10)
+        response.raise_for_status()
+        job = response.json()
+        progress = job.get("progress") or {}
+        if job["status"] == "queued":
+            status_text.info("Waiting for an ingestion worker...")
+        else:
+            status_text.info(
+                f"Stage: {progress.get('stage', 'starting')} | "
+                f"pages parsed: {progress.get('pages_parsed', 0)} | "
+                f"chunks: {progress.get('chunks', 0)} | "
+                f"embedded: {progress.get('embedded', 0)} | "
+                f"indexed: {progress.get('indexed', 0)}"
+            )
+            chunks = progress.get("chunks", 0)
+            if chunks:
+                progress_bar.progress(min(progress.get("embedded", 0) / chunks, 1.0))
+        if job["status"] in ("succeeded", "failed"):
+            progress_bar.progress(1.0)
+            return job
+        if time.monotonic() >= deadline:
+            raise TimeoutError(f"Job {job_id} did not finish within {timeout:.0f} seconds.")
+        time.sleep(poll_interval)
+
+
 def main():
     """
     Main function to run the Streamlit application.
@@ -22,6 +91,12 @@ def main():
 
     # Sidebar for PDF uploads
     with st.sidebar:
+        collection_id = st.text_input(
+            "Collection",
+            value=config.DEFAULT_COLLECTION,
+            help="Documents are uploaded to and questions are answered from this collection only."
+        )
+
         st.header("1. Upload Documents")
         st.markdown("""
         Upload one or more PDF files. The system will process them and build a knowledge base. 
@@ -40,14 +115,27 @@ def main():
                     files_to_upload = [("files", (file.name, file.getvalue(), file.type)) for file in uploaded_files]
                     
                     try:
-                        response = requests.post(f"{config.BACKEND_URL}/upload/", files=files_to_upload, timeout=600)
+                        response = requests.post(
+                            f"{config.BACKEND_URL}/upload/",
+                            files=files_to_upload,
+                            data={"collection_id": collection_id},
+                            timeout=600,
+                        )
                         if response.status_code == 202:
-                            st.success(response.json().get("message", "Processing started!"))
-                            with st.spinner("Indexing documents... this can take a moment."):
-                                time.sleep(10) # Give backend some time to process
-                            st.toast("✅ Documents are ready for querying!")
+                            body = response.json()
+                            st.success(body.get("message", "Processing started!"))
+                            job = wait_for_job(body["job_id"])
+                            if job.get("status") == "succeeded":
+                                st.toast("✅ Documents are ready for querying!")
+                                empty_files = (job.get("progress") or {}).get("empty_files", 0)
+                                if empty_files:
+                                    st.warning(f"{empty_files} file(s) could not be read and were not indexed.")
+                            else:
+                                st.error(f"Processing failed: {job.get('error', 'Unknown error')}")
                         else:
                             st.error(f"Error: {response.status_code} - {response.text}")
+                    except TimeoutError as e:
+                        st.warning(f"{e} It keeps running in the background.")
                     except requests.exceptions.RequestException as e:
                         st.error(f"Could not connect to backend: {e}")
             else:
@@ -71,31 +159,44 @@ def main():
 
         with st.chat_message("assistant"):
             message_placeholder = st.empty()
-            with st.spinner("Thinking..."):
-                try:
-                    payload = {"query": prompt}
-                    response = requests.post(f"{config.BACKEND_URL}/ask/", json=payload, timeout=300)
-                    
-                    if response.status_code == 200:
-                        result = response.json()
-                        answer = result.get("answer", "Sorry, I couldn't find an answer.")
-                        message_placeholder.markdown(answer)
-                        
-                        # Display source documents
-                        with st.expander("View Sources"):
-                            for doc in result.get("source_documents", []):
-                                st.write(f"**Source:** `{doc.get('source', 'N/A')}`")
-                                st.info(doc.get("content", ""))
-                                
-                        full_response = answer
-                    else:
-                        error_detail = response.json().get('detail', 'Unknown error')
-                        st.error(f"Failed to get an answer: {error_detail}")
-                        full_response = f"Error: {error_detail}"
-
-                except requests.exceptions.RequestException as e:
-                    st.error(f"API request failed: {e}")
-                    full_response = f"Error: Could not get a response from the backend. {e}"
+            full_response = ""
+            try:
+                payload = {"query": prompt, "collection_id": collection_id}
+                with st.spinner("Thinking..."):
+                    response = requests.post(
+                        f"{config.BACKEND_URL}/ask/stream", json=payload, stream=True, timeout=(10, 300)
+                    )
+
+                if response.status_code == 200:
+                    sources = []
+                    answer = ""
+                    for event, data in iter_sse_events(response):
+                        if event == "sources":
+                            sources = data
+                        elif event == "token":
+                            answer += data.get("token", "")
+                            message_placeholder.markdown(answer + "▌")
+                        elif event == "error":
+                            st.error(f"Failed to get an answer: {data.get('detail', 'Unknown error')}")
+                            break
+                    answer = answer or "Sorry, I couldn't find an answer."
+                    message_placeholder.markdown(answer)
+
+                    # Display source documents
+                    with st.expander("View Sources"):
+                        for doc in sources:
+                            st.write(f"**Source:** `{doc.get('source', 'N/A')}`")
+                            st.info(doc.get("content", ""))
+
+                    full_response = answer
+                else:
+                    error_detail = response.json().get('detail', 'Unknown error')
+                    st.error(f"Failed to get an answer: {error_detail}")
+                    full_response = f"Error: {error_detail}"
+
+            except requests.exceptions.RequestException as e:
+                st.error(f"API request failed: {e}")
+                full_response = f"Error: Could not get a response from the backend. {e}"
             
             st.session_state.messages.append({"role": "assistant", "content": full_response})
 
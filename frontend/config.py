@@ -1,2 +1,8 @@
 # Configuration for the FastAPI backend URL
-BACKEND_URL = "http://127.0.0.1:8000"
\ No newline at end of file
+BACKEND_URL = "http://127.0.0.1:8000"
+
+# Collection selected when the app opens
+DEFAULT_COLLECTION = "default"
+
+# Seconds the app waits for an ingestion job before it stops polling
+JOB_WAIT_TIMEOUT = 3600